@@ -44,11 +44,81 @@ DROPOUT_VARIANTS = [
     'mcgaussiandrop',   # monte carlo gaussian dropout
     'mcspatialdrop']    # monte carlo spatial dropout
 
-from .metrics import *
-from .inference import *
-from .utils import *
-from .dataloader import *
-from .models import *
-from .training import *
-from .preprocessing import *
+PRECISION_POLICIES = [
+    'float32',          # full precision
+    'mixed_float16',    # float16 computations, float32 variables (GPUs, with loss scaling)
+    'mixed_bfloat16']   # bfloat16 computations, float32 variables (TPUs, recent CPUs and GPUs)
+
+import importlib
+
+# The submodules (and tensorflow) are imported on first access to their 
+# attributes (PEP 562), e.g., ``dl4ds.StandardScaler`` only loads 
+# dl4ds.preprocessing. ``from dl4ds import *`` loads all of them.
+_SUBMODULES = ['benchmarks', 'dataloader', 'datasources', 'inference', 'losses', 
+               'metrics', 'models', 'preprocessing', 'profiling', 'training', 
+               'utils']
+
+_LAZY_ATTRIBUTES = {
+    'dataloader': [
+        'BatchPrefetcher', 'DataGenerator', 'DistributedSampler', 'StaticFields', 
+        'create_batch_hr_lr', 'create_pair_hr_lr'],
+    'datasources': [
+        'ArraySource', 'ConcatenatedSource', 'DataSource', 'InterpolatedSource', 
+        'WindowSource', 'XarraySource', 'as_data_source', 'concatenate_sources', 
+        'open_data_source', 'precompute_lr', 'to_shared_memory', 'window_frames'],
+    'inference': [
+        'Predictor', 'load_model', 'predict'],
+    'metrics': [
+        'MetricsAccumulator', 'compute_correlation', 'compute_metrics', 
+        'compute_rmse'],
+    'models': [
+        'ChannelAttention2D', 'ConvBlock', 'ConvNextBlock', 'DeconvolutionBlock', 
+        'DenseBlock', 'DropPath', 'EncoderBlock', 'InterpolationUpsampling', 
+        'LocalizedConvBlock', 'MCDropout', 'MCGaussianDropout', 
+        'MCSpatialDropout2D', 'MCSpatialDropout3D', 'PadConcat', 
+        'RecurrentConvBlock', 'RepeatBatch', 'ResidualBlock', 
+        'ResizeConvolutionBlock', 'SubpixelConvolutionBlock', 'TransitionBlock', 
+        'cast_to_float32', 'get_dropout_layer', 'net_pin', 'net_postupsampling', 
+        'recnet_pin', 'recnet_postupsampling', 'residual_discriminator', 
+        'unet_pin'],
+    'preprocessing': [
+        'MinMaxScaler', 'StandardScaler'],
+    'profiling': [
+        'Profiler', 'ThroughputMonitor'],
+    'training': [
+        'CGANTrainer', 'PlainModelCheckpoint', 'ProfilerCallback', 
+        'SupervisedTrainer', 'ThroughputCallback', 'Trainer', 
+        'broadcast_variables', 
+        'discriminator_loss', 'generator_loss', 'load_checkpoint', 
+        'make_train_step', 'train_step', 'write_summaries'],
+    'utils': [
+        'Timing', 'check_compatibility_upsbackb', 'checkarg_backbone', 
+        'checkarg_dropout_variant', 'checkarg_loss', 'checkarg_precision', 
+        'checkarg_upsampling', 'checkarray_ndim', 'crop_array', 'list_devices', 
+        'plot_history', 'precision_policy', 'rank', 'resize_array', 
+        'set_gpu_memory_growth', 'set_visible_gpus', 
+        'spatial_to_spatiotemporal_samples', 'spatiotemporal_to_spatial_samples'],
+}
+_ATTRIBUTE_MODULES = {name: module for module, names in _LAZY_ATTRIBUTES.items() 
+                      for name in names}
+
+__all__ = (['BACKBONE_BLOCKS', 'UPSAMPLING_METHODS', 'POSTUPSAMPLING_METHODS', 
+            'INTERPOLATION_METHODS', 'LOSS_FUNCTIONS', 'DROPOUT_VARIANTS', 
+            'PRECISION_POLICIES'] + sorted(_ATTRIBUTE_MODULES))
+
+
+def __getattr__(name):
+    if name in _ATTRIBUTE_MODULES:
+        module = importlib.import_module('.' + _ATTRIBUTE_MODULES[name], __name__)
+        value = getattr(module, name)
+        # cached, __getattr__ is only called for missing attributes
+        globals()[name] = value
+        return value
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_ATTRIBUTE_MODULES) | set(_SUBMODULES))
 
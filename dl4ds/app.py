@@ -15,18 +15,10 @@ from absl import app, flags
 import matplotlib
 matplotlib.use('Agg')
 
-# Attempting to import horovod
-try:
-    import horovod.tensorflow.keras as hvd
-    has_horovod = True
-    hvd.init()
-    if hvd.rank() == 0:
-        running_on_first_worker = True
-    else:
-        running_on_first_worker = False
-except ImportError:
-    has_horovod = False
-    running_on_first_worker = True
+# Horovod (and tensorflow) are imported and initialized when the app runs, 
+# not when this module is imported, see ``dl4ds``
+has_horovod = False
+running_on_first_worker = True
 
 import dl4ds as dds
 from dl4ds import BACKBONE_BLOCKS, UPSAMPLING_METHODS, INTERPOLATION_METHODS, LOSS_FUNCTIONS, DROPOUT_VARIANTS
@@ -94,6 +86,17 @@ flags.DEFINE_string('inference_save_fname', None, 'Filename for saving the infer
 def dl4ds(argv):
     """DL4DS absl.FLAGS-based command line app.
     """
+    global has_horovod, running_on_first_worker
+    # Attempting to import horovod
+    try:
+        import horovod.tensorflow.keras as hvd
+        has_horovod = True
+        hvd.init()
+        running_on_first_worker = hvd.rank() == 0
+    except ImportError:
+        has_horovod = False
+        running_on_first_worker = True
+
     if running_on_first_worker:
         print('<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< DL4DS >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>\n')
 
@@ -0,0 +1,15 @@
+"""
+Benchmarks of the data pipeline, models, inference and metrics on synthetic
+data. Results are saved as JSON, including the dl4ds version and git commit,
+and can be compared across commits to catch performance regressions:
+
+python -m dl4ds.benchmarks --suites=dataloader,models --output=bench_new.json --compare=bench_old.json
+
+or, from Python:
+
+results = dl4ds.benchmarks.run_benchmarks(suites=['dataloader'])
+dl4ds.benchmarks.save_results(results, 'bench.json')
+"""
+
+from .core import *
+from .suites import *
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+"""
+absl.FLAGS-based command line app for running the benchmarks. To be executed
+run something like this:
+
+python -m dl4ds.benchmarks --suites=dataloader,metrics --size=small --output=bench.json
+"""
+
+from absl import app, flags
+
+# Usign Agg MLP backend to prevent the plots of the metrics from being shown
+import matplotlib
+matplotlib.use('Agg')
+
+import tensorflow as tf
+
+from .core import SIZES, run_benchmarks, save_results, compare_results
+from .suites import SUITES
+
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('suites', None, f'Suites to run, from {list(SUITES.keys())}. All of them by default')
+flags.DEFINE_enum('size', 'small', list(SIZES.keys()), 'Size of the synthetic problems')
+flags.DEFINE_integer('repeat', 5, 'Number of timed runs per case')
+flags.DEFINE_integer('warmup', 1, 'Number of untimed runs per case')
+flags.DEFINE_bool('memory', True, 'Measuring the peak of allocated memory (one extra run per case)')
+flags.DEFINE_string('filter', None, 'Only running the cases whose name contains this string')
+flags.DEFINE_enum('device', 'CPU', ['CPU', 'GPU'], 'Device to be used')
+flags.DEFINE_integer('seed', 0, 'Seed for the synthetic data')
+flags.DEFINE_string('output', None, 'Path of the JSON file for saving the results')
+flags.DEFINE_string('compare', None, 'Path of a JSON file with baseline results to compare with')
+flags.DEFINE_float('threshold', 0.1, 'Relative change of the median time flagged as regression/improvement')
+
+
+def benchmarks(argv):
+    """DL4DS benchmarks command line app.
+    """
+    if FLAGS.device == 'CPU':
+        tf.config.set_visible_devices([], 'GPU')
+
+    results = run_benchmarks(
+        suites=FLAGS.suites, 
+        size=FLAGS.size, 
+        repeat=FLAGS.repeat, 
+        warmup=FLAGS.warmup, 
+        memory=FLAGS.memory, 
+        pattern=FLAGS.filter, 
+        device=FLAGS.device, 
+        seed=FLAGS.seed)
+
+    if FLAGS.output is not None:
+        save_results(results, FLAGS.output)
+
+    if FLAGS.compare is not None:
+        print()
+        comparison = compare_results(FLAGS.compare, results, threshold=FLAGS.threshold)
+        n_regressions = sum(res['status'] == 'regression' for res in comparison)
+        print(f'\n{n_regressions} regression(s) out of {len(comparison)} cases')
+
+
+def main():
+    """Entry point of the ``dl4ds-benchmarks`` console script.
+    """
+    app.run(benchmarks)
+
+
+if __name__ == '__main__':
+    main()
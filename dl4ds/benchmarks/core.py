@@ -0,0 +1,258 @@
+"""
+Timing and memory measurement of the benchmark cases, and (de)serialization
+and comparison of the results
+"""
+
+import os
+import io
+import gc
+import sys
+import json
+import time
+import platform
+import resource
+import subprocess
+import tracemalloc
+import contextlib
+import numpy as np
+import tensorflow as tf
+from datetime import datetime
+
+from .. import __version__
+
+__all__ = ['SIZES',
+           'measure',
+           'run_benchmarks',
+           'save_results',
+           'load_results',
+           'compare_results']
+
+# Size of the synthetic problems
+SIZES = {
+    'small': dict(n_samples=16, hr_size=64, scale=4, batch_size=8,
+                  time_window=3, n_filters=8, n_blocks=2),
+    'medium': dict(n_samples=64, hr_size=128, scale=4, batch_size=16,
+                   time_window=4, n_filters=16, n_blocks=4),
+    'large': dict(n_samples=256, hr_size=256, scale=8, batch_size=32,
+                  time_window=4, n_filters=32, n_blocks=6)}
+
+
+def measure(func, repeat=5, warmup=1, memory=True, device='CPU'):
+    """Time ``func`` and measure the memory it allocates.
+
+    Parameters
+    ----------
+    func : callable
+        Function without arguments.
+    repeat : int, optional
+        Number of timed calls.
+    warmup : int, optional
+        Number of untimed calls done first (e.g., for tracing tf.functions).
+    memory : bool, optional
+        If True, an additional call is done with ``tracemalloc`` enabled to
+        obtain the peak of memory allocated by Python and NumPy. Memory
+        allocated by TensorFlow is not traced, the peak resident set size of
+        the process is reported as well.
+    device : str, optional
+        Device where ``func`` is executed.
+
+    Returns
+    -------
+    res : dict
+        Timings in seconds (``times``, ``min``, ``median``, ``mean``, ``std``)
+        and memory in MB (``peak_traced_mb``, ``peak_rss_mb``).
+    """
+    with tf.device('/' + device + ':0'), contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            func()
+        times = []
+        for _ in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+
+        peak_traced = None
+        if memory:
+            gc.collect()
+            tracemalloc.start()
+            try:
+                func()
+                _, peak_traced = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            peak_traced /= 2 ** 20
+
+    times = np.array(times)
+    return dict(times=times.tolist(),
+                min=float(times.min()),
+                median=float(np.median(times)),
+                mean=float(times.mean()),
+                std=float(times.std()),
+                peak_traced_mb=peak_traced,
+                peak_rss_mb=_peak_rss_mb())
+
+
+def run_benchmarks(suites=None, size='small', repeat=5, warmup=1, memory=True,
+                   pattern=None, device='CPU', seed=0, verbose=True):
+    """Run the benchmark suites on synthetic data.
+
+    Parameters
+    ----------
+    suites : list of str or None, optional
+        Suites to run, from ``dl4ds.benchmarks.SUITES``. If None, all of them.
+    size : str, optional
+        Size of the synthetic problems, one of ``dl4ds.benchmarks.SIZES``.
+    repeat, warmup, memory, device : optional
+        See ``dl4ds.benchmarks.measure``.
+    pattern : str or None, optional
+        If given, only the cases whose name contains ``pattern`` are run.
+    seed : int, optional
+        Seed for the synthetic data.
+    verbose : bool, optional
+        If True, the timing of each case is printed.
+
+    Returns
+    -------
+    results : dict
+        With ``metadata`` (versions, commit, machine, settings) and
+        ``results`` (one dict per case, keyed by its ``name``), ready to be
+        saved as JSON with ``dl4ds.benchmarks.save_results``.
+    """
+    from .suites import SUITES
+
+    if size not in SIZES:
+        msg = f'`size` not recognized. Must be one of {list(SIZES.keys())}'
+        raise ValueError(msg)
+    if suites is None:
+        suites = list(SUITES.keys())
+    for suite in suites:
+        if suite not in SUITES:
+            msg = f'`{suite}` suite not recognized. Must be one of {list(SUITES.keys())}'
+            raise ValueError(msg)
+
+    config = SIZES[size]
+    results = []
+    for suite in suites:
+        rng = np.random.default_rng(seed)
+        for name, params, func in SUITES[suite](config, rng):
+            name = f'{suite}.{name}'
+            if pattern is not None and pattern not in name:
+                continue
+            res = measure(func, repeat=repeat, warmup=warmup, memory=memory,
+                          device=device)
+            res = dict(name=name, suite=suite, params=params, **res)
+            results.append(res)
+            if verbose:
+                mem = res['peak_traced_mb']
+                mem = f'{mem:10.2f} MB' if mem is not None else ''
+                print(f'{name:<70} {res["median"] * 1e3:10.3f} ms {mem}')
+        tf.keras.backend.clear_session()
+        gc.collect()
+
+    metadata = dict(
+        dl4ds_version=__version__,
+        commit=_git_commit(),
+        timestamp=datetime.now().isoformat(timespec='seconds'),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        tensorflow=tf.__version__,
+        platform=platform.platform(),
+        processor=platform.processor(),
+        cpu_count=os.cpu_count(),
+        device=device,
+        size=size,
+        config=config,
+        repeat=repeat,
+        warmup=warmup,
+        seed=seed)
+    return dict(metadata=metadata, results=results)
+
+
+def save_results(results, path):
+    """Save the results of ``run_benchmarks`` as JSON.
+    """
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
+
+
+def load_results(path):
+    """Load results saved with ``save_results``.
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare_results(baseline, current, stat='median', threshold=0.1,
+                    verbose=True):
+    """Compare two sets of benchmark results (e.g., from different commits).
+
+    Parameters
+    ----------
+    baseline, current : dict or str
+        Results from ``run_benchmarks`` or paths to the JSON files.
+    stat : str, optional
+        Timing statistic compared, 'min', 'median' or 'mean'.
+    threshold : float, optional
+        Relative change above which a case is flagged as a regression (slower)
+        or an improvement (faster).
+    verbose : bool, optional
+        If True, a table with the comparison is printed.
+
+    Returns
+    -------
+    comparison : list of dict
+        One dict per case present in both results, with the ``baseline`` and
+        ``current`` timings, their ``ratio`` (current / baseline) and
+        ``status`` ('regression', 'improvement' or 'unchanged').
+    """
+    if isinstance(baseline, str):
+        baseline = load_results(baseline)
+    if isinstance(current, str):
+        current = load_results(current)
+    if baseline['metadata']['size'] != current['metadata']['size']:
+        msg = 'The results were obtained with different `size` and are not comparable'
+        raise ValueError(msg)
+
+    baseline_cases = {res['name']: res for res in baseline['results']}
+    comparison = []
+    for res in current['results']:
+        if res['name'] not in baseline_cases:
+            continue
+        t_base = baseline_cases[res['name']][stat]
+        t_curr = res[stat]
+        ratio = t_curr / t_base
+        if ratio > 1 + threshold:
+            status = 'regression'
+        elif ratio < 1 - threshold:
+            status = 'improvement'
+        else:
+            status = 'unchanged'
+        comparison.append(dict(name=res['name'], baseline=t_base, current=t_curr,
+                               ratio=ratio, status=status))
+        if verbose:
+            print(f'{res["name"]:<70} {t_base * 1e3:10.3f} ms {t_curr * 1e3:10.3f} ms '
+                  f'{ratio:6.2f}x  {status}')
+    return comparison
+
+
+def _peak_rss_mb():
+    """Peak resident set size of the process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak / 2 ** 20
+    return peak / 2 ** 10
+
+
+def _git_commit():
+    """Commit of the dl4ds source tree, if it is a git repository.
+    """
+    path = os.path.dirname(os.path.abspath(__file__))
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=path,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,286 @@
+"""
+Benchmark suites. Each suite is a generator function that receives the size
+configuration (see ``dl4ds.benchmarks.SIZES``) and a np.random.Generator, and
+yields ``(name, params, func)`` tuples, where ``func`` is a callable without
+arguments and ``params`` a JSON serializable dict describing the case
+"""
+
+import os
+import sys
+import tempfile
+import subprocess
+import numpy as np
+import tensorflow as tf
+
+from .. import POSTUPSAMPLING_METHODS, UPSAMPLING_METHODS, INTERPOLATION_METHODS
+from ..dataloader import create_batch_hr_lr
+from ..utils import resize_array
+from ..models import (net_postupsampling, net_pin, unet_pin,
+                      recnet_postupsampling, recnet_pin)
+from ..inference import predict
+from ..metrics import (compute_metrics, compute_rmse, compute_correlation,
+                       MetricsAccumulator)
+
+__all__ = ['SUITES']
+
+
+def dataloader_suite(config, rng):
+    """``create_batch_hr_lr`` per upsampling mode, with and without predictors,
+    static variables and time window, for full grids and patches.
+    """
+    hr_size = config['hr_size']
+    time_window = config['time_window']
+    n_samples = config['n_samples'] + time_window - 1
+    array = rng.normal(size=(n_samples, hr_size, hr_size, 1)).astype('float32')
+    predictors = rng.normal(size=(n_samples, hr_size, hr_size, 2)).astype('float32')
+    static_vars = [rng.random((hr_size, hr_size)).astype('float32') for _ in range(2)]
+    variants = {
+        'plain': dict(),
+        'predictors': dict(predictors=predictors),
+        'static_vars': dict(static_vars=static_vars),
+        'time_window': dict(time_window=time_window),
+        'all': dict(predictors=predictors, static_vars=static_vars,
+                    time_window=time_window)}
+
+    for upsampling in UPSAMPLING_METHODS:
+        for patch_size in [None, hr_size // 2]:
+            for variant, kwargs in variants.items():
+                n = config['n_samples'] if 'time_window' in kwargs else n_samples
+                indices = np.arange(n)
+                def func(upsampling=upsampling, patch_size=patch_size,
+                         kwargs=kwargs, indices=indices):
+                    create_batch_hr_lr(
+                        indices, 0, array, None, upsampling,
+                        scale=config['scale'], batch_size=config['batch_size'],
+                        patch_size=patch_size, random_state=np.random.RandomState(0),
+                        **kwargs)
+                name = f'create_batch_hr_lr[{upsampling}-{variant}-patch_{patch_size}]'
+                params = dict(upsampling=upsampling, variant=variant,
+                              patch_size=patch_size)
+                yield name, params, func
+
+
+def resize_suite(config, rng):
+    """``resize_array`` per interpolation method, downsampling and upsampling
+    a stack of grids.
+    """
+    hr_size = config['hr_size']
+    lr_size = hr_size // config['scale']
+    array_hr = rng.normal(size=(config['n_samples'], hr_size, hr_size, 1)).astype('float32')
+    array_lr = rng.normal(size=(config['n_samples'], lr_size, lr_size, 1)).astype('float32')
+
+    for interpolation in INTERPOLATION_METHODS:
+        for direction, array, newsize in [('down', array_hr, (lr_size, lr_size)),
+                                          ('up', array_lr, (hr_size, hr_size))]:
+            def func(array=array, newsize=newsize, interpolation=interpolation):
+                resize_array(array, newsize, interpolation, squeezed=False)
+            name = f'resize_array[{interpolation}-{direction}]'
+            params = dict(interpolation=interpolation, direction=direction,
+                          shape=list(array.shape), newsize=list(newsize))
+            yield name, params, func
+
+
+def models_suite(config, rng):
+    """Forward and forward/backward (gradients of the MAE loss) passes of the
+    models, per backbone and upsampling method.
+    """
+    hr_size = config['hr_size']
+    lr_size = hr_size // config['scale']
+    time_window = config['time_window']
+    batch_size = config['batch_size']
+    common = dict(n_channels=1, n_aux_channels=0, n_filters=config['n_filters'],
+                  n_blocks=config['n_blocks'])
+
+    cases = []
+    for backbone in ['convnet', 'resnet', 'densenet', 'convnext']:
+        # convnext blocks require a normalization layer
+        norm = dict(normalization='ln') if backbone == 'convnext' else dict()
+        for upsampling in POSTUPSAMPLING_METHODS:
+            cases.append(('net_postupsampling', backbone, upsampling, None,
+                          lambda b=backbone, u=upsampling, norm=norm: net_postupsampling(
+                              b, u, config['scale'], lr_size=(lr_size, lr_size),
+                              **common, **norm)))
+        cases.append(('net_pin', backbone, 'pin', None,
+                      lambda b=backbone, norm=norm: net_pin(
+                          b, hr_size=(hr_size, hr_size), **common, **norm)))
+    # unet (skip connections padding) needs a grid of known size, non-square
+    for decoder_upsampling in POSTUPSAMPLING_METHODS:
+        cases.append(('unet_pin', 'unet', 'pin-' + decoder_upsampling, None,
+                      lambda d=decoder_upsampling: unet_pin(
+                          'unet', hr_size=(hr_size, hr_size * 3 // 2),
+                          decoder_upsampling=d, **common)))
+    for backbone in ['convnet', 'resnet', 'densenet']:
+        for upsampling in POSTUPSAMPLING_METHODS:
+            cases.append(('recnet_postupsampling', backbone, upsampling, time_window,
+                          lambda b=backbone, u=upsampling: recnet_postupsampling(
+                              b, u, config['scale'], lr_size=(lr_size, lr_size),
+                              time_window=time_window, **common)))
+        cases.append(('recnet_pin', backbone, 'pin', time_window,
+                      lambda b=backbone: recnet_pin(
+                          b, hr_size=(hr_size, hr_size), time_window=time_window,
+                          **common)))
+
+    loss_fn = tf.keras.losses.MeanAbsoluteError()
+    for model_name, backbone, upsampling, tw, build in cases:
+        with tf.device('/CPU:0'):
+            model = build()
+            size = hr_size if upsampling.startswith('pin') else lr_size
+            shape = [size if d is None else d for d in model.inputs[0].shape[1:]]
+            if tw is not None:
+                shape[0] = tw
+            shape = (batch_size,) + tuple(shape)
+            x = tf.constant(rng.normal(size=shape), dtype=tf.float32)
+            y = tf.random.normal(model(x).shape)
+
+        @tf.function
+        def forward(model=model, x=x):
+            return model(x, training=False)
+
+        @tf.function
+        def forward_backward(model=model, x=x, y=y):
+            with tf.GradientTape() as tape:
+                y_pred = model(x, training=True)
+                loss = loss_fn(y, y_pred)
+            gradients = tape.gradient(loss, model.trainable_variables)
+            return loss, gradients
+
+        params = dict(model=model_name, backbone=backbone, upsampling=upsampling,
+                      time_window=tw, input_shape=list(shape),
+                      n_params=int(model.count_params()))
+        key = f'{model_name}-{backbone}-{upsampling}'
+        yield f'forward[{key}]', params, lambda f=forward: f().numpy()
+        yield f'forward_backward[{key}]', params, lambda f=forward_backward: f()[0].numpy()
+
+
+def inference_suite(config, rng):
+    """``predict`` with spatial and spatio-temporal models, on HR and LR data,
+    with tiled and streaming inference.
+    """
+    hr_size = config['hr_size']
+    scale = config['scale']
+    lr_size = hr_size // scale
+    time_window = config['time_window']
+    n_samples = config['n_samples']
+    common = dict(n_channels=1, n_aux_channels=0, n_filters=config['n_filters'],
+                  n_blocks=config['n_blocks'])
+    array_hr = rng.normal(size=(n_samples, hr_size, hr_size, 1)).astype('float32')
+    array_lr = rng.normal(size=(n_samples, lr_size, lr_size, 1)).astype('float32')
+
+    with tf.device('/CPU:0'):
+        models = {
+            'resnet_spc': net_postupsampling('resnet', 'spc', scale,
+                                             lr_size=(lr_size, lr_size), **common),
+            'resnet_pin': net_pin('resnet', hr_size=(hr_size, hr_size), **common),
+            'recnet_resnet_spc': recnet_postupsampling(
+                'resnet', 'spc', scale, lr_size=(lr_size, lr_size),
+                time_window=time_window, **common)}
+
+    tile_size = hr_size // 2
+    variants = {
+        'hr': dict(array=array_hr, array_in_hr=True),
+        'lr': dict(array=array_lr, array_in_hr=False),
+        'hr-tiled': dict(array=array_hr, array_in_hr=True, tile_size=tile_size),
+        'hr-streaming': dict(array=array_hr, array_in_hr=True,
+                             chunk_size=n_samples // 4)}
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for model_name, model in models.items():
+            tw = time_window if model_name.startswith('recnet') else None
+            for variant, kwargs in variants.items():
+                if tw is not None and 'tile_size' in kwargs:
+                    continue
+                def func(model=model, kwargs=kwargs, tw=tw):
+                    predict(model, scale=scale, time_window=tw,
+                            batch_size=config['batch_size'], save_path=tmpdir,
+                            device='CPU', **kwargs)
+                params = dict(model=model_name, variant=variant, time_window=tw,
+                              shape=list(kwargs['array'].shape))
+                yield f'predict[{model_name}-{variant}]', params, func
+
+
+def metrics_suite(config, rng):
+    """``compute_metrics`` (including the plots), the per grid point maps and
+    the streaming ``MetricsAccumulator``.
+    """
+    hr_size = config['hr_size']
+    n_samples = config['n_samples']
+    y = rng.normal(5, 1, size=(n_samples, hr_size, hr_size, 1)).astype('float32')
+    y_hat = (y + rng.normal(0, 0.3, size=y.shape)).astype('float32')
+    mask = np.ones((hr_size, hr_size), dtype='float32')
+    mask[: hr_size // 4, : hr_size // 4] = 0
+    shape = list(y.shape)
+
+    for over in ['time', 'space']:
+        yield (f'compute_rmse[{over}]', dict(over=over, shape=shape),
+               lambda over=over: compute_rmse(y, y_hat, over=over))
+        for mode in ['pearson', 'spearman']:
+            yield (f'compute_correlation[{over}-{mode}]',
+                   dict(over=over, mode=mode, shape=shape),
+                   lambda over=over, mode=mode: compute_correlation(
+                       y, y_hat, over=over, mode=mode))
+
+    def accumulate():
+        accumulator = MetricsAccumulator(mask=mask)
+        for i in range(0, n_samples, config['batch_size']):
+            accumulator.update(y[i: i + config['batch_size']],
+                               y_hat[i: i + config['batch_size']])
+        accumulator.result()
+    yield ('MetricsAccumulator', dict(shape=shape, chunk_size=config['batch_size']),
+           accumulate)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for masked in [False, True]:
+            def func(masked=masked):
+                compute_metrics(y, y_hat, mask=mask if masked else None,
+                                save_path=tmpdir)
+                os.remove(os.path.join(tmpdir, 'metrics_summary.txt'))
+            yield (f'compute_metrics[mask_{masked}]', dict(mask=masked, shape=shape),
+                   func)
+
+
+def import_suite(config, rng):
+    """Import time of the package and of its lightweight submodules, each in a
+    fresh interpreter. A case fails if the import loads heavy dependencies 
+    that it does not need (e.g., tensorflow when importing the scalers).
+    """
+    cases = {
+        'dl4ds': ('import dl4ds', 
+                  ['tensorflow', 'xarray', 'sklearn', 'matplotlib', 'cv2']),
+        'preprocessing': ('from dl4ds.preprocessing import StandardScaler', 
+                          ['tensorflow', 'matplotlib']),
+        'utils': ('from dl4ds.utils import resize_array', 
+                  ['tensorflow', 'matplotlib', 'sklearn']),
+        'datasources': ('from dl4ds.datasources import as_data_source', 
+                        ['tensorflow', 'matplotlib', 'sklearn'])}
+
+    for name, (statement, forbidden) in cases.items():
+        def func(statement=statement, forbidden=forbidden):
+            _check_import(statement, forbidden)
+        params = dict(statement=statement, forbidden=forbidden)
+        yield f'import[{name}]', params, func
+
+
+SUITES = {
+    'import': import_suite,
+    'dataloader': dataloader_suite,
+    'resize': resize_suite,
+    'models': models_suite,
+    'inference': inference_suite,
+    'metrics': metrics_suite}
+
+
+def _check_import(statement, forbidden):
+    """Run ``statement`` in a new interpreter, raising a RuntimeError if any of
+    the ``forbidden`` modules gets imported.
+    """
+    code = (f'import sys; {statement}; '
+            f'print(",".join(m for m in {forbidden!r} if m in sys.modules))')
+    # the dl4ds package being benchmarked, even if not installed
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+    out = subprocess.run([sys.executable, '-c', code], env=env, capture_output=True,
+                         text=True, check=True)
+    loaded = out.stdout.strip()
+    if loaded:
+        raise RuntimeError(f'`{statement}` imports {loaded}')
@@ -1,11 +1,15 @@
+import time
 import tensorflow as tf
 import numpy as np
-import scipy as sc
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import xarray as xr
-import ecubevis as ecv
 
 from . import POSTUPSAMPLING_METHODS
-from .utils import crop_array, resize_array, checkarray_ndim
+from .utils import crop_array, resize_array, checkarray_ndim, _resize_stack
+from .datasources import (as_data_source, concatenate_sources, precompute_lr, 
+                          window_frames, _gather_patches, _take_samples)
+from .profiling import _timer, _count
 
 
 def create_pair_hr_lr(
@@ -18,7 +22,8 @@ def create_pair_hr_lr(
     predictors=None, 
     season=None,
     debug=False, 
-    interpolation='inter_area'):
+    interpolation='inter_area',
+    dtype='float32'):
     """
     Create a pair of HR and LR square sub-patches. In this case, the LR 
     corresponds to a coarsen version of the HR reference with land-ocean mask,
@@ -47,6 +52,8 @@ def create_pair_hr_lr(
         By default 'bicubic'. 
     debug : bool, optional
         If True, plots and debugging information are shown.
+    dtype : str, optional
+        Data type of the returned arrays, 'float32', 'float16' or 'bfloat16'.
 
     """
     def preproc_static_vars(var):
@@ -244,14 +251,16 @@ def create_pair_hr_lr(
     else:
         season_array_lr = None
 
-    hr_array = np.asarray(hr_array, 'float32')
-    lr_array = np.asarray(lr_array, 'float32')
+    dtype = _numpy_dtype(dtype)
+    hr_array = np.asarray(hr_array, dtype)
+    lr_array = np.asarray(lr_array, dtype)
     if static_vars is not None or season_array_lr is not None:
-        static_array_hr = np.asanyarray(static_array_hr, 'float32')
+        static_array_hr = np.asanyarray(static_array_hr, dtype)
     else:
         static_array_hr = None
 
     if debug: 
+        import ecubevis as ecv
         if is_spatiotemp:
             print(f'HR array: {hr_array.shape}, LR array: {lr_array.shape}, Auxiliary array: {season_array_hr.shape}')
             if patch_size is not None:
@@ -307,59 +316,264 @@ def create_batch_hr_lr(
     static_vars=None, 
     predictors=None,
     interpolation='inter_area',
-    time_metadata=None
+    time_metadata=None,
+    random_state=None,
+    dtype='float32',
+    graph_interpolation=False,
+    static_on_device=False
     ):
-    """Create a batch of HR/LR samples.
+    """Create a batch of HR/LR samples. 
+    
+    The whole batch is assembled at once: the crops of all the samples are 
+    gathered with a single fancy-indexing operation, the resulting stacks are 
+    resized as a whole (see ``_resize_stack``) and the LR channels are written 
+    into a preallocated buffer of type ``dtype`` ('float32', or 'float16' and 
+    'bfloat16' for half-precision batches that halve the host-to-device 
+    transfers). The pairing logic is the same as in ``create_pair_hr_lr``. 
+    Crop positions are drawn from ``random_state`` (np.random.RandomState) or, 
+    when it is None, from the global NumPy random generator. With 
+    ``graph_interpolation`` and 'pin' upsampling, the LR arrays are kept at the
+    LR resolution, as for post-upsampling, and the interpolation to the HR grid
+    is done by the model (see ``dl4ds.InterpolationUpsampling``).
+
+    With ``static_on_device``, the static variables and season are not copied
+    into the batch. The int32 HR crop offsets [n, 2] (y, x) and the season 
+    vectors [n, 4] are returned instead, and the crops are gathered in-graph 
+    from the device-resident static variables by ``dl4ds.StaticFields``. The
+    crops are then aligned with the LR grid.
+
+    Returns
+    -------
+    [batch_lr, batch_aux_hr], [batch_hr] when static variables or season are
+    used, [batch_lr], [batch_hr] otherwise. With ``static_on_device``, 
+    [batch_lr, batch_offsets] or [batch_lr, batch_offsets, batch_season], 
+    [batch_hr].
     """
     # take a batch of indices (`batch_size` indices randomized temporally)
-    batch_rand_idx = all_indices[index * batch_size : (index + 1) * batch_size]
-    batch_hr = []
-    batch_lr = []
-    batch_aux_hr = []
-
-    # looping to create a batch of samples
-    for i in batch_rand_idx:
-        # spatial samples
-        if time_window is None:  
-            data_i = array[i]
-            data_lr_i = None if array_lr is None else array_lr[i]
-            predictors_i = None if predictors is None else predictors[i]
-            season_i = _get_season_(time_metadata[i], time_window) if time_metadata is not None else None
-
-        # spatio-temporal samples
+    batch_rand_idx = np.asarray(all_indices[index * batch_size : (index + 1) * batch_size])
+    n = len(batch_rand_idx)
+    _count('samples', n)
+    is_spatiotemp = time_window is not None
+    if random_state is None:
+        random_state = np.random
+    # whether the lr channels are kept at the lr resolution
+    lr_sized = upsampling in POSTUPSAMPLING_METHODS or graph_interpolation
+    
+    array = as_data_source(array)
+    hr_y, hr_x = array.shape[1], array.shape[2]
+    lr_is_given = array_lr is not None
+    lr_in_hr_grid = False
+    if lr_is_given:
+        array_lr = as_data_source(array_lr)
+        lr_y, lr_x = array_lr.shape[1], array_lr.shape[2]
+        # for 'pin', the lr array can be given already interpolated to the hr
+        # grid (e.g., precomputed with ``dl4ds.precompute_lr``)
+        if upsampling == 'pin' and (lr_y, lr_x) == (hr_y, hr_x):
+            if graph_interpolation:
+                msg = 'With `graph_interpolation`, `array_lr` must be at the LR resolution'
+                raise ValueError(msg)
+            lr_in_hr_grid = True
+            lr_x, lr_y = int(hr_x / scale), int(hr_y / scale)
+    else:
+        lr_x, lr_y = int(hr_x / scale), int(hr_y / scale)
+
+    # --------------------------------------------------------------------------
+    # Crop positions (one per sample), in the HR grid and in the LR grid
+    crop_y = crop_x = crop_y_lr = crop_x_lr = patch_size_lr = None
+    if patch_size is not None:
+        if lr_sized:
+            patch_size_lr = int(patch_size / scale)
+            if lr_is_given or predictors is not None or static_on_device:
+                crop_y_lr = random_state.randint(0, lr_y - patch_size_lr, size=n)
+                crop_x_lr = random_state.randint(0, lr_x - patch_size_lr, size=n)
+                crop_y = crop_y_lr * scale
+                crop_x = crop_x_lr * scale
+            else:
+                crop_y = random_state.randint(0, hr_y - patch_size, size=n)
+                crop_x = random_state.randint(0, hr_x - patch_size, size=n)
+        else:
+            crop_y = random_state.randint(0, hr_y - patch_size, size=n)
+            crop_x = random_state.randint(0, hr_x - patch_size, size=n)
+        out_hr_y = out_hr_x = patch_size
+        if lr_sized:
+            out_lr_y = out_lr_x = patch_size_lr
+        else:
+            out_lr_y = out_lr_x = patch_size
+    else:
+        out_hr_y, out_hr_x = hr_y, hr_x
+        if lr_sized:
+            out_lr_y, out_lr_x = lr_y, lr_x
+        else:
+            out_lr_y, out_lr_x = hr_y, hr_x
+
+    # Frames (time slices) of the batch. For spatio-temporal samples, the 
+    # frames shared by overlapping windows are read and resized only once 
+    # (per-timestep frame cache) and the windows are built when cropping
+    if is_spatiotemp:
+        frame_times, frame_starts = window_frames(batch_rand_idx, time_window)
+    else:
+        frame_times, frame_starts = batch_rand_idx, np.arange(n)
+
+    def gather(source, y=None, x=None, size=None):
+        """Batch of (cropped) samples read from ``source`` (only the needed 
+        time slices and spatial windows)."""
+        with _timer('read'):
+            if size is None:
+                return source.take(batch_rand_idx, time_window)
+            return source.take_patches(batch_rand_idx, y, x, size, time_window)
+
+    def gather_frames(source):
+        """Frames of the batch [n_frames, y, x, c] read from ``source``."""
+        with _timer('read'):
+            return source.read(frame_times)
+
+    def crop(frames, y, x, size):
+        """Samples [n, (time,) y, x, c], cropped if ``size`` is given, from 
+        the frames of the batch."""
+        if size is None:
+            if is_spatiotemp:
+                return _take_samples(frames, frame_starts, time_window)
+            return frames
+        return _gather_patches(frames, frame_starts, y, x, size, time_window)
+
+    # --------------------------------------------------------------------------
+    # HR and LR (target variable) samples
+    hr_frames = None
+    if is_spatiotemp and patch_size is None:
+        # the frames are read once for the hr and the coarsened lr samples
+        hr_frames = gather_frames(array)
+        batch_hr = crop(hr_frames, None, None, None)
+    else:
+        batch_hr = gather(array, crop_y, crop_x, patch_size)
+
+    if not lr_sized:
+        if lr_in_hr_grid:
+            # only the crops of the (already interpolated) lr grid are read
+            lr_target = gather(array_lr, crop_y, crop_x, patch_size)
+        else:
+            if lr_is_given:
+                # lr grid is upsampled via interpolation
+                lr_stack = _resize_stack(gather_frames(array_lr), (hr_x, hr_y), 
+                                         interpolation)
+            else:
+                # hr grid is downsampled and upsampled via interpolation
+                if hr_frames is None:
+                    hr_frames = gather_frames(array)
+                lr_stack = _resize_stack(hr_frames, (lr_x, lr_y), interpolation)
+                lr_stack = _resize_stack(lr_stack, (hr_x, hr_y), interpolation)
+            lr_target = crop(lr_stack, crop_y, crop_x, patch_size)
+    else:
+        if lr_is_given:
+            lr_target = gather(array_lr, crop_y_lr, crop_x_lr, patch_size_lr)
+        elif hr_frames is not None:
+            # downsampling the hr frames (shared by overlapping windows)
+            lr_frames = _resize_stack(hr_frames, (lr_x, lr_y), interpolation)
+            lr_target = crop(lr_frames, None, None, None)
+        else:
+            # downsampling the hr array to get lr_array
+            lr_target = _resize_stack(batch_hr, (out_lr_x, out_lr_y), interpolation)
+
+    # --------------------------------------------------------------------------
+    # Predictors (concatenated to the LR array)
+    lr_predictors = None
+    if predictors is not None:
+        predictors = as_data_source(predictors)
+        pred_stack = gather_frames(predictors)
+        if pred_stack.shape[-3] != lr_y or pred_stack.shape[-2] != lr_x:
+            # we coarsen/interpolate the mid-res or high-res predictors
+            pred_stack = _resize_stack(pred_stack, (lr_x, lr_y), interpolation)
+        if not lr_sized:
+            pred_stack = _resize_stack(pred_stack, (hr_x, hr_y), interpolation)
+            pred_stack = crop(pred_stack, crop_y, crop_x, patch_size)
         else:
-            data_i = array[i:i+time_window]  
-            data_lr_i = None if array_lr is None else array_lr[i:i+time_window]     
-            predictors_i = None if predictors is None else predictors[i:i+time_window]
-            season_i = _get_season_(time_metadata[i:i+time_window], time_window) if time_metadata is not None else None
-
-        res = create_pair_hr_lr(
-            array=data_i,
-            array_lr=data_lr_i,
-            upsampling=upsampling,
-            scale=scale, 
-            patch_size=patch_size, 
-            static_vars=static_vars, 
-            season=season_i,
-            interpolation=interpolation,
-            predictors=predictors_i)
-
-        if static_vars is not None or season_i is not None:
-            hr_array, lr_array, static_array_hr = res
-            batch_aux_hr.append(static_array_hr)
+            pred_stack = crop(pred_stack, crop_y_lr, crop_x_lr, patch_size_lr)
+        lr_predictors = pred_stack
+
+    # --------------------------------------------------------------------------
+    # Static variables and season (HR auxiliary array)
+    static_hr = static_lr = None
+    if static_vars is not None and not static_on_device:
+        static_array = np.concatenate(
+            [checkarray_ndim(np.squeeze(var), 3, -1) for var in static_vars], 
+            axis=-1).astype('float32')
+        if patch_size is not None:
+            static_hr = _gather_patches(static_array[np.newaxis], np.zeros(n, int), 
+                                        crop_y, crop_x, patch_size)
+            if lr_sized:
+                static_lr = _resize_stack(static_hr, (out_lr_x, out_lr_y), interpolation)
+            else:
+                static_lr = static_hr
         else:
-            hr_array, lr_array = res
-        batch_lr.append(lr_array)
-        batch_hr.append(hr_array)
-    batch_lr = np.asarray(batch_lr)
-    batch_hr = np.asarray(batch_hr) 
-    if static_vars is not None or season_i is not None:
-        batch_aux_hr = np.asarray(batch_aux_hr)
+            static_hr = static_array[np.newaxis]
+            if lr_sized:
+                static_lr = resize_array(static_array, (lr_x, lr_y), interpolation, 
+                                         squeezed=False)[np.newaxis]
+            else:
+                static_lr = static_hr
+
+    season_vectors = season_lr = None
+    if time_metadata is not None:
+        if is_spatiotemp:
+            seasons = [_get_season_(time_metadata[i:i+time_window], time_window) 
+                       for i in batch_rand_idx]
+        else:
+            seasons = [_get_season_(time_metadata[i], time_window) for i in batch_rand_idx]
+        season_vectors = np.stack([_get_season_vector_(s) for s in seasons])
+        if not static_on_device:
+            season_lr = season_vectors[:, np.newaxis, np.newaxis, :]
+
+    # --------------------------------------------------------------------------
+    # Writing the LR channels into a preallocated float32 buffer
+    lr_blocks = [lr_target]
+    if lr_predictors is not None:
+        lr_blocks.append(lr_predictors)
+    # for spatial samples, static variables and season are concatenated to the lr
+    if not is_spatiotemp:
+        if static_lr is not None:
+            lr_blocks.append(static_lr)
+        if season_lr is not None:
+            lr_blocks.append(season_lr)
+    
+    lr_shape = (out_lr_y, out_lr_x)
+    if is_spatiotemp:
+        lr_shape = (time_window,) + lr_shape
+    dtype = _numpy_dtype(dtype)
+    batch_lr = _fill_buffer(n, lr_shape, lr_blocks, dtype)
+    batch_hr = np.asarray(batch_hr, dtype)
+    
+    if static_on_device:
+        batch_offsets = np.zeros((n, 2), dtype='int32')
+        if patch_size is not None:
+            batch_offsets[:, 0], batch_offsets[:, 1] = crop_y, crop_x
+        if season_vectors is not None:
+            return [batch_lr, batch_offsets, season_vectors.astype(dtype)], [batch_hr]
+        return [batch_lr, batch_offsets], [batch_hr]
+    elif static_vars is not None or season_lr is not None:
+        aux_blocks = []
+        if static_hr is not None:
+            aux_blocks.append(static_hr)
+        if season_lr is not None:
+            aux_blocks.append(season_lr)
+        batch_aux_hr = _fill_buffer(n, (out_hr_y, out_hr_x), aux_blocks, dtype)
         return [batch_lr, batch_aux_hr], [batch_hr]
     else:
         return [batch_lr], [batch_hr]
 
 
+def _fill_buffer(n, shape, blocks, dtype='float32'):
+    """Write ``blocks`` (broadcastable to [n, *shape, c_i]) one after the other 
+    along the channels dimension of a preallocated array of type ``dtype``.
+    """
+    n_channels = sum(block.shape[-1] for block in blocks)
+    buffer = np.empty((n,) + tuple(shape) + (n_channels,), dtype=dtype)
+    i = 0
+    for block in blocks:
+        c = block.shape[-1]
+        buffer[..., i: i + c] = block
+        i += c
+    return buffer
+
+
 class DataGenerator(tf.keras.utils.Sequence):
     """
     DataGenerator creates batches of paired training samples according to the
@@ -386,14 +600,21 @@ class DataGenerator(tf.keras.utils.Sequence):
         static_vars=None, 
         predictors=None,
         interpolation='inter_area',
-        repeat=None
+        repeat=None,
+        lr_cache=None,
+        dtype='float32',
+        sampler=None,
+        graph_interpolation=False,
+        static_on_device=False
         ):
         """
         Parameters
         ----------
-        array : np.ndarray
-            HR gridded data.
-        array_lr : np.ndarray
+        array : np.ndarray, xr.DataArray or dl4ds.DataSource
+            HR gridded data. A np.memmap, a dask-backed xr.DataArray or a 
+            ``dl4ds.DataSource`` (see ``dl4ds.open_data_source``) is read 
+            lazily, loading only the samples needed by each batch.
+        array_lr : np.ndarray, xr.DataArray or dl4ds.DataSource
             LR gridded data. If not provided, then implicit/coarsened pairs are
             created from ``array``.
         backbone : str
@@ -412,30 +633,37 @@ class DataGenerator(tf.keras.utils.Sequence):
         static_vars : None or list of 2D ndarrays, optional
             Static variables such as elevation data or a binary land-ocean mask.
         predictors : list of ndarray 
-            List of predictor ndarrays. 
+            List of predictor ndarrays (or xr.DataArrays/dl4ds.DataSources).
         interpolation : str, optional
             Interpolation used when upsampling/downsampling the training samples.
         repeat : int or None, optional
             Factor to repeat the samples in ``array``. Useful when ``patch_size``
             is not None.
-
-        TO-DO
-        -----
-        * instead of the in-memory array, we could input the path and load the 
-        netcdf files lazily or memmap a numpy array
+        lr_cache : bool, str or None, optional
+            Only used when ``array_lr`` is None. If True, the coarsened LR 
+            grids are computed once (see ``dl4ds.precompute_lr``) instead of 
+            for every batch. If a str is given, the LR grids are persisted to 
+            this directory and reused by later runs.
+        dtype : str, optional
+            Data type of the batches. 'float16' or 'bfloat16' halve the 
+            host-to-device transfers, e.g., when training with mixed precision.
+        sampler : dl4ds.DistributedSampler or None, optional
+            If given, the samples are drawn from the shard of this sampler 
+            (e.g., the one of the current Horovod rank), reshuffled at every 
+            epoch. Otherwise, a single permutation of all the samples is used.
+        graph_interpolation : bool, optional
+            For 'pin' upsampling, the LR arrays are kept at the LR resolution 
+            and interpolated by the model on the device (see 
+            ``dl4ds.InterpolationUpsampling``).
+        static_on_device : bool, optional
+            If True, the batches contain the crop offsets (and season vectors)
+            instead of the static variables, which are gathered on the device 
+            by ``dl4ds.StaticFields``.
         """        
-        if isinstance(array, xr.DataArray):
-            # self.time_metadata = array.time.copy()  # grabbing time metadata
-            self.time_metadata = None
-            self.array = array.values
-        elif isinstance(array, np.ndarray):
-            self.array = array
-            self.time_metadata = None
-
-        if isinstance(array_lr, xr.DataArray):
-            self.array_lr = array_lr.values
-        else:
-            self.array_lr = array_lr
+        # self.time_metadata = array.time.copy()  # grabbing time metadata
+        self.time_metadata = None
+        self.array = as_data_source(array)
+        self.array_lr = as_data_source(array_lr)
         
         self.batch_size = batch_size
         self.scale = scale
@@ -451,22 +679,42 @@ class DataGenerator(tf.keras.utils.Sequence):
         self.predictors = predictors
         # concatenating list of ndarray variables along the last dimension  
         if self.predictors is not None:
-            self.predictors = np.concatenate(self.predictors, axis=-1)
+            self.predictors = concatenate_sources(self.predictors)
         self.interpolation = interpolation
         self.repeat = repeat
+        self.lr_cache = lr_cache
+        self.dtype = dtype
+        self.sampler = sampler
+        self.graph_interpolation = graph_interpolation
+        self.static_on_device = static_on_device
+        # optional callable notified when a batch is ready, see 
+        # ``dl4ds.ThroughputCallback``
+        self.on_batch_ready = None
+        if self.array_lr is None and self.lr_cache:
+            cache_dir = self.lr_cache if isinstance(self.lr_cache, str) else None
+            # with in-graph interpolation, only the coarsened grids are cached
+            lr_upsampling = 'spc' if self.graph_interpolation else self.upsampling
+            self.array_lr = precompute_lr(self.array, self.scale, lr_upsampling, 
+                                          self.interpolation, cache_dir)
         
         # shuffling the order of the available indices (n samples)
         if self.time_window is not None:
             self.n = self.array.shape[0] - self.time_window
         else:
             self.n = self.array.shape[0]
-        self.indices = np.random.permutation(np.arange(self.n))
-        
-        if self.repeat is not None and isinstance(self.repeat, int):
-            self.indices = np.hstack([self.indices for i in range(self.repeat)])
+        if self.sampler is not None:
+            if self.sampler.n_samples != self.n:
+                msg = f'The sampler has {self.sampler.n_samples} samples, expected {self.n}'
+                raise ValueError(msg)
+            self.epoch = 0
+            self.indices = self._epoch_indices(self.epoch)
+        else:
+            self.indices = np.random.permutation(np.arange(self.n))
+            if self.repeat is not None and isinstance(self.repeat, int):
+                self.indices = np.hstack([self.indices for i in range(self.repeat)])
 
         if patch_size is not None:
-            if self.upsampling in POSTUPSAMPLING_METHODS: 
+            if self.upsampling in POSTUPSAMPLING_METHODS or self.graph_interpolation: 
                 if not self.patch_size % self.scale == 0:   
                     raise ValueError('`patch_size` must be divisible by `scale`')
 
@@ -476,6 +724,8 @@ class DataGenerator(tf.keras.utils.Sequence):
         A common practice is to set this value to n_samples / batch_size so that 
         the model sees the training samples at most once per epoch. 
         """
+        if self.sampler is not None:
+            return len(self.indices) // self.batch_size
         n_batches = self.n // self.batch_size
         if self.repeat:
             return n_batches * self.repeat
@@ -487,23 +737,380 @@ class DataGenerator(tf.keras.utils.Sequence):
         Generate one batch of data as (X, y) value pairs where X represents the 
         input and y represents the output.
         """
-        res = create_batch_hr_lr(
-            self.indices,
-            index,
-            self.array, 
-            self.array_lr,
-            upsampling=self.upsampling,
-            scale=self.scale, 
-            batch_size=self.batch_size, 
-            patch_size=self.patch_size,
-            time_window=self.time_window,
-            static_vars=self.static_vars, 
-            predictors=self.predictors,
-            interpolation=self.interpolation,
-            time_metadata=self.time_metadata)
+        return self._get_batch(index)
 
+    def on_epoch_end(self):
+        """With a sampler, the samples of the shard are reshuffled with the 
+        seed of the next epoch.
+        """
+        if self.sampler is not None:
+            self.epoch += 1
+            self.indices = self._epoch_indices(self.epoch)
+
+    def _epoch_indices(self, epoch):
+        """Indices of the samples of the sampler shard in a given epoch.
+        """
+        indices = self.sampler.indices(epoch)
+        if self.repeat is not None and isinstance(self.repeat, int):
+            indices = np.hstack([indices for i in range(self.repeat)])
+        return indices
+
+    def _get_batch(self, index, random_state=None, epoch=None):
+        """Batch number ``index``, see ``create_batch_hr_lr``. With a sampler, 
+        the samples of ``epoch`` are used if given.
+        """
+        indices = self.indices
+        if self.sampler is not None and epoch is not None:
+            indices = self._epoch_indices(epoch)
+        with _timer('batch_assembly'):
+            res = create_batch_hr_lr(
+                indices,
+                index,
+                self.array, 
+                self.array_lr,
+                upsampling=self.upsampling,
+                scale=self.scale, 
+                batch_size=self.batch_size, 
+                patch_size=self.patch_size,
+                time_window=self.time_window,
+                static_vars=self.static_vars, 
+                predictors=self.predictors,
+                interpolation=self.interpolation,
+                time_metadata=self.time_metadata,
+                random_state=random_state,
+                dtype=self.dtype,
+                graph_interpolation=self.graph_interpolation,
+                static_on_device=self.static_on_device)
+
+        if self.on_batch_ready is not None:
+            self.on_batch_ready()
         return res
 
+    def as_dataset(
+        self, 
+        shuffle=True, 
+        deterministic=False, 
+        seed=0,
+        num_parallel_calls=tf.data.AUTOTUNE, 
+        prefetch=tf.data.AUTOTUNE, 
+        repeat=False, 
+        shard=None, 
+        device=None):
+        """Build a ``tf.data.Dataset`` yielding the same batches as this 
+        generator, ((batch_lr, [batch_aux_hr]), (batch_hr,)). The batches are 
+        assembled by several threads in parallel (the NumPy/OpenCV code 
+        releases the GIL), without forking processes or pickling the arrays as 
+        with ``use_multiprocessing=True``.
+
+        Parameters
+        ----------
+        shuffle : bool, optional
+            If True, the order of the batches is shuffled at every epoch.
+        deterministic : bool, optional
+            If True, the order of the batches and the random crops are 
+            reproducible given ``seed``. If False, the batches are yielded as 
+            soon as they are ready.
+        seed : int, optional
+            Seed used when ``deterministic`` is True. The crops of each batch 
+            are drawn from a random state seeded with ``seed`` and the step 
+            number, so they change at every epoch only when ``repeat`` is True.
+        num_parallel_calls : int, optional
+            Number of batches assembled in parallel. By default it is tuned 
+            dynamically.
+        prefetch : int, optional
+            Number of batches prefetched.
+        repeat : bool, optional
+            If True, the dataset is repeated indefinitely.
+        shard : tuple of int or None, optional
+            Tuple (number of shards, shard index), e.g. (hvd.size(), hvd.rank())
+            to split the batches across the Horovod workers. Not needed when 
+            the generator has a ``sampler``, whose shard is reshuffled at 
+            every repetition of the dataset.
+        device : str or None, optional
+            If not None (e.g., '/gpu:0'), batches are prefetched to this device.
+            Must be the last transformation, so this dataset should be iterated
+            directly (e.g., in a custom training loop).
+        """
+        n_batches = len(self)
+        if n_batches == 0:
+            raise ValueError('`batch_size` is larger than the number of samples')
+        # probing the first batch for the number of inputs and their shapes
+        inputs, targets = self[0]
+        n_inputs = len(inputs)
+        shapes = [(None,) + x.shape[1:] for x in list(inputs) + list(targets)]
+        # crop offsets are int32, see ``create_batch_hr_lr``
+        dtypes = [tf.int32 if x.dtype == np.int32 else tf.as_dtype(self.dtype) 
+                  for x in list(inputs) + list(targets)]
+
+        dataset = tf.data.Dataset.range(n_batches)
+        if shard is not None:
+            dataset = dataset.shard(*shard)
+        if shuffle:
+            dataset = dataset.shuffle(n_batches, seed=seed if deterministic else None, 
+                                      reshuffle_each_iteration=True)
+        if repeat:
+            dataset = dataset.repeat()
+        dataset = dataset.enumerate()
+
+        def load_batch(step, index):
+            random_state = np.random.RandomState([seed, step]) if deterministic else None
+            # with a sampler, the samples change with every repetition (epoch)
+            epoch = int(step) // n_batches if self.sampler is not None else None
+            inputs, targets = self._get_batch(int(index), random_state, epoch)
+            return list(inputs) + list(targets)
+
+        def tf_load_batch(step, index):
+            arrays = tf.numpy_function(load_batch, [step, index], dtypes)
+            for array, shape in zip(arrays, shapes):
+                array.set_shape(shape)
+            return tuple(arrays[:n_inputs]), tuple(arrays[n_inputs:])
+
+        dataset = dataset.map(tf_load_batch, num_parallel_calls=num_parallel_calls,
+                              deterministic=deterministic)
+        dataset = dataset.prefetch(prefetch)
+        if device is not None:
+            dataset = dataset.apply(tf.data.experimental.prefetch_to_device(device))
+        return dataset
+
+
+class DistributedSampler():
+    """
+    Rank-aware sampler for data-parallel training (e.g., with Horovod). At 
+    every epoch, the samples are shuffled with a permutation seeded with 
+    ``seed`` and the epoch number, identical on all the ranks, and split into
+    ``num_replicas`` disjoint shards of equal size. Each rank then loads and 
+    processes only its shard.
+    """
+    def __init__(self, n_samples, num_replicas=1, rank=0, shuffle=True, seed=0):
+        """
+        Parameters
+        ----------
+        n_samples : int
+            Number of samples.
+        num_replicas : int, optional
+            Number of ranks, e.g., ``hvd.size()``.
+        rank : int, optional
+            Rank of the current process, e.g., ``hvd.rank()``.
+        shuffle : bool, optional
+            If True, the samples are shuffled at every epoch. Otherwise, the 
+            shards are strided slices of the samples in order.
+        seed : int, optional
+            Seed of the permutations, must be the same on all the ranks.
+        """
+        if not 0 <= rank < num_replicas:
+            msg = f'`rank` must be in [0, {num_replicas}), got {rank}'
+            raise ValueError(msg)
+        if n_samples < num_replicas:
+            raise ValueError('`n_samples` must be larger than `num_replicas`')
+        self.n_samples = n_samples
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self._cache = (None, None)
+
+    def __len__(self):
+        """Number of samples per rank (the last ``n_samples % num_replicas`` 
+        samples of each permutation are dropped).
+        """
+        return self.n_samples // self.num_replicas
+
+    def indices(self, epoch=0):
+        """Indices of the samples of the current rank in a given epoch.
+        """
+        # the cache is read once, it can be replaced concurrently by another
+        # thread (tf.data parallel map, BatchPrefetcher workers)
+        cached_epoch, cached = self._cache
+        if cached_epoch == epoch:
+            return cached
+        if self.shuffle:
+            indices = np.random.RandomState([self.seed, epoch]).permutation(self.n_samples)
+        else:
+            indices = np.arange(self.n_samples)
+        indices = indices[self.rank: len(self) * self.num_replicas: self.num_replicas]
+        self._cache = (epoch, indices)
+        return indices
+
+
+class BatchPrefetcher():
+    """
+    Bounded queue of batches prepared in the background by a pool of threads
+    (the NumPy/OpenCV code releases the GIL), so that the next batches are 
+    cropped and resized while the current training step runs. Iterating 
+    yields the batches in order, ``load_batch(0)``, ``load_batch(1)``, ... 
+
+    The time the consumer was blocked waiting for a batch is accumulated in 
+    ``wait_time`` (seconds).
+    """
+    def __init__(self, load_batch, n_batches, workers=1, depth=2):
+        """
+        Parameters
+        ----------
+        load_batch : callable
+            Function returning the batch for a given step number. Should not 
+            rely on global random states if ``workers`` > 1, e.g., the step 
+            number can be used to seed a np.random.RandomState.
+        n_batches : int
+            Number of batches (steps).
+        workers : int, optional
+            Number of threads preparing batches.
+        depth : int, optional
+            Maximum number of batches prepared in advance (queue depth).
+        """
+        if workers < 1:
+            raise ValueError('`workers` must be a positive integer')
+        if depth < 1:
+            raise ValueError('`depth` must be a positive integer')
+        self.load_batch = load_batch
+        self.n_batches = n_batches
+        self.workers = workers
+        self.depth = depth
+        self.wait_time = 0.
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._queue = deque()
+        self._next_step = 0
+        self._fill_queue()
+
+    def __len__(self):
+        return self.n_batches
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._queue:
+            self.close()
+            raise StopIteration
+        future = self._queue.popleft()
+        self._fill_queue()
+        start = time.perf_counter()
+        batch = future.result()
+        self.wait_time += time.perf_counter() - start
+        return batch
+
+    def close(self):
+        """Cancel the pending batches and stop the threads.
+        """
+        for future in self._queue:
+            future.cancel()
+        self._queue.clear()
+        self._executor.shutdown(wait=True)
+
+    def _fill_queue(self):
+        while len(self._queue) < self.depth and self._next_step < self.n_batches:
+            self._queue.append(self._executor.submit(self.load_batch, self._next_step))
+            self._next_step += 1
+
+
+class StaticFields(tf.keras.layers.Layer):
+    """
+    Layer that completes the inputs of a model with the static variables and 
+    the season encoding, on the device. The static variables are uploaded once
+    (as non-trainable variables) and the crops of each batch are gathered 
+    in-graph from the HR crop offsets returned by ``create_batch_hr_lr`` with 
+    ``static_on_device=True``, instead of being copied with every batch. The 
+    season vectors [n, 4] are broadcast to the grids. 
+    
+    The layer maps [batch_lr, batch_offsets(, batch_season)] to the inputs of 
+    the model, [batch_lr, batch_aux_hr], as built by ``create_batch_hr_lr``.
+    """
+    def __init__(
+        self, 
+        static_vars, 
+        scale, 
+        lr_sized=False, 
+        is_spatiotemporal=False, 
+        interpolation='inter_area', 
+        name='StaticFields'):
+        """
+        Parameters
+        ----------
+        static_vars : list of 2D ndarrays or None
+            Static variables such as elevation data or a binary land-ocean 
+            mask, or None when only the season is used.
+        scale : int
+            Scaling factor.
+        lr_sized : bool, optional
+            Whether the LR inputs are at the LR resolution (post-upsampling or
+            'pin' with in-graph interpolation). Otherwise they are on the HR 
+            grid.
+        is_spatiotemporal : bool, optional
+            If True, the static variables and season are only passed in the HR
+            auxiliary input, as for spatio-temporal models.
+        interpolation : str, optional
+            Interpolation used for coarsening the static variables.
+        """
+        super().__init__(name=name)
+        self.scale = scale
+        self.lr_sized = lr_sized
+        self.is_spatiotemporal = is_spatiotemporal
+        self.static_hr = self.static_lr = None
+        if static_vars is not None:
+            static_array = np.concatenate(
+                [checkarray_ndim(np.squeeze(np.asarray(var)), 3, -1) for var in static_vars], 
+                axis=-1).astype('float32')
+            self.static_hr = tf.Variable(static_array, trainable=False, name='static_hr')
+            if lr_sized and not is_spatiotemporal:
+                lr_x = int(static_array.shape[1] / scale)
+                lr_y = int(static_array.shape[0] / scale)
+                static_lr = resize_array(static_array, (lr_x, lr_y), interpolation, 
+                                         squeezed=False)
+                self.static_lr = tf.Variable(static_lr.astype('float32'), 
+                                             trainable=False, name='static_lr')
+            else:
+                self.static_lr = self.static_hr
+
+    @property
+    def n_channels(self):
+        """Number of channels added by the layer, without the season."""
+        return 0 if self.static_hr is None else self.static_hr.shape[-1]
+
+    def call(self, inputs):
+        batch_lr, offsets = inputs[0], tf.cast(inputs[1], tf.int32)
+        season = inputs[2] if len(inputs) > 2 else None
+        lr_y, lr_x = tf.shape(batch_lr)[-3], tf.shape(batch_lr)[-2]
+        factor = self.scale if self.lr_sized else 1
+        hr_y, hr_x = lr_y * factor, lr_x * factor
+
+        lr_blocks, aux_blocks = [batch_lr], []
+        if self.static_hr is not None:
+            aux_blocks.append(_gather_crops(self.static_hr, offsets, hr_y, hr_x))
+            if not self.is_spatiotemporal:
+                lr_blocks.append(_gather_crops(self.static_lr, offsets // factor, 
+                                               lr_y, lr_x))
+        if season is not None:
+            aux_blocks.append(_broadcast_vectors(season, hr_y, hr_x))
+            if not self.is_spatiotemporal:
+                lr_blocks.append(_broadcast_vectors(season, lr_y, lr_x))
+        
+        lr_blocks = [tf.cast(block, batch_lr.dtype) for block in lr_blocks]
+        aux_blocks = [tf.cast(block, batch_lr.dtype) for block in aux_blocks]
+        return [tf.concat(lr_blocks, axis=-1), tf.concat(aux_blocks, axis=-1)]
+
+    def wrap(self, model, season=False):
+        """
+        Model taking the batches of ``create_batch_hr_lr`` with 
+        ``static_on_device=True`` and running ``model`` on the inputs completed
+        by this layer. The weights are shared with ``model``.
+
+        Parameters
+        ----------
+        model : tf.keras.Model
+            Model with inputs [batch_lr, batch_aux_hr].
+        season : bool, optional
+            Whether the batches contain the season vectors. 
+        """
+        lr_shape = tuple(model.inputs[0].shape[1:])
+        if not self.is_spatiotemporal:
+            n_channels_lr = lr_shape[-1] - self.n_channels - (4 if season else 0)
+            lr_shape = lr_shape[:-1] + (n_channels_lr,)
+        inputs = [tf.keras.layers.Input(shape=lr_shape), 
+                  tf.keras.layers.Input(shape=(2,), dtype='int32')]
+        if season:
+            inputs.append(tf.keras.layers.Input(shape=(4,)))
+        outputs = model(self(inputs))
+        return tf.keras.Model(inputs=inputs, outputs=outputs, name=model.name)
+
 
 def _get_season_(time_metadata, time_window):
     """ Get the season for a given sample.
@@ -511,6 +1118,7 @@ def _get_season_(time_metadata, time_window):
     if time_window is None:
         month_int = time_metadata.dt.month.values
     else:
+        import scipy as sc
         month_int = sc.stats.mode(time_metadata.time.dt.month.values)
         month_int = int(month_int.count)
 
@@ -525,12 +1133,22 @@ def _get_season_(time_metadata, time_window):
     return season
 
 
+def _get_season_vector_(season):
+    """ Produce a one-hot vector encoding the season. 
+    """
+    if season not in ['winter', 'spring', 'summer', 'autumn']:
+        raise ValueError('``season`` not recognized')
+    season_vector = np.zeros(4)
+    season_vector[['winter', 'spring', 'summer', 'autumn'].index(season)] = 1
+    return season_vector
+
+
 def _get_season_array_(season, sizey, sizex):
     """ Produce a multichannel array encoding the season. 
     """
     if season not in ['winter', 'spring', 'summer', 'autumn']:
         raise ValueError('``season`` not recognized')
-    season_array = np.zeros((sizey, sizex, 4))
+    season_array = np.zeros((sizey, sizex, 4), dtype='float32')
     if season == 'winter':
         season_array[:,:,0] += 1
     elif season == 'spring':
@@ -539,4 +1157,32 @@ def _get_season_array_(season, sizey, sizex):
         season_array[:,:,2] += 1
     elif season == 'autumn':
         season_array[:,:,3] += 1    
-    return season_array
\ No newline at end of file
+    return season_array
+
+
+def _to_device(batch):
+    """Tensors of the (host) arrays of a batch, copied to the default device
+    (before the step instead of within it).
+    """
+    return tf.nest.map_structure(
+        lambda x: tf.identity(x) if isinstance(x, np.ndarray) else x, batch)
+
+
+def _numpy_dtype(dtype):
+    """NumPy data type from a str or a NumPy/TF data type ('bfloat16' is not
+    a native NumPy type).
+    """
+    return tf.as_dtype(dtype).as_numpy_dtype
+
+
+def _gather_crops(field, offsets, size_y, size_x):
+    """Crops [n, size_y, size_x, c] of a 2D ``field`` [y, x, c] at the
+    ``offsets`` [n, 2] (y, x), gathered in-graph."""
+    rows = tf.gather(field, offsets[:, :1] + tf.range(size_y))
+    return tf.gather(rows, offsets[:, 1:] + tf.range(size_x), axis=2, batch_dims=1)
+
+
+def _broadcast_vectors(vectors, size_y, size_x):
+    """Vectors [n, k] broadcast to grids [n, size_y, size_x, k]."""
+    n, k = tf.shape(vectors)[0], tf.shape(vectors)[1]
+    return tf.broadcast_to(vectors[:, tf.newaxis, tf.newaxis, :], [n, size_y, size_x, k])
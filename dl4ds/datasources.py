@@ -0,0 +1,648 @@
+"""
+Data sources for reading (lazily) the samples needed by each batch
+"""
+
+import os
+import hashlib
+import numpy as np
+import xarray as xr
+from abc import ABC, abstractmethod
+from numpy.lib.stride_tricks import sliding_window_view
+
+from . import POSTUPSAMPLING_METHODS
+from .utils import checkarray_ndim, _resize_stack
+
+
+# LR pixels around a window needed by the interpolation kernels (lanczos4)
+_INTERPOLATION_MARGIN = 4
+
+
+class DataSource(ABC):
+    """
+    Abstract data source with dims [time, lat, lon, variables]. A data source
+    only reads the time slices and spatial windows requested by each batch,
+    which allows feeding ``dl4ds.DataGenerator``, ``dl4ds.CGANTrainer`` and
+    ``dl4ds.predict`` with datasets that do not fit in memory.
+    """
+    @property
+    @abstractmethod
+    def shape(self):
+        pass
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def __len__(self):
+        return self.shape[0]
+
+    @abstractmethod
+    def read(self, time, y=slice(None), x=slice(None)):
+        """Read a block of data as a 4D ndarray [time, y, x, variables].
+
+        Parameters
+        ----------
+        time : slice or 1D ndarray of int
+            Time slice or time indices.
+        y, x : slice, optional
+            Spatial window.
+        """
+        pass
+
+    def take(self, indices, time_window=None):
+        """Gather the samples in ``indices``. Returns an ndarray with dims
+        [n, y, x, variables] or, when ``time_window`` is given,
+        [n, time_window, y, x, variables].
+        """
+        indices = np.asarray(indices)
+        if time_window is None:
+            return self.read(indices)
+        # the time slices shared by overlapping windows are read only once
+        times, starts = window_frames(indices, time_window)
+        return _take_samples(self.read(times), starts, time_window)
+
+    def take_patches(self, indices, crop_y, crop_x, size, time_window=None):
+        """Gather square patches of ``size`` for the samples in ``indices``,
+        with per-sample bottom-left corners (``crop_y``, ``crop_x``). Only the
+        requested windows are read. Returns an ndarray with dims
+        [n, size, size, variables] or, when ``time_window`` is given,
+        [n, time_window, size, size, variables].
+        """
+        n = len(indices)
+        sample_shape = (size, size, self.shape[-1])
+        if time_window is not None:
+            sample_shape = (time_window,) + sample_shape
+        patches = None
+        for k in range(n):
+            t = indices[k] if time_window is None else slice(indices[k], indices[k] + time_window)
+            y, x = int(crop_y[k]), int(crop_x[k])
+            block = self.read(t, slice(y, y + size), slice(x, x + size))
+            if patches is None:
+                patches = np.empty((n,) + sample_shape, dtype=block.dtype)
+            patches[k] = block.reshape(sample_shape)
+        return patches
+
+    def __getitem__(self, key):
+        """Basic indexing with [time, (y, x)] keys, as for a np.ndarray.
+        """
+        if not isinstance(key, tuple):
+            key = (key,)
+        block = self.read(*key)
+        if np.ndim(key[0]) == 0 and not isinstance(key[0], slice):
+            block = block[0]
+        return block
+
+    def __array__(self, dtype=None):
+        array = self.read(slice(None))
+        return array if dtype is None else array.astype(dtype)
+
+
+class ArraySource(DataSource):
+    """
+    In-memory (np.ndarray) or memory-mapped (np.memmap) data source. With a
+    memory-mapped array only the pages touched by each batch are read from disk.
+    """
+    def __init__(self, array):
+        """
+        Parameters
+        ----------
+        array : np.ndarray or np.memmap
+            Gridded data with dims [time, lat, lon] or [time, lat, lon, vars].
+        """
+        self.array = checkarray_ndim(array, 4, -1)
+
+    @classmethod
+    def from_npy(cls, path):
+        """Memory-map a .npy file (read-only).
+        """
+        return cls(np.load(path, mmap_mode='r'))
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    @property
+    def dtype(self):
+        return self.array.dtype
+
+    def read(self, time, y=slice(None), x=slice(None)):
+        return np.asarray(self.array[_time_key(time), y, x])
+
+    def take(self, indices, time_window=None):
+        return _take_samples(self.array, np.asarray(indices), time_window)
+
+    def take_patches(self, indices, crop_y, crop_x, size, time_window=None):
+        return _gather_patches(self.array, np.asarray(indices), crop_y, crop_x,
+                               size, time_window)
+
+
+class XarraySource(DataSource):
+    """
+    Lazy data source from an xr.DataArray, e.g., backed by chunked dask arrays
+    when opening NetCDF or Zarr stores. Only the selected blocks are loaded.
+    """
+    def __init__(self, data):
+        """
+        Parameters
+        ----------
+        data : xr.DataArray
+            Gridded data with dims [time, lat, lon] or [time, lat, lon, vars].
+            When a ``time`` dimension is present it is moved to the first
+            position.
+        """
+        if not isinstance(data, xr.DataArray):
+            raise TypeError('`data` must be a xr.DataArray')
+        if 'time' in data.dims and data.dims[0] != 'time':
+            data = data.transpose('time', ...)
+        if data.ndim not in [3, 4]:
+            raise ValueError('`data` must be 3D [time, lat, lon] or 4D [time, lat, lon, vars]')
+        self.data = data
+
+    @property
+    def shape(self):
+        if self.data.ndim == 3:
+            return tuple(self.data.shape) + (1,)
+        return tuple(self.data.shape)
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def read(self, time, y=slice(None), x=slice(None)):
+        block = np.asarray(self.data[_time_key(time), y, x].values)
+        return checkarray_ndim(block, 4, -1)
+
+
+class InterpolatedSource(DataSource):
+    """
+    Data source that interpolates the grids of another data source to a new
+    size on the fly (e.g., LR data upsampled to the HR grid for inference).
+    """
+    def __init__(self, source, newsize, interpolation='inter_area'):
+        """
+        Parameters
+        ----------
+        source : dl4ds.DataSource, np.ndarray or xr.DataArray
+            Data source to be interpolated.
+        newsize : tuple of int
+            New size in X,Y.
+        interpolation : str, optional
+            Interpolation method.
+        """
+        self.source = as_data_source(source)
+        self.newsize = newsize
+        self.interpolation = interpolation
+
+    @property
+    def shape(self):
+        size_x, size_y = self.newsize
+        return (self.source.shape[0], size_y, size_x, self.source.shape[-1])
+
+    @property
+    def dtype(self):
+        return self.source.dtype
+
+    def read(self, time, y=slice(None), x=slice(None)):
+        size_x, size_y = self.newsize
+        lr_y, lr_x = self.source.shape[1:3]
+        window_y = _lr_window(y, size_y, lr_y)
+        window_x = _lr_window(x, size_x, lr_x)
+        if window_y is None or window_x is None:
+            block = self.source.read(_time_key(time))
+            block = _resize_stack(block, self.newsize, self.interpolation)
+            return block[:, y, x]
+        # only the LR window covering the requested one (plus a margin for 
+        # the interpolation kernel) is read and resized, e.g., for tiles
+        (ys, crop_y), (xs, crop_x) = window_y, window_x
+        block = self.source.read(_time_key(time), ys, xs)
+        newsize = ((xs.stop - xs.start) * (size_x // lr_x), 
+                   (ys.stop - ys.start) * (size_y // lr_y))
+        block = _resize_stack(block, newsize, self.interpolation)
+        return block[:, crop_y, crop_x]
+
+    def take(self, indices, time_window=None):
+        if time_window is None:
+            return _resize_stack(self.source.take(indices), self.newsize, 
+                                 self.interpolation)
+        # the frames shared by overlapping windows are resized only once
+        times, starts = window_frames(indices, time_window)
+        frames = _resize_stack(self.source.read(times), self.newsize, 
+                               self.interpolation)
+        return _take_samples(frames, starts, time_window)
+
+
+class WindowSource(DataSource):
+    """
+    Spatial window of another data source (e.g., a tile of the domain). Only
+    the window is read from the underlying data source.
+    """
+    def __init__(self, source, y, x):
+        """
+        Parameters
+        ----------
+        source : dl4ds.DataSource, np.ndarray or xr.DataArray
+            Data source.
+        y, x : slice
+            Spatial window, with non-negative start and stop.
+        """
+        self.source = as_data_source(source)
+        self.y = slice(y.start or 0, self.source.shape[1] if y.stop is None else y.stop)
+        self.x = slice(x.start or 0, self.source.shape[2] if x.stop is None else x.stop)
+
+    @property
+    def shape(self):
+        return (self.source.shape[0], self.y.stop - self.y.start, 
+                self.x.stop - self.x.start, self.source.shape[-1])
+
+    @property
+    def dtype(self):
+        return self.source.dtype
+
+    def read(self, time, y=slice(None), x=slice(None)):
+        return self.source.read(time, _subwindow(self.y, y), _subwindow(self.x, x))
+
+
+class ConcatenatedSource(DataSource):
+    """
+    Concatenation of several data sources along the variables dimension.
+    """
+    def __init__(self, sources):
+        self.sources = [as_data_source(s) for s in sources]
+        first = self.sources[0].shape[:3]
+        for s in self.sources[1:]:
+            if s.shape[:3] != first:
+                raise ValueError('All the data sources must have the same [time, lat, lon] dims')
+
+    @property
+    def shape(self):
+        return self.sources[0].shape[:3] + (sum(s.shape[-1] for s in self.sources),)
+
+    @property
+    def dtype(self):
+        return np.result_type(*[s.dtype for s in self.sources])
+
+    def read(self, time, y=slice(None), x=slice(None)):
+        return np.concatenate([s.read(time, y, x) for s in self.sources], axis=-1)
+
+    def take(self, indices, time_window=None):
+        return np.concatenate([s.take(indices, time_window) for s in self.sources], axis=-1)
+
+    def take_patches(self, indices, crop_y, crop_x, size, time_window=None):
+        return np.concatenate([s.take_patches(indices, crop_y, crop_x, size, time_window)
+                               for s in self.sources], axis=-1)
+
+
+def as_data_source(data):
+    """Wrap ``data`` into a ``dl4ds.DataSource``.
+
+    Parameters
+    ----------
+    data : dl4ds.DataSource, np.ndarray, np.memmap, xr.DataArray or str
+        Gridded data. Dask-backed xr.DataArrays are read lazily, while in-memory
+        ones are converted to np.ndarray. A str is interpreted as a path to be
+        opened with ``dl4ds.open_data_source``.
+    """
+    if data is None or isinstance(data, DataSource):
+        return data
+    elif isinstance(data, str):
+        return open_data_source(data)
+    elif isinstance(data, xr.DataArray):
+        if data.chunks is not None:
+            return XarraySource(data)
+        return ArraySource(data.values)
+    elif isinstance(data, np.ndarray):
+        return ArraySource(data)
+    else:
+        raise TypeError('`data` must be a np.ndarray, xr.DataArray, dl4ds.DataSource or a path')
+
+
+def concatenate_sources(sources):
+    """Concatenate a list of arrays or data sources along the last dimension.
+    When all of them are in memory a single np.ndarray is returned, otherwise
+    a ``dl4ds.DataSource``. An already concatenated array or data source is 
+    returned as it is.
+    """
+    if sources is None:
+        return None
+    if not isinstance(sources, (list, tuple)):
+        sources = [sources]
+    sources = [as_data_source(s) for s in sources]
+    if all(isinstance(s, ArraySource) and not isinstance(s.array, np.memmap)
+           for s in sources):
+        if len(sources) == 1:
+            return sources[0].array
+        return np.concatenate([s.array for s in sources], axis=-1)
+    if len(sources) == 1:
+        return sources[0]
+    return ConcatenatedSource(sources)
+
+
+def open_data_source(path, variable=None, chunks=None):
+    """Open a data source from disk without loading it into memory.
+
+    Parameters
+    ----------
+    path : str
+        Path to a .npy file (memory-mapped), a NetCDF file or a Zarr store.
+    variable : str or None, optional
+        Name of the variable to read from a NetCDF/Zarr dataset. If None, the
+        dataset must contain a single data variable.
+    chunks : dict, int, str or None, optional
+        Passed to ``xr.open_dataset``/``xr.open_zarr`` to get dask-backed
+        chunked arrays. If None, xarray's lazy (on access) indexing is used.
+    """
+    path = str(path)
+    if path.endswith('.npy'):
+        return ArraySource.from_npy(path)
+
+    if path.rstrip(os.sep).endswith('.zarr'):
+        ds = xr.open_zarr(path, chunks=chunks)
+    else:
+        ds = xr.open_dataset(path, chunks=chunks)
+
+    if isinstance(ds, xr.Dataset):
+        if variable is None:
+            if len(ds.data_vars) != 1:
+                msg = f'`variable` must be given, the dataset contains {list(ds.data_vars)}'
+                raise ValueError(msg)
+            variable = list(ds.data_vars)[0]
+        ds = ds[variable]
+    return XarraySource(ds)
+
+
+def window_frames(indices, time_window):
+    """Time slices (frames) needed by the spatio-temporal samples starting at
+    ``indices``, and the position of the first frame of each sample within 
+    them. The frames shared by overlapping windows appear only once, so they 
+    are read and interpolated once. The frames of each window are consecutive,
+    so the samples are windows [starts, starts + time_window) of the frames.
+
+    Returns
+    -------
+    times : 1D ndarray of int
+        Sorted unique time indices.
+    starts : 1D ndarray of int
+        Position of the first frame of each sample in ``times``.
+    """
+    indices = np.asarray(indices)
+    windows = indices[:, np.newaxis] + np.arange(time_window)
+    times, inverse = np.unique(windows, return_inverse=True)
+    starts = inverse.reshape(windows.shape)[:, 0]
+    return times, starts
+
+
+def precompute_lr(
+    array, 
+    scale, 
+    upsampling, 
+    interpolation='inter_area', 
+    cache_dir=None, 
+    chunk_size=256,
+    cache_key=None):
+    """Precompute the coarsened LR counterpart of the HR ``array``, used for
+    creating implicit (PerfectProg) pairs. The HR grids are downsampled by 
+    ``scale`` and, for pre-upsampling ('pin'), interpolated back to the HR grid.
+    The result can be passed as ``array_lr`` to ``dl4ds.DataGenerator``, the 
+    trainers or ``dl4ds.predict``, so the interpolation is done only once 
+    instead of for every sample in every epoch.
+
+    Parameters
+    ----------
+    array : np.ndarray, xr.DataArray or dl4ds.DataSource
+        HR gridded data with dims [time, lat, lon, vars].
+    scale : int
+        Scaling factor.
+    upsampling : str
+        String with the name of the upsampling method.
+    interpolation : str, optional
+        Interpolation used when downsampling/upsampling.
+    cache_dir : str or None, optional
+        If not None, the LR array is persisted as a .npy file in this directory,
+        with a name built from the upsampling type, ``scale``, 
+        ``interpolation`` and a key of the data (see ``cache_key``). An 
+        existing file with the same name is reused (memory-mapped) instead of 
+        being recomputed.
+    chunk_size : int, optional
+        Number of time slices interpolated at once.
+    cache_key : str or None, optional
+        Key identifying the data in the name of the cache file. If None, it is
+        derived from the shape and dtype of the data and, without reading it, 
+        from the path, modification time and offset of memory-mapped arrays or 
+        the name of dask-backed xr.DataArrays. Other (in-memory) data is 
+        identified by a hash of its values.
+
+    Returns
+    -------
+    lr_source : dl4ds.ArraySource
+        In-memory (``cache_dir=None``) or memory-mapped LR data.
+    """
+    source = as_data_source(array)
+    n, hr_y, hr_x = source.shape[:3]
+    lr_x, lr_y = int(hr_x / scale), int(hr_y / scale)
+    if upsampling in POSTUPSAMPLING_METHODS:
+        kind = 'post'
+        out_shape = (n, lr_y, lr_x, source.shape[-1])
+    elif upsampling == 'pin':
+        kind = 'pin'
+        out_shape = (n, hr_y, hr_x, source.shape[-1])
+    else:
+        raise ValueError('`upsampling` not recognized')
+
+    def coarsen(block):
+        block = _resize_stack(block, (lr_x, lr_y), interpolation)
+        if kind == 'pin':
+            block = _resize_stack(block, (hr_x, hr_y), interpolation)
+        return block
+
+    if cache_dir is None:
+        lr_array = np.empty(out_shape, dtype=source.dtype)
+        for i in range(0, n, chunk_size):
+            lr_array[i: i + chunk_size] = coarsen(source.read(slice(i, i + chunk_size)))
+        return ArraySource(lr_array)
+
+    if cache_key is None:
+        cache_key = _hash_source(source, chunk_size)
+    digest = hashlib.sha1(str(cache_key).encode()).hexdigest()
+    fname = f'lr_{kind}_x{scale}_{interpolation}_{digest[:16]}.npy'
+    path = os.path.join(cache_dir, fname)
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        # writing to a temporary file first, so concurrent workers never read
+        # a partially written cache
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        lr_array = np.lib.format.open_memmap(tmp_path, mode='w+', 
+                                             dtype=source.dtype, shape=out_shape)
+        for i in range(0, n, chunk_size):
+            lr_array[i: i + chunk_size] = coarsen(source.read(slice(i, i + chunk_size)))
+        lr_array.flush()
+        del lr_array
+        os.replace(tmp_path, path)
+    return ArraySource.from_npy(path)
+
+
+def to_shared_memory(data, path, is_writer=True, barrier=None, chunk_size=256,
+                     time_series=True):
+    """Copy ``data`` once to a .npy file in node-local shared memory (e.g., 
+    under /dev/shm) and memory-map it. All the processes mapping the file 
+    share the same physical pages (zero-copy), including forked data loading
+    workers. With several processes per node (e.g., Horovod local ranks), only
+    the writer (e.g., local rank 0) reads ``data`` and writes the file, while 
+    the others wait at ``barrier`` and then map it. 
+
+    Parameters
+    ----------
+    data : np.ndarray, xr.DataArray or dl4ds.DataSource
+        Gridded data with dims [time, lat, lon(, vars)], read ``chunk_size`` 
+        time slices at a time, or an array without a time dimension (e.g., a 
+        static variable) copied at once.
+    path : str
+        Path of the .npy file, e.g., '/dev/shm/dl4ds_<job>_data_train.npy'. 
+        Must be the same for all the processes of the node.
+    is_writer : bool, optional
+        Whether this process writes the file.
+    barrier : callable or None, optional
+        Function blocking until all the processes reach it, called between 
+        the writing and the mapping of the file.
+    chunk_size : int, optional
+        Number of time slices copied at once.
+    time_series : bool, optional
+        Whether the first dimension of ``data`` is time. If False, ``data`` is
+        copied as is (e.g., a static variable [lat, lon, 1]).
+
+    Returns
+    -------
+    array : np.memmap
+        Read-only memory-mapped array. The file can be removed once all the 
+        processes have mapped it, the memory is released when they unmap it.
+    """
+    if is_writer:
+        # writing to a temporary file first, so that a partially written file
+        # is never mapped
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            if time_series:
+                source = as_data_source(data)
+                array = np.lib.format.open_memmap(tmp_path, mode='w+', 
+                                                  dtype=source.dtype, 
+                                                  shape=source.shape)
+                for i in range(0, source.shape[0], chunk_size):
+                    array[i: i + chunk_size] = source.read(slice(i, i + chunk_size))
+                array.flush()
+                del array
+            else:
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, np.asarray(data))
+            os.replace(tmp_path, path)
+        finally:
+            # the shared memory of a partially written file is released
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    if barrier is not None:
+        barrier()
+    return np.load(path, mmap_mode='r')
+
+
+def _hash_source(source, chunk_size=256):
+    """Key of a data source for the LR cache: its shape and dtype plus the
+    metadata of its data (see ``_data_key``), or a SHA1 hash of its values 
+    (read ``chunk_size`` time slices at a time) for in-memory data.
+    """
+    key = str((tuple(source.shape), str(source.dtype)))
+    data_key = _data_key(source)
+    if data_key is not None:
+        return key + data_key
+    sha = hashlib.sha1()
+    sha.update(key.encode())
+    for i in range(0, source.shape[0], chunk_size):
+        block = np.ascontiguousarray(source.read(slice(i, i + chunk_size)))
+        sha.update(block.tobytes())
+    return sha.hexdigest()
+
+
+def _data_key(source):
+    """Metadata identifying the data of a source without reading it: path, 
+    modification time and position of a memory-mapped array, or name of a 
+    dask array (the names of the dask arrays opened from files depend on 
+    their paths and modification times). None for other data.
+    """
+    if isinstance(source, ConcatenatedSource):
+        keys = [_data_key(s) for s in source.sources]
+        return None if None in keys else str(keys)
+    if isinstance(source, XarraySource):
+        name = getattr(source.data.data, 'name', None)
+        return None if name is None else f'dask:{name}'
+    if isinstance(source, ArraySource) and isinstance(source.array, np.memmap):
+        array = source.array
+        if array.filename is None:
+            return None
+        # position of the (possibly sliced) array in the mapped file
+        root = array
+        while isinstance(root.base, np.ndarray):
+            root = root.base
+        start = np.byte_bounds(array)[0] - np.byte_bounds(root)[0]
+        stat = os.stat(array.filename)
+        return str(('memmap', os.path.abspath(array.filename), stat.st_mtime_ns,
+                    stat.st_size, array.offset, start, array.strides))
+    return None
+
+
+def _take_samples(array, indices, time_window=None):
+    """Gather the samples in ``indices`` from ``array`` [time, y, x, c]. For 
+    spatio-temporal samples, the windows [indices, indices + time_window) are
+    gathered resulting in an array [n, time_window, y, x, c].
+    """
+    if time_window is None:
+        return array[indices]
+    # fancy indexing on a (zero-copy) sliding-window view
+    windows = sliding_window_view(array, time_window, axis=0)
+    return np.moveaxis(windows[indices], -1, 1)
+
+
+def _gather_patches(array, indices, crop_y, crop_x, size, time_window=None):
+    """Gather square patches of ``size`` from ``array`` [time, y, x, c], with 
+    per-sample bottom-left corners (``crop_y``, ``crop_x``), using a single 
+    fancy-indexing operation on a (zero-copy) sliding-window view. Returns 
+    [n, size, size, c] or, when ``time_window`` is given, 
+    [n, time_window, size, size, c].
+    """
+    if time_window is None:
+        windows = sliding_window_view(array, (size, size), axis=(1, 2))
+    else:
+        windows = sliding_window_view(array, (time_window, size, size), 
+                                      axis=(0, 1, 2))
+    # windows are indexed as [time, y, x, c, (time_window,) size, size]
+    patches = windows[indices, crop_y, crop_x]
+    return np.moveaxis(patches, 1, -1)
+
+
+def _subwindow(window, key):
+    """Compose a window slice with a (non-negative) slice relative to it.
+    """
+    start = window.start + (key.start or 0)
+    stop = window.stop if key.stop is None else window.start + key.stop
+    return slice(start, min(stop, window.stop))
+
+
+def _lr_window(window, size, lr_size):
+    """LR slice covering the (HR) ``window`` slice of an axis of ``size``
+    pixels, with a margin of ``_INTERPOLATION_MARGIN`` LR pixels, and the 
+    slice cropping the window from the resized LR slice. None if the window 
+    is strided or the scaling factor is not an integer.
+    """
+    start, stop, step = window.indices(size)
+    if step != 1 or size % lr_size != 0 or stop <= start:
+        return None
+    factor = size // lr_size
+    lr_start = max(0, start // factor - _INTERPOLATION_MARGIN)
+    lr_stop = min(lr_size, -(-stop // factor) + _INTERPOLATION_MARGIN)
+    offset = lr_start * factor
+    return slice(lr_start, lr_stop), slice(start - offset, stop - offset)
+
+
+def _time_key(time):
+    """Time key that keeps the time dimension when indexing (integer indices
+    are converted to 1-element arrays).
+    """
+    if isinstance(time, slice):
+        return time
+    return np.atleast_1d(time)
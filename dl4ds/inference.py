@@ -1,13 +1,21 @@
 from datetime import time
 import os
+import re
+import json
+import copy
 import numpy as np
 import xarray as xr
 import tensorflow as tf
 import keras
 
-from .utils import Timing, checkarray_ndim, resize_array, spatiotemporal_to_spatial_samples
-from .dataloader import create_batch_hr_lr
+from . import POSTUPSAMPLING_METHODS
+from .utils import Timing, crop_array, spatiotemporal_to_spatial_samples
+from .dataloader import create_batch_hr_lr, StaticFields, _to_device
+from .profiling import Profiler, _step, _sync, _timer
+from .datasources import (as_data_source, concatenate_sources, InterpolatedSource,
+                          WindowSource, precompute_lr, open_data_source)
 
+_METADATA_FNAME = 'dl4ds_metadata.json'
 
 class Predictor():
     """     
@@ -31,15 +39,27 @@ class Predictor():
         save_path=None,
         save_fname='y_hat.npy',
         return_lr=False,
-        device='GPU'):
+        device='GPU',
+        lr_cache=None,
+        tile_size=None,
+        tile_overlap=None,
+        blending='cosine',
+        chunk_size=None,
+        batch_dtype='float32',
+        static_on_device=False,
+        profile=False,
+        coords=None,
+        mc_samples=None,
+        quantiles=None):
         """ 
         Parameters
         ----------
         trainer : dl4ds.SupervisedTrainer or dl4ds.CGANTrainer
             Trainer containing a keras model (``model`` or ``generator``). 
             Optionally, you can direclty pass the tf.keras model.
-        array : ndarray
-            Batch of HR grids. 
+        array : ndarray, xr.DataArray or dl4ds.DataSource
+            Batch of HR or LR grids. Lazy data sources (memmap, dask) are read 
+            only when the samples are gathered.
         scale : int
             Scaling factor. 
         array_in_hr : bool, optional
@@ -68,6 +88,47 @@ class Predictor():
             Filename to complete the path were the prediciton is saved.     
         return_lr : bool, optional
             If True, the LR array is returned along with the downscaled one.                                                                
+        lr_cache : bool, str or None, optional
+            Only used when ``array_in_hr`` is True. If True, the coarsened LR 
+            grids are computed with ``dl4ds.precompute_lr``. If a str is given, 
+            the LR grids cached in this directory (e.g., during training) are 
+            reused, or persisted there otherwise.
+        tile_size : int or None, optional
+            If not None, tiled inference is performed with square tiles of 
+            ``tile_size`` HR pixels, processing ``batch_size`` samples at a time.
+            The memory used by the model is then independent of the domain 
+            size. 
+        tile_overlap : int or None, optional
+            Overlap between neighboring tiles, in HR pixels. If None, a quarter 
+            of ``tile_size`` is used. 
+        blending : {'cosine', 'linear'}, optional
+            Feathering used for blending the tiles in the overlapping regions.
+        chunk_size : int or None, optional
+            If not None, streaming inference is performed in chunks of 
+            ``chunk_size`` samples (time steps) that are written incrementally
+            to ``save_path``/``save_fname`` (.npy, .nc or .zarr).
+        batch_dtype : str, optional
+            Data type of the batches fed to the model, e.g., 'float16' or 
+            'bfloat16' for models trained with a mixed precision policy.
+        static_on_device : bool, optional
+            If True, the static variables are uploaded once to the device and 
+            gathered in-graph for each batch (see ``dl4ds.StaticFields``).
+        profile : bool or dl4ds.Profiler, optional
+            If True (or a dl4ds.Profiler is given), the inference steps (batch 
+            assembly, host-to-device transfer and compute), inverse scaling 
+            and writing are timed (see ``dl4ds.Profiler``). The profile is 
+            printed and saved (profile.json and profile.csv) to ``save_path``.
+        coords : dict or None, optional
+            Coordinates of the output [time, lat, lon] dimensions written to 
+            .nc or .zarr files with streaming inference.
+        mc_samples : int or None, optional
+            If not None, ``mc_samples`` stochastic passes are run with models
+            built with Monte Carlo dropout ('mcdrop', 'mcgaussiandrop' or 
+            'mcspatialdrop') and reduced to their mean, standard deviation 
+            and ``quantiles``.
+        quantiles : list of float or None, optional
+            Quantiles (in [0, 1]) of the Monte Carlo members, only used with
+            ``mc_samples``.
         """
         self.trainer = trainer 
         self.array_in_hr = array_in_hr
@@ -78,11 +139,22 @@ class Predictor():
         self.time_window = time_window
         self.time_metadata = time_metadata
         self.interpolation = interpolation 
+        self.lr_cache = lr_cache
+        self.tile_size = tile_size
+        self.tile_overlap = tile_overlap
+        self.blending = blending
+        self.chunk_size = chunk_size
         self.batch_size = batch_size
+        self.batch_dtype = batch_dtype
+        self.static_on_device = static_on_device
         self.scaler = scaler
         self.save_path = save_path
         self.save_fname = save_fname
+        self.coords = coords
+        self.mc_samples = mc_samples
+        self.quantiles = quantiles
         self.return_lr = return_lr
+        self.profile = profile
         self.device = device
 
     def run(self): 
@@ -98,11 +170,22 @@ class Predictor():
             time_window=self.time_window, 
             time_metadata=self.time_metadata, 
             interpolation=self.interpolation, 
+            lr_cache=self.lr_cache,
+            tile_size=self.tile_size,
+            tile_overlap=self.tile_overlap,
+            blending=self.blending,
+            chunk_size=self.chunk_size,
             batch_size=self.batch_size, 
+            batch_dtype=self.batch_dtype,
+            static_on_device=self.static_on_device,
             scaler=self.scaler,
             save_path=self.save_path,
             save_fname=self.save_fname, 
+            coords=self.coords,
+            mc_samples=self.mc_samples,
+            quantiles=self.quantiles,
             return_lr=self.return_lr,
+            profile=self.profile,
             device=self.device) 
 
 
@@ -121,7 +204,18 @@ def predict(
     save_path=None,
     save_fname='y_hat.npy',
     return_lr=False,
-    device='GPU'):
+    device='GPU',
+    lr_cache=None,
+    tile_size=None,
+    tile_overlap=None,
+    blending='cosine',
+    chunk_size=None,
+    batch_dtype='float32',
+    static_on_device=False,
+    profile=False,
+    coords=None,
+    mc_samples=None,
+    quantiles=None):
     """Inference on unseen HR or LR data. The data (``array``) is super-resolved 
     or downscaled using the trained super-resolution network (``model``). 
 
@@ -130,8 +224,9 @@ def predict(
     trainer : dl4ds.SupervisedTrainer or dl4ds.CGANTrainer
         Trainer containing a keras model (``model`` or ``generator``). 
         Optionally, you can direclty pass the tf.keras model.
-    array : ndarray
-        Batch of HR grids. 
+    array : ndarray, xr.DataArray or dl4ds.DataSource
+        Batch of HR or LR grids. Lazy data sources (memmap, dask) are read 
+        only when the samples are gathered.
     scale : int
         Scaling factor. 
     array_in_hr : bool, optional
@@ -159,8 +254,76 @@ def predict(
         Filename to complete the path were the prediciton is saved. 
     return_lr : bool, optional
         If True, the LR array is returned along with the downscaled one. 
+    lr_cache : bool, str or None, optional
+        Only used when ``array_in_hr`` is True. If True, the coarsened LR grids
+        are computed with ``dl4ds.precompute_lr``. If a str is given, the LR 
+        grids cached in this directory (e.g., during training) are reused, or 
+        persisted there otherwise.
+    tile_size : int or None, optional
+        If not None, tiled inference is performed with square tiles of 
+        ``tile_size`` HR pixels (multiple of ``scale``), processing 
+        ``batch_size`` samples at a time. The memory used by the model is then
+        independent of the domain size. Only for fully convolutional models 
+        (built without ``localcon_layer``).
+    tile_overlap : int or None, optional
+        Overlap between neighboring tiles, in HR pixels (multiple of ``scale``). 
+        If None, a quarter of ``tile_size`` is used. 
+    blending : {'cosine', 'linear'}, optional
+        Feathering used for blending the tiles in the overlapping regions. The
+        weights ramp up from the tile borders over ``tile_overlap`` pixels.
+    chunk_size : int or None, optional
+        If not None, streaming inference is performed: chunks of ``chunk_size``
+        samples (time steps) are read from the data sources, super-resolved 
+        (tiled if ``tile_size`` is given), inverse-transformed with ``scaler``
+        and appended to the output file given by ``save_path`` and 
+        ``save_fname``. The extension of ``save_fname`` determines the format:
+        .npy (memory-mapped), .nc (NetCDF, requires netCDF4) or .zarr. The host
+        memory used is proportional to ``chunk_size``. With ``time_window``, 
+        consecutive chunks read overlapping input time windows and the output 
+        time steps match those of non-streaming inference. The output is 
+        returned as a lazy ``dl4ds.DataSource``.
+    batch_dtype : str, optional
+        Data type of the batches fed to the model, e.g., 'float16' or 
+        'bfloat16' to halve the host memory and the host-device transfers 
+        with models trained with a mixed precision policy. The output is 
+        float32.
+    static_on_device : bool, optional
+        If True, the static variables are uploaded once to the device and 
+        gathered in-graph for each batch (see ``dl4ds.StaticFields``), instead
+        of being copied for every sample or tile.
+    profile : bool or dl4ds.Profiler, optional
+        If True (or a dl4ds.Profiler is given), the inference steps (batch 
+        assembly, host-to-device transfer and compute), inverse scaling 
+        and writing are timed (see ``dl4ds.Profiler``). The profile is 
+        printed and saved (profile.json and profile.csv) to ``save_path``.
+    coords : dict or None, optional
+        Coordinates of the output written with streaming inference to .nc or 
+        .zarr files, as a dict of 1D arrays for the [time, lat, lon] 
+        dimensions (in this order, the keys are used as dimension names). 
+        The coordinates are trimmed to the output time steps and grid.
+    mc_samples : int or None, optional
+        If not None, Monte Carlo dropout inference is performed with models 
+        built with a Monte Carlo dropout variant ('mcdrop', 'mcgaussiandrop' 
+        or 'mcspatialdrop'), whose dropout stays active at inference. Each 
+        batch of samples is assembled and copied to the device once, and 
+        repeated along the batch dimension on the device for running 
+        ``mc_samples`` stochastic passes (members), with up to 
+        ``batch_size`` members per model call. The members are reduced on 
+        the device to their mean and standard deviation, merged across calls,
+        so they are not kept in memory (except those of the current batch of 
+        samples, when ``quantiles`` are requested). A dict with the 'mean', 
+        'std' and 'quantiles' (if requested, with a leading dimension 
+        matching ``quantiles``) arrays is returned, each one is saved with 
+        the corresponding suffix in ``save_fname``. Not supported with tiled
+        or streaming inference.
+    quantiles : list of float or None, optional
+        Quantiles (in [0, 1]) of the Monte Carlo members, e.g., [0.05, 0.95].
+        Only used with ``mc_samples``.
     """         
     timing = Timing()
+    profiler = profile if isinstance(profile, Profiler) else (Profiler() if profile else None)
+    if profiler is not None:
+        profiler.start()
 
     if hasattr(trainer, 'model'):
         model = trainer.model
@@ -170,87 +333,683 @@ def predict(
         model = trainer
 
     upsampling = model.name.split('_')[-1]
-    dim = len(model.input.shape)
+    # 'pin' models with in-graph interpolation take LR-sized inputs
+    graph_interpolation = any(layer.name == 'InputInterpolation' for layer in model.layers)
+    dim = len(model.inputs[0].shape)
     if dim == 5 and time_window is None:
        raise ValueError('`time_window` must be provided for spatiotemporal model')
+    is_spatiotemporal_out = len(model.outputs[0].shape) == 5 and time_window is not None
 
     time_metadata = None
 
-    if isinstance(array, xr.DataArray):    
-        array = array.values  
+    array = as_data_source(array)
 
     if static_vars is not None:
         for i in range(len(static_vars)):
             if isinstance(static_vars[i], xr.DataArray):
                 static_vars[i] = static_vars[i].values
 
+    ### Static variables uploaded once to the device, the model is wrapped to
+    # take the crop offsets instead (see ``dl4ds.StaticFields``)
+    static_on_device = static_on_device and static_vars is not None
+    if static_on_device:
+        lr_sized = upsampling in POSTUPSAMPLING_METHODS or graph_interpolation
+        with tf.device('/' + device + ':0'):
+            static_fields = StaticFields(static_vars, scale, lr_sized=lr_sized, 
+                                         is_spatiotemporal=dim == 5, 
+                                         interpolation=interpolation)
+            model = static_fields.wrap(model, season=time_metadata is not None)
+
     n_samples = array.shape[0]
     if time_window is not None:
         n_samples -= time_window - 1
 
     ### Concatenating list of ndarray variables along the last dimension  
     if predictors is not None:
-        predictors = np.concatenate(predictors, axis=-1)
+        predictors = concatenate_sources(predictors)
 
     ### Array is upsampled according to scale when array is in LR
     if array_in_hr:
         array_hr = array
         array_lr = None
+        if lr_cache:
+            lr_upsampling = 'spc' if graph_interpolation else upsampling
+            array_lr = precompute_lr(array, scale, lr_upsampling, interpolation,
+                                     lr_cache if isinstance(lr_cache, str) else None)
     else:
-        array = checkarray_ndim(array, 4, -1)
         hr_xy = (array.shape[2] * scale, array.shape[1] * scale)
-        array_hr = resize_array(array, hr_xy, interpolation, squeezed=False) 
+        array_hr = InterpolatedSource(array, hr_xy, interpolation) 
         array_lr = array
 
-    batch = create_batch_hr_lr(       
-        all_indices=np.arange(n_samples),
-        index=0,
-        array=array_hr, 
-        array_lr=array_lr,
-        upsampling=upsampling,
-        scale=scale, 
-        batch_size=n_samples, 
-        patch_size=None,
-        time_window=time_window,
-        static_vars=static_vars, 
-        predictors=predictors,
-        interpolation=interpolation,
-        time_metadata=time_metadata)
+    if mc_samples is not None:
+        if tile_size is not None or chunk_size is not None or return_lr:
+            msg = '`mc_samples` is not supported with tiled or streaming '
+            msg += 'inference, or with `return_lr`'
+            raise ValueError(msg)
+        with tf.device('/' + device + ':0'):
+            stats = _predict_mc(
+                model, np.arange(n_samples), array_hr, array_lr, upsampling, 
+                scale, time_window, static_vars, predictors, interpolation, 
+                time_metadata, batch_size, mc_samples, quantiles, batch_dtype,
+                graph_interpolation, static_on_device)
+        
+        if scaler is not None:
+            with _timer('inverse_transform'):
+                stats = _inverse_transform_stats(scaler, stats)
+        
+        if save_path is not None and save_fname is not None:
+            name, ext = os.path.splitext(os.path.join(save_path, save_fname))
+            with _timer('write'):
+                for key, value in stats.items():
+                    np.save(f'{name}_{key}{ext}', value.astype('float32'))
+        
+        timing.runtime()
+        _stop_profiler(profiler, save_path)
+        return stats
 
-    if static_vars is not None:
-        [batch_lr, batch_aux_hr], _ = batch
-    else:
-        [batch_lr], _ = batch
-
-    x_test_lr = batch_lr  
+    if chunk_size is not None:
+        if save_path is None or save_fname is None:
+            raise ValueError('`save_path` and `save_fname` must be given for streaming inference')
+        if return_lr:
+            raise ValueError('`return_lr` is not supported with streaming inference')
+        name = os.path.join(save_path, save_fname)
+        writer = None
+        # the first time step of each spatio-temporal sample, plus the remaining
+        # ones of the last sample (see ``spatiotemporal_to_spatial_samples``)
+        n_times = n_samples
+        if is_spatiotemporal_out:
+            n_times += time_window - 1
+        for start in range(0, n_samples, chunk_size):
+            indices = np.arange(start, min(start + chunk_size, n_samples))
+            last_chunk = indices[-1] == n_samples - 1
+            with tf.device('/' + device + ':0'):
+                if tile_size is not None:
+                    out = _predict_tiled(
+                        model, indices, array_hr, array_lr, upsampling, scale, 
+                        tile_size, tile_overlap, blending, time_window, 
+                        static_vars, predictors, interpolation, batch_size,
+                        batch_dtype, graph_interpolation, static_on_device, 
+                        last_chunk)
+                else:
+                    out = _predict_batches(
+                        model, indices, array_hr, array_lr, upsampling, scale, 
+                        time_window, static_vars, predictors, interpolation, 
+                        time_metadata, batch_size, batch_dtype, 
+                        graph_interpolation, static_on_device, last_chunk)
+            
+            if scaler is not None:
+                with _timer('inverse_transform'):
+                    out = _inverse_transform_chunk(scaler, out, start, n_times)
+            with _timer('write'):
+                if writer is None:
+                    writer = _ChunkWriter(name, (n_times,) + out.shape[1:], 
+                                          coords=coords)
+                writer.write(start, out)
+        writer.close()
+        timing.runtime()
+        _stop_profiler(profiler, save_path)
+        return open_data_source(name)
 
-    ### Casting as TF tensors, creating inputs ---------------------------------
-    x_test_lr = tf.cast(x_test_lr, tf.float32)   
-    if static_vars is not None: 
-        aux_vars_hr = tf.cast(batch_aux_hr, tf.float32) 
-        inputs = [x_test_lr, aux_vars_hr]
+    if tile_size is not None:
+        if return_lr:
+            raise ValueError('`return_lr` is not supported with tiled inference')
+        with tf.device('/' + device + ':0'):
+            out = _predict_tiled(
+                model, np.arange(n_samples), array_hr, array_lr, upsampling, 
+                scale, tile_size, tile_overlap, blending, time_window, 
+                static_vars, predictors, interpolation, batch_size, 
+                batch_dtype, graph_interpolation, static_on_device)
+    elif is_spatiotemporal_out and not return_lr:
+        # the spatio-temporal samples are built and collapsed batch by batch,
+        # the memory used does not grow with ``time_window``
+        with tf.device('/' + device + ':0'):
+            out = _predict_batches(
+                model, np.arange(n_samples), array_hr, array_lr, upsampling, 
+                scale, time_window, static_vars, predictors, interpolation, 
+                time_metadata, batch_size, batch_dtype, graph_interpolation, 
+                static_on_device)
     else:
-        inputs = [x_test_lr]
+        with _timer('batch_assembly'):
+            batch = create_batch_hr_lr(       
+                all_indices=np.arange(n_samples),
+                index=0,
+                array=array_hr, 
+                array_lr=array_lr,
+                upsampling=upsampling,
+                scale=scale, 
+                batch_size=n_samples, 
+                patch_size=None,
+                time_window=time_window,
+                static_vars=static_vars, 
+                predictors=predictors,
+                interpolation=interpolation,
+                time_metadata=time_metadata,
+                dtype=batch_dtype,
+                graph_interpolation=graph_interpolation,
+                static_on_device=static_on_device)
+
+        ### Casting as TF tensors (of ``batch_dtype``), creating inputs --------
+        # [batch_lr(, batch_aux_hr)] or [batch_lr, batch_offsets(, batch_season)]
+        inputs, _ = batch
+        inputs = [tf.convert_to_tensor(x) for x in inputs]
+        x_test_lr = inputs[0]
     
-    ### Inference --------------------------------------------------------------
-    # https://www.tensorflow.org/api_docs/python/tf/keras/Model#predict
-    with tf.device('/' + device + ':0'):
-        out = model.predict(inputs, batch_size=batch_size, verbose=1)
+        ### Inference ----------------------------------------------------------
+        # https://www.tensorflow.org/api_docs/python/tf/keras/Model#predict
+        with tf.device('/' + device + ':0'), _timer('predict'):
+            out = model.predict(inputs, batch_size=batch_size, verbose=1)
     
     ### 
     if out.ndim == 5 and time_window is not None:
         out = spatiotemporal_to_spatial_samples(out, time_window)
 
     if scaler is not None:
-        out = scaler.inverse_transform(out)
+        with _timer('inverse_transform'):
+            out = scaler.inverse_transform(out)
 
     if save_path is not None and save_fname is not None:
         name = os.path.join(save_path, save_fname)
-        np.save(name, out.astype('float32'))
+        with _timer('write'):
+            np.save(name, out.astype('float32'))
     
     timing.runtime()
+    _stop_profiler(profiler, save_path)
     if return_lr:
         return out, np.array(x_test_lr)
     else:
-        return out        
+        return out
+
+
+def load_model(path):
+    """Load a model saved by the trainers (``save_results`` or the checkpoints
+    of ``dl4ds.CGANTrainer``) for inference, along with the parameters saved 
+    with it (see ``Trainer.save_metadata``).
+
+    Parameters
+    ----------
+    path : str
+        Directory of the SavedModel. If a checkpoints directory is given (or 
+        a directory containing a checkpoints one), the generator saved at the 
+        latest epoch (save_epoch<N>) is loaded.
+
+    Returns
+    -------
+    model : tf.keras.Model
+        Model loaded without its training configuration.
+    metadata : dict
+        Parameters of the model, e.g., ``scale`` and ``time_window``. For 
+        models saved without them, only ``upsampling`` is set (from the model 
+        name).
+    """
+    path = str(path).rstrip(os.sep)
+    if not os.path.isfile(os.path.join(path, 'saved_model.pb')):
+        path = _latest_checkpoint(path)
+
+    model = keras.models.load_model(path, compile=False)
+    metadata_path = os.path.join(path, _METADATA_FNAME)
+    if os.path.isfile(metadata_path):
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+    else:
+        metadata = {'upsampling': model.name.split('_')[-1]}
+    return model, metadata
+
+
+def _predict_tiled(
+    model, 
+    indices,
+    array_hr, 
+    array_lr, 
+    upsampling, 
+    scale, 
+    tile_size, 
+    tile_overlap, 
+    blending, 
+    time_window, 
+    static_vars, 
+    predictors, 
+    interpolation, 
+    batch_size,
+    batch_dtype='float32',
+    graph_interpolation=False,
+    static_on_device=False,
+    last_chunk=True):
+    """Tiled inference on the samples in ``indices``. The domain is covered 
+    with square tiles (aligned with the LR grid), each batch of samples is 
+    super-resolved tile by tile and the tiles are blended with feathering 
+    weights in the overlapping regions. Only the tiles are read from the data 
+    sources. With ``static_on_device``, the tile positions are added to the
+    crop offsets of the static variables. Spatio-temporal outputs are 
+    collapsed batch by batch (see ``_collapse_time_window``).
+    """
+    # the domain covered by the tiles is aligned with the lr grid
+    hr_y = (array_hr.shape[1] // scale) * scale
+    hr_x = (array_hr.shape[2] // scale) * scale
+    if tile_size % scale != 0:
+        raise ValueError('`tile_size` must be divisible by `scale`')
+    if tile_overlap is None:
+        tile_overlap = (tile_size // 4) // scale * scale
+    if tile_overlap % scale != 0:
+        raise ValueError('`tile_overlap` must be divisible by `scale`')
+    if tile_overlap >= tile_size:
+        raise ValueError('`tile_overlap` must be smaller than `tile_size`')
+    tile_size = min(tile_size, hr_y, hr_x)
+    tile_overlap = min(tile_overlap, tile_size - scale)
+    positions_y = _tile_positions(hr_y, tile_size, tile_size - tile_overlap)
+    positions_x = _tile_positions(hr_x, tile_size, tile_size - tile_overlap)
+
+    window = _blending_window(tile_size, tile_overlap, blending)
+    weights = np.outer(window, window)[..., np.newaxis]
+    weights_sum = np.zeros((hr_y, hr_x, 1), dtype='float32')
+    for y in positions_y:
+        for x in positions_x:
+            weights_sum[y: y + tile_size, x: x + tile_size] += weights
+
+    out = None
+    n_samples = len(indices)
+    for i in range(0, n_samples, batch_size):
+        batch_indices = indices[i: i + batch_size]
+        last_batch = last_chunk and i + batch_size >= n_samples
+        for y in positions_y:
+            for x in positions_x:
+                ys, xs = slice(y, y + tile_size), slice(x, x + tile_size)
+                tile_lr = tile_pred = tile_static = None
+                if array_lr is not None:
+                    tile_lr = _window(array_lr, y, x, tile_size, hr_y, hr_x)
+                if predictors is not None:
+                    tile_pred = _window(predictors, y, x, tile_size, hr_y, hr_x)
+                if static_vars is not None and not static_on_device:
+                    tile_static = [crop_array(np.squeeze(var), tile_size, yx=(y, x)) 
+                                   for var in static_vars]
+                with _step('predict_step'):
+                    with _timer('batch_assembly'):
+                        inputs, _ = create_batch_hr_lr(
+                            all_indices=batch_indices,
+                            index=0,
+                            array=WindowSource(array_hr, ys, xs), 
+                            array_lr=tile_lr,
+                            upsampling=upsampling,
+                            scale=scale, 
+                            batch_size=len(batch_indices), 
+                            patch_size=None,
+                            time_window=time_window,
+                            static_vars=tile_static, 
+                            predictors=tile_pred,
+                            interpolation=interpolation,
+                            dtype=batch_dtype,
+                            graph_interpolation=graph_interpolation,
+                            static_on_device=static_on_device)
+                        if static_on_device:
+                            inputs[1] += np.array([y, x], dtype='int32')
+                    with _timer('host_to_device'):
+                        inputs = _to_device(inputs)
+                        _sync(inputs)
+                    with _timer('compute'):
+                        tile_out = model.predict_on_batch(inputs)
+                        tile_out = np.asarray(tile_out, dtype='float32')
+                n_out = n_samples
+                if tile_out.ndim == 5:
+                    if last_chunk:
+                        n_out += tile_out.shape[1] - 1
+                    tile_out = _collapse_time_window(tile_out, last_batch)
+                if out is None:
+                    out = np.zeros((n_out, hr_y, hr_x, tile_out.shape[-1]), 
+                                   dtype='float32')
+                ts = slice(i, i + len(tile_out))
+                out[ts, ys, xs, :] += tile_out * weights
+        out[ts] /= weights_sum
+    return out
+
+
+def _predict_batches(
+    model, 
+    indices,
+    array_hr, 
+    array_lr, 
+    upsampling, 
+    scale, 
+    time_window, 
+    static_vars, 
+    predictors, 
+    interpolation, 
+    time_metadata,
+    batch_size,
+    batch_dtype='float32',
+    graph_interpolation=False,
+    static_on_device=False,
+    last_chunk=True):
+    """Inference on the samples in ``indices``, assembled batch by batch. 
+    Spatio-temporal outputs are collapsed batch by batch (see 
+    ``_collapse_time_window``), so the memory used does not grow with 
+    ``time_window``.
+    """
+    out = []
+    n_samples = len(indices)
+    for i in range(0, n_samples, batch_size):
+        batch_indices = indices[i: i + batch_size]
+        with _step('predict_step'):
+            with _timer('batch_assembly'):
+                inputs, _ = create_batch_hr_lr(
+                    all_indices=batch_indices,
+                    index=0,
+                    array=array_hr, 
+                    array_lr=array_lr,
+                    upsampling=upsampling,
+                    scale=scale, 
+                    batch_size=len(batch_indices), 
+                    patch_size=None,
+                    time_window=time_window,
+                    static_vars=static_vars, 
+                    predictors=predictors,
+                    interpolation=interpolation,
+                    time_metadata=time_metadata,
+                    dtype=batch_dtype,
+                    graph_interpolation=graph_interpolation,
+                    static_on_device=static_on_device)
+            with _timer('host_to_device'):
+                inputs = _to_device(inputs)
+                _sync(inputs)
+            with _timer('compute'):
+                batch_out = np.asarray(model.predict_on_batch(inputs), dtype='float32')
+        if batch_out.ndim == 5 and time_window is not None:
+            last_batch = last_chunk and i + batch_size >= n_samples
+            batch_out = _collapse_time_window(batch_out, last_batch)
+        out.append(batch_out)
+    return np.concatenate(out, axis=0)
+
+
+def _predict_mc(
+    model, 
+    indices,
+    array_hr, 
+    array_lr, 
+    upsampling, 
+    scale, 
+    time_window, 
+    static_vars, 
+    predictors, 
+    interpolation, 
+    time_metadata,
+    batch_size,
+    mc_samples,
+    quantiles=None,
+    batch_dtype='float32',
+    graph_interpolation=False,
+    static_on_device=False):
+    """Monte Carlo dropout inference on the samples in ``indices``. The 
+    batches hold ``batch_size // mc_samples`` samples (at least one), which 
+    are assembled and copied to the device once. They are repeated on the 
+    device for running up to ``batch_size`` members per model call, and the 
+    mean and the sum of squared deviations of the members of each call are
+    merged (Chan et al. parallel algorithm) into the mean and standard 
+    deviation. The members are only gathered when ``quantiles`` are given.
+    """
+    if mc_samples < 1:
+        raise ValueError('`mc_samples` must be a positive integer')
+    if quantiles is not None:
+        quantiles = np.asarray(quantiles, dtype='float64')
+        if np.any(quantiles < 0) or np.any(quantiles > 1):
+            raise ValueError('`quantiles` must be in the interval [0, 1]')
+
+    @tf.function(reduce_retracing=True)
+    def mc_pass(inputs, n_members):
+        repeated = [tf.repeat(x, n_members, axis=0) for x in inputs]
+        members = tf.cast(model(repeated, training=False), tf.float32)
+        # [samples * members, ...] -> [samples, members, ...]
+        members = tf.reshape(members, tf.concat([[-1, n_members], 
+                                                 tf.shape(members)[1:]], 0))
+        mean = tf.reduce_mean(members, axis=1)
+        sqdev = tf.reduce_sum(tf.square(members - mean[:, tf.newaxis]), axis=1)
+        return mean, sqdev, members
+
+    samples_per_batch = max(1, batch_size // mc_samples)
+    members_per_pass = min(mc_samples, batch_size)
+    stats = {'mean': [], 'std': []}
+    if quantiles is not None:
+        stats['quantiles'] = []
+    n_samples = len(indices)
+    for i in range(0, n_samples, samples_per_batch):
+        batch_indices = indices[i: i + samples_per_batch]
+        with _timer('batch_assembly'):
+            inputs, _ = create_batch_hr_lr(
+                all_indices=batch_indices,
+                index=0,
+                array=array_hr, 
+                array_lr=array_lr,
+                upsampling=upsampling,
+                scale=scale, 
+                batch_size=len(batch_indices), 
+                patch_size=None,
+                time_window=time_window,
+                static_vars=static_vars, 
+                predictors=predictors,
+                interpolation=interpolation,
+                time_metadata=time_metadata,
+                dtype=batch_dtype,
+                graph_interpolation=graph_interpolation,
+                static_on_device=static_on_device)
+        with _timer('host_to_device'):
+            inputs = _to_device(list(inputs))
+            _sync(inputs)
+
+        count, mean, sqdev, members = 0, 0., 0., []
+        for start in range(0, mc_samples, members_per_pass):
+            n_members = min(members_per_pass, mc_samples - start)
+            with _step('predict_step'), _timer('compute'):
+                pass_mean, pass_sqdev, pass_members = mc_pass(inputs, n_members)
+                pass_mean = pass_mean.numpy().astype('float64')
+                pass_sqdev = pass_sqdev.numpy().astype('float64')
+                if quantiles is not None:
+                    members.append(pass_members.numpy())
+            delta = pass_mean - mean
+            total = count + n_members
+            mean = mean + delta * n_members / total
+            sqdev = sqdev + pass_sqdev + delta ** 2 * count * n_members / total
+            count = total
+
+        batch_stats = {'mean': mean.astype('float32'), 
+                       'std': np.sqrt(sqdev / count).astype('float32')}
+        if quantiles is not None:
+            with _timer('quantiles'):
+                members = np.concatenate(members, axis=1)
+                batch_stats['quantiles'] = np.quantile(members, quantiles, 
+                                                       axis=1).astype('float32')
+        
+        for key, value in batch_stats.items():
+            if mean.ndim == 5 and time_window is not None:
+                last_batch = i + samples_per_batch >= n_samples
+                if key == 'quantiles':
+                    value = np.stack([_collapse_time_window(q, last_batch) 
+                                      for q in value])
+                else:
+                    value = _collapse_time_window(value, last_batch)
+            stats[key].append(value)
     
+    stats['mean'] = np.concatenate(stats['mean'], axis=0)
+    stats['std'] = np.concatenate(stats['std'], axis=0)
+    if quantiles is not None:
+        stats['quantiles'] = np.concatenate(stats['quantiles'], axis=1)
+    return stats
+
+
+def _tile_positions(size, tile_size, step):
+    """Start positions of the tiles covering a dimension of ``size`` pixels 
+    (multiple of ``scale``). The last tile is aligned with the end of the 
+    domain.
+    """
+    last = size - tile_size
+    return list(range(0, last, step)) + [last]
+
+
+def _blending_window(tile_size, overlap, blending='cosine'):
+    """1D feathering window for blending overlapping tiles.
+    """
+    window = np.ones(tile_size, dtype='float32')
+    if overlap > 0:
+        ramp = (np.arange(overlap, dtype='float32') + 0.5) / overlap
+        if blending == 'cosine':
+            ramp = 0.5 - 0.5 * np.cos(np.pi * ramp)
+        elif blending != 'linear':
+            raise ValueError("`blending` must be one of ['cosine', 'linear']")
+        window[:overlap] = ramp
+        window[-overlap:] = np.minimum(window[-overlap:], ramp[::-1])
+    return window
+
+
+def _window(source, y, x, tile_size, hr_y, hr_x):
+    """Window of ``source`` (at its own resolution) corresponding to the HR 
+    tile with bottom-left corner (``y``, ``x``).
+    """
+    source = as_data_source(source)
+    ratio_y, ratio_x = source.shape[1] / hr_y, source.shape[2] / hr_x
+    ys = slice(int(round(y * ratio_y)), int(round((y + tile_size) * ratio_y)))
+    xs = slice(int(round(x * ratio_x)), int(round((x + tile_size) * ratio_x)))
+    return WindowSource(source, ys, xs)
+
+
+def _collapse_time_window(out, last_chunk):
+    """Time steps of a chunk of spatio-temporal samples [n, time_window, lat, 
+    lon, vars]: the first time step of each sample and, for the last chunk, 
+    the remaining time steps of the last sample.
+    """
+    frames = out[:, 0]
+    if last_chunk:
+        frames = np.concatenate([frames, out[-1, 1:]], axis=0)
+    return frames
+
+
+def _latest_checkpoint(path):
+    """Path of the generator saved at the latest epoch in a checkpoints 
+    directory (or in the checkpoints directory inside ``path``).
+    """
+    for folder in [path, os.path.join(path, 'checkpoints')]:
+        if not os.path.isdir(folder):
+            continue
+        epochs = [(int(match.group(1)), name) for name in os.listdir(folder)
+                  for match in [re.fullmatch(r'save_epoch(\d+)', name)] if match]
+        if epochs:
+            return os.path.join(folder, max(epochs)[1])
+    raise ValueError(f'No SavedModel or saved checkpoints found in {path}')
+
+
+def _stop_profiler(profiler, save_path):
+    """Stop the profiler of ``predict`` (if any), print its summary and save
+    it to ``save_path``.
+    """
+    if profiler is not None:
+        profiler.stop()
+        profiler.summary()
+        if save_path is not None:
+            profiler.save(os.path.join(save_path, 'profile'))
+
+
+def _inverse_transform_chunk(scaler, out, start, n_times):
+    """Inverse scaling of a chunk of time steps starting at ``start``. The NaN
+    mask of dl4ds scalers is taken from the time steps in the chunk, other 
+    NaN masks with the time dimension (as fitted on the whole array) are 
+    sliced to the chunk.
+    """
+    if hasattr(scaler, 'nan_mask_'):
+        return np.reshape(scaler.inverse_transform(out, start=start), out.shape)
+    nan_mask = getattr(scaler, 'nan_mask', None)
+    if nan_mask is not None and nan_mask.ndim > 2 and nan_mask.shape[0] == n_times:
+        scaler = copy.copy(scaler)
+        scaler.nan_mask = nan_mask[start: start + out.shape[0]]
+    return np.reshape(scaler.inverse_transform(out), out.shape)
+
+
+def _inverse_transform_stats(scaler, stats):
+    """Inverse scaling of the statistics of the Monte Carlo members. The 
+    scalers are affine, so the standard deviation is the difference between
+    the inverse-transformed mean plus one standard deviation and the 
+    inverse-transformed mean.
+    """
+    def inverse(x):
+        return np.reshape(scaler.inverse_transform(x.copy()), x.shape)
+    
+    mean = inverse(stats['mean'])
+    stats['std'] = np.abs(inverse(stats['mean'] + stats['std']) - mean)
+    stats['mean'] = mean
+    if 'quantiles' in stats:
+        stats['quantiles'] = np.stack([inverse(q) for q in stats['quantiles']])
+    return stats
+
+
+class _ChunkWriter():
+    """
+    Incremental writer of the time chunks of an array [time, lat, lon, vars] 
+    to a .npy (memory-mapped), NetCDF (.nc) or Zarr (.zarr) file. The 
+    ``coords`` of the [time, lat, lon] dimensions (if any) are written to the
+    NetCDF and Zarr files.
+    """
+    def __init__(self, path, shape, dtype='float32', name='y_hat', coords=None):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.name = name
+        self.coords = {}
+        dims = ('time', 'lat', 'lon')
+        if coords is not None:
+            if len(coords) != 3:
+                raise ValueError('`coords` must contain the [time, lat, lon] coordinates')
+            dims = tuple(coords)
+            for dim, size in zip(dims, self.shape):
+                if coords[dim] is not None:
+                    self.coords[dim] = np.asarray(coords[dim])[:size]
+        # single-variable outputs are written as [time, lat, lon]
+        if self.shape[-1] == 1:
+            self.dims = dims
+        else:
+            self.dims = dims + ('variable',)
+        
+        if path.endswith('.npy'):
+            self.format = 'npy'
+            self.array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, 
+                                                   shape=self.shape)
+        elif path.endswith('.nc'):
+            try:
+                import netCDF4
+            except ImportError:
+                raise ImportError('Writing NetCDF files requires the netCDF4 package')
+            self.format = 'netcdf'
+            self.dataset = netCDF4.Dataset(path, mode='w')
+            self.dataset.createDimension(self.dims[0], None)
+            for dim, size in zip(self.dims[1:], self.shape[1:]):
+                self.dataset.createDimension(dim, size)
+            self.variable = self.dataset.createVariable(name, dtype, self.dims)
+        elif path.rstrip(os.sep).endswith('.zarr'):
+            self.format = 'zarr'
+            self.first_chunk = True
+        else:
+            raise ValueError('`save_fname` must end with .npy, .nc or .zarr')
+
+    def write(self, start, chunk):
+        """Write ``chunk`` at time step ``start``.
+        """
+        chunk = np.reshape(chunk, (-1,) + self.shape[1:]).astype(self.dtype)
+        stop = start + chunk.shape[0]
+        if self.format == 'npy':
+            self.array[start: stop] = chunk
+        elif self.format == 'netcdf':
+            self.variable[start: stop] = np.reshape(chunk, (-1,) + self.shape[1: len(self.dims)])
+        elif self.format == 'zarr':
+            chunk = np.reshape(chunk, (-1,) + self.shape[1: len(self.dims)])
+            coords = {dim: values[start: stop] if dim == self.dims[0] else values
+                      for dim, values in self.coords.items()}
+            dataset = xr.DataArray(chunk, dims=self.dims, coords=coords, 
+                                   name=self.name).to_dataset()
+            if self.first_chunk:
+                dataset.to_zarr(self.path, mode='w')
+                self.first_chunk = False
+            else:
+                dataset.to_zarr(self.path, append_dim=self.dims[0])
+
+    def close(self):
+        if self.format == 'npy':
+            self.array.flush()
+            del self.array
+        elif self.format == 'netcdf':
+            self.dataset.close()
+            if self.coords:
+                # appending the coordinate variables (CF-encoded by xarray)
+                xr.Dataset(coords=self.coords).to_netcdf(self.path, mode='a')
@@ -38,6 +38,9 @@ def dssim(y_true, y_pred):
     https://github.com/keras-team/keras-contrib/issues/464
     https://github.com/keras-team/keras-contrib/blob/master/keras_contrib/losses/dssim.py
     """
+    # computed in float32, also with mixed precision
+    y_true = tf.cast(y_true, tf.float32)
+    y_pred = tf.cast(y_pred, tf.float32)
     maxv = tfk.maximum(tfk.max(y_true), tfk.max(y_pred))
     minv = tfk.minimum(tfk.min(y_true), tfk.min(y_pred))
     drange = maxv - minv
@@ -110,6 +113,9 @@ def msdssim(y_true, y_pred):
     filter_size: Default value 11 (size of gaussian filter).
     filter_sigma: Default value 1.5 (width of gaussian filter).
     """
+    # computed in float32, also with mixed precision
+    y_true = tf.cast(y_true, tf.float32)
+    y_pred = tf.cast(y_pred, tf.float32)
     maxv = tfk.maximum(tfk.max(y_true), tfk.max(y_pred))
     minv = tfk.minimum(tfk.min(y_true), tfk.min(y_pred))
     drange = maxv - minv
@@ -1,38 +1,62 @@
-import tensorflow as tf
 import numpy as np
 import xarray as xr
 from joblib import Parallel, delayed
-from matplotlib import pyplot as plt
-from sklearn.metrics import mean_squared_error
-from scipy.stats import spearmanr, pearsonr
+from scipy.stats import spearmanr, pearsonr, rankdata
 import os
-import seaborn as sns
-import ecubevis as ecv
+import warnings
 
 from .utils import checkarray_ndim, Timing
 
 
-def compute_rmse(y, y_hat, over='time', squared=False, n_jobs=40):
+def compute_rmse(y, y_hat, over='time', squared=False, n_jobs=40, 
+                 vectorized=True, chunk_size=None):
     """
+    Compute the (R)MSE per grid point (``over='time'``) or per pair of grids 
+    (``over='space'``).
 
     Parameters
     ----------
+    y, y_hat : np.ndarray
+        Groundtruth and prediction with dims [time, lat, lon, vars].
+    over : {'time', 'space'}, optional
+        If 'time', the MSE of the time series of each grid point is computed 
+        and a map is returned (grid points equal to zero in the first time step
+        are set to NaN). If 'space', the RMSE (or MSE) between each pair of 
+        grids is computed. 
     squared : bool
-        If True returns MSE value, if False returns RMSE value.
+        If True returns MSE value, if False returns RMSE value. Only used when
+        ``over='space'``.
+    n_jobs : int, optional
+        Number of joblib workers, only used when ``vectorized`` is False.
+    vectorized : bool, optional
+        If True, the metric is computed with NumPy array reductions. If False,
+        one joblib task per grid point (or per pair of grids) is used.
+    chunk_size : int or None, optional
+        If not None and ``over='time'``, the grid points are processed in 
+        chunks of ``chunk_size`` to bound the memory of the temporary arrays.
 
     https://scikit-learn.org/stable/modules/generated/sklearn.metrics.mean_squared_error.html
     """
     def rmse_per_px(tupyx):
+        from sklearn.metrics import mean_squared_error
         y_coord, x_coord = tupyx
         return y_coord, x_coord, mean_squared_error(y[:,y_coord,x_coord,0], y_hat[:,y_coord,x_coord,0])
 
     def rmse_gridpair(index):
-        return mean_squared_error(y[index].flatten(), y_hat[index].flatten(), squared=squared)
+        from sklearn.metrics import mean_squared_error
+        mse = mean_squared_error(y[index].flatten(), y_hat[index].flatten())
+        return mse if squared else np.sqrt(mse)
 
     #---------------------------------------------------------------------------
     if over == 'time':
         rmse_map = np.zeros_like(y[0,:,:,0]) 
         rmse_map *= np.nan
+        if vectorized:
+            rmse_map.ravel()[:] = _reduce_gridpoints(
+                y, y_hat, lambda a, b: np.mean((a - b) ** 2, axis=1), chunk_size)
+            rmse_map[y[0,:,:,0] == 0] = np.nan
+            return rmse_map
+        
         yy, xx = np.where(y[0,:,:,0])
         coords = zip(yy, xx)
         out = Parallel(n_jobs=n_jobs, verbose=False)(delayed(rmse_per_px)(i) for i in coords) 
@@ -43,13 +67,43 @@ def compute_rmse(y, y_hat, over='time', squared=False, n_jobs=40):
         return rmse_map
 
     elif over == 'space':
+        if vectorized:
+            mse = np.mean((_as_rows(y) - _as_rows(y_hat)) ** 2, axis=1)
+            return mse if squared else np.sqrt(mse)
+
         n_timesteps = np.arange(y.shape[0])
         out = Parallel(n_jobs=n_jobs, verbose=False)(delayed(rmse_gridpair)(i) for i in n_timesteps)
         return out
     
 
-def compute_correlation(y, y_hat, over='time', mode='spearman', n_jobs=40):
+def compute_correlation(y, y_hat, over='time', mode='spearman', n_jobs=40,
+                        vectorized=True, chunk_size=None):
     """
+    Compute the Spearman or Pearson correlation per grid point 
+    (``over='time'``) or per pair of grids (``over='space'``). 
+
+    Parameters
+    ----------
+    y, y_hat : np.ndarray
+        Groundtruth and prediction with dims [time, lat, lon, vars].
+    over : {'time', 'space'}, optional
+        If 'time', the correlation of the time series of each grid point is 
+        computed and a map is returned (grid points equal to zero in the first
+        time step are set to NaN). If 'space', the correlation between each 
+        pair of grids is computed. 
+    mode : {'spearman', 'pearson'}, optional
+        Correlation coefficient. The Spearman coefficient is computed as the 
+        Pearson coefficient of the ranks (averaged for ties).
+    n_jobs : int, optional
+        Number of joblib workers, only used when ``vectorized`` is False.
+    vectorized : bool, optional
+        If True, the coefficients are computed with NumPy array reductions. If
+        False, one joblib task per grid point (or per pair of grids) calls
+        ``scipy.stats.spearmanr`` or ``scipy.stats.pearsonr``.
+    chunk_size : int or None, optional
+        If not None and ``over='time'``, the grid points are processed in 
+        chunks of ``chunk_size`` to bound the memory of the temporary arrays.
+
     https://scipy.github.io/devdocs/generated/scipy.stats.spearmanr.html
 
     https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.pearsonr.html
@@ -69,10 +123,24 @@ def compute_correlation(y, y_hat, over='time', mode='spearman', n_jobs=40):
             f = pearsonr
         return index, f(y[index].ravel(), y_hat[index].ravel())[0]
 
+    def corr_rows(a, b):
+        if mode == 'spearman':
+            a = rankdata(a, axis=1)
+            b = rankdata(b, axis=1)
+        return _pearson_rows(a, b)
+
+    if mode not in ['spearman', 'pearson']:
+        raise ValueError("`mode` must be one of ['spearman', 'pearson']")
+
     #---------------------------------------------------------------------------
     if over == 'time':
         corrmap = np.zeros_like(y[0,:,:,0]) 
         corrmap *= np.nan
+        if vectorized:
+            corrmap.ravel()[:] = _reduce_gridpoints(y, y_hat, corr_rows, chunk_size)
+            corrmap[y[0,:,:,0] == 0] = np.nan
+            return corrmap
+
         yy, xx = np.where(y[0,:,:,0])
         coords = zip(yy, xx)
         out = Parallel(n_jobs=n_jobs, verbose=False)(delayed(corr_per_px)(i) for i in coords) 
@@ -84,6 +152,9 @@ def compute_correlation(y, y_hat, over='time', mode='spearman', n_jobs=40):
         return corrmap
 
     elif over == 'space':
+        if vectorized:
+            return corr_rows(_as_rows(y), _as_rows(y_hat))
+
         n_timesteps = np.arange(y.shape[0])
         out = Parallel(n_jobs=n_jobs, verbose=False)(delayed(corr_per_gridpair)(i) for i in n_timesteps)
 
@@ -98,16 +169,20 @@ def compute_correlation(y, y_hat, over='time', mode='spearman', n_jobs=40):
 
 
 def compute_metrics(
-    y_test, 
-    y_test_hat, 
-    dpi=150, 
+    y_test,
+    y_test_hat,
+    dpi=150,
     plot_size_px=1000,
-    n_jobs=-1, 
-    scaler=None, 
+    n_jobs=-1,
+    scaler=None,
     mask=None,
-    save_path=None):
-    """ Compute temporal and spatial-wise metrics, e.g., RMSE and CORRELATION, 
-    based on the groundtruth and prediction ndarrays.
+    save_path=None,
+    chunk_size=256,
+    data_range=None):
+    """ Compute temporal and spatial-wise metrics, e.g., RMSE and CORRELATION,
+    based on the groundtruth and prediction ndarrays. The metrics are
+    accumulated in a single pass over chunks of time steps (see
+    ``dl4ds.MetricsAccumulator``), which are inverse scaled one at a time.
 
     Parameters
     ----------
@@ -116,19 +191,24 @@ def compute_metrics(
     y_test_hat : np.ndarray
         Prediction.
     dpi : int, optional
-        DPI of the plots.  
+        DPI of the plots.
     n_jobs : int, optional
-        Number of cores for the computation of metrics (parallelizing over
-        grid points). Passed to joblib.Parallel. If -1 all CPUs are used. If 1 
-        or None is given, no parallel computing code is used at all, which is 
-        useful for debugging.
+        Not used, kept for backward compatibility. The metrics are computed
+        with vectorized array reductions.
     scaler : scaler object
-        Scaler object from preprocessing module. 
+        Scaler object from preprocessing module.
     mask : np.ndarray or None
         Binary mask with valid (ones) and non-valid (zeroes) grid points.
     save_path : str or None, optional
-        Path to save results to disk. 
-        
+        Path to save results to disk.
+    chunk_size : int, optional
+        Number of time steps processed at once.
+    data_range : float or None, optional
+        Dynamic range of the data (in the original units), used for the SSIM.
+        If None, the range fitted by the scaler is used if available (e.g., 
+        ``dl4ds.MinMaxScaler``), otherwise it is computed with a first pass 
+        over the chunks (min and max of the groundtruth and prediction).
+
     """
     timing = Timing()
 
@@ -139,190 +219,423 @@ def compute_metrics(
     y_test = checkarray_ndim(y_test, 4, -1)
     y_test_hat = checkarray_ndim(y_test_hat, 4, -1)
 
-    # backward transformation with the provided scaler
-    if scaler is not None:
-        if hasattr(scaler, 'inverse_transform'):
-            y_test = scaler.inverse_transform(y_test)
-            y_test_hat = scaler.inverse_transform(y_test_hat)        
+    # backward transformation of each chunk with the provided scaler
+    if scaler is not None and not hasattr(scaler, 'inverse_transform'):
+        scaler = None
+    def chunks():
+        for i in range(0, y_test.shape[0], chunk_size):
+            y_chunk = y_test[i: i + chunk_size]
+            y_hat_chunk = y_test_hat[i: i + chunk_size]
+            if scaler is not None:
+                y_chunk = _inverse_transform_chunk(scaler, y_chunk, i)
+                y_hat_chunk = _inverse_transform_chunk(scaler, y_hat_chunk, i)
+            yield y_chunk, y_hat_chunk
+
+    accumulator = MetricsAccumulator(mask=mask)
+    if data_range is None:
+        data_range = _fitted_data_range(scaler)
+    if data_range is None:
+        # streaming min/max, the chunks are not kept in memory
+        vmin, vmax = np.inf, -np.inf
+        for y_chunk, y_hat_chunk in chunks():
+            chunk_min, chunk_max = _min_max([y_chunk, y_hat_chunk], accumulator.mask)
+            vmin, vmax = min(vmin, chunk_min), max(vmax, chunk_max)
+        data_range = vmax - vmin
+    accumulator.data_range = data_range
+    for y_chunk, y_hat_chunk in chunks():
+        accumulator.update(y_chunk, y_hat_chunk)
+
+    res = accumulator.report(dpi=dpi, plot_size_px=plot_size_px, save_path=save_path)
+    timing.runtime()
+    return res
+
 
-    # applying valid grid points mask
-    if mask is not None:
+class MetricsAccumulator():
+    """
+    Single-pass accumulator of the metrics computed by ``compute_metrics``.
+    Chunks of groundtruth and prediction grids (over time) are passed to
+    ``update``, which keeps running sums, sums of squares and cross-products
+    per grid point, together with the per time step metrics (PSNR, SSIM, MAE,
+    RMSE and spatial correlations). This allows computing the metrics on
+    datasets larger than memory or during streaming inference.
+    """
+    def __init__(self, mask=None, data_range=None):
+        """
+        Parameters
+        ----------
+        mask : np.ndarray, xr.DataArray or None
+            Binary mask with valid (ones) and non-valid (zeroes) grid points.
+        data_range : float or None, optional
+            Dynamic range of the data, used for the SSIM. Should be given when 
+            the accumulator is used on its own (as ``compute_metrics`` does): 
+            if None, the range of the first chunk passed to ``update`` is used
+            for all the chunks (a warning is issued), and the SSIM depends on
+            how the data is chunked. The PSNR is always computed with the range
+            of all the data passed to ``update``.
+        """
         if isinstance(mask, xr.DataArray):
-            mask = mask.values.copy()
-        elif isinstance(mask, np.ndarray):
-            mask = mask.copy()
-
-        if mask.ndim == 2:
-            mask = np.expand_dims(mask, -1)
-        y_test = y_test.copy()
-        y_test_hat = y_test_hat.copy()
-        for i in range(y_test.shape[0]):
-            y_test[i] *= mask
-        for i in range(y_test_hat.shape[0]):
-            y_test_hat[i] *= mask
-        mask_nan = mask.astype('float').copy()
-        mask_nan[mask == 0] = np.nan
-        mask = np.squeeze(mask)
-
-    ### Computing metrics
-    drange = max(y_test.max(), y_test_hat.max()) - min(y_test.min(), y_test_hat.min())
-    with tf.device("cpu:0"):
-        psnr = tf.image.psnr(y_test, y_test_hat, drange)
-    mean_psnr = np.mean(psnr)
-    std_psnr = np.std(psnr)
-
-    with tf.device("cpu:0"):
-        ssim = tf.image.ssim(tf.convert_to_tensor(y_test, dtype=tf.float32), 
-                             tf.convert_to_tensor(y_test_hat, dtype=tf.float32), 
-                             drange)
-    mean_ssim = np.mean(ssim)
-    std_ssim = np.std(ssim)
-
-    with tf.device("cpu:0"):
-        maes = tf.keras.metrics.mean_absolute_error(y_test, y_test_hat)
-    maes_pairs = np.mean(maes, axis=(1,2))
-    mean_mae = np.mean(maes_pairs)
-    std_mae = np.std(maes_pairs)
-
-    ### RMSE 
-    temp_rmse_map = compute_rmse(y_test, y_test_hat, n_jobs=n_jobs, over='time')
-    spatial_rmse = compute_rmse(y_test, y_test_hat, n_jobs=n_jobs, over='space')
-    if save_path is not None:
-        np.save(os.path.join(save_path, 'metrics_mse_pergridpair.npy'), spatial_rmse)
-    mean_spatial_rmse = np.mean(spatial_rmse)
-    std_spatial_rmse = np.std(spatial_rmse)
-    mean_temp_rmse = np.nanmean(temp_rmse_map)
-    std_temp_rmse = np.nanstd(temp_rmse_map)
-    if mask is not None:
-        temp_rmse_map[np.where(mask == 0)] = 0
-    subpti = f'RMSE map ($\mu$ = {mean_temp_rmse:.6f})'
-    if save_path is not None:
-        savepath = os.path.join(save_path, 'metrics_pergridpoint_rmse_map.png')
-        np.save(os.path.join(save_path, 'metrics_pergridpoint_rmse_map.npy'), temp_rmse_map)
-    else:
-        savepath = None
-    ecv.plot_ndarray(temp_rmse_map, dpi=dpi, subplot_titles=(subpti), cmap='viridis', 
-                     plot_size_px=plot_size_px, interactive=False, save=savepath)
-
-    ### Normalized per grid point RMSE 
-    norm_temp_rmse_map = temp_rmse_map / (np.mean(y_test) * 100)
-    norm_mean_temp_rmse = np.nanmean(norm_temp_rmse_map)
-    norm_std_temp_rmse = np.nanstd(norm_temp_rmse_map)
-    if mask is not None:
-        norm_temp_rmse_map[np.where(mask == 0)] = 0
-    subpti = f'nRMSE map ($\mu$ = {norm_mean_temp_rmse:.6f})'
-    if save_path is not None:
-        savepath = os.path.join(save_path, 'metrics_pergridpoint_nrmse_map.png')
-        np.save(os.path.join(save_path, 'metrics_pergridpoint_nrmse_map.npy'), norm_temp_rmse_map)
-    else:
-        savepath = None
-    ecv.plot_ndarray(norm_temp_rmse_map, dpi=dpi, subplot_titles=(subpti), cmap='viridis', 
-                     plot_size_px=plot_size_px, interactive=False, save=savepath)
-
-    # Normalized mean bias
-    nmeanbias = np.mean(y_test_hat - y_test, axis=0)
-    nmeanbias /= np.mean(y_test) * 100
-    if mask is not None:
-        nmeanbias *= mask_nan
-    mean_nmeanbias = np.nanmean(nmeanbias)
-    nmeanbias[np.where(mask == 0)] = 0
-    subpti = f'NMBias map ($\mu$ = {mean_nmeanbias:.6f})'
-    if save_path is not None:
-        savepath = os.path.join(save_path, 'metrics_nmeanbias_map.png')
-        np.save(os.path.join(save_path, 'metrics_nmeanbias_map.npy'), nmeanbias)
-    else:
-        savepath = None
-    ecv.plot_ndarray(nmeanbias, dpi=dpi, subplot_titles=(subpti), cmap='viridis', 
-                     plot_size_px=plot_size_px, interactive=False, save=savepath)
-
-    ### Spearman correlation coefficient
-    spatial_spearman_corr = compute_correlation(y_test, y_test_hat, n_jobs=n_jobs, over='space')
-    mean_spatial_spearman_corr = np.mean(spatial_spearman_corr)
-    std_spatial_spearman_corr = np.std(spatial_spearman_corr)
-    if save_path is not None:
-        np.save(os.path.join(save_path, 'metrics_spearcorr_pergridpair.npy'), spatial_spearman_corr)
-
-    ### Pearson correlation coefficient
-    spatial_pearson_corr = compute_correlation(y_test, y_test_hat, mode='pearson', n_jobs=n_jobs, over='space')
-    mean_spatial_pearson_corr = np.mean(spatial_pearson_corr)
-    std_spatial_pearson_corr = np.std(spatial_pearson_corr)
-    if save_path is not None:
-        np.save(os.path.join(save_path, 'metrics_pearcorr_pergridpair.npy'), spatial_pearson_corr)
-    temp_pearson_corrmap = compute_correlation(y_test, y_test_hat, mode='pearson', n_jobs=n_jobs)
-    mean_temp_pearson_corr = np.nanmean(temp_pearson_corrmap)
-    std_temp_pearson_corr = np.nanstd(temp_pearson_corrmap)
-    temp_pearson_corrmap[np.where(mask == 0)] = 0
-    subpti = f'Pearson correlation map ($\mu$ = {mean_temp_pearson_corr:.6f})'
-    if save_path is not None:
-        savepath = os.path.join(save_path, 'metrics_pergridpoint_corrpears_map.png')
-        np.save(os.path.join(save_path, 'metrics_pergridpoint_corrpears_map.npy'), temp_pearson_corrmap)
-    else:
-        savepath = None
-    ecv.plot_ndarray(temp_pearson_corrmap, dpi=dpi, subplot_titles=(subpti), cmap='magma', 
-                     plot_size_px=plot_size_px, interactive=False, save=savepath)
+            mask = mask.values
+        if mask is not None:
+            mask = np.asarray(mask)
+            if mask.ndim == 2:
+                mask = np.expand_dims(mask, -1)
+        self.mask = mask
+        self.data_range = data_range
+        self.n = 0
+        self.vmin = np.inf
+        self.vmax = -np.inf
+        self.mse = []
+        self.ssim = []
+        self.mae = []
+        self.spearman = []
+        self.pearson = []
+
+    def update(self, y, y_hat):
+        """Update the metrics with a chunk of time steps.
+
+        Parameters
+        ----------
+        y, y_hat : np.ndarray
+            Groundtruth and prediction with dims [time, lat, lon, vars].
+        """
+        y = checkarray_ndim(np.asarray(y), 4, -1)
+        y_hat = checkarray_ndim(np.asarray(y_hat), 4, -1)
+        if self.mask is not None:
+            # the non-valid grid points are set to zero, keeping the dtype
+            y = np.where(self.mask != 0, y, y.dtype.type(0))
+            y_hat = np.where(self.mask != 0, y_hat, y_hat.dtype.type(0))
+
+        if self.n == 0:
+            # grid points equal to zero in the first time step are not valid
+            self.valid = y[0,:,:,0] != 0
+            self.dtype = y.dtype
+            self.sum_y = 0.
+            self.sum_diff = np.zeros(y.shape[1:])
+            self.sum_sqdiff = np.zeros(y.shape[1:3])
+            self.mean_y = np.zeros(y.shape[1:3])
+            self.mean_y_hat = np.zeros(y.shape[1:3])
+            self.m2_y = np.zeros(y.shape[1:3])
+            self.m2_y_hat = np.zeros(y.shape[1:3])
+            self.cov = np.zeros(y.shape[1:3])
+        self.vmin = min(self.vmin, np.min(y), np.min(y_hat))
+        self.vmax = max(self.vmax, np.max(y), np.max(y_hat))
+        if self.data_range is None:
+            warnings.warn('`data_range` is not given, the range of the first '
+                          'chunk is used for the SSIM of all the chunks')
+            self.data_range = self.vmax - self.vmin
+
+        ### Per time step metrics
+        diff = y_hat.astype('float64') - y
+        self.mse.append(np.mean(diff ** 2, axis=(1, 2, 3)))
+        self.mae.append(np.mean(np.abs(diff), axis=(1, 2, 3)))
+        import tensorflow as tf
+        with tf.device("cpu:0"):
+            ssim = tf.image.ssim(tf.convert_to_tensor(y, dtype=tf.float32),
+                                 tf.convert_to_tensor(y_hat, dtype=tf.float32),
+                                 self.data_range)
+        self.ssim.append(np.asarray(ssim))
+        self.spearman.append(compute_correlation(y, y_hat, over='space'))
+        self.pearson.append(compute_correlation(y, y_hat, mode='pearson', over='space'))
+
+        ### Per grid point sums
+        self.sum_y += np.sum(y, dtype='float64')
+        self.sum_diff += np.sum(diff, axis=0)
+        self.sum_sqdiff += np.sum(diff[..., 0] ** 2, axis=0)
+
+        # means, sums of squares and cross-products of the deviations (of the
+        # first variable), merged with the pairwise update of Chan et al. 1979
+        y0 = y[..., 0].astype('float64')
+        y_hat0 = y_hat[..., 0].astype('float64')
+        n_a, n_b = self.n, y.shape[0]
+        n = n_a + n_b
+        mean_y_b = np.mean(y0, axis=0)
+        mean_y_hat_b = np.mean(y_hat0, axis=0)
+        dev_y = y0 - mean_y_b
+        dev_y_hat = y_hat0 - mean_y_hat_b
+        delta_y = mean_y_b - self.mean_y
+        delta_y_hat = mean_y_hat_b - self.mean_y_hat
+        self.m2_y += np.sum(dev_y ** 2, axis=0) + delta_y ** 2 * n_a * n_b / n
+        self.m2_y_hat += np.sum(dev_y_hat ** 2, axis=0) + delta_y_hat ** 2 * n_a * n_b / n
+        self.cov += np.sum(dev_y * dev_y_hat, axis=0) + delta_y * delta_y_hat * n_a * n_b / n
+        self.mean_y += delta_y * n_b / n
+        self.mean_y_hat += delta_y_hat * n_b / n
+        self.n = n
+
+    def result(self):
+        """Return a dictionary with the per time step metrics and the per grid
+        point maps.
+        """
+        if self.n == 0:
+            raise RuntimeError('No data has been accumulated, call `update` first')
+        mse = np.concatenate(self.mse)
+        with np.errstate(divide='ignore'):
+            psnr = 20 * np.log10(self.vmax - self.vmin) - 10 * np.log10(mse)
+
+        rmse_map = (self.sum_sqdiff / self.n).astype(self.dtype)
+        rmse_map[~self.valid] = np.nan
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pearson_map = self.cov / np.sqrt(self.m2_y * self.m2_y_hat)
+        pearson_map = np.clip(pearson_map, -1, 1).astype(self.dtype)
+        pearson_map[~self.valid] = np.nan
+
+        return dict(
+            psnr=psnr,
+            ssim=np.concatenate(self.ssim),
+            mae=np.concatenate(self.mae),
+            spatial_rmse=np.sqrt(mse),
+            spatial_spearman_corr=np.concatenate(self.spearman),
+            spatial_pearson_corr=np.concatenate(self.pearson),
+            mean_y=self.sum_y / (self.n * self.sum_diff.size),
+            temp_rmse_map=rmse_map,
+            temp_pearson_corrmap=pearson_map,
+            meanbias_map=(self.sum_diff / self.n).astype(self.dtype))
+
+    def report(self, dpi=150, plot_size_px=1000, save_path=None):
+        """Plot the maps and violin plots, and print (or save to disk) the
+        summary of the metrics.
+
+        Parameters
+        ----------
+        dpi : int, optional
+            DPI of the plots.
+        save_path : str or None, optional
+            Path to save results to disk.
+
+        Returns
+        -------
+        temp_rmse_map, temp_pearson_corrmap, nmeanbias : np.ndarray
+            Per grid point RMSE, Pearson correlation and normalized mean bias.
+        """
+        from matplotlib import pyplot as plt
+        import seaborn as sns
+        import ecubevis as ecv
+        res = self.result()
+        mask = None
+        if self.mask is not None:
+            mask_nan = self.mask.astype('float').copy()
+            mask_nan[self.mask == 0] = np.nan
+            mask = np.squeeze(self.mask)
+
+        ### Computing metrics
+        psnr = res['psnr']
+        mean_psnr = np.mean(psnr)
+        std_psnr = np.std(psnr)
+
+        ssim = res['ssim']
+        mean_ssim = np.mean(ssim)
+        std_ssim = np.std(ssim)
+
+        maes_pairs = res['mae']
+        mean_mae = np.mean(maes_pairs)
+        std_mae = np.std(maes_pairs)
+
+        ### RMSE
+        temp_rmse_map = res['temp_rmse_map']
+        spatial_rmse = res['spatial_rmse']
+        if save_path is not None:
+            np.save(os.path.join(save_path, 'metrics_mse_pergridpair.npy'), spatial_rmse)
+        mean_spatial_rmse = np.mean(spatial_rmse)
+        std_spatial_rmse = np.std(spatial_rmse)
+        mean_temp_rmse = np.nanmean(temp_rmse_map)
+        std_temp_rmse = np.nanstd(temp_rmse_map)
+        if mask is not None:
+            temp_rmse_map[np.where(mask == 0)] = 0
+        subpti = f'RMSE map ($\mu$ = {mean_temp_rmse:.6f})'
+        if save_path is not None:
+            savepath = os.path.join(save_path, 'metrics_pergridpoint_rmse_map.png')
+            np.save(os.path.join(save_path, 'metrics_pergridpoint_rmse_map.npy'), temp_rmse_map)
+        else:
+            savepath = None
+        ecv.plot_ndarray(temp_rmse_map, dpi=dpi, subplot_titles=(subpti), cmap='viridis', 
+                         plot_size_px=plot_size_px, interactive=False, save=savepath)
+
+        ### Normalized per grid point RMSE 
+        norm_temp_rmse_map = temp_rmse_map / (res['mean_y'] * 100)
+        norm_mean_temp_rmse = np.nanmean(norm_temp_rmse_map)
+        norm_std_temp_rmse = np.nanstd(norm_temp_rmse_map)
+        if mask is not None:
+            norm_temp_rmse_map[np.where(mask == 0)] = 0
+        subpti = f'nRMSE map ($\mu$ = {norm_mean_temp_rmse:.6f})'
+        if save_path is not None:
+            savepath = os.path.join(save_path, 'metrics_pergridpoint_nrmse_map.png')
+            np.save(os.path.join(save_path, 'metrics_pergridpoint_nrmse_map.npy'), norm_temp_rmse_map)
+        else:
+            savepath = None
+        ecv.plot_ndarray(norm_temp_rmse_map, dpi=dpi, subplot_titles=(subpti), cmap='viridis', 
+                         plot_size_px=plot_size_px, interactive=False, save=savepath)
+
+        # Normalized mean bias
+        nmeanbias = res['meanbias_map']
+        nmeanbias /= res['mean_y'] * 100
+        if mask is not None:
+            nmeanbias *= mask_nan
+        mean_nmeanbias = np.nanmean(nmeanbias)
+        nmeanbias[np.where(mask == 0)] = 0
+        subpti = f'NMBias map ($\mu$ = {mean_nmeanbias:.6f})'
+        if save_path is not None:
+            savepath = os.path.join(save_path, 'metrics_nmeanbias_map.png')
+            np.save(os.path.join(save_path, 'metrics_nmeanbias_map.npy'), nmeanbias)
+        else:
+            savepath = None
+        ecv.plot_ndarray(nmeanbias, dpi=dpi, subplot_titles=(subpti), cmap='viridis', 
+                         plot_size_px=plot_size_px, interactive=False, save=savepath)
+
+        ### Spearman correlation coefficient
+        spatial_spearman_corr = res['spatial_spearman_corr']
+        mean_spatial_spearman_corr = np.mean(spatial_spearman_corr)
+        std_spatial_spearman_corr = np.std(spatial_spearman_corr)
+        if save_path is not None:
+            np.save(os.path.join(save_path, 'metrics_spearcorr_pergridpair.npy'), spatial_spearman_corr)
+
+        ### Pearson correlation coefficient
+        spatial_pearson_corr = res['spatial_pearson_corr']
+        mean_spatial_pearson_corr = np.mean(spatial_pearson_corr)
+        std_spatial_pearson_corr = np.std(spatial_pearson_corr)
+        if save_path is not None:
+            np.save(os.path.join(save_path, 'metrics_pearcorr_pergridpair.npy'), spatial_pearson_corr)
+        temp_pearson_corrmap = res['temp_pearson_corrmap']
+        mean_temp_pearson_corr = np.nanmean(temp_pearson_corrmap)
+        std_temp_pearson_corr = np.nanstd(temp_pearson_corrmap)
+        temp_pearson_corrmap[np.where(mask == 0)] = 0
+        subpti = f'Pearson correlation map ($\mu$ = {mean_temp_pearson_corr:.6f})'
+        if save_path is not None:
+            savepath = os.path.join(save_path, 'metrics_pergridpoint_corrpears_map.png')
+            np.save(os.path.join(save_path, 'metrics_pergridpoint_corrpears_map.npy'), temp_pearson_corrmap)
+        else:
+            savepath = None
+        ecv.plot_ndarray(temp_pearson_corrmap, dpi=dpi, subplot_titles=(subpti), cmap='magma', 
+                         plot_size_px=plot_size_px, interactive=False, save=savepath)
     
-    ### Plotting violin plots: http://seaborn.pydata.org/tutorial/aesthetics.html
-    sns.set_style("whitegrid") #{"axes.facecolor": ".9"}
-    sns.despine(left=True)
-    sns.set_context("notebook")
-    f, ax = plt.subplots(1, 6, figsize=(15, 5), dpi=dpi)
-    for axis in f.axes:
-        axis.tick_params(labelrotation=40)
-
-    ax_ = sns.violinplot(x=np.array(psnr), ax=ax[0], orient='h', color="skyblue", saturation=1, linewidth=0.8)
-    ax_.set_title('PSNR')
-    ax_.set_xlabel(f'$\mu$ = {mean_psnr:.4f} \n$\sigma$ = {std_psnr:.4f}')
-
-    ax_ = sns.violinplot(x=np.array(ssim), ax=ax[1], orient='h', color="skyblue", saturation=1, linewidth=0.8)
-    ax_.set_title('SSIM')
-    ax_.set_xlabel(f'$\mu$ = {mean_ssim:.4f} \n$\sigma$ = {std_ssim:.4f}')
-
-    ax_ = sns.violinplot(x=maes_pairs, ax=ax[2], orient='h', color="skyblue", saturation=1, linewidth=0.8)
-    ax_.set_title('MAE')
-    ax_.set_xlabel(f'$\mu$ = {mean_mae:.4f} \n$\sigma$ = {std_mae:.4f}')
-
-    ax_ = sns.violinplot(x=spatial_rmse, ax=ax[3], orient='h', color="skyblue", saturation=1, linewidth=0.8)
-    ax_.set_title('RMSE')
-    ax_.set_xlabel(f'$\mu$ = {mean_spatial_rmse:.4f} \n$\sigma$ = {std_spatial_rmse:.4f}')
-
-    ax_ = sns.violinplot(x=spatial_pearson_corr, ax=ax[4], orient='h', color="skyblue", saturation=1, linewidth=0.8)
-    ax_.set_title('Pearson correlation')
-    ax_.set_xlabel(f'$\mu$ = {mean_spatial_pearson_corr:.4f} \n$\sigma$ = {std_spatial_pearson_corr:.4f}')
-
-    ax_ = sns.violinplot(x=spatial_spearman_corr, ax=ax[5], orient='h', color="skyblue", saturation=1, linewidth=0.8)
-    ax_.set_title('Spearman correlation')
-    ax_.set_xlabel(f'$\mu$ = {mean_spatial_spearman_corr:.4f} \n$\sigma$ = {std_spatial_spearman_corr:.4f}')
-
-    f.tight_layout()
-    if save_path is not None: 
-        plt.savefig(os.path.join(save_path, 'metrics_violin_plots.png'))
-        plt.close()
-    else:
-        plt.show()
+        ### Plotting violin plots: http://seaborn.pydata.org/tutorial/aesthetics.html
+        sns.set_style("whitegrid") #{"axes.facecolor": ".9"}
+        sns.despine(left=True)
+        sns.set_context("notebook")
+        f, ax = plt.subplots(1, 6, figsize=(15, 5), dpi=dpi)
+        for axis in f.axes:
+            axis.tick_params(labelrotation=40)
+
+        ax_ = sns.violinplot(x=np.array(psnr), ax=ax[0], orient='h', color="skyblue", saturation=1, linewidth=0.8)
+        ax_.set_title('PSNR')
+        ax_.set_xlabel(f'$\mu$ = {mean_psnr:.4f} \n$\sigma$ = {std_psnr:.4f}')
+
+        ax_ = sns.violinplot(x=np.array(ssim), ax=ax[1], orient='h', color="skyblue", saturation=1, linewidth=0.8)
+        ax_.set_title('SSIM')
+        ax_.set_xlabel(f'$\mu$ = {mean_ssim:.4f} \n$\sigma$ = {std_ssim:.4f}')
+
+        ax_ = sns.violinplot(x=maes_pairs, ax=ax[2], orient='h', color="skyblue", saturation=1, linewidth=0.8)
+        ax_.set_title('MAE')
+        ax_.set_xlabel(f'$\mu$ = {mean_mae:.4f} \n$\sigma$ = {std_mae:.4f}')
+
+        ax_ = sns.violinplot(x=spatial_rmse, ax=ax[3], orient='h', color="skyblue", saturation=1, linewidth=0.8)
+        ax_.set_title('RMSE')
+        ax_.set_xlabel(f'$\mu$ = {mean_spatial_rmse:.4f} \n$\sigma$ = {std_spatial_rmse:.4f}')
+
+        ax_ = sns.violinplot(x=spatial_pearson_corr, ax=ax[4], orient='h', color="skyblue", saturation=1, linewidth=0.8)
+        ax_.set_title('Pearson correlation')
+        ax_.set_xlabel(f'$\mu$ = {mean_spatial_pearson_corr:.4f} \n$\sigma$ = {std_spatial_pearson_corr:.4f}')
+
+        ax_ = sns.violinplot(x=spatial_spearman_corr, ax=ax[5], orient='h', color="skyblue", saturation=1, linewidth=0.8)
+        ax_.set_title('Spearman correlation')
+        ax_.set_xlabel(f'$\mu$ = {mean_spatial_spearman_corr:.4f} \n$\sigma$ = {std_spatial_spearman_corr:.4f}')
+
+        f.tight_layout()
+        if save_path is not None: 
+            plt.savefig(os.path.join(save_path, 'metrics_violin_plots.png'))
+            plt.close()
+        else:
+            plt.show()
     
-    sns.set_style("white")
+        sns.set_style("white")
+
+        if save_path is not None: 
+            f = open(os.path.join(save_path, 'metrics_summary.txt'), "a")
+        else:
+            f = None
+
+        print('Metrics on y_test and y_test_hat:\n', file=f)
+        print(f'PSNR \tmu = {mean_psnr} \tsigma = {std_psnr}', file=f)
+        print(f'SSIM \tmu = {mean_ssim} \tsigma = {std_ssim}', file=f)
+        print(f'MAE \tmu = {mean_mae} \tsigma = {std_mae}', file=f)
+        print(f'Per-grid-point RMSE \tmu = {mean_temp_rmse} \tsigma = {std_temp_rmse}', file=f)
+        print(f'Per-grid-point nRMSE \tmu = {norm_mean_temp_rmse} \tsigma = {norm_std_temp_rmse}', file=f)
+        print(f'Per-grid-point Spearman correlation \tmu = {mean_spatial_spearman_corr} \tsigma = {std_spatial_spearman_corr}', file=f)
+        print(f'Per-grid-point Pearson correlation \tmu = {mean_temp_pearson_corr} \tsigma = {std_temp_pearson_corr}', file=f)
+        print(file=f)
+        print(f'Spatial MSE \tmu = {mean_spatial_rmse} \tsigma = {std_spatial_rmse}', file=f)
+        print(f'Spatial Spearman correlation \tmu = {mean_spatial_spearman_corr} \tsigma = {std_spatial_spearman_corr}', file=f)
+        print(f'Spatial Pearson correlation \tmu = {mean_spatial_pearson_corr} \tsigma = {std_spatial_pearson_corr}', file=f)
+
+        if save_path is not None:
+            f.close()
+
+        return temp_rmse_map, temp_pearson_corrmap, nmeanbias
+
+
+def _as_rows(array):
+    """Flatten each grid of ``array`` [time, ...] into a row (float64).
+    """
+    return np.asarray(array, dtype='float64').reshape(array.shape[0], -1)
+
+
+def _reduce_gridpoints(y, y_hat, func, chunk_size=None):
+    """Apply ``func`` to the time series (rows of shape [n_gridpoints, time]) 
+    of the first variable of ``y`` and ``y_hat``, optionally in chunks of 
+    grid points. Returns a flat array with one value per grid point.
+    """
+    y = y[..., 0].reshape(y.shape[0], -1)
+    y_hat = y_hat[..., 0].reshape(y_hat.shape[0], -1)
+    n = y.shape[1]
+    if chunk_size is None:
+        chunk_size = n
+    out = np.empty(n, dtype='float64')
+    for i in range(0, n, chunk_size):
+        y_chunk = np.asarray(y[:, i: i + chunk_size], dtype='float64').T
+        y_hat_chunk = np.asarray(y_hat[:, i: i + chunk_size], dtype='float64').T
+        out[i: i + chunk_size] = func(y_chunk, y_hat_chunk)
+    return out
+
+
+def _pearson_rows(a, b):
+    """Pearson correlation coefficient between the rows of ``a`` and ``b``.
+    Rows with zero variance result in NaN, as in ``scipy.stats.pearsonr``.
+    """
+    a = a - a.mean(axis=1, keepdims=True)
+    b = b - b.mean(axis=1, keepdims=True)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.sum(a * b, axis=1) / np.sqrt(np.sum(a * a, axis=1) * np.sum(b * b, axis=1))
+    return np.clip(r, -1, 1)
+
 
-    if save_path is not None: 
-        f = open(os.path.join(save_path, 'metrics_summary.txt'), "a")
+def _min_max(arrays, mask=None):
+    """Minimum and maximum of a list of arrays [time, lat, lon, vars]. With a
+    mask, the non-valid grid points count as zeros, as in 
+    ``MetricsAccumulator.update``.
+    """
+    if mask is None:
+        vmax = max(np.max(array) for array in arrays)
+        vmin = min(np.min(array) for array in arrays)
     else:
-        f = None
-
-    print('Metrics on y_test and y_test_hat:\n', file=f)
-    print(f'PSNR \tmu = {mean_psnr} \tsigma = {std_psnr}', file=f)
-    print(f'SSIM \tmu = {mean_ssim} \tsigma = {std_ssim}', file=f)
-    print(f'MAE \tmu = {mean_mae} \tsigma = {std_mae}', file=f)
-    print(f'Per-grid-point RMSE \tmu = {mean_temp_rmse} \tsigma = {std_temp_rmse}', file=f)
-    print(f'Per-grid-point nRMSE \tmu = {norm_mean_temp_rmse} \tsigma = {norm_std_temp_rmse}', file=f)
-    print(f'Per-grid-point Spearman correlation \tmu = {mean_spatial_spearman_corr} \tsigma = {std_spatial_spearman_corr}', file=f)
-    print(f'Per-grid-point Pearson correlation \tmu = {mean_temp_pearson_corr} \tsigma = {std_temp_pearson_corr}', file=f)
-    print(file=f)
-    print(f'Spatial MSE \tmu = {mean_spatial_rmse} \tsigma = {std_spatial_rmse}', file=f)
-    print(f'Spatial Spearman correlation \tmu = {mean_spatial_spearman_corr} \tsigma = {std_spatial_spearman_corr}', file=f)
-    print(f'Spatial Pearson correlation \tmu = {mean_spatial_pearson_corr} \tsigma = {std_spatial_pearson_corr}', file=f)
-
-    if save_path is not None:
-        f.close()
+        valid = np.broadcast_to(mask != 0, arrays[0].shape[1:])
+        vmax = max(np.max(array, where=valid, initial=-np.inf) for array in arrays)
+        vmin = min(np.min(array, where=valid, initial=np.inf) for array in arrays)
+        if not np.all(valid):
+            vmax, vmin = max(vmax, 0), min(vmin, 0)
+    return vmin, vmax
 
-    timing.runtime()
-    return temp_rmse_map, temp_pearson_corrmap, nmeanbias
 
+def _fitted_data_range(scaler):
+    """Dynamic range of the data fitted by ``scaler`` (e.g., 
+    ``dl4ds.MinMaxScaler``), or None if the scaler does not keep it.
+    """
+    if scaler is None or not hasattr(scaler, 'data_min_'):
+        return None
+    return float(np.nanmax(scaler.data_max_) - np.nanmin(scaler.data_min_))
+
+
+def _inverse_transform_chunk(scaler, chunk, start):
+    """Inverse scaling of a chunk of time steps starting at ``start`` (the NaN
+    mask of dl4ds scalers is taken from these time steps).
+    """
+    if hasattr(scaler, 'nan_mask_'):
+        return np.reshape(scaler.inverse_transform(chunk, start=start), chunk.shape)
+    return np.reshape(scaler.inverse_transform(chunk), chunk.shape)
@@ -177,7 +177,7 @@ class ConvNextBlock(tf.keras.layers.Layer):
         x = self.activation(x)
         x = self.pwconv2(x)
         if self.gamma is not None:
-            x = self.gamma * x
+            x = tf.cast(self.gamma, x.dtype) * x
         if self.use_1x1conv:
             input = self.conv1x1(input)
         x = input + self.drop_path(x)
@@ -484,9 +484,16 @@ class ResizeConvolutionBlock(tf.keras.layers.Layer):
 
     def call(self, x):
         input_shape = x.shape
-        height = int(input_shape[1] * self.scale)
-        width = int(input_shape[2] * self.scale)
-        y = Resizing(height, width, interpolation=self.interpolation)(x)
+        if input_shape[1] is None or input_shape[2] is None:
+            # inputs of unknown size (None, None), e.g., square grids
+            input_shape = tf.shape(x)
+            height = input_shape[1] * self.scale
+            width = input_shape[2] * self.scale
+            y = tf.image.resize(x, (height, width), method=self.interpolation)
+        else:
+            height = int(input_shape[1] * self.scale)
+            width = int(input_shape[2] * self.scale)
+            y = Resizing(height, width, interpolation=self.interpolation)(x)
         y = self.conv(y)
         return y
 
@@ -656,6 +663,82 @@ class PadConcat(tf.keras.layers.Layer):
         return Concatenate()([t1, t2])
 
 
+class RepeatBatch(tf.keras.layers.Layer):
+    """Layer that takes two tensors and repeats the first one along the batch
+    dimension to match the batch size of the second one (a multiple of it). 
+    Used in the discriminator to share the features of a LR input with a 
+    batch of several HR inputs concatenated along the batch dimension.
+    """
+    def __init__(self, name=None):
+        super().__init__(name=name)
+
+    def call(self, X):
+        (t1, t2) = X
+        multiples = tf.shape(t2)[0] // tf.shape(t1)[0]
+        multiples = tf.concat([[multiples], tf.ones([tf.rank(t1) - 1], tf.int32)], axis=0)
+        return tf.tile(t1, multiples)
+
+
+class InterpolationUpsampling(tf.keras.layers.Layer):
+    """Layer that upsamples the input by ``scale`` via interpolation, e.g., on
+    the first layer of a pre-upsampling ('pin') model that takes LR-sized
+    inputs. The interpolation runs on the device instead of in the data
+    pipeline. Spatio-temporal inputs [batch, time, y, x, channels] are
+    interpolated slice by slice.
+
+    Parameters
+    ----------
+    scale : int
+        Scaling factor.
+    interpolation : str, optional
+        Interpolation method. Supports "inter_area", "bicubic", "bilinear",
+        "nearest" and "lanczos", mapped to the ``tf.image.resize`` methods.
+        "inter_area", "bilinear" and "nearest" give the same grids as 
+        ``dl4ds.resize_array`` (OpenCV): with integer upsampling factors, 
+        OpenCV's INTER_AREA replicates the pixels as nearest neighbors does. 
+        The TF "bicubic" (Keys kernel with a=-0.5) and "lanczos3" kernels 
+        differ from OpenCV's bicubic (a=-0.75) and Lanczos4 ones, models 
+        trained with these interpolations in the data pipeline see slightly 
+        different inputs.
+    """
+    methods = {'inter_area': 'nearest', 'bicubic': 'bicubic',
+               'bilinear': 'bilinear', 'nearest': 'nearest',
+               'lanczos': 'lanczos3'}
+
+    def __init__(self, scale, interpolation='inter_area', name=None):
+        super().__init__(name=name)
+        if interpolation not in self.methods:
+            msg = f'`interpolation` must be one of {list(self.methods)}'
+            raise ValueError(msg)
+        self.scale = scale
+        self.interpolation = interpolation
+
+    def call(self, x):
+        shape = tf.shape(x)
+        height, width = shape[-3] * self.scale, shape[-2] * self.scale
+        if x.shape.rank == 5:
+            y = tf.reshape(x, tf.concat([[-1], shape[-3:]], axis=0))
+        else:
+            y = x
+        y = tf.image.resize(y, (height, width),
+                            method=self.methods[self.interpolation])
+        if x.shape.rank == 5:
+            y = tf.reshape(y, tf.concat([shape[:2], [height, width, shape[-1]]], axis=0))
+        return tf.cast(y, x.dtype)
+
+    def compute_output_shape(self, input_shape):
+        input_shape = tf.TensorShape(input_shape).as_list()
+        for i in (-3, -2):
+            if input_shape[i] is not None:
+                input_shape[i] *= self.scale
+        return tf.TensorShape(input_shape)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'scale': self.scale, 'interpolation': self.interpolation})
+        return config
+
+
 class MCDropout(Dropout):
     def call(self, inputs):
         return super().call(inputs, training=True)
@@ -705,3 +788,12 @@ def get_dropout_layer(dropout_rate, dropout_variant, dim=2):
         layer = Lambda(lambda x: tf.identity(x))
     return layer
 
+
+def cast_to_float32(x):
+    """Cast the output of a model to float32 when it is built with a mixed 
+    precision policy (see ``dl4ds.precision_policy``), so that the losses are 
+    computed in float32. Otherwise ``x`` is returned without modification.
+    """
+    if tf.keras.mixed_precision.global_policy().compute_dtype != 'float32':
+        x = Activation('linear', dtype='float32', name='OutputFloat32')(x)
+    return x
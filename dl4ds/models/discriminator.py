@@ -4,7 +4,8 @@ from tensorflow.keras.layers import (Input, Dropout, Dense, Conv2D, Add,
                                      GlobalAveragePooling3D, Cropping2D,
                                      Resizing)
 
-from .blocks import ResidualBlock, RecurrentConvBlock
+from .blocks import (ResidualBlock, RecurrentConvBlock, RepeatBatch, 
+                     cast_to_float32)
 from .. import POSTUPSAMPLING_METHODS
 
 
@@ -21,6 +22,11 @@ def residual_discriminator(
     activation='relu',
     attention=False):
     """
+    Residual discriminator with a branch for the LR input and another one for 
+    the HR (reference or generated) input. The HR input can contain several 
+    arrays concatenated along the batch dimension, e.g., the reference and the
+    generated HR arrays, for a single LR batch. The features of the LR branch 
+    are then computed once and shared among them. 
     """
     # Branch with the LR input array
     if is_spatiotemporal:
@@ -65,6 +71,8 @@ def residual_discriminator(
         c = Conv2D(n_filters, (3, 3), padding='same')(c)
         x_2 = Add()([x_2, c])
 
+    # LR features repeated to match the batch size of the HR input
+    x_1 = RepeatBatch(name='RepeatBatchBranch1')([x_1, x_2])
     x = Concatenate(name='Concat2Branches')([x_1, x_2])
     
     x = ResidualBlock(x.shape[-1], normalization=normalization, attention=attention)(x)
@@ -77,5 +85,7 @@ def residual_discriminator(
     x = Dropout(0.4)(x)
     x = Dense(32, activation='sigmoid')(x)
     output = Dense(1, activation='sigmoid')(x)
+    # float32 output layer (for mixed precision)
+    output = cast_to_float32(output)
 
     return tf.keras.Model([x_in, x_ref], output, name="discriminator")
\ No newline at end of file
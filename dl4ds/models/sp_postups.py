@@ -6,7 +6,7 @@ from tensorflow.keras.models import Model
 from .blocks import (ResidualBlock, ConvBlock, DeconvolutionBlock,
                      DenseBlock, TransitionBlock, SubpixelConvolutionBlock,
                      LocalizedConvBlock, get_dropout_layer, ConvNextBlock,
-                     ResizeConvolutionBlock)
+                     ResizeConvolutionBlock, cast_to_float32)
 from ..utils import (checkarg_backbone, checkarg_upsampling, 
                     checkarg_dropout_variant)
 
@@ -210,6 +210,8 @@ def net_postupsampling(
     x = ConvBlock(
         n_channels_out, ks_cl1=ks, ks_cl2=ks, activation=output_activation, 
         dropout_rate=0, normalization=normalization, attention=False)(x) 
+    # float32 output layer (for mixed precision)
+    x = cast_to_float32(x)
 
     if auxvar_array_is_given:
         return Model(inputs=[x_in, s_in], outputs=x, name=model_name)  
@@ -6,7 +6,8 @@ from tensorflow.keras.models import Model
 from .blocks import (ResidualBlock, ConvBlock, DenseBlock, TransitionBlock,
                      LocalizedConvBlock, SubpixelConvolutionBlock, 
                      DeconvolutionBlock, EncoderBlock, PadConcat, 
-                     get_dropout_layer, ConvNextBlock, ResizeConvolutionBlock)
+                     get_dropout_layer, ConvNextBlock, ResizeConvolutionBlock,
+                     InterpolationUpsampling, cast_to_float32)
 from ..utils import checkarg_backbone, checkarg_dropout_variant
  
 
@@ -25,14 +26,18 @@ def net_pin(
     attention=False,
     activation='relu',
     output_activation=None,
-    localcon_layer=False):
+    localcon_layer=False,
+    scale=None,
+    interpolation='inter_area'):
     """
     Deep neural network with different backbone architectures (according to the
     ``backbone_block``) and pre-upsampling via interpolation (the samples are 
     expected to be interpolated to the HR grid).
 
     The interpolation method depends on the ``interpolation`` argument used in
-    the training procedure (which is passed to the DataGenerator).
+    the training procedure (which is passed to the DataGenerator). If ``scale``
+    is given, the model takes LR-sized inputs instead and interpolates them on
+    the device with a first ``InterpolationUpsampling`` layer.
 
     Parameters
     ----------
@@ -79,6 +84,11 @@ def net_pin(
         the values distribution of the output grid.
     localcon_layer : bool, optional
         If True, the LocalizedConvBlock is activated in the output module. 
+    scale : int or None, optional
+        If not None, scaling factor of the in-graph interpolation of the 
+        LR-sized input (HR auxiliary channels are not interpolated).
+    interpolation : str, optional
+        Interpolation method used when ``scale`` is given.
     """
     backbone_block = checkarg_backbone(backbone_block)
     dropout_variant = checkarg_dropout_variant(dropout_variant)
@@ -96,14 +106,15 @@ def net_pin(
     if not localcon_layer:  
         x_in = Input(shape=(None, None, n_channels))
     else:
-        x_in = Input(shape=(h_hr, w_hr, n_channels))
+        x_in = Input(shape=_input_size(h_hr, w_hr, scale) + (n_channels,))
+    x = _interpolate_input(x_in, scale, interpolation)
 
     init_n_filters = n_filters
     #---------------------------------------------------------------------------
     # N conv blocks
     if backbone_block == 'convnext':  
         ks = (7, 7)     
-        x = b = Conv2D(n_filters, ks, padding='same')(x_in)
+        x = b = Conv2D(n_filters, ks, padding='same')(x)
         # N convnext blocks
         for i in range(n_blocks):
             n_filters = init_n_filters * (i + 1)
@@ -115,7 +126,7 @@ def net_pin(
         x = Add()([x, b])
     else:
         ks = (3, 3)
-        x = b = Conv2D(n_filters, ks, padding='same')(x_in)
+        x = b = Conv2D(n_filters, ks, padding='same')(x)
         # N conv blocks
         for i in range(n_blocks):
             n_filters = init_n_filters * (i + 1)
@@ -181,6 +192,8 @@ def net_pin(
     x = ConvBlock(
         n_channels_out, ks_cl1=ks, ks_cl2=ks, activation=output_activation, 
         dropout_rate=0, normalization=normalization, attention=False)(x)     
+    # float32 output layer (for mixed precision)
+    x = cast_to_float32(x)
     
     model_name = backbone_block + '_pin'
     if auxvar_array_is_given:
@@ -206,13 +219,17 @@ def unet_pin(
     rc_interpolation='bilinear',
     output_activation=None,
     width_cap=256,
-    localcon_layer=False):
+    localcon_layer=False,
+    scale=None,
+    interpolation='inter_area'):
     """    
     Deep neural network with UNET (encoder-decoder) backbone and pre-upsampling 
     via interpolation.
 
     The interpolation method depends on the ``interpolation`` argument used in
-    the training procedure (which is passed to the DataGenerator).
+    the training procedure (which is passed to the DataGenerator). If ``scale``
+    is given, the model takes LR-sized inputs instead and interpolates them on
+    the device with a first ``InterpolationUpsampling`` layer.
 
     Parameters
     ----------
@@ -226,6 +243,11 @@ def unet_pin(
         dropout is applied. 
     dropout_variant : str or None, optional
         Type of dropout. Defined in dl4ds.DROPOUT_VARIANTS variable. 
+    scale : int or None, optional
+        If not None, scaling factor of the in-graph interpolation of the 
+        LR-sized input (HR auxiliary channels are not interpolated).
+    interpolation : str, optional
+        Interpolation method used when ``scale`` is given.
     """
     backbone_block = checkarg_backbone(backbone_block)
     dropout_variant = checkarg_dropout_variant(dropout_variant)
@@ -243,12 +265,12 @@ def unet_pin(
     if not localcon_layer and h_hr == w_hr:  
         x_in = Input(shape=(None, None, n_channels))
     else:
-        x_in = Input(shape=(h_hr, w_hr, n_channels))
+        x_in = Input(shape=_input_size(h_hr, w_hr, scale) + (n_channels,))
 
     init_n_filters = n_filters
     #---------------------------------------------------------------------------
     # n enconding conv blocks
-    x = x_in
+    x = _interpolate_input(x_in, scale, interpolation)
     enconding_filters = []
     n_filters_list = []
     for i in range(n_blocks):
@@ -307,6 +329,8 @@ def unet_pin(
 
     x = ConvBlock(n_channels_out, activation=output_activation, dropout_rate=0, 
         normalization=normalization, attention=False)(x)     
+    # float32 output layer (for mixed precision)
+    x = cast_to_float32(x)
     
     model_name = backbone_block + '_pin'
     if auxvar_array_is_given:
@@ -323,3 +347,17 @@ def _check_nblocks(shape, power):
         power -= 1
     return power
 
+
+def _input_size(h_hr, w_hr, scale=None):
+    """Size of the (LR-sized when ``scale`` is given) main input grid."""
+    if scale is None:
+        return (h_hr, w_hr)
+    return (h_hr // scale, w_hr // scale)
+
+
+def _interpolate_input(x_in, scale=None, interpolation='inter_area'):
+    """In-graph interpolation of the LR-sized input when ``scale`` is given."""
+    if scale is None:
+        return x_in
+    return InterpolationUpsampling(scale, interpolation, 
+                                   name='InputInterpolation')(x_in)
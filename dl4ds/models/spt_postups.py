@@ -4,7 +4,8 @@ from tensorflow.keras.models import Model
 
 from .blocks import (RecurrentConvBlock, ConvBlock, SubpixelConvolutionBlock, 
                      DeconvolutionBlock, LocalizedConvBlock, 
-                     get_dropout_layer, TransitionBlock, ResizeConvolutionBlock)
+                     get_dropout_layer, TransitionBlock, ResizeConvolutionBlock,
+                     cast_to_float32)
 from ..utils import (checkarg_backbone, checkarg_upsampling, 
                     checkarg_dropout_variant)
 
@@ -155,6 +156,8 @@ def recnet_postupsampling(
 
     x = ConvBlock(n_channels_out, activation=output_activation, 
         dropout_rate=0, normalization=normalization, attention=False)(x) 
+    # float32 output layer (for mixed precision)
+    x = cast_to_float32(x)
 
     model_name = 'rec' + backbone_block + '_' + upsampling
     if auxvar_array_is_given:
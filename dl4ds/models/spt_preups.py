@@ -5,7 +5,8 @@ from tensorflow.keras.models import Model
 
 from .blocks import (RecurrentConvBlock, ResidualBlock, ConvBlock, 
                      DenseBlock, TransitionBlock, LocalizedConvBlock,
-                     get_dropout_layer)
+                     get_dropout_layer, InterpolationUpsampling, 
+                     cast_to_float32)
 from ..utils import checkarg_backbone, checkarg_dropout_variant
 
 
@@ -25,7 +26,9 @@ def recnet_pin(
     attention=False,
     activation='relu',
     output_activation=None,
-    localcon_layer=False):
+    localcon_layer=False,
+    scale=None,
+    interpolation='inter_area'):
     """
     Recurrent deep neural network with different backbone architectures 
     (according to the ``backbone_block``) and pre-upsampling via interpolation
@@ -33,7 +36,9 @@ def recnet_pin(
     capable of exploiting spatio-temporal samples.
 
     The interpolation method depends on the ``interpolation`` argument used in
-    the training procedure (which is passed to the DataGenerator).
+    the training procedure (which is passed to the DataGenerator). If ``scale``
+    is given, the model takes LR-sized inputs instead and interpolates them on
+    the device with a first ``InterpolationUpsampling`` layer.
 
     Parameters
     ----------
@@ -81,6 +86,11 @@ def recnet_pin(
         the values distribution of the output grid.
     localcon_layer : bool, optional
         If True, the LocalizedConvBlock is activated in the output module. 
+    scale : int or None, optional
+        If not None, scaling factor of the in-graph interpolation of the 
+        LR-sized input (HR auxiliary channels are not interpolated).
+    interpolation : str, optional
+        Interpolation method used when ``scale`` is given.
     """
     backbone_block = checkarg_backbone(backbone_block)
     dropout_variant = checkarg_dropout_variant(dropout_variant)
@@ -89,13 +99,20 @@ def recnet_pin(
     h_hr, w_hr = hr_size
     if not localcon_layer: 
         x_in = Input(shape=(None, None, None, n_channels))
-    else:
+    elif scale is None:
         x_in = Input(shape=(None, h_hr, w_hr, n_channels))
+    else:
+        x_in = Input(shape=(None, h_hr // scale, w_hr // scale, n_channels))
+    if scale is not None:
+        x = InterpolationUpsampling(scale, interpolation, 
+                                    name='InputInterpolation')(x_in)
+    else:
+        x = x_in
    
     init_n_filters = n_filters
 
     x = b = RecurrentConvBlock(n_filters, activation=activation, 
-                               normalization=normalization)(x_in)
+                               normalization=normalization)(x)
 
     for i in range(n_blocks):
         b = RecurrentConvBlock(n_filters, activation=activation, 
@@ -136,6 +153,8 @@ def recnet_pin(
 
     x = ConvBlock(n_channels_out, activation=output_activation, dropout_rate=0, 
         normalization=normalization, attention=False)(x) 
+    # float32 output layer (for mixed precision)
+    x = cast_to_float32(x)
     
     model_name = 'rec' + backbone_block + '_pin' 
     if auxvar_array_is_given:
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""
+absl.FLAGS-based command line app for downscaling new data with a model saved
+by the trainers (``save_results`` or the checkpoints of ``dl4ds.CGANTrainer``),
+in a separate process from the training. To be executed run something like
+this:
+
+python -m dl4ds.predict_app --model=./resnet_spc/ --input=tas_lr.nc --variable=tas --scaler=scaler.joblib --output=tas_hr.nc
+
+The scale, time window and interpolation of the model are read from the
+metadata saved with it (see ``dl4ds.load_model``), the flags override them.
+The input is opened lazily and streamed by chunks of time steps, which are
+scaled, downscaled, inverse scaled and appended to the output file (NetCDF,
+Zarr or .npy). The time and (HR) lat/lon coordinates of the input are written
+to the NetCDF and Zarr outputs.
+"""
+
+import os
+import numpy as np
+from absl import app, flags
+
+from . import INTERPOLATION_METHODS
+
+
+FLAGS = flags.FLAGS
+
+### MODEL
+flags.DEFINE_string('model', None, 'Directory of the SavedModel, or checkpoints directory (the latest epoch is used)')
+flags.DEFINE_integer('scale', None, 'Scaling factor. Read from the model metadata by default')
+flags.DEFINE_integer('time_window', None, 'Time window of spatio-temporal models. Read from the model metadata by default')
+flags.DEFINE_enum('interpolation', None, INTERPOLATION_METHODS, 'Interpolation method. Read from the model metadata by default')
+
+### DATA
+flags.DEFINE_string('input', None, 'Path of the input data (NetCDF, Zarr or .npy)')
+flags.DEFINE_string('variable', None, 'Variable to read from the input dataset, if it contains several ones')
+flags.DEFINE_bool('array_in_hr', False, 'If True, the input is a HR dataset coarsened before downscaling (e.g., for evaluation)')
+flags.DEFINE_list('static_vars', None, 'Paths of the 2D static variables (NetCDF, Zarr or .npy), as used for training')
+flags.DEFINE_list('predictors', None, 'Paths of the (already scaled) predictor variables (NetCDF, Zarr or .npy)')
+flags.DEFINE_string('scaler', None, 'Path of the fitted scaler (joblib) used for scaling the input and inverse scaling the output')
+flags.DEFINE_string('input_scaler', None, 'Path of the fitted scaler (joblib) for the input, if different from --scaler')
+flags.DEFINE_string('output', 'y_hat.nc', 'Path of the output file (.nc, .zarr or .npy)')
+
+### INFERENCE
+flags.DEFINE_integer('chunk_size', 256, 'Number of time steps read, downscaled and written at once')
+flags.DEFINE_integer('batch_size', 64, 'Batch size for inference')
+flags.DEFINE_integer('tile_size', None, 'If given, tiled inference is performed with tiles of this size (in HR pixels)')
+flags.DEFINE_integer('tile_overlap', None, 'Overlap between tiles, in HR pixels')
+flags.DEFINE_enum('device', 'GPU', ['CPU', 'GPU'], 'Device to be used')
+flags.DEFINE_bool('profile', False, 'Profiling the inference, the profile is saved next to the output')
+
+flags.mark_flags_as_required(['model', 'input'])
+
+
+def downscale(argv):
+    """DL4DS inference command line app.
+    """
+    # tensorflow is only imported once the flags are parsed
+    import tensorflow as tf
+    from .inference import load_model, predict
+    from .datasources import XarraySource, open_data_source
+
+    if FLAGS.device == 'CPU':
+        tf.config.set_visible_devices([], 'GPU')
+
+    model, metadata = load_model(FLAGS.model)
+    scale = FLAGS.scale or metadata.get('scale')
+    if scale is None:
+        raise ValueError('`--scale` must be given, the model was saved without metadata')
+    time_window = FLAGS.time_window or metadata.get('time_window')
+    interpolation = FLAGS.interpolation or metadata.get('interpolation', 'inter_area')
+
+    scaler = _load_scaler(FLAGS.scaler)
+    input_scaler = _load_scaler(FLAGS.input_scaler) or scaler
+
+    # the input is chunked along time (dask) for the lazy scaling of the chunks
+    chunks = {'time': FLAGS.chunk_size} if input_scaler is not None else None
+    source = open_data_source(FLAGS.input, FLAGS.variable, chunks)
+    coords = None
+    if isinstance(source, XarraySource):
+        coords = _output_coords(source.data, scale, FLAGS.array_in_hr)
+    if input_scaler is not None:
+        if not isinstance(source, XarraySource) or source.data.chunks is None:
+            raise ValueError('Scaling the input requires a NetCDF or Zarr input with a time dimension')
+        source = XarraySource(input_scaler.transform(source.data))
+
+    static_vars = None
+    if FLAGS.static_vars is not None:
+        static_vars = [_read_static(path) for path in FLAGS.static_vars]
+    predictors = None
+    if FLAGS.predictors is not None:
+        predictors = [open_data_source(path) for path in FLAGS.predictors]
+
+    save_path, save_fname = os.path.split(os.path.abspath(FLAGS.output))
+    y_hat = predict(
+        model,
+        source,
+        scale,
+        array_in_hr=FLAGS.array_in_hr,
+        static_vars=static_vars,
+        predictors=predictors,
+        time_window=time_window,
+        interpolation=interpolation,
+        tile_size=FLAGS.tile_size,
+        tile_overlap=FLAGS.tile_overlap,
+        chunk_size=FLAGS.chunk_size,
+        batch_size=FLAGS.batch_size,
+        batch_dtype=metadata.get('batch_dtype', 'float32'),
+        scaler=scaler,
+        save_path=save_path,
+        save_fname=save_fname,
+        coords=coords,
+        profile=FLAGS.profile,
+        device=FLAGS.device)
+    print(f'Downscaled array of shape {y_hat.shape} saved to {FLAGS.output}')
+
+
+def main():
+    """Entry point of the ``dl4ds-predict`` console script.
+    """
+    app.run(downscale)
+
+
+def _load_scaler(path):
+    """Load a fitted scaler saved with joblib (e.g., ``joblib.dump(scaler,
+    path)``).
+    """
+    if path is None:
+        return None
+    import joblib
+    return joblib.load(path)
+
+
+def _read_static(path):
+    """Read a 2D static variable from a .npy, NetCDF or Zarr file.
+    """
+    if path.endswith('.npy'):
+        return np.squeeze(np.load(path))
+    import xarray as xr
+    if path.rstrip(os.sep).endswith('.zarr'):
+        dataset = xr.open_zarr(path)
+    else:
+        dataset = xr.open_dataset(path)
+    if len(dataset.data_vars) != 1:
+        msg = f'The static variable file {path} must contain a single variable'
+        raise ValueError(msg)
+    return np.squeeze(dataset[list(dataset.data_vars)[0]].values)
+
+
+def _output_coords(data, scale, array_in_hr):
+    """Coordinates of the [time, lat, lon] dimensions of the output, from the
+    input xr.DataArray. For LR inputs, the lat/lon coordinates of the HR grid
+    are refined from the LR ones.
+    """
+    coords = {}
+    for i, dim in enumerate(data.dims[:3]):
+        values = data[dim].values if dim in data.coords else None
+        if i > 0 and values is not None and not array_in_hr:
+            values = _refine_coords(values, scale)
+        coords[dim] = values
+    return coords
+
+
+def _refine_coords(values, scale):
+    """Centers of the ``scale`` HR cells within each LR cell, interpolated
+    (linearly) from the LR cell centers ``values``.
+    """
+    n = len(values)
+    positions = (np.arange(n * scale) + 0.5) / scale - 0.5
+    if n == 1:
+        return np.full(scale, values[0])
+    # the positions beyond the first/last cell centers are extrapolated
+    index = np.arange(-1, n + 1)
+    values = np.concatenate([[2 * values[0] - values[1]], values,
+                             [2 * values[-1] - values[-2]]])
+    return np.interp(positions, index, values)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,124 @@ from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.preprocessing._data import _handle_zeros_in_scale
 
 
-class MinMaxScaler(TransformerMixin, BaseEstimator):
+class _ChunkedScalerMixin():
+    """Fitting and transformation of the scalers by chunks along the first
+    (time) axis, for arrays that do not fit in memory (np.memmap or
+    dask-backed xr.DataArray).
+    """
+    @property
+    def nan_mask(self):
+        """Boolean NaN mask of the fitted data. It is built from the compact
+        mask ``nan_mask_``, only present when the data contain NaNs.
+        """
+        nan_mask = getattr(self, 'nan_mask_', None)
+        if nan_mask is None or not nan_mask.any:
+            raise AttributeError("'nan_mask' is not available, no NaNs were fitted")
+        return nan_mask.frames()
+
+    def _fit_chunks(self, X, chunk_size):
+        """Reset the scaler and fit it over the time chunks of X."""
+        self._reset()
+        if self._reduces_time(np.squeeze(X)):
+            chunks = _time_chunks(X, chunk_size)
+        elif chunk_size is None:
+            chunks = [np.squeeze(X)]
+        else:
+            msg = 'Chunked fitting requires `axis` to include the first (time) axis'
+            raise ValueError(msg)
+        for chunk in chunks:
+            self._partial_fit(chunk)
+        return self
+
+    def _check_input(self, X):
+        """Validation of the input and statistics of its NaN mask."""
+        if sparse.issparse(X):
+            raise TypeError(f'{type(self).__name__} does not support sparse input.')
+        if not isinstance(X, (np.ndarray, xr.DataArray)):
+            raise TypeError('`X` is neither a np.ndarray or xr.DataArray')
+        if hasattr(self, 'nan_mask_') and not self._reduces_time(X):
+            msg = ('`partial_fit` can only merge statistics when `axis` includes the '
+                   'first (time) axis')
+            raise ValueError(msg)
+        if not hasattr(self, 'nan_mask_'):
+            self.nan_mask_ = _NanMask()
+        self.nan_mask_.update(X)
+
+    def _reduces_time(self, X):
+        """Whether the statistics are computed along the first axis of X."""
+        axis = _get_axis(X, self.axis)
+        if axis is None or np.ndim(X) == 0:
+            return True
+        axis = (axis,) if np.isscalar(axis) else axis
+        return 0 in [a % np.ndim(X) for a in axis]
+
+    def _apply(self, func, X, chunk_size=None, out=None, start=0):
+        """Apply ``func`` (in place) to the time chunks of X. NumPy arrays
+        (e.g., np.memmap) are written to ``out`` if given, in place if
+        ``copy`` is False and X is a writable float array, and to a new array
+        otherwise. Dask-backed xr.DataArrays are transformed lazily, by blocks.
+        """
+        X = np.squeeze(X)
+        if isinstance(X, xr.DataArray) and X.chunks is not None:
+            dtype = np.result_type(X.dtype, np.float32)
+            def apply_block(block, block_info=None):
+                t0, t1 = block_info[0]['array-location'][0]
+                return func(block.astype(dtype), slice(start + t0, start + t1))
+            return X.copy(data=X.data.map_blocks(apply_block, dtype=dtype))
+
+        data = X.values if isinstance(X, xr.DataArray) else X
+        if not isinstance(data, np.ndarray):
+            raise TypeError('`X` is neither a np.ndarray or xr.DataArray')
+        if out is None:
+            if self.copy or not data.flags.writeable or data.dtype.kind != 'f':
+                out = np.empty(data.shape, dtype=np.result_type(data.dtype, np.float32))
+            else:
+                out = data
+        elif out.shape != data.shape:
+            raise ValueError(f'`out` must have shape {data.shape}, got {out.shape}')
+
+        nan_mask = getattr(self, 'nan_mask_', None)
+        if nan_mask is not None and data.shape == nan_mask.frame_shape:
+            # a single time step (squeezed), processed as a whole
+            chunks = [(slice(None), slice(start, start + 1))]
+        else:
+            n = data.shape[0]
+            chunk_size = n if chunk_size is None else chunk_size
+            chunks = [(slice(i, i + chunk_size), slice(start + i, start + min(i + chunk_size, n)))
+                      for i in range(0, n, chunk_size)]
+        for chunk, time_slice in chunks:
+            block = out[chunk]
+            if out is not data:
+                block[...] = data[chunk]
+            func(block, time_slice)
+
+        if isinstance(X, xr.DataArray):
+            return X.copy(data=out)
+        return out
+
+    def _fill_nans(self, block):
+        """Replace the NaNs of block by ``fillnanto`` (in place)."""
+        np.copyto(block, self.fillnanto, where=np.isnan(block))
+        return block
+
+    def _restore_nans(self, block, time_slice):
+        """Restore the NaNs of the fitted data in block (in place)."""
+        nan_mask = getattr(self, 'nan_mask_', None)
+        if nan_mask is None or not nan_mask.any:
+            return block
+        if block.shape == nan_mask.frame_shape:
+            mask = nan_mask.frames(time_slice.start, time_slice.start + 1)[0]
+        elif block.shape[1:] == nan_mask.frame_shape:
+            mask = nan_mask.frames(time_slice.start, time_slice.stop)
+        else:
+            msg = f'The NaN mask of the fitted data, with time steps of shape '
+            msg += f'{nan_mask.frame_shape}, does not match `X` ({block.shape})'
+            raise ValueError(msg)
+        np.copyto(block, np.nan, where=mask)
+        return block
+
+
+class MinMaxScaler(_ChunkedScalerMixin, TransformerMixin, BaseEstimator):
     """Transform data to a given range.
     This estimator scales and translates the data distribution such
     that it is in the given range on the training set, e.g. between
@@ -38,7 +155,14 @@ class MinMaxScaler(TransformerMixin, BaseEstimator):
     Notes
     -----
     NaNs are disregarded in fit when transforming to the new value range, and 
-    then replaced according to ``fillnanto`` in transform. 
+    then replaced according to ``fillnanto`` in transform. Their positions are
+    kept in a compact mask (``nan_mask_``) for restoring them in
+    inverse_transform.
+
+    Arrays that do not fit in memory (np.memmap or dask-backed xr.DataArray)
+    can be fitted by time chunks, with ``fit(X, chunk_size=...)`` or
+    successive calls to ``partial_fit``, and transformed by time chunks into
+    a (memory-mapped) float32 array, e.g., in place with ``copy=False``.
     """
 
     def __init__(self, value_range=(0, 1), copy=True, axis=None, fillnanto=-1):
@@ -59,8 +183,9 @@ class MinMaxScaler(TransformerMixin, BaseEstimator):
             del self.data_min_
             del self.data_max_
             del self.data_range_
+            del self.nan_mask_
 
-    def fit(self, X, y=None):
+    def fit(self, X, y=None, chunk_size=None):
         """Calculate the minimum and maximum to be used for later scaling.
 
         Parameters
@@ -70,13 +195,15 @@ class MinMaxScaler(TransformerMixin, BaseEstimator):
             scaling along the desired axis.
         y : None
             Ignored.
+        chunk_size : int or None, optional
+            Number of time steps (first axis) loaded at once. If None, the
+            whole array is used (or the chunks of a dask-backed array).
         """
-        # Reset internal state before fitting
-        self._reset()
-        return self.partial_fit(X, y)
+        return self._fit_chunks(X, chunk_size)
 
     def partial_fit(self, X, y=None):
-        """Calculate the min and max on X for later scaling.
+        """Update the min and max with the time steps in X (e.g., a chunk of
+        the data along the first axis) for later scaling.
 
         Parameters
         ----------
@@ -86,27 +213,21 @@ class MinMaxScaler(TransformerMixin, BaseEstimator):
         y : None
             Ignored.
         """
-        X = np.squeeze(X)
+        return self._partial_fit(np.squeeze(X))
+
+    def _partial_fit(self, X):
         value_range = self.value_range
         if value_range[0] >= value_range[1]:
-            raise ValueError("Minimum of desired value_range must be smaller than maximum. Got %s."% str(range))
+            raise ValueError("Minimum of desired value_range must be smaller than maximum. Got %s."% str(value_range))
+        self._check_input(X)
 
-        if sparse.issparse(X):
-            raise TypeError("MinMaxScaler does not support sparse input.")
-        
-        ### creating a nan mask
-        if np.any(np.isnan(X)):
-            self.nan_mask = np.isnan(X)
-
-        ### data type validation
-        if isinstance(X, np.ndarray):
-            data_min = np.nanmin(X, axis=self.axis, keepdims=True)
-            data_max = np.nanmax(X, axis=self.axis, keepdims=True)
-        elif isinstance(X, xr.DataArray):
-            data_min = X.min(dim=self.axis, skipna=True, keepdims=True).values
-            data_max = X.max(dim=self.axis, skipna=True, keepdims=True).values
-        else:
-            raise TypeError('`X` is neither a np.ndarray or xr.DataArray')
+        data = X.data if isinstance(X, xr.DataArray) else X
+        axis = _get_axis(X, self.axis)
+        data_min = np.asarray(np.nanmin(data, axis=axis, keepdims=True))
+        data_max = np.asarray(np.nanmax(data, axis=axis, keepdims=True))
+        if hasattr(self, 'data_min_'):
+            data_min = np.fmin(self.data_min_, data_min)
+            data_max = np.fmax(self.data_max_, data_max)
 
         data_range = data_max - data_min
         self.scale_ = (value_range[1] - value_range[0]) / _handle_zeros_in_scale(
@@ -117,61 +238,57 @@ class MinMaxScaler(TransformerMixin, BaseEstimator):
         self.data_range_ = data_range
         return self
 
-    def transform(self, X):
+    def transform(self, X, chunk_size=None, out=None):
         """Scale X according to range.
 
         Parameters
         ----------
         X : xr.DataArray or np.ndarray
             Input data that will be transformed.
+        chunk_size : int or None, optional
+            Number of time steps (first axis) transformed at once. If None,
+            the whole array is transformed at once.
+        out : np.ndarray or None, optional
+            Array (e.g., a float32 np.memmap) where the result is written.
         """
         check_is_fitted(self)
-        X = np.squeeze(X)
+        return self._apply(self._transform_block, X, chunk_size, out)
 
-        if self.copy:
-            X = X.copy()
-
-        X *= self.scale_
-        X += self.min_
-            
-        ### filling nan values
-        if np.any(np.isnan(X)):
-            if isinstance(X, np.ndarray):
-                X = np.nan_to_num(X, nan=self.fillnanto)
-            elif isinstance(X, xr.DataArray):
-                X = X.fillna(value=self.fillnanto)
-        return X
-
-    def inverse_transform(self, X):
+    def inverse_transform(self, X, chunk_size=None, out=None, start=0):
         """Undo the scaling of X according to range.
 
         Parameters
         ----------
         X : xr.DataArray or np.ndarray
             Input data that will be transformed.
+        chunk_size : int or None, optional
+            Number of time steps (first axis) transformed at once. If None,
+            the whole array is transformed at once.
+        out : np.ndarray or None, optional
+            Array (e.g., a float32 np.memmap) where the result is written.
+        start : int, optional
+            Index of the first time step of X in the fitted data, for
+            restoring the NaNs of a chunk.
         """
         check_is_fitted(self)
-        X = np.squeeze(X)
-
-        if self.copy:
-            X = X.copy()
+        return self._apply(self._inverse_transform_block, X, chunk_size, out, start)
 
-        ### restoring nan mask
-        if hasattr(self, 'nan_mask'):
-            if isinstance(X, np.ndarray):
-                X[self.nan_mask] = np.nan
-            elif isinstance(X, xr.DataArray):
-                X.values[self.nan_mask] = np.nan
+    def _transform_block(self, block, time_slice):
+        block *= _take_time(self.scale_, time_slice, block.ndim)
+        block += _take_time(self.min_, time_slice, block.ndim)
+        return self._fill_nans(block)
 
-        X -= self.min_
-        X /= self.scale_
-        return X
+    def _inverse_transform_block(self, block, time_slice):
+        self._restore_nans(block, time_slice)
+        block -= _take_time(self.min_, time_slice, block.ndim)
+        block /= _take_time(self.scale_, time_slice, block.ndim)
+        return block
 
     def _more_tags(self):
         return {"allow_nan": True}
 
 
-class StandardScaler(TransformerMixin, BaseEstimator):
+class StandardScaler(_ChunkedScalerMixin, TransformerMixin, BaseEstimator):
     """Standardize features by removing the mean and scaling to unit variance.
     
     The standard score of a sample `x` is calculated as:
@@ -208,7 +325,15 @@ class StandardScaler(TransformerMixin, BaseEstimator):
     Notes
     -----
     NaNs are disregarded in fit when transforming to the new value range, and 
-    then replaced according to ``fillnanto`` in transform. 
+    then replaced according to ``fillnanto`` in transform. Their positions are
+    kept in a compact mask (``nan_mask_``) for restoring them in
+    inverse_transform.
+
+    The mean and variance are updated incrementally in ``partial_fit`` (with
+    the pairwise algorithm of Chan et al.), so arrays that do not fit in
+    memory can be fitted by time chunks, with ``fit(X, chunk_size=...)`` or
+    successive calls to ``partial_fit``, and transformed by time chunks into
+    a (memory-mapped) float32 array, e.g., in place with ``copy=False``.
     """
 
     def __init__(self, copy=True, with_mean=True, with_std=True, axis=None,
@@ -227,9 +352,12 @@ class StandardScaler(TransformerMixin, BaseEstimator):
         # in partial_fit
         if hasattr(self, "mean_"):
             del self.mean_
+            del self.var_
             del self.std_
+            del self.n_samples_seen_
+            del self.nan_mask_
 
-    def fit(self, X, y=None):
+    def fit(self, X, y=None, chunk_size=None):
         """Calculate the mean and standard deviation of X for later scaling.
 
         Parameters
@@ -239,13 +367,15 @@ class StandardScaler(TransformerMixin, BaseEstimator):
             used for later scaling along the features axis.
         y : None
             Ignored.
+        chunk_size : int or None, optional
+            Number of time steps (first axis) loaded at once. If None, the
+            whole array is used (or the chunks of a dask-backed array).
         """
-        # Reset internal state before fitting
-        self._reset()
-        return self.partial_fit(X, y)
+        return self._fit_chunks(X, chunk_size)
 
     def partial_fit(self, X, y=None):
-        """Calculate the mean and standard deviation of X for later scaling.
+        """Update the mean and standard deviation with the time steps in X
+        (e.g., a chunk of the data along the first axis) for later scaling.
 
         Parameters
         ----------
@@ -255,84 +385,192 @@ class StandardScaler(TransformerMixin, BaseEstimator):
         y : None
             Ignored.
         """
-        X = np.squeeze(X)
-        ### creating a nan mask
-        if np.any(np.isnan(X)):
-            self.nan_mask = np.isnan(X)
-
-        ### data type validation
-        if isinstance(X, np.ndarray):
-            if self.with_mean:
-                data_mean = np.nanmean(X, axis=self.axis, keepdims=True)
-            if self.with_std:
-                data_std = np.nanstd(X, axis=self.axis, keepdims=True)
-        elif isinstance(X, xr.DataArray):
-            if self.with_mean:
-                data_mean = X.mean(dim=self.axis, skipna=True, keepdims=True).values
-            if self.with_std:
-                data_std = X.std(dim=self.axis, skipna=True, keepdims=True).values
-        else:
-            raise TypeError('`X` is neither a np.ndarray or xr.DataArray')
-
-        if self.with_mean:
-            self.mean_ = data_mean
-        if self.with_std:
-            self.std_ = data_std
+        return self._partial_fit(np.squeeze(X))
+
+    def _partial_fit(self, X):
+        self._check_input(X)
+
+        data = X.data if isinstance(X, xr.DataArray) else X
+        axis = _get_axis(X, self.axis)
+        count = np.asarray(np.sum(~np.isnan(data), axis=axis, keepdims=True))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.asarray(np.nansum(data, axis=axis, keepdims=True,
+                                        dtype=np.float64)) / count
+            m2 = np.asarray(np.nansum((data - mean) ** 2, axis=axis, keepdims=True))
+
+            # merging with the statistics of the previous chunks
+            if hasattr(self, 'n_samples_seen_'):
+                count_a, mean_a = self.n_samples_seen_, self.mean_
+                m2_a = self.var_ * count_a
+                total = count_a + count
+                delta = mean - mean_a
+                merged_mean = mean_a + delta * count / total
+                merged_m2 = m2_a + m2 + delta ** 2 * count_a * count / total
+                mean = np.where(count == 0, mean_a, np.where(count_a == 0, mean, merged_mean))
+                m2 = np.where(count == 0, m2_a, np.where(count_a == 0, m2, merged_m2))
+                count = total
+            var = m2 / count
+
+        self.n_samples_seen_ = count
+        self.mean_ = mean
+        self.var_ = var
+        self.std_ = np.sqrt(var)
         return self
 
-    def transform(self, X):
+    def transform(self, X, chunk_size=None, out=None):
         """ Perform standardization by centering and scaling.
 
         Parameters
         ----------
         X : xr.DataArray or np.ndarray
             The data used to scale along the desired axis.
+        chunk_size : int or None, optional
+            Number of time steps (first axis) transformed at once. If None,
+            the whole array is transformed at once.
+        out : np.ndarray or None, optional
+            Array (e.g., a float32 np.memmap) where the result is written.
         """
         check_is_fitted(self)
-        X = np.squeeze(X)
+        return self._apply(self._transform_block, X, chunk_size, out)
 
-        if self.copy:
-            X = X.copy()
-
-        if self.with_std:
-            X -= self.mean_
-        if self.with_std:
-            X /= self.std_
-            
-        ### filling nan values
-        if np.any(np.isnan(X)):
-            if isinstance(X, np.ndarray):
-                X = np.nan_to_num(X, nan=self.fillnanto)
-            elif isinstance(X, xr.DataArray):
-                X = X.fillna(value=self.fillnanto)
-        return X
-
-    def inverse_transform(self, X):
+    def inverse_transform(self, X, chunk_size=None, out=None, start=0):
         """Scale back the data to the original representation.
 
         Parameters
         ----------
         X : xr.DataArray or np.ndarray
             The data used to scale along the desired axis.
+        chunk_size : int or None, optional
+            Number of time steps (first axis) transformed at once. If None,
+            the whole array is transformed at once.
+        out : np.ndarray or None, optional
+            Array (e.g., a float32 np.memmap) where the result is written.
+        start : int, optional
+            Index of the first time step of X in the fitted data, for
+            restoring the NaNs of a chunk.
         """
         check_is_fitted(self)
-        X = np.squeeze(X)
-
-        if self.copy:
-            X = X.copy()
+        return self._apply(self._inverse_transform_block, X, chunk_size, out, start)
 
-        ### restoring nan mask
-        if hasattr(self, 'nan_mask'):
-            if isinstance(X, np.ndarray):
-                X[self.nan_mask] = np.nan
-            elif isinstance(X, xr.DataArray):
-                X.values[self.nan_mask] = np.nan
+    def _transform_block(self, block, time_slice):
+        if self.with_mean:
+            block -= _take_time(self.mean_, time_slice, block.ndim)
+        if self.with_std:
+            block /= _take_time(self.std_, time_slice, block.ndim)
+        return self._fill_nans(block)
 
+    def _inverse_transform_block(self, block, time_slice):
+        self._restore_nans(block, time_slice)
         if self.with_std:
-            X *= self.std_
+            block *= _take_time(self.std_, time_slice, block.ndim)
         if self.with_mean:
-            X += self.mean_
-        return X
+            block += _take_time(self.mean_, time_slice, block.ndim)
+        return block
 
     def _more_tags(self):
-        return {"allow_nan": True}
\ No newline at end of file
+        return {"allow_nan": True}
+
+
+class _NanMask():
+    """
+    Compact NaN mask of an array, accumulated over chunks along its first
+    (time) axis. Only the mask of one time step is kept while the NaNs are
+    the same in all the time steps (e.g., a land-sea mask), otherwise the masks
+    of the time steps are bit-packed.
+    """
+    def __init__(self):
+        self.frame_shape = None
+        self.n_frames = 0
+        self.static = None
+        self.packed = None
+
+    @property
+    def any(self):
+        """Whether the mask contains any NaN."""
+        return self.packed is not None or bool(self.static.any())
+
+    @property
+    def shape(self):
+        return (self.n_frames,) + self.frame_shape
+
+    def update(self, X):
+        """Append the NaN mask of the time steps of X."""
+        mask = np.isnan(np.asarray(X))
+        mask = mask.reshape((-1,) + mask.shape[1:])
+        if self.frame_shape is None:
+            self.frame_shape = mask.shape[1:]
+            self.static = mask[0].copy()
+        elif mask.shape[1:] != self.frame_shape:
+            msg = f'Expected time steps of shape {self.frame_shape}, got {mask.shape[1:]}'
+            raise ValueError(msg)
+
+        if self.packed is None:
+            if (mask == self.static).all():
+                self.n_frames += mask.shape[0]
+                return
+            self.packed = np.repeat(self._pack(self.static[np.newaxis]),
+                                    self.n_frames, axis=0)
+        self.packed = np.concatenate([self.packed, self._pack(mask)])
+        self.n_frames += mask.shape[0]
+
+    def frames(self, start=0, stop=None):
+        """Boolean mask of the time steps from ``start`` to ``stop``."""
+        stop = self.n_frames if stop is None else stop
+        if self.packed is None:
+            return np.broadcast_to(self.static, (stop - start,) + self.frame_shape)
+        if stop > self.n_frames:
+            msg = f'The NaN mask contains {self.n_frames} time steps, '
+            msg += f'requested up to {stop}'
+            raise ValueError(msg)
+        frame_size = int(np.prod(self.frame_shape))
+        mask = np.unpackbits(self.packed[start: stop], axis=1, count=frame_size)
+        return mask.astype(bool).reshape((-1,) + self.frame_shape)
+
+    def _pack(self, mask):
+        return np.packbits(mask.reshape(mask.shape[0], -1), axis=1)
+
+
+def _time_chunks(X, chunk_size=None):
+    """Chunks of X along its first (time) axis, squeezed like the whole X. If
+    ``chunk_size`` is None, X is returned whole, or by chunks if it is a
+    dask-backed xr.DataArray.
+    """
+    shape = np.shape(X)
+    if len(shape) == 0 or shape[0] == 1:
+        yield np.squeeze(X)
+        return
+    X = np.squeeze(X, axis=tuple(i for i, s in enumerate(shape) if s == 1))
+
+    if chunk_size is not None:
+        bounds = list(range(0, shape[0], chunk_size)) + [shape[0]]
+    elif isinstance(X, xr.DataArray) and X.chunks is not None:
+        bounds = [0] + list(np.cumsum(X.chunks[0]))
+    else:
+        yield X
+        return
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        yield X[start: stop]
+
+
+def _get_axis(X, axis):
+    """Axis or axes (int) of X, given as int or dimension names for
+    xr.DataArray.
+    """
+    if isinstance(X, xr.DataArray):
+        if isinstance(axis, str):
+            return X.get_axis_num(axis)
+        elif isinstance(axis, (tuple, list)):
+            return tuple(X.get_axis_num(a) if isinstance(a, str) else a for a in axis)
+    return axis
+
+
+def _take_time(stat, time_slice, ndim):
+    """Statistic for the time steps in ``time_slice`` (if it has a time
+    dimension, when the first axis is not reduced), for a block with ``ndim``
+    dimensions (one less for a single time step).
+    """
+    if np.ndim(stat) > 0 and stat.shape[0] > 1:
+        stat = stat[time_slice]
+    if np.ndim(stat) > ndim:
+        stat = stat[0]
+    return stat
@@ -0,0 +1,461 @@
+"""
+Profiling of the training and inference hot paths: hierarchical named timers
+and counters, and capture of TensorFlow profiler traces
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import threading
+import numpy as np
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+    has_resource = True
+except ImportError:
+    has_resource = False
+
+
+class Profiler():
+    """
+    Hierarchical named timers and counters for the hot paths of the trainers
+    and ``dl4ds.predict``: data wait, batch assembly (reading the data sources
+    and resizing), host-to-device transfer, step compute, checkpointing and
+    metrics.
+
+    Timers nest: a timer started inside another one is recorded under the
+    path of its parents (e.g., 'data_wait/batch_assembly/resize'). Each thread
+    keeps its own stack of timers, so the batches assembled in background
+    threads are recorded at the top level ('batch_assembly/...'). While the
+    profiler is active (between ``start`` and ``stop``, or within a ``with``
+    block), the timers placed in the dl4ds data pipeline are recorded as well.
+
+    Examples
+    --------
+    >>> profiler = dl4ds.Profiler(trace_steps=(10, 15))
+    >>> trainer = dl4ds.SupervisedTrainer(..., profile=profiler)
+    >>> trainer.run()
+    >>> profiler.summary()
+    """
+    def __init__(self, trace_steps=None, trace_dir='./profiler_trace'):
+        """
+        Parameters
+        ----------
+        trace_steps : tuple of int or None, optional
+            Range of steps (start, stop), with stop excluded, for which a
+            TensorFlow profiler trace is captured (see ``tf.profiler``) into
+            ``trace_dir``. The trace can be inspected with the profile plugin
+            of TensorBoard.
+        trace_dir : str, optional
+            Directory where the TensorFlow profiler trace is written.
+        """
+        if trace_steps is not None:
+            if len(trace_steps) != 2 or not 0 <= trace_steps[0] < trace_steps[1]:
+                msg = '`trace_steps` must be a tuple (start, stop) with 0 <= start < stop'
+                raise ValueError(msg)
+        self.trace_steps = trace_steps
+        self.trace_dir = trace_dir
+        self.timers = dict()
+        self.counters = dict()
+        self.n_steps = 0
+        self.wall_time = 0.
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._tracing = False
+        self._start_time = None
+        self._previous = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Activate the profiler (the timers of the dl4ds data pipeline are
+        recorded in it).
+        """
+        global _ACTIVE_PROFILER
+        if _ACTIVE_PROFILER is not self:
+            self._previous = _ACTIVE_PROFILER
+            _ACTIVE_PROFILER = self
+        self._start_time = time.perf_counter()
+
+    def stop(self):
+        """Deactivate the profiler and stop the profiler trace if running.
+        """
+        global _ACTIVE_PROFILER
+        self._stop_trace()
+        if self._start_time is not None:
+            self.wall_time += time.perf_counter() - self._start_time
+            self._start_time = None
+        if _ACTIVE_PROFILER is self:
+            _ACTIVE_PROFILER = self._previous
+            self._previous = None
+
+    @contextmanager
+    def timer(self, name):
+        """Context manager timing its block as ``name``, under the path of the
+        timers running in the current thread.
+        """
+        stack = self._stack()
+        stack.append(name)
+        path = '/'.join(stack)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            self._record(path, elapsed)
+
+    def record(self, name, elapsed):
+        """Record ``elapsed`` seconds for the timer ``name`` (under the path of
+        the timers running in the current thread).
+        """
+        self._record('/'.join(self._stack() + [name]), elapsed)
+
+    def count(self, name, value=1):
+        """Increase the counter ``name`` by ``value``.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def sync(self, tensors):
+        """Wait for the computation of ``tensors`` (asynchronous on GPUs), so
+        that it is attributed to the running timer.
+        """
+        import tensorflow as tf
+        for tensor in tf.nest.flatten(tensors):
+            if isinstance(tensor, tf.Tensor):
+                tensor.numpy()
+
+    def begin_step(self):
+        """Mark the beginning of a step, starting the profiler trace at the
+        first step of ``trace_steps``.
+        """
+        import tensorflow as tf
+        if self.trace_steps is not None and self.n_steps == self.trace_steps[0]:
+            tf.profiler.experimental.start(self.trace_dir)
+            self._tracing = True
+
+    def end_step(self):
+        """Mark the end of a step, stopping the profiler trace after the last
+        step of ``trace_steps``.
+        """
+        self.n_steps += 1
+        if self._tracing and self.n_steps >= self.trace_steps[1]:
+            self._stop_trace()
+
+    @contextmanager
+    def step(self, name='step'):
+        """Context manager for a step, timed as ``name``. The steps are
+        annotated in the profiler trace.
+        """
+        import tensorflow as tf
+        self.begin_step()
+        if self._tracing:
+            annotation = tf.profiler.experimental.Trace(name, step_num=self.n_steps, _r=1)
+        else:
+            annotation = nullcontext()
+        try:
+            with annotation, self.timer(name):
+                yield
+        finally:
+            self.end_step()
+
+    def report(self):
+        """Report of the timers (number of calls, total, mean, min and max
+        time in seconds, and percentage of the wall time) and counters.
+
+        Returns
+        -------
+        report : dict
+        """
+        wall_time = self.wall_time
+        if self._start_time is not None:
+            wall_time += time.perf_counter() - self._start_time
+        with self._lock:
+            timers = [dict(name=name, count=n, total_s=total, mean_s=total / n,
+                           min_s=tmin, max_s=tmax,
+                           percent=100 * total / wall_time if wall_time > 0 else np.nan)
+                      for name, (n, total, tmin, tmax) in sorted(self.timers.items())]
+            counters = dict(sorted(self.counters.items()))
+        return dict(wall_time_s=wall_time, n_steps=self.n_steps, timers=timers,
+                    counters=counters)
+
+    def save(self, path):
+        """Save the report as JSON (``path``.json) and CSV (``path``.csv).
+
+        Parameters
+        ----------
+        path : str
+            Path of the report files, without extension.
+        """
+        report = self.report()
+        with open(path + '.json', 'w') as f:
+            json.dump(report, f, indent=2)
+        columns = ['name', 'count', 'total_s', 'mean_s', 'min_s', 'max_s', 'percent']
+        with open(path + '.csv', 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['kind'] + columns)
+            writer.writeheader()
+            for row in report['timers']:
+                writer.writerow(dict(kind='timer', **row))
+            for name, value in report['counters'].items():
+                writer.writerow(dict(kind='counter', name=name, count=value))
+
+    def summary(self):
+        """Print the timers (indented by nesting level) and counters.
+        """
+        report = self.report()
+        sep = '-' * 80
+        print(sep)
+        print(f"Profile: {report['wall_time_s']:.2f}s wall time, {report['n_steps']} steps")
+        print(sep)
+        print(f"{'timer':<36}{'count':>8}{'total [s]':>12}{'mean [ms]':>12}{'% wall':>10}")
+        for row in report['timers']:
+            *parents, name = row['name'].split('/')
+            name = '  ' * len(parents) + name
+            print(f"{name:<36}{row['count']:>8}{row['total_s']:>12.3f}"
+                  f"{1e3 * row['mean_s']:>12.3f}{row['percent']:>10.1f}")
+        for name, value in report['counters'].items():
+            print(f"{name:<36}{value:>8}")
+        print(sep)
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _record(self, path, elapsed):
+        with self._lock:
+            n, total, tmin, tmax = self.timers.get(path, (0, 0., np.inf, 0.))
+            self.timers[path] = (n + 1, total + elapsed, min(tmin, elapsed),
+                                 max(tmax, elapsed))
+
+    def _stop_trace(self):
+        if self._tracing:
+            import tensorflow as tf
+            tf.profiler.experimental.stop()
+            self._tracing = False
+
+
+class ThroughputMonitor():
+    """
+    Per-epoch throughput of a training loop: samples and steps per second, 
+    fraction of the step time spent waiting for the input pipeline, and 
+    high-water marks of the GPU and host memory. The statistics of every epoch
+    are kept in ``history`` and appended to a CSV file if ``log_path`` is given.
+
+    Examples
+    --------
+    >>> monitor = ThroughputMonitor(batch_size=32, log_path='throughput.csv')
+    >>> monitor.begin_epoch()
+    >>> monitor.add_step(step_time, wait_time)
+    >>> stats = monitor.end_epoch(epoch)
+    """
+    columns = ['epoch', 'steps', 'samples', 'time_s', 'samples_per_sec', 
+               'steps_per_sec', 'step_time_ms', 'input_wait_s', 'input_wait', 
+               'gpu_peak_mb', 'host_peak_mb']
+    # metrics shown in the progress bars, values for the epoch so far
+    progbar_metrics = ['samples_per_sec', 'input_wait', 'gpu_peak_mb', 'host_peak_mb']
+
+    def __init__(self, batch_size, n_workers=1, log_path=None):
+        """
+        Parameters
+        ----------
+        batch_size : int
+            Number of samples per step (in each worker).
+        n_workers : int, optional
+            Number of workers (e.g., Horovod processes) training in parallel on
+            batches of ``batch_size`` samples, for the global samples per second.
+        log_path : str or None, optional
+            Path of the CSV file where the statistics of every epoch are 
+            appended. 
+        """
+        self.batch_size = batch_size
+        self.n_workers = n_workers
+        self.log_path = log_path
+        self.history = []
+        self.gpu = _gpu_device()
+        self._epoch_start = None
+        self._steps = 0
+        self._step_time = 0.
+        self._wait_time = 0.
+        self._wait_measured = True
+        if self.log_path is not None and os.path.exists(self.log_path):
+            os.remove(self.log_path)
+
+    def begin_epoch(self):
+        """Reset the statistics (and the GPU memory peak) at the beginning of 
+        an epoch.
+        """
+        self._epoch_start = time.perf_counter()
+        self._steps = 0
+        self._step_time = 0.
+        self._wait_time = 0.
+        self._wait_measured = True
+        if self.gpu is not None:
+            import tensorflow as tf
+            tf.config.experimental.reset_memory_stats(self.gpu)
+
+    def add_step(self, step_time, wait_time=None):
+        """Record a step lasting ``step_time`` seconds, of which ``wait_time`` 
+        were spent waiting for the batch. If ``wait_time`` is None (not 
+        measured), the input wait of the epoch is reported as not available.
+        """
+        self._steps += 1
+        self._step_time += step_time
+        if wait_time is None:
+            self._wait_measured = False
+        else:
+            self._wait_time += min(wait_time, step_time)
+
+    def step_logs(self):
+        """Statistics of the epoch so far, for the progress bars.
+
+        Returns
+        -------
+        logs : dict
+        """
+        elapsed = time.perf_counter() - self._epoch_start
+        logs = dict(samples_per_sec=self._steps * self.batch_size * self.n_workers / elapsed)
+        if self._wait_measured:
+            logs['input_wait'] = self._wait_time / self._step_time if self._step_time > 0 else 0.
+        gpu_peak = _gpu_memory_peak(self.gpu)
+        if gpu_peak is not None:
+            logs['gpu_peak_mb'] = gpu_peak
+        host_peak = _host_memory_peak()
+        if host_peak is not None:
+            logs['host_peak_mb'] = host_peak
+        return logs
+
+    def end_epoch(self, epoch):
+        """Statistics of the epoch, appended to ``history`` and to the CSV log.
+
+        Parameters
+        ----------
+        epoch : int
+            Epoch number.
+
+        Returns
+        -------
+        stats : dict
+            Number of steps and samples, time in seconds, samples and steps 
+            per second, mean step time in milliseconds, time waiting for the 
+            input pipeline in seconds and as a fraction of the step time (NaN 
+            when not measured), and peak GPU and host memory in MiB (None when
+            not available).
+        """
+        elapsed = time.perf_counter() - self._epoch_start
+        samples = self._steps * self.batch_size * self.n_workers
+        stats = dict(
+            epoch=epoch, 
+            steps=self._steps, 
+            samples=samples, 
+            time_s=elapsed,
+            samples_per_sec=samples / elapsed, 
+            steps_per_sec=self._steps / elapsed,
+            step_time_ms=1e3 * self._step_time / self._steps if self._steps > 0 else np.nan,
+            input_wait_s=self._wait_time if self._wait_measured else np.nan,
+            input_wait=(self._wait_time / self._step_time 
+                        if self._step_time > 0 and self._wait_measured else np.nan),
+            gpu_peak_mb=_gpu_memory_peak(self.gpu),
+            host_peak_mb=_host_memory_peak())
+        self.history.append(stats)
+        if self.log_path is not None:
+            write_header = not os.path.exists(self.log_path)
+            with open(self.log_path, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=self.columns)
+                if write_header:
+                    writer.writeheader()
+                writer.writerow(stats)
+        return stats
+
+    def summary(self, stats):
+        """One-line summary of the statistics of an epoch (see ``end_epoch``).
+        """
+        msg = f"{stats['samples_per_sec']:.1f} samples/s, {stats['steps_per_sec']:.2f} steps/s, "
+        if np.isnan(stats['input_wait']):
+            msg += "input wait not measured"
+        else:
+            msg += f"waiting for data {100 * stats['input_wait']:.1f}% of the step time"
+        if stats['gpu_peak_mb'] is not None:
+            msg += f", GPU memory peak {stats['gpu_peak_mb']:.0f} MiB"
+        if stats['host_peak_mb'] is not None:
+            msg += f", host memory peak {stats['host_peak_mb']:.0f} MiB"
+        return msg
+
+
+def _timer(name):
+    """Timer ``name`` of the active profiler, or a no-op context manager.
+    """
+    profiler = _ACTIVE_PROFILER
+    if profiler is None:
+        return _NULL_CONTEXT
+    return profiler.timer(name)
+
+
+def _step(name):
+    """Step ``name`` of the active profiler (see ``Profiler.step``), or a no-op
+    context manager.
+    """
+    profiler = _ACTIVE_PROFILER
+    if profiler is None:
+        return _NULL_CONTEXT
+    return profiler.step(name)
+
+
+def _sync(tensors):
+    """Wait for ``tensors`` if a profiler is active (see ``Profiler.sync``).
+    """
+    profiler = _ACTIVE_PROFILER
+    if profiler is not None:
+        profiler.sync(tensors)
+
+
+def _count(name, value=1):
+    """Increase the counter ``name`` of the active profiler, if any.
+    """
+    profiler = _ACTIVE_PROFILER
+    if profiler is not None:
+        profiler.count(name, value)
+
+
+def _gpu_device():
+    """Name of the first GPU (e.g., 'GPU:0'), or None.
+    """
+    import tensorflow as tf
+    gpus = tf.config.list_logical_devices('GPU')
+    if not gpus:
+        return None
+    return gpus[0].name.replace('/device:', '')
+
+
+def _gpu_memory_peak(device):
+    """Peak memory allocated by TensorFlow on ``device`` in MiB, or None.
+    """
+    if device is None:
+        return None
+    import tensorflow as tf
+    return tf.config.experimental.get_memory_info(device)['peak'] / 2**20
+
+
+def _host_memory_peak():
+    """High-water mark of the resident memory of the process in MiB, or None.
+    """
+    if not has_resource:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    if sys.platform == 'darwin':
+        return maxrss / 2**20
+    return maxrss / 2**10
+
+
+_ACTIVE_PROFILER = None
+_NULL_CONTEXT = nullcontext()
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from dl4ds.benchmarks import (compare_results, load_results, measure, 
+                              run_benchmarks, save_results)
+
+
+def test_measure():
+    calls = []
+    res = measure(lambda: calls.append(np.ones(1000)), repeat=3, warmup=2)
+    # warmup, timed calls and the traced call
+    assert len(calls) == 6
+    assert len(res['times']) == 3
+    assert res['min'] <= res['median'] <= max(res['times'])
+    assert res['peak_traced_mb'] > 0 and res['peak_rss_mb'] > 0
+    assert measure(lambda: None, repeat=1, memory=False)['peak_traced_mb'] is None
+
+
+def test_run_save_and_compare(tmp_path):
+    results = run_benchmarks(['resize'], repeat=1, warmup=0, memory=False, 
+                             pattern='bilinear', verbose=False)
+    names = [res['name'] for res in results['results']]
+    assert names == ['resize.resize_array[bilinear-down]', 
+                     'resize.resize_array[bilinear-up]']
+    assert results['metadata']['size'] == 'small'
+    path = str(tmp_path / 'results.json')
+    save_results(results, path)
+    assert load_results(path) == results
+
+    slower = load_results(path)
+    slower['results'][0]['median'] *= 2
+    slower['results'][1]['median'] /= 2
+    comparison = compare_results(path, slower, verbose=False)
+    assert [c['status'] for c in comparison] == ['regression', 'improvement']
+    assert compare_results(results, results, verbose=False)[0]['status'] == 'unchanged'
+    other_size = load_results(path)
+    other_size['metadata']['size'] = 'large'
+    with pytest.raises(ValueError):
+        compare_results(results, other_size)
+
+
+@pytest.mark.parametrize('kwargs', [dict(suites=['unknown']), dict(size='huge')])
+def test_run_benchmarks_checks_arguments(kwargs):
+    with pytest.raises(ValueError):
+        run_benchmarks(**kwargs)
+
+
+def test_rc_model_on_square_grids():
+    # the LR size of square grids is unknown when building the model
+    from dl4ds.models import net_postupsampling
+    model = net_postupsampling('resnet', 'rc', 2, n_channels=1, n_aux_channels=0,
+                               lr_size=(8, 8), n_filters=4, n_blocks=1)
+    out = model.predict_on_batch(np.zeros((1, 8, 8, 1), 'float32'))
+    assert out.shape == (1, 16, 16, 1)
+
+
+def test_import_suite():
+    from dl4ds.benchmarks.suites import import_suite
+    cases = list(import_suite({}, np.random.default_rng(0)))
+    assert [name for name, _, _ in cases][0] == 'import[dl4ds]'
+    # each import runs in a fresh interpreter and loads no heavy dependency
+    for name, params, func in cases:
+        assert 'tensorflow' in params['forbidden']
+        func()
+
+
+def test_check_import_detects_loaded_modules():
+    from dl4ds.benchmarks.suites import _check_import
+    _check_import('import json', ['fractions'])
+    with pytest.raises(RuntimeError, match='fractions'):
+        _check_import('import fractions', ['fractions', 'tensorflow'])
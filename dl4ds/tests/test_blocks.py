@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from dl4ds.models.blocks import InterpolationUpsampling, RepeatBatch
+from dl4ds.utils import resize_array
+
+
+@pytest.fixture(scope='module')
+def array():
+    return np.random.default_rng(0).normal(size=(2, 12, 10, 3)).astype('float32')
+
+
+@pytest.mark.parametrize('interpolation', ['inter_area', 'bilinear', 'nearest'])
+@pytest.mark.parametrize('scale', [2, 3, 4])
+def test_interpolation_upsampling_matches_resize_array(array, interpolation, scale):
+    out = InterpolationUpsampling(scale, interpolation)(array).numpy()
+    expected = resize_array(array, (10 * scale, 12 * scale), interpolation, 
+                            squeezed=False)
+    np.testing.assert_allclose(out, expected, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('interpolation', ['bicubic', 'lanczos'])
+def test_interpolation_upsampling_kernels_differ_from_opencv(array, interpolation):
+    # documented difference between the TF and OpenCV kernels, small compared
+    # to the interpolated values
+    out = InterpolationUpsampling(2, interpolation)(array).numpy()
+    expected = resize_array(array, (20, 24), interpolation, squeezed=False)
+    assert out.shape == expected.shape
+    assert not np.allclose(out, expected, atol=1e-5)
+    assert np.abs(out - expected).mean() < 0.25 * np.abs(expected).mean()
+
+
+def test_interpolation_upsampling_spatiotemporal(array):
+    windows = np.stack([array, array[::-1]], axis=1)
+    out = InterpolationUpsampling(2)(windows).numpy()
+    assert out.shape == (2, 2, 24, 20, 3)
+    np.testing.assert_array_equal(out[:, 1], out[::-1, 0])
+
+
+def test_interpolation_upsampling_unknown_method():
+    with pytest.raises(ValueError):
+        InterpolationUpsampling(2, 'cubic')
+
+
+def test_repeat_batch():
+    t1 = tf.random.normal((2, 3, 4, 5))
+    t2 = tf.zeros((6, 3, 4, 1))
+    repeated = RepeatBatch()([t1, t2])
+    np.testing.assert_array_equal(repeated, tf.tile(t1, [3, 1, 1, 1]))
+    # same batch size, unchanged
+    np.testing.assert_array_equal(RepeatBatch()([t1, t2[:2]]), t1)
@@ -0,0 +1,191 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from dl4ds.models import net_postupsampling, residual_discriminator
+from dl4ds.training.cgan import (_tensor_spec, discriminator_loss,
+                                 generator_loss, make_train_step, train_step)
+from dl4ds.utils import precision_policy
+
+
+SCALE = 2
+
+
+def _models(precision='float32', seed=0, n_aux_channels=0, dropout=True):
+    tf.keras.utils.set_random_seed(seed)
+    with precision_policy(precision):
+        generator = net_postupsampling('resnet', 'spc', SCALE, n_channels=1,
+                                       n_aux_channels=n_aux_channels, lr_size=(6, 8),
+                                       n_filters=4, n_blocks=1)
+        discriminator = residual_discriminator(1, 'spc', False, SCALE, (6, 8),
+                                               n_filters=4, n_res_blocks=1)
+    if not dropout:
+        # the (random) dropout of the discriminator is disabled for comparisons
+        for layer in discriminator.layers:
+            if isinstance(layer, tf.keras.layers.Dropout):
+                layer.rate = 0.
+    return generator, discriminator
+
+
+def _optimizers(mixed=False):
+    optimizers = [tf.keras.optimizers.Adam(1e-3), tf.keras.optimizers.Adam(1e-3)]
+    if mixed:
+        optimizers = [tf.keras.mixed_precision.LossScaleOptimizer(opt)
+                      for opt in optimizers]
+    return optimizers
+
+
+@pytest.fixture(scope='module')
+def batch():
+    rng = np.random.default_rng(0)
+    hr = rng.normal(size=(3, 12, 16, 1)).astype('float32')
+    lr = hr.reshape(3, 6, 2, 8, 2, 1).mean(axis=(2, 4))
+    return lr, hr
+
+
+def _step_kwargs(generator, discriminator, optimizers):
+    return dict(generator=generator, discriminator=discriminator,
+                generator_optimizer=optimizers[0],
+                discriminator_optimizer=optimizers[1], epoch=None,
+                gen_pxloss_function=tf.keras.losses.MeanAbsoluteError(),
+                summary_writer=None, first_batch=False)
+
+
+def test_mixed_precision_train_step(batch):
+    lr, hr = batch
+    generator, discriminator = _models('mixed_float16')
+    optimizers = _optimizers(mixed=True)
+    weights = [w.copy() for w in generator.get_weights()]
+    # the steps with non-finite scaled gradients are skipped (lowering the
+    # loss scale), the following ones update the weights
+    for _ in range(2):
+        losses = train_step(lr, hr, **_step_kwargs(generator, discriminator,
+                                                   optimizers))
+        assert all(loss.dtype == tf.float32 and np.isfinite(loss.numpy())
+                   for loss in losses)
+    assert any(not np.array_equal(a, b) for a, b in zip(weights, generator.get_weights()))
+
+
+def _assert_same_weights(model1, model2, atol=1e-5):
+    for w1, w2 in zip(model1.get_weights(), model2.get_weights()):
+        np.testing.assert_allclose(w1, w2, rtol=1e-4, atol=atol)
+
+
+@pytest.mark.parametrize('n_aux_channels', [0, 1])
+@pytest.mark.parametrize('jit_compile', [False, True])
+def test_compiled_train_step_matches_eager(batch, n_aux_channels, jit_compile):
+    lr, hr = batch
+    arrays = [lr, hr]
+    if n_aux_channels > 0:
+        arrays.append(np.random.default_rng(1).normal(size=hr.shape).astype('float32'))
+    gen_eager, disc_eager = _models(n_aux_channels=n_aux_channels,
+                                     dropout=False)
+    gen_graph, disc_graph = _models(n_aux_channels=n_aux_channels,
+                                     dropout=False)
+    optimizers_eager = _optimizers()
+    optimizers_graph = _optimizers()
+    compiled_train_step = make_train_step(
+        gen_graph, disc_graph, *optimizers_graph,
+        gen_pxloss_function=tf.keras.losses.MeanAbsoluteError(),
+        input_signature=[_tensor_spec(array) for array in arrays],
+        jit_compile=jit_compile)
+
+    for _ in range(2):
+        static_array = arrays[2] if n_aux_channels > 0 else None
+        losses_eager = train_step(lr, hr, static_array=static_array,
+                                  **_step_kwargs(gen_eager, disc_eager,
+                                                 optimizers_eager))
+        losses_graph = compiled_train_step(*arrays)
+        np.testing.assert_allclose([loss.numpy() for loss in losses_graph],
+                                   [loss.numpy() for loss in losses_eager],
+                                   rtol=1e-4)
+    _assert_same_weights(gen_graph, gen_eager)
+    _assert_same_weights(disc_graph, disc_eager)
+
+
+def test_compiled_train_step_not_retraced(batch):
+    lr, hr = batch
+    generator, discriminator = _models()
+    compiled_train_step = make_train_step(
+        generator, discriminator, *_optimizers(),
+        gen_pxloss_function=tf.keras.losses.MeanAbsoluteError(),
+        input_signature=[_tensor_spec(lr), _tensor_spec(hr)])
+    # the first call may trace twice, as the optimizer variables are created
+    compiled_train_step(lr, hr)
+    n_traces = compiled_train_step.experimental_get_tracing_count()
+    # batches of different sizes (e.g., the last one of an epoch)
+    compiled_train_step(lr[:2], hr[:2])
+    compiled_train_step(lr[:1], hr[:1])
+    assert compiled_train_step.experimental_get_tracing_count() == n_traces
+
+
+def test_tensor_spec_unknown_batch_size(batch):
+    lr, _ = batch
+    spec = _tensor_spec(lr.astype('float16'))
+    assert spec.shape.as_list() == [None, 6, 8, 1]
+    assert spec.dtype == tf.float16
+
+
+@pytest.mark.parametrize('normalization', [None, 'bn'])
+@pytest.mark.parametrize('is_spatiotemporal', [False, True])
+def test_discriminator_concatenated_batch_matches_separate_calls(
+        normalization, is_spatiotemporal):
+    rng = np.random.default_rng(2)
+    # spatio-temporal discriminators with pre-upsampling ('pin'), where the LR
+    # input is interpolated to the HR grid
+    shape = (2, 3) if is_spatiotemporal else (2,)
+    upsampling = 'pin' if is_spatiotemporal else 'spc'
+    lr_size = (12, 16) if is_spatiotemporal else (6, 8)
+    lr = rng.normal(size=shape + lr_size + (1,)).astype('float32')
+    hr = rng.normal(size=shape + (12, 16, 1)).astype('float32')
+    gen = rng.normal(size=shape + (12, 16, 1)).astype('float32')
+    tf.keras.utils.set_random_seed(0)
+    discriminator = residual_discriminator(1, upsampling, is_spatiotemporal, SCALE,
+                                           lr_size, n_filters=4, n_res_blocks=1,
+                                           normalization=normalization)
+    # the batch statistics (training=True) of 'bn' depend on the batch
+    training = normalization is None
+    disc_output = discriminator([lr, np.concatenate([hr, gen])], training=training)
+    disc_real_output, disc_generated_output = np.split(disc_output, 2)
+    # the dropout is random in training mode
+    if training:
+        for layer in discriminator.layers:
+            if isinstance(layer, tf.keras.layers.Dropout):
+                layer.rate = 0.
+        disc_output = discriminator([lr, np.concatenate([hr, gen])], training=training)
+        disc_real_output, disc_generated_output = np.split(disc_output, 2)
+    np.testing.assert_allclose(disc_real_output,
+                               discriminator([lr, hr], training=training),
+                               rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(disc_generated_output,
+                               discriminator([lr, gen], training=training),
+                               rtol=1e-5, atol=1e-6)
+
+
+def test_train_step_matches_separate_discriminator_calls(batch):
+    lr, hr = batch
+    pxloss = tf.keras.losses.MeanAbsoluteError()
+    gen_ref, disc_ref = _models(dropout=False)
+    optimizers_ref = _optimizers()
+    # previous formulation, with a discriminator call per HR array
+    with tf.GradientTape() as gen_tape, tf.GradientTape() as disc_tape:
+        gen_array = gen_ref(lr, training=True)
+        disc_real_output = disc_ref([lr, hr], training=True)
+        disc_generated_output = disc_ref([lr, gen_array], training=True)
+        losses_ref = generator_loss(disc_generated_output, gen_array, hr, pxloss)
+        disc_loss = discriminator_loss(disc_real_output, disc_generated_output)
+    optimizers_ref[0].apply_gradients(zip(
+        gen_tape.gradient(losses_ref[0], gen_ref.trainable_variables),
+        gen_ref.trainable_variables))
+    optimizers_ref[1].apply_gradients(zip(
+        disc_tape.gradient(disc_loss, disc_ref.trainable_variables),
+        disc_ref.trainable_variables))
+
+    generator, discriminator = _models(dropout=False)
+    losses = train_step(lr, hr, **_step_kwargs(generator, discriminator,
+                                               _optimizers()))
+    np.testing.assert_allclose([loss.numpy() for loss in losses],
+                               [loss.numpy() for loss in losses_ref + (disc_loss,)],
+                               rtol=1e-5)
+    _assert_same_weights(generator, gen_ref)
+    _assert_same_weights(discriminator, disc_ref)
@@ -0,0 +1,552 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from dl4ds.dataloader import (BatchPrefetcher, DistributedSampler, StaticFields,
+                              create_batch_hr_lr, create_pair_hr_lr)
+from dl4ds.utils import resize_array
+
+
+SCALE = 2
+
+
+@pytest.fixture(scope='module')
+def data():
+    rng = np.random.default_rng(0)
+    hr = rng.normal(size=(9, 16, 12, 1)).astype('float32')
+    lr = rng.normal(size=(9, 8, 6, 1)).astype('float32')
+    static = [rng.normal(size=(16, 12)).astype('float32'), 
+              (rng.random(size=(16, 12)) > 0.5).astype('float32')]
+    predictors = rng.normal(size=(9, 8, 6, 2)).astype('float32')
+    return hr, lr, static, predictors
+
+
+def _reference_batch(indices, array, array_lr, upsampling, static_vars=None, 
+                     predictors=None):
+    """Batch built sample by sample with ``create_pair_hr_lr``, as before the
+    vectorized assembly."""
+    batch_hr, batch_lr, batch_aux = [], [], []
+    for i in indices:
+        res = create_pair_hr_lr(
+            array=array[i], 
+            array_lr=None if array_lr is None else array_lr[i],
+            upsampling=upsampling, 
+            scale=SCALE, 
+            patch_size=None, 
+            static_vars=static_vars, 
+            predictors=None if predictors is None else predictors[i])
+        if static_vars is not None:
+            hr, lr, aux = res
+            batch_aux.append(aux)
+        else:
+            hr, lr = res
+        batch_hr.append(hr)
+        batch_lr.append(lr)
+    inputs = [np.asarray(batch_lr)]
+    if static_vars is not None:
+        inputs.append(np.asarray(batch_aux))
+    return inputs, [np.asarray(batch_hr)]
+
+
+@pytest.mark.parametrize('upsampling', ['spc', 'pin'])
+@pytest.mark.parametrize('explicit_lr', [False, True])
+@pytest.mark.parametrize('with_static', [False, True])
+@pytest.mark.parametrize('with_predictors', [False, True])
+def test_batch_matches_pairs(data, upsampling, explicit_lr, with_static, 
+                             with_predictors):
+    hr, lr, static, predictors = data
+    array_lr = lr if explicit_lr else None
+    static_vars = static if with_static else None
+    predictors = predictors if with_predictors else None
+    indices = np.array([4, 0, 7, 2, 5])
+    inputs, targets = create_batch_hr_lr(
+        indices, 0, hr, array_lr, upsampling, scale=SCALE, batch_size=4,
+        static_vars=static_vars, predictors=predictors)
+    expected_inputs, expected_targets = _reference_batch(
+        indices[:4], hr, array_lr, upsampling, static_vars, predictors)
+    assert len(inputs) == len(expected_inputs)
+    for out, expected in zip(inputs + targets, expected_inputs + expected_targets):
+        assert out.dtype == np.float32
+        np.testing.assert_allclose(out, expected, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('upsampling', ['spc', 'pin'])
+def test_patches_are_cropped_at_the_same_offsets(data, upsampling):
+    hr, _, static, _ = data
+    inputs, [batch_hr] = create_batch_hr_lr(
+        np.arange(9), 1, hr, None, upsampling, scale=SCALE, batch_size=3, 
+        patch_size=8, static_vars=static, static_on_device=True,
+        random_state=np.random.RandomState(0))
+    batch_lr, offsets = inputs
+    assert offsets.dtype == np.int32 and offsets.shape == (3, 2)
+    for k, (i, (y, x)) in enumerate(zip([3, 4, 5], offsets)):
+        if upsampling == 'spc':
+            # the crops are aligned with the LR grid
+            assert y % SCALE == 0 and x % SCALE == 0
+        np.testing.assert_array_equal(batch_hr[k], hr[i, y: y + 8, x: x + 8])
+        if upsampling == 'spc':
+            lr = resize_array(batch_hr[k], (4, 4), squeezed=False)
+        else:
+            # the whole grid is coarsened and interpolated back, then cropped
+            lr = resize_array(hr[i], (6, 8), squeezed=False)
+            lr = resize_array(lr, (12, 16), squeezed=False)[y: y + 8, x: x + 8]
+        np.testing.assert_allclose(batch_lr[k], lr, rtol=1e-5, atol=1e-5)
+
+
+def test_static_vars_cropped_at_the_hr_offsets(data):
+    hr, _, static, _ = data
+    # the HR data is the first static variable, so that the static crops must
+    # be equal to the HR crops
+    array = np.broadcast_to(static[0][None, ..., None], hr.shape)
+    [batch_lr, batch_aux], [batch_hr] = create_batch_hr_lr(
+        np.arange(9), 0, array, None, 'pin', scale=SCALE, batch_size=6, 
+        patch_size=8, static_vars=static, random_state=np.random.RandomState(1))
+    np.testing.assert_array_equal(batch_aux[..., :1], batch_hr)
+    np.testing.assert_array_equal(batch_lr[..., 1:2], batch_hr)
+
+
+def test_spatiotemporal_implicit_lr_keeps_channels(data):
+    hr = data[0]
+    [batch_lr], [batch_hr] = create_batch_hr_lr(
+        np.arange(6), 0, hr, None, 'spc', scale=SCALE, batch_size=3, 
+        time_window=3)
+    assert batch_hr.shape == (3, 3, 16, 12, 1)
+    assert batch_lr.shape == (3, 3, 8, 6, 1)
+    np.testing.assert_allclose(
+        batch_lr[1], resize_array(hr[1:4], (6, 8), squeezed=False), 
+        rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('upsampling', ['spc', 'pin'])
+@pytest.mark.parametrize('time_window', [None, 3])
+def test_precomputed_lr_matches_implicit_pairs(data, upsampling, time_window):
+    from dl4ds.datasources import precompute_lr
+    hr = data[0]
+    array_lr = precompute_lr(hr, SCALE, upsampling, chunk_size=4)
+    kwargs = dict(upsampling=upsampling, scale=SCALE, batch_size=4, 
+                  time_window=time_window)
+    expected = create_batch_hr_lr(np.arange(6), 0, hr, None, **kwargs)
+    out = create_batch_hr_lr(np.arange(6), 0, hr, array_lr, **kwargs)
+    for a, b in zip(out[0] + out[1], expected[0] + expected[1]):
+        np.testing.assert_allclose(a, b, rtol=1e-5, atol=1e-5)
+
+
+def test_precomputed_pin_lr_patches_match_implicit_pairs(data):
+    from dl4ds.datasources import precompute_lr
+    hr = data[0]
+    array_lr = precompute_lr(hr, SCALE, 'pin')
+    kwargs = dict(upsampling='pin', scale=SCALE, batch_size=5, patch_size=6)
+    expected = create_batch_hr_lr(np.arange(9), 1, hr, None, 
+                                  random_state=np.random.RandomState(3), **kwargs)
+    out = create_batch_hr_lr(np.arange(9), 1, hr, array_lr, 
+                             random_state=np.random.RandomState(3), **kwargs)
+    for a, b in zip(out[0] + out[1], expected[0] + expected[1]):
+        np.testing.assert_allclose(a, b, rtol=1e-5, atol=1e-5)
+
+
+def test_data_generator_lr_cache(tmp_path, data):
+    import os
+    from dl4ds.dataloader import DataGenerator
+    hr = data[0]
+    cache_dir = str(tmp_path / 'cache')
+    kwargs = dict(backbone='resnet', upsampling='spc', scale=SCALE, 
+                  batch_size=3, patch_size=4)
+    gen = DataGenerator(hr, None, lr_cache=cache_dir, **kwargs)
+    [fname] = os.listdir(cache_dir)
+    assert fname.startswith('lr_post_x2_inter_area_') and fname.endswith('.npy')
+    np.testing.assert_allclose(gen.array_lr.read(slice(None)), 
+                               resize_array(hr, (6, 8), squeezed=False), 
+                               rtol=1e-5, atol=1e-5)
+    [batch_lr], [batch_hr] = gen[0]
+    assert batch_lr.shape == (3, 2, 2, 1) and batch_hr.shape == (3, 4, 4, 1)
+    for lr, hr_patch in zip(batch_lr, batch_hr):
+        # the crops of the cached LR grids are aligned with the HR ones
+        np.testing.assert_allclose(lr, resize_array(hr_patch, (2, 2), squeezed=False),
+                                   rtol=1e-5, atol=1e-5)
+    gen = DataGenerator(hr, None, lr_cache=cache_dir, **kwargs)
+    assert os.listdir(cache_dir) == [fname]
+
+
+def _dataset_batches(dataset):
+    return [[np.asarray(x) for x in inputs + targets] 
+            for inputs, targets in dataset]
+
+
+def test_as_dataset_yields_the_generator_batches(data):
+    from dl4ds.dataloader import DataGenerator
+    hr, _, static, _ = data
+    gen = DataGenerator(hr, None, 'resnet', 'spc', SCALE, batch_size=2, 
+                        static_vars=static)
+    batches = _dataset_batches(gen.as_dataset(shuffle=False, deterministic=True))
+    assert len(batches) == len(gen) == 4
+    for index, batch in enumerate(batches):
+        inputs, targets = gen[index]
+        assert len(batch) == 3
+        for a, b in zip(batch, list(inputs) + list(targets)):
+            np.testing.assert_array_equal(a, b)
+
+
+def test_as_dataset_deterministic_crops(data):
+    from dl4ds.dataloader import DataGenerator
+    hr = data[0]
+    gen = DataGenerator(hr, None, 'resnet', 'spc', SCALE, batch_size=2, 
+                        patch_size=4)
+    first = _dataset_batches(gen.as_dataset(deterministic=True, seed=7))
+    second = _dataset_batches(gen.as_dataset(deterministic=True, seed=7))
+    for a, b in zip(first, second):
+        for x, y in zip(a, b):
+            np.testing.assert_array_equal(x, y)
+    # without shuffling, the crops of step i are drawn with the seed (7, i)
+    batches = _dataset_batches(gen.as_dataset(shuffle=False, deterministic=True, 
+                                              seed=7))
+    for step, batch in enumerate(batches):
+        inputs, targets = gen._get_batch(step, np.random.RandomState([7, step]))
+        np.testing.assert_array_equal(batch[0], inputs[0])
+        np.testing.assert_array_equal(batch[1], targets[0])
+
+
+def test_as_dataset_shards(data):
+    from dl4ds.dataloader import DataGenerator
+    hr = data[0]
+    gen = DataGenerator(hr, None, 'resnet', 'spc', SCALE, batch_size=2)
+    hr_batches = {}
+    for rank in range(3):
+        dataset = gen.as_dataset(shuffle=False, deterministic=True, shard=(3, rank))
+        hr_batches[rank] = [batch[-1] for batch in _dataset_batches(dataset)]
+    assert [len(b) for b in hr_batches.values()] == [2, 1, 1]
+    all_batches = np.concatenate([b for r in range(3) for b in hr_batches[r]])
+    np.testing.assert_array_equal(np.sort(all_batches, axis=0), 
+                                  np.sort(hr[gen.indices[:8]], axis=0))
+
+
+def test_as_dataset_batch_larger_than_data(data):
+    from dl4ds.dataloader import DataGenerator
+    gen = DataGenerator(data[0], None, 'resnet', 'spc', SCALE, batch_size=20)
+    with pytest.raises(ValueError):
+        gen.as_dataset()
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_prefetcher_matches_synchronous_batches(data, workers):
+    hr, _, static, _ = data
+    seeds = np.random.RandomState(0).randint(0, 2**31 - 1, size=6)
+
+    def load_batch(step):
+        return create_batch_hr_lr(np.arange(len(hr)), step % 3, hr, None,
+                                  upsampling='spc', scale=SCALE, batch_size=3,
+                                  patch_size=4, static_vars=static,
+                                  random_state=np.random.RandomState(seeds[step]))
+
+    prefetcher = BatchPrefetcher(load_batch, n_batches=6, workers=workers)
+    assert len(prefetcher) == 6
+    batches = list(prefetcher)
+    assert len(batches) == 6
+    for step, batch in enumerate(batches):
+        expected = load_batch(step)
+        for array, expected_array in zip(_flatten(batch), _flatten(expected)):
+            np.testing.assert_array_equal(array, expected_array)
+
+
+def _flatten(batch):
+    inputs, targets = batch
+    return list(inputs) + list(targets)
+
+
+def test_prefetcher_order_and_depth():
+    lock = threading.Lock()
+    started = []
+    consumed = []
+    rng = np.random.default_rng(0)
+    delays = rng.uniform(0, 0.01, size=10)
+
+    def load_batch(step):
+        with lock:
+            # started but not consumed: the queued batches and the one being
+            # returned to the consumer
+            assert len(started) - len(consumed) <= 2
+            started.append(step)
+        time.sleep(delays[step])
+        return step
+
+    prefetcher = BatchPrefetcher(load_batch, n_batches=10, workers=2, depth=2)
+    for step in prefetcher:
+        with lock:
+            consumed.append(step)
+    assert consumed == list(range(10))
+    assert sorted(started) == list(range(10))
+    assert prefetcher.wait_time >= 0
+
+
+def test_prefetcher_wait_time():
+    prefetcher = BatchPrefetcher(lambda step: time.sleep(0.05), n_batches=2,
+                                 depth=1)
+    list(prefetcher)
+    # the first batch is waited for entirely, at least
+    assert prefetcher.wait_time > 0.02
+
+
+def test_prefetcher_propagates_errors():
+    def load_batch(step):
+        if step == 1:
+            raise RuntimeError('bad batch')
+        return step
+
+    prefetcher = BatchPrefetcher(load_batch, n_batches=4)
+    assert next(prefetcher) == 0
+    with pytest.raises(RuntimeError, match='bad batch'):
+        next(prefetcher)
+    prefetcher.close()
+
+
+def test_prefetcher_close_cancels_pending_batches():
+    started = []
+    prefetcher = BatchPrefetcher(lambda step: started.append(step),
+                                 n_batches=100, depth=3)
+    next(prefetcher)
+    prefetcher.close()
+    assert len(started) <= 4
+    with pytest.raises(StopIteration):
+        next(prefetcher)
+
+
+@pytest.mark.parametrize('kwargs', [dict(workers=0), dict(depth=0)])
+def test_prefetcher_invalid_arguments(kwargs):
+    with pytest.raises(ValueError):
+        BatchPrefetcher(lambda step: step, n_batches=2, **kwargs)
+
+
+@pytest.mark.parametrize('n_samples', [12, 14])
+def test_sampler_shards_are_disjoint(n_samples):
+    samplers = [DistributedSampler(n_samples, num_replicas=3, rank=rank, seed=5)
+                for rank in range(3)]
+    for epoch in range(3):
+        shards = [sampler.indices(epoch) for sampler in samplers]
+        assert all(len(shard) == len(samplers[0]) == n_samples // 3
+                   for shard in shards)
+        all_indices = np.concatenate(shards)
+        # the last n_samples % num_replicas samples of the permutation are dropped
+        assert len(np.unique(all_indices)) == len(all_indices) == 12
+        assert set(all_indices) <= set(range(n_samples))
+
+
+def test_sampler_reshuffles_every_epoch():
+    sampler = DistributedSampler(50, seed=1)
+    epochs = [sampler.indices(epoch) for epoch in range(3)]
+    # a single replica covers all the samples
+    for indices in epochs:
+        np.testing.assert_array_equal(np.sort(indices), np.arange(50))
+    assert not np.array_equal(epochs[0], epochs[1])
+    assert not np.array_equal(epochs[1], epochs[2])
+    # the permutations only depend on the seed and the epoch
+    other = DistributedSampler(50, seed=1)
+    np.testing.assert_array_equal(other.indices(1), epochs[1])
+    np.testing.assert_array_equal(other.indices(0), epochs[0])
+    assert not np.array_equal(DistributedSampler(50, seed=2).indices(0), epochs[0])
+
+
+def test_sampler_without_shuffling():
+    shards = [DistributedSampler(7, num_replicas=2, rank=rank, shuffle=False).indices(3)
+              for rank in range(2)]
+    np.testing.assert_array_equal(shards[0], [0, 2, 4])
+    np.testing.assert_array_equal(shards[1], [1, 3, 5])
+
+
+def test_sampler_cache():
+    sampler = DistributedSampler(20, num_replicas=2, rank=1)
+    first = sampler.indices(4)
+    assert sampler.indices(4) is first
+    second = sampler.indices(5)
+    assert not np.array_equal(second, first)
+    np.testing.assert_array_equal(sampler.indices(4), first)
+
+
+def test_sampler_concurrent_epochs():
+    from concurrent.futures import ThreadPoolExecutor
+    sampler = DistributedSampler(100, num_replicas=2, rank=0)
+    expected = {epoch: DistributedSampler(100, num_replicas=2, rank=0).indices(epoch)
+                for epoch in range(2)}
+    epochs = [step % 2 for step in range(200)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(sampler.indices, epochs))
+    for epoch, indices in zip(epochs, results):
+        np.testing.assert_array_equal(indices, expected[epoch])
+
+
+@pytest.mark.parametrize('kwargs', [dict(num_replicas=2, rank=2),
+                                    dict(num_replicas=2, rank=-1),
+                                    dict(n_samples=1, num_replicas=2, rank=0)])
+def test_sampler_invalid_arguments(kwargs):
+    kwargs.setdefault('n_samples', 10)
+    with pytest.raises(ValueError):
+        DistributedSampler(**kwargs)
+
+
+def test_data_generator_with_sampler(data):
+    from dl4ds.dataloader import DataGenerator
+    hr = data[0]
+    sampler = DistributedSampler(len(hr), num_replicas=2, rank=1, seed=3)
+    gen = DataGenerator(hr, None, 'resnet', 'spc', SCALE, batch_size=2,
+                        sampler=sampler)
+    assert len(gen) == 2
+    for epoch in range(2):
+        shard = sampler.indices(epoch)
+        for index in range(len(gen)):
+            _, [batch_hr] = gen[index]
+            np.testing.assert_array_equal(batch_hr,
+                                          hr[shard[index * 2: (index + 1) * 2]])
+        gen.on_epoch_end()
+    # the tf.data batches of the repetitions use the shards of the next epochs
+    gen = DataGenerator(hr, None, 'resnet', 'spc', SCALE, batch_size=2,
+                        sampler=sampler)
+    dataset = gen.as_dataset(shuffle=False, deterministic=True, repeat=True)
+    batches = _dataset_batches(dataset.take(4))
+    for step, batch in enumerate(batches):
+        shard = sampler.indices(step // 2)
+        index = step % 2
+        np.testing.assert_array_equal(batch[-1], hr[shard[index * 2: (index + 1) * 2]])
+
+
+def test_data_generator_sampler_size_mismatch(data):
+    from dl4ds.dataloader import DataGenerator
+    with pytest.raises(ValueError):
+        DataGenerator(data[0], None, 'resnet', 'spc', SCALE, batch_size=2,
+                      sampler=DistributedSampler(5))
+
+
+def test_graph_interpolation_batch_is_lr_sized(data):
+    hr, _, static, _ = data
+    kwargs = dict(scale=SCALE, batch_size=3, patch_size=4, static_vars=static)
+    [lr, aux], [batch_hr] = create_batch_hr_lr(
+        np.arange(9), 1, hr, None, upsampling='pin', graph_interpolation=True, 
+        random_state=np.random.RandomState(4), **kwargs)
+    # the same LR crops as for post-upsampling
+    [lr_post, aux_post], [batch_hr_post] = create_batch_hr_lr(
+        np.arange(9), 1, hr, None, upsampling='spc', 
+        random_state=np.random.RandomState(4), **kwargs)
+    # the coarsened static variables are also in the LR input
+    assert lr.shape == (3, 2, 2, 3) and batch_hr.shape == (3, 4, 4, 1)
+    np.testing.assert_array_equal(lr, lr_post)
+    np.testing.assert_array_equal(aux, aux_post)
+    np.testing.assert_array_equal(batch_hr, batch_hr_post)
+
+
+@pytest.mark.parametrize('interpolation', ['inter_area', 'bilinear'])
+def test_graph_interpolation_matches_pin_batches(data, interpolation):
+    from dl4ds.models.blocks import InterpolationUpsampling
+    hr = data[0]
+    kwargs = dict(scale=SCALE, batch_size=3, interpolation=interpolation)
+    [lr], [batch_hr] = create_batch_hr_lr(np.arange(9), 0, hr, None, 'pin', 
+                                          graph_interpolation=True, **kwargs)
+    [lr_pin], [batch_hr_pin] = create_batch_hr_lr(np.arange(9), 0, hr, None, 
+                                                  'pin', **kwargs)
+    upsampled = InterpolationUpsampling(SCALE, interpolation)(lr).numpy()
+    np.testing.assert_allclose(upsampled, lr_pin, rtol=1e-5, atol=1e-5)
+    np.testing.assert_array_equal(batch_hr, batch_hr_pin)
+
+
+def test_graph_interpolation_rejects_hr_sized_lr(data):
+    hr = data[0]
+    with pytest.raises(ValueError):
+        create_batch_hr_lr(np.arange(9), 0, hr, hr, 'pin', scale=SCALE, 
+                           batch_size=3, graph_interpolation=True)
+
+
+def test_graph_interpolation_patch_size_divisible_by_scale(data):
+    from dl4ds.dataloader import DataGenerator
+    with pytest.raises(ValueError):
+        DataGenerator(data[0], None, 'resnet', 'pin', SCALE, batch_size=2, 
+                      patch_size=5, graph_interpolation=True)
+
+
+def _time_metadata(n):
+    import pandas as pd
+    import xarray as xr
+    times = pd.date_range('2000-01-15', periods=n, freq='35D')
+    return xr.DataArray(times, dims='time', coords={'time': times})['time']
+
+
+@pytest.mark.parametrize('upsampling,graph_interpolation', [('spc', False), 
+                                                            ('pin', False),
+                                                            ('pin', True)])
+@pytest.mark.parametrize('season', [False, True])
+def test_static_fields_match_copied_static_vars(data, upsampling, 
+                                                graph_interpolation, season):
+    hr, _, static, _ = data
+    kwargs = dict(scale=SCALE, batch_size=4, static_vars=static, 
+                  graph_interpolation=graph_interpolation, 
+                  time_metadata=_time_metadata(9) if season else None)
+    [lr, aux], [batch_hr] = create_batch_hr_lr(np.arange(9), 1, hr, None, 
+                                               upsampling, **kwargs)
+    inputs, [batch_hr_device] = create_batch_hr_lr(np.arange(9), 1, hr, None, 
+                                                   upsampling, 
+                                                   static_on_device=True, 
+                                                   **kwargs)
+    assert len(inputs) == (3 if season else 2)
+    np.testing.assert_array_equal(inputs[1], np.zeros((4, 2)))
+    lr_sized = upsampling == 'spc' or graph_interpolation
+    layer = StaticFields(static, SCALE, lr_sized=lr_sized)
+    lr_device, aux_device = layer(inputs)
+    np.testing.assert_allclose(lr_device, lr, rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(aux_device, aux, rtol=1e-6, atol=1e-6)
+    np.testing.assert_array_equal(batch_hr_device, batch_hr)
+
+
+@pytest.mark.parametrize('upsampling', ['spc', 'pin'])
+def test_static_fields_gather_crops_at_the_offsets(data, upsampling):
+    hr, _, static, _ = data
+    [lr, offsets], [batch_hr] = create_batch_hr_lr(
+        np.arange(9), 0, hr, None, upsampling, scale=SCALE, batch_size=5, 
+        patch_size=4, static_vars=static, static_on_device=True, 
+        random_state=np.random.RandomState(2))
+    lr_sized = upsampling == 'spc'
+    assert offsets.dtype == np.int32
+    if lr_sized:
+        # the crops are aligned with the LR grid
+        assert np.all(offsets % SCALE == 0)
+    lr_device, aux_device = StaticFields(static, SCALE, lr_sized=lr_sized)([lr, offsets])
+    static_hr = np.stack(static, axis=-1)
+    static_lr = resize_array(static_hr, (6, 8), squeezed=False)
+    for k, (y, x) in enumerate(offsets):
+        np.testing.assert_array_equal(aux_device[k], static_hr[y: y + 4, x: x + 4])
+        if lr_sized:
+            expected_lr = static_lr[y // SCALE: y // SCALE + 2, x // SCALE: x // SCALE + 2]
+        else:
+            expected_lr = static_hr[y: y + 4, x: x + 4]
+        np.testing.assert_allclose(lr_device[k, ..., 1:], expected_lr, 
+                                   rtol=1e-6, atol=1e-6)
+        np.testing.assert_array_equal(lr_device[k, ..., :1], lr[k])
+
+
+def test_static_fields_spatiotemporal_only_in_aux(data):
+    hr, _, static, _ = data
+    inputs, _ = create_batch_hr_lr(np.arange(6), 0, hr, None, 'spc', 
+                                   scale=SCALE, batch_size=3, time_window=3, 
+                                   static_vars=static, static_on_device=True)
+    lr, aux = StaticFields(static, SCALE, lr_sized=True, 
+                           is_spatiotemporal=True)(inputs)
+    np.testing.assert_array_equal(lr, inputs[0])
+    np.testing.assert_array_equal(aux, np.broadcast_to(np.stack(static, -1), 
+                                                       (3, 16, 12, 2)))
+
+
+def test_static_fields_wrap_shares_weights(data):
+    import tensorflow as tf
+    hr, _, static, _ = data
+    x_in = tf.keras.layers.Input(shape=(None, None, 3))
+    aux_in = tf.keras.layers.Input(shape=(None, None, 2))
+    x = tf.keras.layers.Conv2D(SCALE ** 2, 1)(x_in)
+    x = tf.keras.layers.Lambda(lambda t: tf.nn.depth_to_space(t, SCALE))(x)
+    x = tf.keras.layers.Conv2D(1, 1)(tf.keras.layers.Concatenate()([x, aux_in]))
+    model = tf.keras.Model([x_in, aux_in], x, name='test_spc')
+    layer = StaticFields(static, SCALE, lr_sized=True)
+    wrapper = layer.wrap(model)
+    assert wrapper.name == model.name
+    assert len(wrapper.trainable_weights) == len(model.trainable_weights)
+    kwargs = dict(scale=SCALE, batch_size=4, patch_size=4, static_vars=static,
+                  random_state=np.random.RandomState(0))
+    inputs, _ = create_batch_hr_lr(np.arange(9), 0, hr, None, 'spc', 
+                                   static_on_device=True, **kwargs)
+    np.testing.assert_allclose(wrapper(inputs), model(layer(inputs)), 
+                               rtol=1e-6, atol=1e-6)
@@ -0,0 +1,343 @@
+import os
+
+import numpy as np
+import pytest
+import xarray as xr
+
+from dl4ds.datasources import ArraySource, to_shared_memory
+
+
+@pytest.fixture
+def data():
+    return np.random.default_rng(0).normal(size=(10, 6, 5, 2)).astype('float32')
+
+
+@pytest.mark.parametrize('chunk_size', [3, 256])
+def test_to_shared_memory_time_series(tmp_path, data, chunk_size):
+    path = str(tmp_path / 'data.npy')
+    da = xr.DataArray(data, dims=('time', 'lat', 'lon', 'var'))
+    array = to_shared_memory(da, path, chunk_size=chunk_size)
+    assert isinstance(array, np.memmap) and not array.flags.writeable
+    np.testing.assert_array_equal(array, data)
+    assert os.listdir(tmp_path) == ['data.npy']
+
+
+def test_to_shared_memory_static_keeps_layout(tmp_path):
+    # a 3D static variable [lat, lon, 1] is not a time series
+    static = np.random.default_rng(0).normal(size=(6, 5, 1))
+    array = to_shared_memory(static, str(tmp_path / 'static.npy'), 
+                             time_series=False)
+    assert array.shape == (6, 5, 1)
+    np.testing.assert_array_equal(array, static)
+
+
+def test_to_shared_memory_non_writer_maps_file(tmp_path, data):
+    path = str(tmp_path / 'data.npy')
+    calls = []
+    to_shared_memory(data, path)
+    array = to_shared_memory(None, path, is_writer=False, 
+                             barrier=lambda: calls.append(1))
+    assert calls == [1]
+    np.testing.assert_array_equal(array, data)
+
+
+class _FailingSource(ArraySource):
+    def read(self, time, y=slice(None), x=slice(None)):
+        if time.start > 0:
+            raise IOError('read error')
+        return super().read(time, y, x)
+
+
+def test_to_shared_memory_removes_partial_file(tmp_path, data):
+    path = str(tmp_path / 'data.npy')
+    with pytest.raises(IOError):
+        to_shared_memory(_FailingSource(data), path, chunk_size=4)
+    assert os.listdir(tmp_path) == []
+
+
+def _reference_hash(array):
+    """SHA1 of the shape, dtype and values, as used for all the sources 
+    before the metadata keys."""
+    import hashlib
+    sha = hashlib.sha1()
+    sha.update(str((array.shape, str(array.dtype))).encode())
+    sha.update(np.ascontiguousarray(array).tobytes())
+    return sha.hexdigest()
+
+
+class _UnreadableSource(ArraySource):
+    def read(self, time, y=slice(None), x=slice(None)):
+        raise AssertionError('the data must not be read')
+
+
+def test_hash_source_in_memory_hashes_values(data):
+    from dl4ds.datasources import _hash_source
+    assert _hash_source(ArraySource(data), chunk_size=3) == _reference_hash(data)
+
+
+def test_hash_source_memmap_uses_metadata(tmp_path, data):
+    from dl4ds.datasources import _hash_source
+    path = str(tmp_path / 'data.npy')
+    np.save(path, data)
+    array = np.load(path, mmap_mode='r')
+    key = _hash_source(_UnreadableSource(array))
+    assert key == _hash_source(ArraySource(np.load(path, mmap_mode='r')))
+    # other windows of the same file
+    assert key != _hash_source(ArraySource(array[2:]))
+    assert _hash_source(ArraySource(array[2:])) != _hash_source(ArraySource(array[3:]))
+    # rewritten file
+    np.save(path, data + 1)
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+    assert key != _hash_source(ArraySource(np.load(path, mmap_mode='r')))
+
+
+def test_hash_source_dask_uses_name(tmp_path, data):
+    from dl4ds.datasources import XarraySource, _hash_source
+    path = str(tmp_path / 'data.nc')
+    xr.DataArray(data[..., 0], dims=('time', 'lat', 'lon'), 
+                 name='tas').to_netcdf(path)
+    def open_source():
+        return XarraySource(xr.open_dataset(path, chunks={'time': 4})['tas'])
+    source = open_source()
+    source.read = None
+    assert _hash_source(source) == _hash_source(open_source())
+
+
+def test_precompute_lr_cache(tmp_path, data):
+    from dl4ds.datasources import precompute_lr
+    path = str(tmp_path / 'data.npy')
+    np.save(path, data)
+    cache_dir = str(tmp_path / 'cache')
+    lr = precompute_lr(np.load(path, mmap_mode='r'), 2, 'spc', cache_dir=cache_dir)
+    expected = precompute_lr(data, 2, 'spc')
+    np.testing.assert_array_equal(lr.array, expected.array)
+    assert len(os.listdir(cache_dir)) == 1
+    # reused without reading the data
+    cached = precompute_lr(_UnreadableSource(np.load(path, mmap_mode='r')), 2, 
+                           'spc', cache_dir=cache_dir)
+    np.testing.assert_array_equal(cached.array, expected.array)
+    precompute_lr(data, 2, 'pin', cache_dir=cache_dir, cache_key='custom')
+    assert len(os.listdir(cache_dir)) == 2
+    cached = precompute_lr(_UnreadableSource(data), 2, 'pin', 
+                           cache_dir=cache_dir, cache_key='custom')
+    assert cached.shape == data.shape
+
+
+def _open_sources(tmp_path, data):
+    """The same data as each kind of data source."""
+    from dl4ds.datasources import ConcatenatedSource, XarraySource, open_data_source
+    dims = ('time', 'lat', 'lon', 'var')
+    np.save(tmp_path / 'data.npy', data)
+    xr.DataArray(data, dims=dims, name='tas').to_netcdf(tmp_path / 'data.nc')
+    xr.DataArray(data, dims=dims, name='tas').to_dataset().to_zarr(tmp_path / 'data.zarr')
+    return {
+        'array': ArraySource(data),
+        'memmap': open_data_source(str(tmp_path / 'data.npy')),
+        'netcdf': open_data_source(str(tmp_path / 'data.nc')),
+        'netcdf_dask': open_data_source(str(tmp_path / 'data.nc'), chunks={'time': 3}),
+        'zarr': open_data_source(str(tmp_path / 'data.zarr')),
+        'dataarray_transposed': XarraySource(
+            xr.DataArray(data, dims=dims).transpose('lat', 'time', 'lon', 'var').chunk()),
+        'concatenated': ConcatenatedSource([data[..., :1], data[..., 1:]]),
+    }
+
+
+def test_data_sources_read_like_numpy(tmp_path, data):
+    sources = _open_sources(tmp_path, data)
+    indices = np.array([7, 1, 4])
+    crop_y, crop_x = np.array([0, 2, 1]), np.array([1, 0, 2])
+    for name, source in sources.items():
+        assert source.shape == data.shape, name
+        np.testing.assert_array_equal(source.read(slice(2, 5), slice(1, 4)), 
+                                      data[2:5, 1:4], err_msg=name)
+        np.testing.assert_array_equal(source[3], data[3], err_msg=name)
+        np.testing.assert_array_equal(source.take(indices), data[indices], 
+                                      err_msg=name)
+        windows = np.stack([data[i: i + 3] for i in indices])
+        np.testing.assert_array_equal(source.take(indices, time_window=3), 
+                                      windows, err_msg=name)
+        patches = np.stack([data[i, y: y + 3, x: x + 3] 
+                            for i, y, x in zip(indices, crop_y, crop_x)])
+        np.testing.assert_array_equal(
+            source.take_patches(indices, crop_y, crop_x, 3), patches, err_msg=name)
+        np.testing.assert_array_equal(np.asarray(source), data, err_msg=name)
+
+
+def test_as_data_source_and_concatenate(tmp_path, data):
+    from dl4ds.datasources import (ConcatenatedSource, XarraySource, 
+                                   as_data_source, concatenate_sources)
+    da = xr.DataArray(data, dims=('time', 'lat', 'lon', 'var'))
+    assert isinstance(as_data_source(da), ArraySource)
+    assert isinstance(as_data_source(da.chunk()), XarraySource)
+    with pytest.raises(TypeError):
+        as_data_source([1, 2])
+    # in-memory arrays are concatenated with NumPy, lazy ones are not loaded
+    out = concatenate_sources([data, data[..., :1]])
+    assert isinstance(out, np.ndarray) and out.shape[-1] == 3
+    np.save(tmp_path / 'data.npy', data)
+    lazy = concatenate_sources([str(tmp_path / 'data.npy'), data])
+    assert isinstance(lazy, ConcatenatedSource) and lazy.shape[-1] == 4
+
+
+def test_open_data_source_requires_variable(tmp_path, data):
+    from dl4ds.datasources import open_data_source
+    dims = ('time', 'lat', 'lon', 'var')
+    xr.Dataset({'a': (dims, data), 'b': (dims, data + 1)}).to_netcdf(tmp_path / 'ab.nc')
+    with pytest.raises(ValueError):
+        open_data_source(str(tmp_path / 'ab.nc'))
+    source = open_data_source(str(tmp_path / 'ab.nc'), variable='b')
+    np.testing.assert_array_equal(source.read(slice(None)), data + 1)
+
+
+def test_batches_from_lazy_sources_match_arrays(tmp_path, data):
+    from dl4ds.dataloader import create_batch_hr_lr
+    sources = _open_sources(tmp_path, data)
+    kwargs = dict(upsampling='spc', scale=2, batch_size=4, patch_size=4)
+    expected = create_batch_hr_lr(np.arange(10), 1, data[..., :1], None, 
+                                  random_state=np.random.RandomState(0), **kwargs)
+    for name in ['memmap', 'netcdf_dask', 'zarr']:
+        single = _single_variable(sources[name])
+        out = create_batch_hr_lr(np.arange(10), 1, single, None, 
+                                 random_state=np.random.RandomState(0), **kwargs)
+        for a, b in zip(out[0] + out[1], expected[0] + expected[1]):
+            np.testing.assert_array_equal(a, b, err_msg=name)
+
+
+def _single_variable(source):
+    """First variable of a data source, read lazily."""
+    from dl4ds.datasources import XarraySource
+    if isinstance(source, XarraySource):
+        return XarraySource(source.data[..., 0])
+    return ArraySource(source.array[..., :1])
+
+
+class _FakeHorovod:
+    """Horovod ranks of which the current process is the first one (writer)."""
+    def __init__(self, local_size):
+        self._local_size = local_size
+        self.barriers = 0
+
+    def local_size(self):
+        return self._local_size
+
+    def rank(self):
+        return 0
+
+    def local_rank(self):
+        return 0
+
+    def broadcast(self, tensor, root_rank, name=None):
+        return tensor
+
+
+def _trainer(data, shm_dir):
+    from types import SimpleNamespace
+    static = np.random.default_rng(1).normal(size=(6, 5))
+    return SimpleNamespace(data_train=data, data_train_lr=data[:, ::2, ::2], 
+                           predictors_train=[data[..., :1]], static_vars=[static],
+                           shm_dir=shm_dir, verbose=False, 
+                           running_on_first_worker=True)
+
+
+def test_setup_shared_memory_single_local_rank(monkeypatch, tmp_path, data):
+    from dl4ds.training import base
+    monkeypatch.setattr(base, 'has_horovod', True)
+    monkeypatch.setattr(base, 'hvd', _FakeHorovod(local_size=1), raising=False)
+    trainer = _trainer(data, str(tmp_path))
+    base.Trainer.setup_shared_memory(trainer)
+    assert trainer.data_train is data
+    assert os.listdir(tmp_path) == []
+
+
+def test_setup_shared_memory_shares_the_arrays(monkeypatch, tmp_path, data):
+    from dl4ds.training import base
+    hvd = _FakeHorovod(local_size=2)
+    monkeypatch.setattr(base, 'has_horovod', True)
+    monkeypatch.setattr(base, 'hvd', hvd, raising=False)
+    monkeypatch.setattr(base, '_horovod_barrier', 
+                        lambda: setattr(hvd, 'barriers', hvd.barriers + 1))
+    trainer = _trainer(data, str(tmp_path))
+    expected = _trainer(data, str(tmp_path))
+    base.Trainer.setup_shared_memory(trainer)
+    for name in ['data_train', 'data_train_lr']:
+        array = getattr(trainer, name)
+        assert isinstance(array, np.memmap)
+        np.testing.assert_array_equal(array, getattr(expected, name))
+    np.testing.assert_array_equal(trainer.predictors_train[0], 
+                                  expected.predictors_train[0])
+    # the 2D static variables are not time series
+    assert trainer.static_vars[0].shape == (6, 5)
+    np.testing.assert_array_equal(trainer.static_vars[0], expected.static_vars[0])
+    # a barrier per shared array and a final one before removing the files
+    assert hvd.barriers == 5
+    # the files are removed once mapped, the mappings stay valid
+    assert os.listdir(tmp_path) == []
+    np.testing.assert_array_equal(trainer.data_train, data)
+
+
+def test_setup_shared_memory_removes_files_on_error(monkeypatch, tmp_path, data):
+    from dl4ds.training import base
+    monkeypatch.setattr(base, 'has_horovod', True)
+    monkeypatch.setattr(base, 'hvd', _FakeHorovod(local_size=2), raising=False)
+    monkeypatch.setattr(base, '_horovod_barrier', lambda: None)
+    trainer = _trainer(data, str(tmp_path))
+    trainer.predictors_train = [_UnreadableSource(data)]
+    with pytest.raises(AssertionError):
+        base.Trainer.setup_shared_memory(trainer)
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('indices', [[0, 1, 2], [5, 0, 3, 1], [2, 2, 6]])
+def test_window_frames(data, indices):
+    from dl4ds.datasources import _take_samples, window_frames
+    times, starts = window_frames(indices, 4)
+    windows = np.asarray(indices)[:, None] + np.arange(4)
+    # each shared frame appears once
+    np.testing.assert_array_equal(times, np.unique(windows))
+    np.testing.assert_array_equal(times[starts[:, None] + np.arange(4)], windows)
+    # the windows gathered from the frames are the samples
+    expected = np.stack([data[i: i + 4] for i in indices])
+    np.testing.assert_array_equal(_take_samples(data[times], starts, 4), expected)
+    np.testing.assert_array_equal(_take_samples(data, np.asarray(indices), 4), 
+                                  expected)
+
+
+class _CountingSource(ArraySource):
+    def __init__(self, array):
+        super().__init__(array)
+        self.n_read = 0
+
+    def read(self, time, y=slice(None), x=slice(None)):
+        block = super().read(time, y, x)
+        self.n_read += len(block)
+        return block
+
+
+@pytest.mark.parametrize('interpolated', [False, True])
+def test_take_reads_shared_frames_once(data, interpolated):
+    from dl4ds.datasources import DataSource, InterpolatedSource
+    from dl4ds.utils import resize_array
+    counting = _CountingSource(data)
+    indices = [1, 2, 3, 4]
+    if interpolated:
+        source = InterpolatedSource(counting, (10, 12))
+        array = resize_array(data, (10, 12), squeezed=False)
+        out = source.take(indices, time_window=3)
+    else:
+        # the generic implementation, as used by the lazy sources
+        array = data
+        out = DataSource.take(counting, indices, time_window=3)
+    np.testing.assert_allclose(out, np.stack([array[i: i + 3] for i in indices]), 
+                               rtol=1e-6, atol=1e-6)
+    assert counting.n_read == 6
+
+
+@pytest.mark.parametrize('n_samples', [1, 4])
+def test_collapse_time_window_by_batches(n_samples):
+    from dl4ds.inference import _collapse_time_window
+    from dl4ds.utils import spatiotemporal_to_spatial_samples
+    out = np.random.default_rng(0).normal(size=(n_samples, 3, 2, 2, 1))
+    expected = spatiotemporal_to_spatial_samples(out, 3)
+    batches = [_collapse_time_window(out[i: i + 2], i + 2 >= n_samples) 
+               for i in range(0, n_samples, 2)]
+    np.testing.assert_array_equal(np.concatenate(batches), expected)
@@ -0,0 +1,429 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from dl4ds import INTERPOLATION_METHODS
+from dl4ds.datasources import InterpolatedSource
+from dl4ds.inference import Predictor, predict
+
+
+SCALE = 4
+
+
+def _spc_model(scale=SCALE, n_channels=1):
+    """Post-upsampling model whose HR pixels only depend on their LR pixel, 
+    for comparing tiled and untiled inference."""
+    x_in = tf.keras.layers.Input(shape=(None, None, n_channels))
+    x = tf.keras.layers.Conv2D(scale ** 2, 1)(x_in)
+    x = tf.keras.layers.Lambda(lambda t: tf.nn.depth_to_space(t, scale))(x)
+    return tf.keras.Model(x_in, x, name='test_spc')
+
+
+def _spc_static_model(scale=SCALE, n_static=1):
+    """Post-upsampling model taking the static variables in the LR input and 
+    in the HR auxiliary input."""
+    x_in = tf.keras.layers.Input(shape=(None, None, 1 + n_static))
+    aux_in = tf.keras.layers.Input(shape=(None, None, n_static))
+    x = tf.keras.layers.Conv2D(scale ** 2, 1)(x_in)
+    x = tf.keras.layers.Lambda(lambda t: tf.nn.depth_to_space(t, scale))(x)
+    x = tf.keras.layers.Concatenate()([x, aux_in])
+    x = tf.keras.layers.Conv2D(1, 1)(x)
+    return tf.keras.Model([x_in, aux_in], x, name='test_spc')
+
+
+def _pin_model(n_static=0):
+    """Pre-upsampling model with 1x1 convolutions, taking the static variables
+    in the input and in the auxiliary input if ``n_static`` > 0."""
+    x_in = tf.keras.layers.Input(shape=(None, None, 1 + n_static))
+    x = tf.keras.layers.Conv2D(4, 1, activation='relu')(x_in)
+    if n_static == 0:
+        return tf.keras.Model(x_in, tf.keras.layers.Conv2D(1, 1)(x), name='test_pin')
+    aux_in = tf.keras.layers.Input(shape=(None, None, n_static))
+    x = tf.keras.layers.Concatenate()([x, aux_in])
+    x = tf.keras.layers.Conv2D(1, 1)(x)
+    return tf.keras.Model([x_in, aux_in], x, name='test_pin')
+
+
+@pytest.fixture(scope='module')
+def array_lr():
+    return np.random.default_rng(0).normal(size=(5, 12, 10, 1)).astype('float32')
+
+
+@pytest.mark.parametrize('interpolation', INTERPOLATION_METHODS)
+@pytest.mark.parametrize('scale', [2, 3, 4])
+def test_interpolated_source_window_matches_full_resize(array_lr, interpolation, scale):
+    source = InterpolatedSource(array_lr, (10 * scale, 12 * scale), interpolation)
+    full = source.read(slice(0, 5))
+    windows = [(slice(0, 7), slice(5, 30)), 
+               (slice(9, None), slice(1, 10 * scale - 1)), 
+               (slice(scale * 3, scale * 6), slice(scale * 2, scale * 9))]
+    for y, x in windows:
+        np.testing.assert_array_equal(source.read(slice(0, 5), y, x), full[:, y, x])
+    # strided windows fall back to the full resize
+    np.testing.assert_array_equal(source.read([1, 3], slice(None, None, 2)), 
+                                  full[[1, 3], ::2])
+
+
+@pytest.mark.parametrize('tile_size', [16, 24])
+def test_tiled_predict_lr_input_matches_untiled(array_lr, tile_size):
+    model = _spc_model()
+    kwargs = dict(array_in_hr=False, batch_size=2, device='CPU')
+    y_hat = predict(model, array_lr, SCALE, **kwargs)
+    y_hat_tiled = predict(model, array_lr, SCALE, tile_size=tile_size, 
+                          tile_overlap=8, **kwargs)
+    assert y_hat_tiled.shape == y_hat.shape == (5, 48, 40, 1)
+    np.testing.assert_allclose(y_hat_tiled, y_hat, rtol=1e-5, atol=1e-5)
+
+
+def test_static_on_device_is_opt_in(array_lr):
+    model = _spc_static_model()
+    assert not Predictor(model, array_lr, SCALE).static_on_device
+    static = np.random.default_rng(1).normal(size=(48, 40)).astype('float32')
+    kwargs = dict(array_in_hr=False, static_vars=[static], batch_size=2, 
+                  device='CPU')
+    y_hat = predict(model, array_lr, SCALE, **kwargs)
+    y_hat_device = predict(model, array_lr, SCALE, static_on_device=True, 
+                           **kwargs)
+    np.testing.assert_allclose(y_hat_device, y_hat, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('ext', ['.npy', '.nc', '.zarr'])
+@pytest.mark.parametrize('n_vars', [1, 2])
+def test_chunk_writer_custom_dims(tmp_path, ext, n_vars):
+    import xarray as xr
+    from dl4ds.inference import _ChunkWriter
+
+    array = np.random.default_rng(0).normal(size=(7, 4, 3, n_vars)).astype('float32')
+    coords = {'valid_time': np.arange(10), 'y': np.linspace(0, 1, 4), 
+              'x': np.linspace(0, 1, 3)}
+    path = str(tmp_path / f'out{ext}')
+    writer = _ChunkWriter(path, array.shape, coords=coords)
+    for start in range(0, 7, 3):
+        writer.write(start, array[start: start + 3])
+    writer.close()
+
+    if ext == '.npy':
+        np.testing.assert_array_equal(np.load(path), array)
+        return
+    dataset = xr.open_zarr(path) if ext == '.zarr' else xr.open_dataset(path)
+    out = dataset['y_hat']
+    assert out.dims[:3] == ('valid_time', 'y', 'x')
+    np.testing.assert_array_equal(out['valid_time'].values, np.arange(7))
+    np.testing.assert_array_equal(np.reshape(out.values, array.shape), array)
+    dataset.close()
+
+
+@pytest.fixture(scope='module')
+def array_hr():
+    return np.random.default_rng(2).normal(size=(4, 40, 36, 1)).astype('float32')
+
+
+@pytest.mark.parametrize('blending', ['cosine', 'linear'])
+@pytest.mark.parametrize('with_static', [False, True])
+def test_tiled_predict_hr_input_matches_untiled(array_hr, blending, with_static):
+    static_vars = None
+    model = _pin_model()
+    if with_static:
+        static_vars = [np.random.default_rng(3).normal(size=(40, 36))]
+        model = _pin_model(n_static=1)
+    kwargs = dict(array_in_hr=True, static_vars=static_vars, batch_size=3, 
+                  device='CPU')
+    y_hat = predict(model, array_hr, SCALE, **kwargs)
+    y_hat_tiled = predict(model, array_hr, SCALE, tile_size=16, tile_overlap=4,
+                          blending=blending, **kwargs)
+    np.testing.assert_allclose(y_hat_tiled, y_hat, rtol=1e-5, atol=1e-5)
+
+
+def test_tile_positions_cover_the_domain():
+    from dl4ds.inference import _tile_positions
+    assert _tile_positions(40, 16, 12) == [0, 12, 24]
+    assert _tile_positions(36, 16, 12) == [0, 12, 20]
+    assert _tile_positions(16, 16, 12) == [0]
+
+
+@pytest.mark.parametrize('blending', ['cosine', 'linear'])
+def test_blending_weights_sum_to_one(blending):
+    from dl4ds.inference import _blending_window, _tile_positions
+    window = _blending_window(16, 4, blending)
+    assert window.min() > 0 and window.max() == 1
+    total = np.zeros(40)
+    for start in _tile_positions(40, 16, 12):
+        total[start: start + 16] += window
+    # the overlapping ramps are complementary away from the domain edges
+    np.testing.assert_allclose(total[4:-4], 1, atol=1e-6)
+    with pytest.raises(ValueError):
+        _blending_window(16, 8, 'gaussian')
+
+
+@pytest.mark.parametrize('tile_size, tile_overlap', [(18, 4), (16, 6), (16, 16)])
+def test_tiled_predict_checks_tile_sizes(array_lr, tile_size, tile_overlap):
+    with pytest.raises(ValueError):
+        predict(_spc_model(), array_lr, SCALE, array_in_hr=False, 
+                tile_size=tile_size, tile_overlap=tile_overlap, device='CPU')
+
+
+def _spatiotemporal_pin_model():
+    """Pre-upsampling spatio-temporal model mixing the time steps."""
+    x_in = tf.keras.layers.Input(shape=(None, None, None, 1))
+    x = tf.keras.layers.Conv3D(2, (3, 1, 1), padding='same')(x_in)
+    x = tf.keras.layers.Conv3D(1, 1)(x)
+    return tf.keras.Model(x_in, x, name='test_pin')
+
+
+@pytest.mark.parametrize('ext', ['.npy', '.nc', '.zarr'])
+@pytest.mark.parametrize('spatiotemporal', [False, True])
+def test_streaming_predict_matches_in_memory(tmp_path, array_hr, ext, spatiotemporal):
+    from dl4ds.preprocessing import StandardScaler
+    scaler = StandardScaler(axis=None).fit(array_hr * 3 + 1)
+    time_window = 3 if spatiotemporal else None
+    model = _spatiotemporal_pin_model() if spatiotemporal else _pin_model()
+    kwargs = dict(array_in_hr=True, time_window=time_window, batch_size=2, 
+                  scaler=scaler, device='CPU')
+    y_hat = predict(model, array_hr, SCALE, **kwargs)
+    out = predict(model, array_hr, SCALE, chunk_size=3, save_path=str(tmp_path), 
+                  save_fname=f'y_hat{ext}', **kwargs)
+    expected_len = 4 if spatiotemporal else len(array_hr)
+    assert out.shape == (expected_len, 40, 36, 1)
+    np.testing.assert_allclose(out.read(slice(None)), 
+                               np.reshape(y_hat, out.shape), rtol=1e-5, atol=1e-5)
+
+
+def test_streaming_predict_requires_output(array_hr):
+    with pytest.raises(ValueError):
+        predict(_pin_model(), array_hr, SCALE, chunk_size=2, device='CPU')
+
+
+@pytest.mark.parametrize('batch_dtype', ['float16', 'bfloat16'])
+def test_half_precision_predict_returns_float32(array_lr, batch_dtype):
+    model = _spc_model()
+    kwargs = dict(array_in_hr=False, batch_size=2, device='CPU')
+    y_hat = predict(model, array_lr, SCALE, **kwargs)
+    y_hat_half = predict(model, array_lr, SCALE, batch_dtype=batch_dtype, **kwargs)
+    assert y_hat_half.dtype == np.float32
+    np.testing.assert_allclose(y_hat_half, y_hat, rtol=2e-2, atol=2e-2)
+
+
+def _graph_interpolation_model(model, interpolation):
+    """Pin model taking LR-sized inputs, interpolated in-graph."""
+    from dl4ds.models.blocks import InterpolationUpsampling
+    x_in = tf.keras.layers.Input(shape=(None, None, 1))
+    x = InterpolationUpsampling(SCALE, interpolation, name='InputInterpolation')(x_in)
+    return tf.keras.Model(x_in, model(x), name='test_pin')
+
+
+@pytest.mark.parametrize('interpolation', ['inter_area', 'bilinear', 'nearest'])
+@pytest.mark.parametrize('tile_size', [None, 24])
+def test_predict_graph_interpolation_matches_cpu_interpolation(array_lr, 
+                                                              interpolation,
+                                                              tile_size):
+    if tile_size is not None and interpolation == 'bilinear':
+        # the tiles are interpolated separately in-graph, the bilinear
+        # interpolation differs on their outer HR pixels (blended with low 
+        # weights), as the convolutions with padding of actual models
+        pytest.skip('tiles interpolated separately')
+    model = _pin_model()
+    kwargs = dict(array_in_hr=False, batch_size=2, device='CPU', 
+                  interpolation=interpolation)
+    y_hat = predict(model, array_lr, SCALE, **kwargs)
+    if tile_size is not None:
+        kwargs.update(tile_size=tile_size, tile_overlap=8)
+    y_hat_graph = predict(_graph_interpolation_model(model, interpolation), 
+                          array_lr, SCALE, **kwargs)
+    assert y_hat_graph.shape == y_hat.shape == (5, 48, 40, 1)
+    np.testing.assert_allclose(y_hat_graph, y_hat, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize('batch_size', [1, 2, 16])
+@pytest.mark.parametrize('tile_size', [None, 20])
+def test_spatiotemporal_predict_matches_collapsed_samples(batch_size, tile_size):
+    from dl4ds.dataloader import create_batch_hr_lr
+    from dl4ds.utils import spatiotemporal_to_spatial_samples
+    array = np.random.default_rng(3).normal(size=(8, 40, 36, 1)).astype('float32')
+    model = _spatiotemporal_pin_model()
+    y_hat = predict(model, array, SCALE, array_in_hr=True, time_window=3, 
+                    batch_size=batch_size, tile_size=tile_size, tile_overlap=8,
+                    device='CPU')
+    # all the samples at once, collapsed as before the batched collapse
+    [samples], _ = create_batch_hr_lr(np.arange(6), 0, array, None, 'pin', 
+                                      scale=SCALE, batch_size=6, time_window=3)
+    expected = spatiotemporal_to_spatial_samples(model.predict(samples, verbose=0), 3)
+    assert y_hat.shape == (8, 40, 36, 1)
+    np.testing.assert_allclose(y_hat, expected, rtol=1e-5, atol=1e-5)
+
+
+def _save_with_metadata(model, path, **metadata):
+    import json
+    from dl4ds.inference import _METADATA_FNAME
+    model.save(path, save_format='tf')
+    if metadata:
+        with open(f'{path}/{_METADATA_FNAME}', 'w') as f:
+            json.dump(metadata, f)
+
+
+def test_load_model_with_and_without_metadata(tmp_path, array_hr):
+    from dl4ds.inference import load_model
+    model = _pin_model()
+    _save_with_metadata(model, str(tmp_path / 'with'), scale=SCALE, time_window=None)
+    _save_with_metadata(model, str(tmp_path / 'without'))
+
+    loaded, metadata = load_model(tmp_path / 'with')
+    assert metadata == {'scale': SCALE, 'time_window': None}
+    assert loaded.optimizer is None
+    np.testing.assert_allclose(loaded.predict(array_hr, verbose=0), 
+                               model.predict(array_hr, verbose=0), rtol=1e-6)
+    # the upsampling is recovered from the model name
+    _, metadata = load_model(str(tmp_path / 'without') + '/')
+    assert metadata == {'upsampling': 'pin'}
+
+
+def test_load_model_latest_checkpoint(tmp_path):
+    from dl4ds.inference import _latest_checkpoint, load_model
+    checkpoints = tmp_path / 'checkpoints'
+    for epoch in [2, 10, 9]:
+        _save_with_metadata(_pin_model(), str(checkpoints / f'save_epoch{epoch}'), 
+                            epoch=epoch)
+    (checkpoints / 'save_epoch11_tmp').mkdir()
+    # epochs are compared as numbers, the checkpoints folder can be omitted
+    for path in [tmp_path, checkpoints]:
+        assert _latest_checkpoint(str(path)) == str(checkpoints / 'save_epoch10')
+    assert load_model(tmp_path)[1] == {'epoch': 10}
+
+    (tmp_path / 'empty').mkdir()
+    with pytest.raises(ValueError, match='No SavedModel'):
+        load_model(tmp_path / 'empty')
+    with pytest.raises(ValueError):
+        load_model(tmp_path / 'missing')
+
+
+def test_trainer_metadata_is_read_by_load_model(tmp_path):
+    from types import SimpleNamespace
+    from dl4ds.inference import load_model
+    from dl4ds.training.base import Trainer
+    path = str(tmp_path / 'model')
+    _pin_model().save(path, save_format='tf')
+    trainer = SimpleNamespace(
+        backbone='resnet', upsampling='pin', scale=SCALE, time_window=3, 
+        model_is_spatiotemporal=False, interpolation='bicubic', 
+        data_train_lr=None, static_vars=[np.zeros((4, 4))], precision='float32', 
+        batch_dtype='float16')
+    Trainer.save_metadata(trainer, path)
+    metadata = load_model(path)[1]
+    assert metadata['scale'] == SCALE and metadata['interpolation'] == 'bicubic'
+    # only spatio-temporal models have a time window
+    assert metadata['time_window'] is None
+    assert metadata['n_static_vars'] == 1 and not metadata['trained_with_lr']
+    assert metadata['batch_dtype'] == 'float16'
+
+
+def _positional_model(model):
+    """``model`` plus the position of each member in the batch, a 
+    reproducible stand-in for the Monte Carlo dropout noise."""
+    def add_position(t):
+        position = tf.range(tf.shape(t)[0])[:, tf.newaxis, tf.newaxis, tf.newaxis]
+        return t + tf.cast(position, t.dtype)
+    x_in = tf.keras.layers.Input(shape=(None, None, 1))
+    x = tf.keras.layers.Lambda(add_position)(model(x_in))
+    return tf.keras.Model(x_in, x, name='test_spc')
+
+
+def _positional_members(base, batch_size, mc_samples):
+    """Members [n_samples, mc_samples, ...] computed by ``_positional_model`` 
+    with the batches and model calls of ``_predict_mc``."""
+    samples_per_batch = max(1, batch_size // mc_samples)
+    members_per_pass = min(mc_samples, batch_size)
+    members = []
+    for i in range(0, len(base), samples_per_batch):
+        batch = base[i: i + samples_per_batch]
+        passes = []
+        for start in range(0, mc_samples, members_per_pass):
+            n = min(members_per_pass, mc_samples - start)
+            position = np.arange(len(batch) * n).reshape(len(batch), n)
+            passes.append(batch[:, None] + position[:, :, None, None, None])
+        members.append(np.concatenate(passes, axis=1))
+    return np.concatenate(members)
+
+
+@pytest.mark.parametrize('batch_size, mc_samples', [(8, 3), (2, 5), (4, 4), (3, 7)])
+@pytest.mark.parametrize('with_scaler', [False, True])
+def test_mc_predict_statistics(array_lr, batch_size, mc_samples, with_scaler):
+    from dl4ds.preprocessing import StandardScaler
+    model = _spc_model()
+    base = predict(model, array_lr, SCALE, array_in_hr=False, batch_size=5, 
+                   device='CPU')
+    members = _positional_members(base, batch_size, mc_samples)
+    quantiles = [0., 0.1, 0.5, 1.]
+    scaler = None
+    if with_scaler:
+        scaler = StandardScaler(axis=None).fit(array_lr * 4 + 2)
+        members = np.reshape(scaler.inverse_transform(members.copy()), 
+                             members.shape)
+    stats = predict(_positional_model(model), array_lr, SCALE, array_in_hr=False,
+                    device='CPU',
+                    batch_size=batch_size, mc_samples=mc_samples, 
+                    quantiles=quantiles, scaler=scaler)
+    assert sorted(stats) == ['mean', 'quantiles', 'std']
+    assert stats['quantiles'].shape == (4,) + base.shape
+    np.testing.assert_allclose(stats['mean'], members.mean(axis=1), 
+                               rtol=1e-5, atol=1e-4)
+    np.testing.assert_allclose(stats['std'], members.std(axis=1), 
+                               rtol=1e-5, atol=1e-4)
+    np.testing.assert_allclose(stats['quantiles'], 
+                               np.quantile(members, quantiles, axis=1), 
+                               rtol=1e-5, atol=1e-4)
+
+
+def test_mc_predict_deterministic_model(tmp_path, array_lr):
+    model = _spc_model()
+    kwargs = dict(array_in_hr=False, batch_size=4, device='CPU')
+    y_hat = predict(model, array_lr, SCALE, **kwargs)
+    stats = predict(model, array_lr, SCALE, mc_samples=3, 
+                    save_path=str(tmp_path), save_fname='y_hat.npy', **kwargs)
+    assert 'quantiles' not in stats
+    assert stats['mean'].dtype == np.float32
+    predictor = Predictor(model, array_lr, SCALE, mc_samples=3, quantiles=[0.5], 
+                          **kwargs)
+    np.testing.assert_allclose(predictor.run()['quantiles'][0], y_hat, 
+                               rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(stats['mean'], y_hat, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(stats['std'], 0, atol=1e-5)
+    for key in ['mean', 'std']:
+        np.testing.assert_array_equal(np.load(tmp_path / f'y_hat_{key}.npy'), 
+                                      stats[key])
+
+
+def test_mc_predict_spatiotemporal(array_hr):
+    model = _spatiotemporal_pin_model()
+    kwargs = dict(array_in_hr=True, time_window=3, batch_size=4, device='CPU')
+    y_hat = predict(model, array_hr, SCALE, **kwargs)
+    stats = predict(model, array_hr, SCALE, mc_samples=3, quantiles=[0.5], 
+                    **kwargs)
+    # the windows are collapsed per statistic, like the deterministic output
+    assert stats['mean'].shape == y_hat.shape
+    assert stats['quantiles'].shape == (1,) + y_hat.shape
+    np.testing.assert_allclose(stats['mean'], y_hat, rtol=1e-5, atol=1e-5)
+    np.testing.assert_allclose(stats['quantiles'][0], y_hat, rtol=1e-5, atol=1e-5)
+
+
+def test_mc_predict_with_mc_dropout(array_lr):
+    from dl4ds.models import MCDropout
+    x_in = tf.keras.layers.Input(shape=(None, None, 1))
+    x = MCDropout(0.5)(tf.keras.layers.Conv2D(8, 1)(x_in))
+    x = tf.keras.layers.Conv2D(SCALE ** 2, 1)(x)
+    x = tf.keras.layers.Lambda(lambda t: tf.nn.depth_to_space(t, SCALE))(x)
+    model = tf.keras.Model(x_in, x, name='test_spc')
+    kwargs = dict(array_in_hr=False, batch_size=8, device='CPU')
+    stats = predict(model, array_lr, SCALE, mc_samples=4, **kwargs)
+    assert np.all(np.isfinite(stats['std'])) and stats['std'].mean() > 0
+    # a single member has no spread
+    stats = predict(model, array_lr, SCALE, mc_samples=1, **kwargs)
+    np.testing.assert_array_equal(stats['std'], 0)
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(mc_samples=0), dict(mc_samples=2, quantiles=[0.5, 1.5]), 
+    dict(mc_samples=2, tile_size=8), dict(mc_samples=2, chunk_size=2), 
+    dict(mc_samples=2, return_lr=True)])
+def test_mc_predict_checks_arguments(array_lr, kwargs):
+    with pytest.raises(ValueError):
+        predict(_spc_model(), array_lr, SCALE, array_in_hr=False, device='CPU', 
+                **kwargs)
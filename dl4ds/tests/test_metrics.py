@@ -0,0 +1,174 @@
+import numpy as np
+import pytest
+
+from dl4ds.metrics import MetricsAccumulator, compute_metrics
+from dl4ds.preprocessing import MinMaxScaler, StandardScaler
+
+
+@pytest.fixture
+def arrays():
+    rng = np.random.default_rng(0)
+    y = rng.normal(size=(11, 12, 13, 1)).astype('float32') + 5
+    y_hat = (y + rng.normal(scale=0.3, size=y.shape)).astype('float32')
+    return y, y_hat
+
+
+@pytest.fixture
+def results(monkeypatch):
+    """Results of the accumulators reported by ``compute_metrics``."""
+    reported = []
+    def report(self, **kwargs):
+        reported.append((self, self.result()))
+    monkeypatch.setattr(MetricsAccumulator, 'report', report)
+    return reported
+
+
+def _reference(y, y_hat, mask=None):
+    """Metrics of the whole arrays at once, as before the chunked pass."""
+    if mask is not None:
+        y, y_hat = y * mask, y_hat * mask
+    data_range = max(y.max(), y_hat.max()) - min(y.min(), y_hat.min())
+    accumulator = MetricsAccumulator(data_range=data_range)
+    accumulator.update(y, y_hat)
+    return accumulator.result()
+
+
+def _assert_results_close(res, expected):
+    for key, value in expected.items():
+        np.testing.assert_allclose(res[key], value, rtol=1e-5, atol=1e-6, 
+                                   err_msg=key)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4, 256])
+def test_compute_metrics_chunked_matches_whole(arrays, results, chunk_size):
+    y, y_hat = arrays
+    compute_metrics(y, y_hat, chunk_size=chunk_size)
+    _assert_results_close(results[0][1], _reference(y, y_hat))
+
+
+@pytest.mark.parametrize('chunk_size', [1, 4])
+def test_compute_metrics_inverse_transforms_chunks(arrays, results, chunk_size):
+    y, y_hat = arrays
+    scaler = StandardScaler(axis=None).fit(y)
+    compute_metrics(scaler.transform(y), scaler.transform(y_hat), 
+                    scaler=scaler, chunk_size=chunk_size)
+    _assert_results_close(results[0][1], _reference(y, y_hat))
+
+
+def test_compute_metrics_uses_fitted_range(arrays, results):
+    y, y_hat = arrays
+    scaler = MinMaxScaler(axis=None).fit(y)
+    compute_metrics(scaler.transform(y), scaler.transform(y_hat), 
+                    scaler=scaler, chunk_size=4)
+    accumulator = results[0][0]
+    assert accumulator.data_range == pytest.approx(float(y.max() - y.min()))
+
+
+def test_compute_metrics_mask(arrays, results):
+    y, y_hat = arrays
+    mask = np.ones((12, 13))
+    mask[:3] = 0
+    compute_metrics(y, y_hat, mask=mask, chunk_size=4)
+    _assert_results_close(results[0][1], _reference(y, y_hat, mask[..., None]))
+
+
+def test_accumulator_mask_keeps_dtype(arrays):
+    y, y_hat = arrays
+    accumulator = MetricsAccumulator(mask=np.ones((12, 13)), data_range=1.)
+    accumulator.update(y, y_hat)
+    res = accumulator.result()
+    assert res['temp_rmse_map'].dtype == np.float32
+    assert res['meanbias_map'].dtype == np.float32
+
+
+def test_accumulator_warns_without_data_range(arrays):
+    y, y_hat = arrays
+    accumulator = MetricsAccumulator()
+    with pytest.warns(UserWarning, match='data_range'):
+        accumulator.update(y[:4], y_hat[:4])
+    assert accumulator.data_range == pytest.approx(
+        max(y[:4].max(), y_hat[:4].max()) - min(y[:4].min(), y_hat[:4].min()))
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(1)
+    y = rng.normal(size=(15, 6, 7, 1)).astype('float32')
+    y_hat = (y + rng.normal(scale=0.5, size=y.shape)).astype('float32')
+    # masked (zero) grid points, a constant series and ties
+    y[:, 0, :2] = 0
+    y_hat[:, 1, 1] = 2
+    y[:5, 2, 3] = 1
+    return y, y_hat
+
+
+@pytest.mark.parametrize('over', ['time', 'space'])
+@pytest.mark.parametrize('chunk_size', [None, 5])
+def test_vectorized_rmse_matches_joblib(series, over, chunk_size):
+    from dl4ds.metrics import compute_rmse
+    y, y_hat = series
+    out = compute_rmse(y, y_hat, over=over, chunk_size=chunk_size)
+    expected = compute_rmse(y, y_hat, over=over, vectorized=False, n_jobs=1)
+    np.testing.assert_allclose(out, expected, rtol=1e-5, atol=1e-6)
+    if over == 'time':
+        assert np.isnan(out[0, :2]).all() and not np.isnan(out[1:]).any()
+
+
+@pytest.mark.parametrize('mode', ['spearman', 'pearson'])
+@pytest.mark.parametrize('over', ['time', 'space'])
+@pytest.mark.parametrize('chunk_size', [None, 5])
+def test_vectorized_correlation_matches_joblib(series, mode, over, chunk_size):
+    from dl4ds.metrics import compute_correlation
+    y, y_hat = series
+    out = compute_correlation(y, y_hat, over=over, mode=mode, chunk_size=chunk_size)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        expected = compute_correlation(y, y_hat, over=over, mode=mode, 
+                                       vectorized=False, n_jobs=1)
+    np.testing.assert_allclose(out, np.asarray(expected, dtype=out.dtype), 
+                               rtol=1e-5, atol=1e-6)
+    if over == 'time':
+        # masked grid points and constant series
+        assert np.isnan(out[0, :2]).all() and np.isnan(out[1, 1])
+
+
+def test_correlation_unknown_mode(series):
+    from dl4ds.metrics import compute_correlation
+    with pytest.raises(ValueError):
+        compute_correlation(*series, mode='kendall')
+
+
+@pytest.mark.parametrize('chunk_sizes', [[11], [4, 4, 3], [1] * 11])
+def test_accumulator_matches_direct_metrics(arrays, chunk_sizes):
+    import tensorflow as tf
+    from dl4ds.metrics import compute_correlation, compute_rmse
+    y, y_hat = arrays
+    data_range = float(max(y.max(), y_hat.max()) - min(y.min(), y_hat.min()))
+    accumulator = MetricsAccumulator(data_range=data_range)
+    start = 0
+    for size in chunk_sizes:
+        accumulator.update(y[start: start + size], y_hat[start: start + size])
+        start += size
+    res = accumulator.result()
+
+    diff = y_hat.astype('float64') - y
+    mse = np.mean(diff ** 2, axis=(1, 2, 3))
+    np.testing.assert_allclose(res['spatial_rmse'], np.sqrt(mse), rtol=1e-6)
+    np.testing.assert_allclose(res['mae'], np.mean(np.abs(diff), axis=(1, 2, 3)), 
+                               rtol=1e-6)
+    np.testing.assert_allclose(res['psnr'], 20 * np.log10(data_range) - 10 * np.log10(mse),
+                               rtol=1e-6)
+    np.testing.assert_allclose(res['ssim'], tf.image.ssim(y, y_hat, data_range).numpy(),
+                               rtol=1e-5)
+    np.testing.assert_allclose(res['spatial_pearson_corr'], 
+                               compute_correlation(y, y_hat, 'space', 'pearson'), rtol=1e-6)
+    np.testing.assert_allclose(res['temp_rmse_map'], compute_rmse(y, y_hat), rtol=1e-5)
+    np.testing.assert_allclose(res['temp_pearson_corrmap'], 
+                               compute_correlation(y, y_hat, mode='pearson'), 
+                               rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(res['meanbias_map'], diff.mean(axis=0), rtol=1e-5, atol=1e-6)
+    assert res['mean_y'] == pytest.approx(y.mean(dtype='float64'))
+
+
+def test_accumulator_result_requires_data():
+    with pytest.raises(RuntimeError):
+        MetricsAccumulator(data_range=1.).result()
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import dl4ds
+
+
+def test_lazy_attributes():
+    for name, module_name in dl4ds._ATTRIBUTE_MODULES.items():
+        module = getattr(dl4ds, module_name)
+        assert getattr(dl4ds, name) is getattr(module, name)
+    # cached in the package namespace after the first access
+    assert 'StandardScaler' in vars(dl4ds)
+    assert dl4ds.preprocessing is sys.modules['dl4ds.preprocessing']
+
+
+def test_all_and_dir():
+    names = dir(dl4ds)
+    for name in dl4ds.__all__:
+        assert name in names
+    assert 'training' in names and 'Profiler' in names
+    assert len(set(dl4ds.__all__)) == len(dl4ds.__all__)
+    assert 'UPSAMPLING_METHODS' in dl4ds.__all__
+
+
+def test_unknown_attribute():
+    with pytest.raises(AttributeError, match='no_such_name'):
+        dl4ds.no_such_name
+    assert not hasattr(dl4ds, 'tf')
+
+
+def test_import_is_lazy_and_star_import_loads_everything():
+    code = ('import sys; import dl4ds; '
+            'assert "tensorflow" not in sys.modules; '
+            'assert "dl4ds.preprocessing" not in sys.modules; '
+            'from dl4ds import *; '
+            'assert "tensorflow" in sys.modules; '
+            'assert callable(net_postupsampling) and callable(StandardScaler)')
+    root = os.path.dirname(os.path.dirname(os.path.abspath(dl4ds.__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    subprocess.run([sys.executable, '-c', code], env=env, check=True)
@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+from dl4ds.predict_app import _output_coords, _read_static, _refine_coords
+
+
+@pytest.mark.parametrize('scale', [2, 3, 5])
+@pytest.mark.parametrize('step', [0.5, -1.])
+def test_refine_coords(scale, step):
+    values = 10 + step * np.arange(6)
+    refined = _refine_coords(values, scale)
+    assert len(refined) == 6 * scale
+    # a regular grid, the HR cells within each LR cell are centered on it
+    np.testing.assert_allclose(np.diff(refined), step / scale)
+    np.testing.assert_allclose(refined.reshape(6, scale).mean(axis=1), values)
+    np.testing.assert_array_equal(_refine_coords(values[:1], scale), 
+                                  np.full(scale, 10.))
+
+
+def test_output_coords():
+    import xarray as xr
+    data = xr.DataArray(np.zeros((3, 4, 2)), dims=('time', 'lat', 'lon'), 
+                        coords={'time': [5, 6, 7], 'lat': [0., 1., 2., 3.]})
+    coords = _output_coords(data, 2, array_in_hr=False)
+    assert list(coords) == ['time', 'lat', 'lon']
+    np.testing.assert_array_equal(coords['time'], [5, 6, 7])
+    np.testing.assert_allclose(coords['lat'], np.arange(8) / 2 - 0.25)
+    assert coords['lon'] is None
+    coords = _output_coords(data, 2, array_in_hr=True)
+    np.testing.assert_array_equal(coords['lat'], data['lat'].values)
+
+
+@pytest.mark.parametrize('ext', ['.npy', '.nc', '.zarr'])
+def test_read_static(tmp_path, ext):
+    import xarray as xr
+    static = np.random.default_rng(0).normal(size=(4, 3))
+    path = str(tmp_path / f'static{ext}')
+    if ext == '.npy':
+        np.save(path, static[None, :, :, None])
+    else:
+        dataset = xr.Dataset({'orog': (('y', 'x'), static)})
+        if ext == '.zarr':
+            dataset.to_zarr(path)
+        else:
+            dataset.to_netcdf(path)
+    np.testing.assert_allclose(_read_static(path), static)
+
+    if ext != '.npy':
+        path = str(tmp_path / f'two{ext}')
+        dataset = xr.Dataset({'orog': (('y', 'x'), static), 
+                              'mask': (('y', 'x'), static > 0)})
+        if ext == '.zarr':
+            dataset.to_zarr(path)
+        else:
+            dataset.to_netcdf(path)
+        with pytest.raises(ValueError, match='single variable'):
+            _read_static(path)
+
+
+def test_downscale_matches_predict(tmp_path):
+    import joblib
+    import tensorflow as tf
+    import xarray as xr
+    from absl import flags
+    from dl4ds.inference import predict
+    from dl4ds.predict_app import downscale
+    from dl4ds.preprocessing import StandardScaler
+
+    scale = 2
+    rng = np.random.default_rng(0)
+    array = rng.normal(size=(5, 6, 4)).astype('float32') * 3 + 280
+    lat = np.linspace(40, 45, 6)
+    data = xr.DataArray(array, dims=('time', 'lat', 'lon'), 
+                        coords={'time': np.arange(5), 'lat': lat, 
+                                'lon': np.linspace(0, 3, 4)})
+    xr.Dataset({'tas': data, 'pr': data * 0}).to_netcdf(tmp_path / 'tas_lr.nc')
+    scaler = StandardScaler(axis=None).fit(array)
+    joblib.dump(scaler, tmp_path / 'scaler.joblib')
+
+    x_in = tf.keras.layers.Input(shape=(None, None, 1))
+    x = tf.keras.layers.Conv2D(4, 1, activation='relu')(x_in)
+    model = tf.keras.Model(x_in, tf.keras.layers.Conv2D(1, 1)(x), name='test_pin')
+    model.save(str(tmp_path / 'model'), save_format='tf')
+
+    output = tmp_path / 'tas_hr.nc'
+    flags.FLAGS([
+        'dl4ds-predict', f'--model={tmp_path / "model"}', 
+        f'--input={tmp_path / "tas_lr.nc"}', '--variable=tas', f'--scale={scale}',
+        '--interpolation=bilinear', f'--scaler={tmp_path / "scaler.joblib"}', 
+        f'--output={output}', '--chunk_size=2', '--batch_size=3', '--device=CPU'])
+    try:
+        downscale([])
+    finally:
+        flags.FLAGS.unparse_flags()
+
+    expected = predict(model, scaler.transform(array)[..., None], scale, 
+                       array_in_hr=False, interpolation='bilinear', 
+                       scaler=scaler, batch_size=3, device='CPU')
+    with xr.open_dataset(output) as dataset:
+        y_hat = dataset['y_hat']
+        np.testing.assert_allclose(np.reshape(y_hat.values, expected.shape), 
+                                   expected, rtol=1e-5, atol=1e-4)
+        np.testing.assert_array_equal(y_hat['time'].values, np.arange(5))
+        np.testing.assert_allclose(y_hat['lat'].values, _refine_coords(lat, scale))
+
+
+def test_downscale_requires_scale_without_metadata(tmp_path):
+    import tensorflow as tf
+    from absl import flags
+    from dl4ds.predict_app import downscale
+
+    x_in = tf.keras.layers.Input(shape=(None, None, 1))
+    model = tf.keras.Model(x_in, tf.keras.layers.Conv2D(1, 1)(x_in), name='test_pin')
+    model.save(str(tmp_path / 'model'), save_format='tf')
+    np.save(tmp_path / 'x.npy', np.zeros((2, 4, 4, 1), 'float32'))
+    flags.FLAGS(['dl4ds-predict', f'--model={tmp_path / "model"}', 
+                 f'--input={tmp_path / "x.npy"}', '--device=CPU'])
+    try:
+        with pytest.raises(ValueError, match='--scale'):
+            downscale([])
+    finally:
+        flags.FLAGS.unparse_flags()
@@ -0,0 +1,180 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from dl4ds.preprocessing import MinMaxScaler, StandardScaler
+
+
+@pytest.fixture
+def data():
+    rng = np.random.default_rng(0)
+    return (rng.normal(size=(20, 6, 5, 2)) * 3 + 1).astype('float32')
+
+
+@pytest.fixture
+def data_nan(data):
+    data = data.copy()
+    # static NaNs (e.g., a land-sea mask) and a few NaNs varying in time
+    data[:, 0, :2] = np.nan
+    return data
+
+
+def _reference_stats(scaler, X):
+    """Statistics computed on the whole array, as before the chunked fitting."""
+    if isinstance(scaler, MinMaxScaler):
+        data_min = np.nanmin(X, axis=scaler.axis, keepdims=True)
+        data_max = np.nanmax(X, axis=scaler.axis, keepdims=True)
+        return {'data_min_': data_min, 'data_max_': data_max}
+    return {'mean_': np.nanmean(X, axis=scaler.axis, keepdims=True, dtype=np.float64),
+            'std_': np.nanstd(X, axis=scaler.axis, keepdims=True, dtype=np.float64)}
+
+
+def _reference_transform(scaler, X, stats):
+    if isinstance(scaler, MinMaxScaler):
+        scale = 1 / (stats['data_max_'] - stats['data_min_'])
+        out = X * scale - stats['data_min_'] * scale
+    else:
+        out = (X - stats['mean_']) / stats['std_']
+    return np.nan_to_num(out, nan=scaler.fillnanto)
+
+
+@pytest.mark.parametrize('scaler_class', [MinMaxScaler, StandardScaler])
+@pytest.mark.parametrize('axis', [None, 0, (0, 1, 2)])
+@pytest.mark.parametrize('chunk_size', [None, 3, 7, 20])
+@pytest.mark.parametrize('with_nans', [False, True])
+def test_chunked_fit_matches_in_memory(data, data_nan, scaler_class, axis, 
+                                       chunk_size, with_nans):
+    X = data_nan if with_nans else data
+    scaler = scaler_class(axis=axis).fit(X, chunk_size=chunk_size)
+    stats = _reference_stats(scaler, X)
+    for name, expected in stats.items():
+        np.testing.assert_allclose(getattr(scaler, name), expected, rtol=1e-5, 
+                                   atol=1e-6, err_msg=name)
+    out = scaler.transform(X, chunk_size=chunk_size)
+    np.testing.assert_allclose(out, _reference_transform(scaler, X, stats), 
+                               rtol=1e-4, atol=1e-5)
+    back = scaler.inverse_transform(out, chunk_size=chunk_size)
+    np.testing.assert_allclose(back, X, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize('scaler_class', [MinMaxScaler, StandardScaler])
+def test_partial_fit_merges_chunks(data_nan, scaler_class):
+    scaler = scaler_class(axis=0)
+    for start in range(0, 20, 6):
+        scaler.partial_fit(data_nan[start: start + 6])
+    expected = scaler_class(axis=0).fit(data_nan)
+    for name in _reference_stats(scaler, data_nan):
+        np.testing.assert_allclose(getattr(scaler, name), getattr(expected, name), 
+                                   rtol=1e-5, atol=1e-6)
+    np.testing.assert_array_equal(scaler.nan_mask, np.isnan(data_nan))
+    # fit resets the statistics
+    scaler.fit(data_nan[:2])
+    np.testing.assert_array_equal(scaler.nan_mask, np.isnan(data_nan[:2]))
+
+
+def test_standard_scaler_merges_chunks_with_all_nan_pixels(data):
+    X = data.copy()
+    # the pixel is only valid in the second chunk
+    X[:10, 1, 1] = np.nan
+    scaler = StandardScaler(axis=0)
+    scaler.partial_fit(X[:10]).partial_fit(X[10:])
+    np.testing.assert_allclose(scaler.mean_[0], np.nanmean(X, axis=0), rtol=1e-5)
+    np.testing.assert_allclose(scaler.std_[0], np.nanstd(X, axis=0), rtol=1e-5)
+    np.testing.assert_array_equal(scaler.n_samples_seen_[0, 1, 1], [10, 10])
+
+
+def test_nan_mask_is_compact(data, data_nan):
+    scaler = MinMaxScaler().fit(data_nan, chunk_size=4)
+    # static NaNs, a single time step is kept
+    assert scaler.nan_mask_.packed is None
+    np.testing.assert_array_equal(scaler.nan_mask, np.isnan(data_nan))
+    varying = data_nan.copy()
+    varying[13, 2, 3, 1] = np.nan
+    scaler = MinMaxScaler().fit(varying, chunk_size=4)
+    assert scaler.nan_mask_.packed is not None
+    assert scaler.nan_mask_.packed.nbytes < np.isnan(varying).nbytes
+    np.testing.assert_array_equal(scaler.nan_mask, np.isnan(varying))
+    with pytest.raises(AttributeError):
+        MinMaxScaler().fit(data).nan_mask
+
+
+def test_inverse_transform_chunk_restores_its_nans(data_nan):
+    X = data_nan.copy()
+    X[13, 2, 3, 1] = np.nan
+    scaler = StandardScaler().fit(X)
+    out = scaler.transform(X)
+    chunk = scaler.inverse_transform(out[12:16], start=12)
+    np.testing.assert_array_equal(np.isnan(chunk), np.isnan(X[12:16]))
+    # a single (squeezed) time step
+    step = scaler.inverse_transform(out[13], start=13)
+    assert step.shape == X.shape[1:]
+    np.testing.assert_array_equal(np.isnan(step), np.isnan(X[13]))
+    with pytest.raises(ValueError):
+        scaler.inverse_transform(out[:, :3])
+
+
+def test_transform_into_memmap(tmp_path, data):
+    path = str(tmp_path / 'data.npy')
+    np.save(path, data)
+    X = np.load(path, mmap_mode='r')
+    scaler = MinMaxScaler(axis=0).fit(X, chunk_size=6)
+    expected = MinMaxScaler(axis=0).fit(data).transform(data)
+    out = np.lib.format.open_memmap(str(tmp_path / 'out.npy'), mode='w+', 
+                                    dtype='float32', shape=X.shape)
+    assert scaler.transform(X, chunk_size=6, out=out) is out
+    np.testing.assert_allclose(out, expected, rtol=1e-6, atol=1e-6)
+    with pytest.raises(ValueError):
+        scaler.transform(X, out=out[:3])
+
+
+def test_transform_in_place(data):
+    X = data.copy()
+    scaler = StandardScaler(copy=False).fit(X)
+    expected = StandardScaler().fit(data).transform(data)
+    assert scaler.transform(X, chunk_size=7) is X
+    np.testing.assert_allclose(X, expected, rtol=1e-6, atol=1e-6)
+    # a float copy is made for integer inputs
+    X = data.astype('int32')
+    out = StandardScaler(copy=False).fit(X).transform(X)
+    assert out.dtype.kind == 'f' and not np.shares_memory(out, X)
+
+
+def test_dask_inputs(data_nan):
+    dims = ('time', 'lat', 'lon', 'var')
+    da = xr.DataArray(data_nan, dims=dims).chunk({'time': 6})
+    scaler = StandardScaler(axis=0).fit(da)
+    expected = StandardScaler(axis=0).fit(data_nan)
+    np.testing.assert_allclose(scaler.mean_, expected.mean_, rtol=1e-5)
+    np.testing.assert_allclose(scaler.std_, expected.std_, rtol=1e-5)
+    out = scaler.transform(da)
+    # transformed lazily, by blocks
+    assert out.chunks is not None
+    np.testing.assert_allclose(out.values, expected.transform(data_nan), 
+                               rtol=1e-5, atol=1e-6)
+    back = scaler.inverse_transform(out).values
+    np.testing.assert_array_equal(np.isnan(back), np.isnan(data_nan))
+
+
+def test_fit_list_input(data):
+    # converted to an array, as before the chunked fitting
+    scaler = MinMaxScaler().fit(data[..., 0].tolist(), chunk_size=5)
+    np.testing.assert_allclose(scaler.data_min_, data[..., 0].min(keepdims=True))
+
+
+def test_standard_scaler_with_mean_only(data):
+    scaler = StandardScaler(with_std=False).fit(data)
+    np.testing.assert_allclose(scaler.transform(data), data - data.mean(), 
+                               rtol=1e-5, atol=1e-5)
+
+
+def test_chunked_fit_requires_time_axis(data):
+    with pytest.raises(ValueError):
+        MinMaxScaler(axis=(1, 2)).fit(data, chunk_size=5)
+    scaler = MinMaxScaler(axis=(1, 2)).fit(data)
+    with pytest.raises(ValueError):
+        scaler.partial_fit(data)
+
+
+def test_invalid_inputs(data):
+    with pytest.raises(ValueError):
+        MinMaxScaler(value_range=(1, 0)).fit(data)
@@ -0,0 +1,226 @@
+import csv
+import json
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from dl4ds.profiling import Profiler, _count, _step, _timer
+
+
+def test_timers_nest():
+    profiler = Profiler()
+    with profiler:
+        for _ in range(3):
+            with profiler.timer('data_wait'):
+                with _timer('batch_assembly'):
+                    with _timer('resize'):
+                        time.sleep(0.001)
+        profiler.record('compute', 0.5)
+        _count('samples', 4)
+        _count('samples', 2)
+    report = profiler.report()
+    timers = {row['name']: row for row in report['timers']}
+    assert set(timers) == {'data_wait', 'data_wait/batch_assembly', 
+                           'data_wait/batch_assembly/resize', 'compute'}
+    assert timers['data_wait']['count'] == 3
+    assert (timers['data_wait']['total_s'] >= 
+            timers['data_wait/batch_assembly/resize']['total_s'] > 0.003)
+    row = timers['data_wait/batch_assembly']
+    assert row['min_s'] <= row['mean_s'] <= row['max_s']
+    assert timers['compute']['total_s'] == 0.5
+    assert report['counters'] == {'samples': 6}
+    assert report['wall_time_s'] > 0
+
+
+def test_threads_keep_their_own_stack():
+    profiler = Profiler()
+    with profiler:
+        with profiler.timer('train_step'):
+            def assemble():
+                with _timer('batch_assembly'):
+                    pass
+            thread = threading.Thread(target=assemble)
+            thread.start()
+            thread.join()
+    names = [row['name'] for row in profiler.report()['timers']]
+    assert names == ['batch_assembly', 'train_step']
+
+
+def test_inactive_profiler_is_a_no_op():
+    profiler = Profiler()
+    with _timer('read'), _step('predict_step'):
+        _count('samples')
+    assert profiler.report()['timers'] == [] and profiler.counters == {}
+    # the previous profiler is restored when a nested one stops
+    outer, inner = Profiler(), Profiler()
+    with outer:
+        with inner:
+            with _timer('read'):
+                pass
+        with _timer('resize'):
+            pass
+    with _timer('compute'):
+        pass
+    assert list(inner.timers) == ['read'] and list(outer.timers) == ['resize']
+
+
+def test_steps():
+    profiler = Profiler()
+    with profiler:
+        for _ in range(4):
+            with _step('train_step'):
+                with _timer('compute'):
+                    pass
+    report = profiler.report()
+    assert report['n_steps'] == 4
+    assert [(row['name'], row['count']) for row in report['timers']] == \
+        [('train_step', 4), ('train_step/compute', 4)]
+
+
+def test_save_and_summary(tmp_path, capsys):
+    profiler = Profiler()
+    with profiler:
+        with _timer('read'):
+            pass
+        _count('samples', 3)
+    path = str(tmp_path / 'profile')
+    profiler.save(path)
+    with open(path + '.json') as f:
+        report = json.load(f)
+    assert report['timers'][0]['name'] == 'read' and report['counters'] == {'samples': 3}
+    with open(path + '.csv') as f:
+        rows = list(csv.DictReader(f))
+    assert [(row['kind'], row['name']) for row in rows] == [('timer', 'read'), 
+                                                            ('counter', 'samples')]
+    assert rows[1]['count'] == '3'
+    profiler.summary()
+    out = capsys.readouterr().out
+    assert 'read' in out and 'samples' in out
+
+
+@pytest.mark.parametrize('trace_steps', [(2,), (3, 3), (-1, 2)])
+def test_invalid_trace_steps(trace_steps):
+    with pytest.raises(ValueError):
+        Profiler(trace_steps=trace_steps)
+
+
+def test_trace_capture(tmp_path):
+    trace_dir = str(tmp_path / 'trace')
+    profiler = Profiler(trace_steps=(1, 2), trace_dir=trace_dir)
+    with profiler:
+        for _ in range(3):
+            with profiler.step():
+                assert profiler._tracing == (profiler.n_steps == 1)
+    assert not profiler._tracing
+    import os
+    assert os.path.isdir(trace_dir) and os.listdir(trace_dir)
+
+
+def test_predict_profile(tmp_path):
+    import tensorflow as tf
+    from dl4ds.inference import predict
+    x_in = tf.keras.layers.Input(shape=(None, None, 1))
+    model = tf.keras.Model(x_in, tf.keras.layers.Conv2D(1, 1)(x_in), name='test_pin')
+    array = np.random.default_rng(0).normal(size=(5, 8, 8, 1)).astype('float32')
+    profiler = Profiler()
+    predict(model, array, 2, batch_size=2, save_path=str(tmp_path), 
+            profile=profiler, device='CPU')
+    report = profiler.report()
+    names = [row['name'] for row in report['timers']]
+    assert {'predict', 'batch_assembly', 'batch_assembly/read', 'write'} <= set(names)
+    assert report['counters']['samples'] == 5
+    assert (tmp_path / 'profile.json').exists() and (tmp_path / 'profile.csv').exists()
+
+
+def test_tiled_predict_profile_steps():
+    import tensorflow as tf
+    from dl4ds.inference import predict
+    x_in = tf.keras.layers.Input(shape=(None, None, 1))
+    model = tf.keras.Model(x_in, tf.keras.layers.Conv2D(1, 1)(x_in), name='test_pin')
+    array = np.random.default_rng(0).normal(size=(5, 16, 16, 1)).astype('float32')
+    with Profiler() as profiler:
+        predict(model, array, 2, batch_size=2, tile_size=8, tile_overlap=4, 
+                device='CPU')
+    report = profiler.report()
+    names = [row['name'] for row in report['timers']]
+    assert {'predict_step', 'predict_step/batch_assembly', 'predict_step/compute', 
+            'predict_step/host_to_device'} <= set(names)
+    # 3 batches of 3x3 tiles
+    assert report['n_steps'] == 27
+
+
+def test_throughput_monitor_epochs(tmp_path):
+    from dl4ds.profiling import ThroughputMonitor
+    log_path = str(tmp_path / 'throughput.csv')
+    with open(log_path, 'w') as f:
+        f.write('previous run\n')
+    monitor = ThroughputMonitor(batch_size=4, n_workers=2, log_path=log_path)
+    for epoch in range(2):
+        monitor.begin_epoch()
+        monitor.add_step(0.2, 0.05)
+        # the wait is at most the step time
+        monitor.add_step(0.1, 0.5)
+        logs = monitor.step_logs()
+        assert logs['input_wait'] == pytest.approx(0.15 / 0.3)
+        assert logs['samples_per_sec'] > 0
+        stats = monitor.end_epoch(epoch)
+    assert stats['steps'] == 2 and stats['samples'] == 16
+    assert stats['step_time_ms'] == pytest.approx(150)
+    assert stats['input_wait_s'] == pytest.approx(0.15)
+    assert stats['input_wait'] == pytest.approx(0.5)
+    assert stats['host_peak_mb'] > 0
+    assert len(monitor.history) == 2
+    with open(log_path) as f:
+        rows = list(csv.DictReader(f))
+    assert [row['epoch'] for row in rows] == ['0', '1']
+    assert list(rows[0]) == ThroughputMonitor.columns
+    assert 'waiting for data 50.0%' in monitor.summary(stats)
+
+
+def test_throughput_monitor_wait_not_measured():
+    from dl4ds.profiling import ThroughputMonitor
+    monitor = ThroughputMonitor(batch_size=2)
+    monitor.begin_epoch()
+    monitor.add_step(0.1, 0.05)
+    monitor.add_step(0.1, None)
+    assert 'input_wait' not in monitor.step_logs()
+    stats = monitor.end_epoch(0)
+    assert np.isnan(stats['input_wait']) and np.isnan(stats['input_wait_s'])
+    assert 'input wait not measured' in monitor.summary(stats)
+    # measured again in the next epoch
+    monitor.begin_epoch()
+    monitor.add_step(0.1, 0.05)
+    assert monitor.end_epoch(1)['input_wait'] == pytest.approx(0.5)
+
+
+@pytest.mark.parametrize('measure_input_wait', [True, False])
+def test_throughput_callback_with_fit(measure_input_wait):
+    import tensorflow as tf
+    from dl4ds.profiling import ThroughputMonitor
+    from dl4ds.training.callbacks import ThroughputCallback
+
+    monitor = ThroughputMonitor(batch_size=2)
+    callback = ThroughputCallback(monitor, measure_input_wait=measure_input_wait)
+
+    class Batches(tf.keras.utils.Sequence):
+        def __len__(self):
+            return 3
+
+        def __getitem__(self, index):
+            time.sleep(0.01)
+            callback.batch_ready()
+            return np.ones((2, 4), 'float32'), np.ones((2, 1), 'float32')
+
+    model = tf.keras.Sequential([tf.keras.layers.Dense(1, input_shape=(4,))])
+    model.compile(optimizer='sgd', loss='mse')
+    history = model.fit(Batches(), epochs=2, verbose=0, callbacks=[callback])
+    assert [stats['steps'] for stats in monitor.history] == [3, 3]
+    assert all(stats['samples'] == 6 for stats in monitor.history)
+    if measure_input_wait:
+        assert all(0 <= stats['input_wait'] <= 1 for stats in monitor.history)
+    else:
+        assert all(np.isnan(stats['input_wait']) for stats in monitor.history)
+    # the statistics are not part of the learning curve
+    assert set(history.history) == {'loss'}
@@ -0,0 +1,50 @@
+import inspect
+
+import pytest
+
+from dl4ds.training import CGANTrainer, SupervisedTrainer, Trainer
+
+
+@pytest.mark.parametrize('trainer', [Trainer, SupervisedTrainer, CGANTrainer])
+@pytest.mark.parametrize('param', ['report_throughput', 'profile', 
+                                   'static_on_device'])
+def test_instrumentation_is_opt_in(trainer, param):
+    parameters = inspect.signature(trainer.__init__).parameters
+    if param in parameters:
+        assert parameters[param].default is False
+
+
+def test_plain_model_checkpoint_saves_the_plain_model(tmp_path):
+    import numpy as np
+    import tensorflow as tf
+    from dl4ds.dataloader import StaticFields, create_batch_hr_lr
+    from dl4ds.training.callbacks import PlainModelCheckpoint
+
+    rng = np.random.default_rng(0)
+    hr = rng.normal(size=(8, 8, 8, 1)).astype('float32')
+    static = [rng.normal(size=(8, 8)).astype('float32')]
+    x_in = tf.keras.layers.Input(shape=(None, None, 2))
+    aux_in = tf.keras.layers.Input(shape=(None, None, 1))
+    x = tf.keras.layers.UpSampling2D(2)(tf.keras.layers.Conv2D(1, 1)(x_in))
+    x = tf.keras.layers.Conv2D(1, 1)(tf.keras.layers.Concatenate()([x, aux_in]))
+    model = tf.keras.Model([x_in, aux_in], x, name='test_spc')
+    layer = StaticFields(static, 2, lr_sized=True)
+    wrapper = layer.wrap(model)
+    wrapper.compile(optimizer='adam', loss='mae')
+
+    inputs, [batch_hr] = create_batch_hr_lr(np.arange(8), 0, hr, None, 'spc', 
+                                            scale=2, batch_size=8, patch_size=4,
+                                            static_vars=static, 
+                                            static_on_device=True)
+    path = str(tmp_path / 'best_model')
+    checkpoint = PlainModelCheckpoint(path, model, save_weights_only=False, 
+                                      monitor='loss', save_best_only=False)
+    wrapper.fit(inputs, batch_hr, epochs=2, batch_size=4, verbose=0, 
+                callbacks=[checkpoint])
+
+    saved = tf.keras.models.load_model(path, compile=False)
+    assert len(saved.inputs) == 2
+    plain_inputs = [np.asarray(x) for x in layer(inputs)]
+    np.testing.assert_allclose(saved.predict(plain_inputs, verbose=0),
+                               model.predict(plain_inputs, verbose=0), 
+                               rtol=1e-5, atol=1e-5)
@@ -0,0 +1,202 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+
+from dl4ds.utils import checkarg_precision, precision_policy
+
+
+@pytest.mark.parametrize('precision', ['mixed_float16', 'mixed_bfloat16'])
+def test_precision_policy_restores_the_global_policy(precision):
+    previous = tf.keras.mixed_precision.global_policy().name
+    with precision_policy(precision):
+        assert tf.keras.mixed_precision.global_policy().name == precision
+    assert tf.keras.mixed_precision.global_policy().name == previous
+    with pytest.raises(RuntimeError):
+        with precision_policy(precision):
+            raise RuntimeError
+    assert tf.keras.mixed_precision.global_policy().name == previous
+
+
+@pytest.mark.parametrize('precision, error', [('float64', ValueError),
+                                              (16, TypeError)])
+def test_checkarg_precision(precision, error):
+    with pytest.raises(error):
+        checkarg_precision(precision)
+
+
+@pytest.mark.parametrize('precision', ['mixed_float16', 'mixed_bfloat16'])
+def test_mixed_precision_models_output_float32(precision):
+    from dl4ds.models import net_postupsampling
+    with precision_policy(precision):
+        model = net_postupsampling('resnet', 'spc', 2, n_channels=1,
+                                   n_aux_channels=0, lr_size=(6, 8),
+                                   n_filters=4, n_blocks=1)
+    assert model.outputs[0].dtype == tf.float32
+    assert all(v.dtype == tf.float32 for v in model.trainable_variables)
+    out = model(np.ones((2, 6, 8, 1), 'float32'))
+    assert out.dtype == tf.float32 and out.shape == (2, 12, 16, 1)
+
+
+@pytest.mark.parametrize('dtype', ['float16', 'bfloat16'])
+def test_half_precision_batches(dtype):
+    from dl4ds.dataloader import create_batch_hr_lr
+    hr = np.random.default_rng(0).normal(size=(4, 8, 8, 1)).astype('float32')
+    static = [np.ones((8, 8))]
+    [batch_lr, batch_aux], [batch_hr] = create_batch_hr_lr(
+        np.arange(4), 0, hr, None, 'spc', scale=2, batch_size=4,
+        static_vars=static, dtype=dtype)
+    [expected_lr, _], _ = create_batch_hr_lr(
+        np.arange(4), 0, hr, None, 'spc', scale=2, batch_size=4,
+        static_vars=static)
+    for batch in [batch_lr, batch_aux, batch_hr]:
+        assert batch.dtype == tf.as_dtype(dtype).as_numpy_dtype
+    np.testing.assert_allclose(batch_lr.astype('float32'), expected_lr,
+                               rtol=1e-2, atol=1e-2)
+
+
+def _reference_spatiotemporal_samples(array, time_window):
+    """Samples filled in a loop, as before the sliding-window view."""
+    n_t_samples = array.shape[0] - (time_window - 1)
+    array_out = np.zeros((n_t_samples, time_window) + array.shape[1:])
+    for i in range(n_t_samples):
+        array_out[i] = array[i: i + time_window]
+    return array_out
+
+
+@pytest.mark.parametrize('time_window', [1, 3, 6])
+def test_spatial_to_spatiotemporal_samples(time_window):
+    from dl4ds.utils import (spatial_to_spatiotemporal_samples, 
+                             spatiotemporal_to_spatial_samples)
+    array = np.random.default_rng(0).normal(size=(6, 4, 3, 2)).astype('float32')
+    expected = _reference_spatiotemporal_samples(array, time_window)
+    samples = spatial_to_spatiotemporal_samples(array, time_window)
+    assert samples.dtype == np.float64 and samples.flags.writeable
+    assert not np.shares_memory(samples, array)
+    np.testing.assert_array_equal(samples, expected)
+    samples[0] = 0
+    view = spatial_to_spatiotemporal_samples(array, time_window, copy=False)
+    assert view.dtype == np.float32 and not view.flags.writeable
+    assert np.shares_memory(view, array)
+    np.testing.assert_array_equal(view, expected)
+    np.testing.assert_array_equal(
+        spatiotemporal_to_spatial_samples(view, time_window), array)
+
+
+_CV_METHODS = {'nearest': 0, 'bilinear': 1, 'bicubic': 2, 'inter_area': 3, 
+               'lanczos': 4}
+
+
+def _reference_resize(array, newsize, interpolation):
+    """Frame by frame OpenCV resize, as before the batched engine. The frames
+    with more channels than supported by OpenCV (which failed before) are 
+    resized channel by channel."""
+    import cv2
+    method = _CV_METHODS[interpolation]
+    max_channels = 4 if interpolation == 'inter_area' else 128
+    frames = []
+    for frame in array:
+        if frame.shape[-1] > max_channels:
+            out = np.stack([cv2.resize(frame[..., c], newsize, interpolation=method) 
+                            for c in range(frame.shape[-1])], axis=-1)
+        else:
+            out = cv2.resize(frame, newsize, interpolation=method)
+        frames.append(out.reshape(out.shape[:2] + (frame.shape[-1],)))
+    return np.stack(frames)
+
+
+@pytest.mark.parametrize('interpolation', list(_CV_METHODS))
+@pytest.mark.parametrize('newsize', [(6, 5), (24, 20), (7, 9)])
+@pytest.mark.parametrize('n_channels', [1, 3, 6, 130])
+def test_resize_array_matches_opencv(interpolation, newsize, n_channels):
+    from dl4ds.utils import resize_array
+    array = np.random.default_rng(0).normal(size=(3, 10, 12, n_channels)).astype('float32')
+    out = resize_array(array, newsize, interpolation, squeezed=False)
+    assert out.dtype == np.float32
+    assert out.shape == (3, newsize[1], newsize[0], n_channels)
+    np.testing.assert_allclose(out, _reference_resize(array, newsize, interpolation),
+                               rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('interpolation', list(_CV_METHODS))
+def test_resize_array_2d_3d_inputs(interpolation):
+    import cv2
+    from dl4ds.utils import resize_array
+    grid = np.random.default_rng(1).normal(size=(10, 12))
+    expected = cv2.resize(grid, (6, 5), interpolation=_CV_METHODS[interpolation])
+    out = resize_array(grid, (6, 5), interpolation)
+    assert out.dtype == np.float64
+    np.testing.assert_array_equal(out, expected)
+    out = resize_array(grid[..., None], (6, 5), interpolation, squeezed=False)
+    assert out.shape == (5, 6, 1)
+    np.testing.assert_array_equal(out[..., 0], expected)
+
+
+@pytest.mark.parametrize('dtype', ['uint8', 'uint16', 'int16'])
+@pytest.mark.parametrize('interpolation', list(_CV_METHODS))
+@pytest.mark.parametrize('n_channels', [1, 6])
+def test_resize_array_opencv_integer_types(dtype, interpolation, n_channels):
+    from dl4ds.utils import resize_array
+    info = np.iinfo(dtype)
+    array = np.random.default_rng(2).integers(info.min, info.max, 
+                                              size=(2, 12, 12, n_channels), 
+                                              dtype=dtype, endpoint=True)
+    for newsize in [(6, 4), (20, 18)]:
+        out = resize_array(array, newsize, interpolation, squeezed=False)
+        assert out.dtype == np.dtype(dtype)
+        np.testing.assert_array_equal(
+            out, _reference_resize(array, newsize, interpolation))
+
+
+@pytest.mark.parametrize('dtype', ['bool', 'int8', 'int32', 'int64', 'uint32'])
+@pytest.mark.parametrize('newsize', [(6, 5), (24, 20), (7, 9)])
+def test_resize_array_other_types_nearest(dtype, newsize):
+    from dl4ds.utils import resize_array
+    rng = np.random.default_rng(3)
+    array = rng.integers(0, 100, size=(2, 10, 12, 2)).astype(dtype)
+    if dtype == 'int64':
+        # values not representable in float32 are kept
+        array = array + np.int64(2**40)
+    out = resize_array(array, newsize, 'bilinear', squeezed=False)
+    assert out.dtype == np.dtype(dtype)
+    # nearest neighbors, as OpenCV on the row/column indices
+    expected = _reference_resize(np.arange(120, dtype='float32').reshape(1, 10, 12, 1),
+                                 newsize, 'nearest').astype(int)[0, ..., 0]
+    rows, cols = np.divmod(expected, 12)
+    np.testing.assert_array_equal(out, array[:, rows, cols])
+
+
+@pytest.mark.parametrize('dtype', ['float32', 'uint8'])
+def test_resize_array_block_mean(dtype):
+    from dl4ds.utils import resize_array
+    rng = np.random.default_rng(4)
+    array = (rng.random(size=(2, 12, 8, 7)) * 255).astype(dtype)
+    out = resize_array(array, (4, 3), 'inter_area', squeezed=False)
+    assert out.dtype == np.dtype(dtype)
+    expected = _reference_resize(array, (4, 3), 'inter_area')
+    if dtype == 'uint8':
+        # rounded as OpenCV, up to the rounding of exact halves
+        np.testing.assert_allclose(out, expected, atol=1)
+    else:
+        np.testing.assert_allclose(out, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_resize_array_workers_and_half_precision():
+    from dl4ds.utils import resize_array
+    array = np.random.default_rng(5).normal(size=(9, 10, 12, 2)).astype('float32')
+    single = resize_array(array, (24, 20), 'bicubic', workers=1)
+    np.testing.assert_array_equal(resize_array(array, (24, 20), 'bicubic', 
+                                               workers=4), single)
+    half = resize_array(array.astype('float16'), (24, 20), 'bicubic')
+    assert half.dtype == np.float16
+    np.testing.assert_allclose(half, single, rtol=1e-2, atol=1e-2)
+
+
+def test_resize_array_keep_dynamic_range_and_errors():
+    from dl4ds.utils import resize_array
+    array = np.random.default_rng(6).normal(size=(10, 12))
+    out = resize_array(array, (24, 20), 'lanczos', keep_dynamic_range=True)
+    assert out.min() >= array.min() and out.max() <= array.max()
+    with pytest.raises(ValueError):
+        resize_array(array, (24, 20), 'cubic')
+    with pytest.raises(RuntimeError):
+        resize_array(array[None, None, ..., None], (24, 20))
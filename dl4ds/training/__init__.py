@@ -1,2 +1,3 @@
 from .supervised import *
 from .cgan import *
+from .callbacks import *
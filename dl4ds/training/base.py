@@ -3,6 +3,7 @@ Base training class
 """
 
 import os
+import json
 import xarray as xr
 import numpy as np
 import tensorflow as tf
@@ -17,8 +18,13 @@ try:
 except ImportError:
     has_horovod = False
 
+from .. import __version__
+from ..datasources import DataSource, to_shared_memory
+from ..inference import _METADATA_FNAME
+from ..profiling import Profiler, ThroughputMonitor
 from ..utils import (list_devices, set_gpu_memory_growth, plot_history, checkarg_loss,
-                     set_visible_gpus, check_compatibility_upsbackb)
+                     set_visible_gpus, check_compatibility_upsbackb, 
+                     checkarg_precision)
 
 
 class Trainer(ABC):
@@ -43,21 +49,30 @@ class Trainer(ABC):
         save=True,
         save_path=None,
         show_plot=False,
+        use_tf_data=False,
+        deterministic=False,
+        precision='float32',
+        batch_dtype='float32',
+        shared_memory=False,
+        shm_dir='/dev/shm',
+        profile=False,
+        profile_trace_steps=None,
+        report_throughput=False,
         ):
         """
         """
         # checking training data split (both hr and lr)
         self.data_train = data_train
-        if not isinstance(self.data_train, (xr.DataArray, np.ndarray)):
-            msg = '`data_train` object must be of np.ndarray or xr.DataArray type'
+        if not isinstance(self.data_train, (xr.DataArray, np.ndarray, DataSource)):
+            msg = '`data_train` object must be of np.ndarray, xr.DataArray or dl4ds.DataSource type'
             raise TypeError(msg)
         if not self.data_train.ndim > 3:
             msg = '`data_train` must be at least 4D [samples, lat, lon, variables]'
             raise ValueError(msg)
         self.data_train_lr = data_train_lr
         if self.data_train_lr is not None:
-            if not isinstance(self.data_train_lr, (xr.DataArray, np.ndarray)):
-                msg = '`data_train_lr` must be a np.ndarray or xr.DataArray object'
+            if not isinstance(self.data_train_lr, (xr.DataArray, np.ndarray, DataSource)):
+                msg = '`data_train_lr` must be a np.ndarray, xr.DataArray or dl4ds.DataSource object'
                 raise TypeError(msg)
             if self.data_train_lr.shape[0] != self.data_train.shape[0]:
                 msg = '`data_train_lr` and `data_train` must contain '
@@ -82,6 +97,12 @@ class Trainer(ABC):
         self.device = device
         self.gpu_memory_growth = gpu_memory_growth
         self.use_multiprocessing = use_multiprocessing
+        self.use_tf_data = use_tf_data
+        self.deterministic = deterministic
+        self.precision = checkarg_precision(precision)
+        self.batch_dtype = batch_dtype
+        self.shared_memory = shared_memory
+        self.shm_dir = shm_dir
         self.verbose = verbose
         self.model_list = model_list
         self.save = save
@@ -93,6 +114,15 @@ class Trainer(ABC):
                 self.save_path += '/'
         self.savecheckpoint_path = self.save_path
         self.show_plot = show_plot
+        if isinstance(profile, Profiler):
+            self.profiler = profile
+        elif profile:
+            self.profiler = Profiler(trace_steps=profile_trace_steps, 
+                                     trace_dir=self.save_path + 'profiler_trace')
+        else:
+            self.profiler = None
+        self.report_throughput = report_throughput
+        self.throughput = None
        
         if has_horovod:
             ### Initializing Horovod
@@ -155,10 +185,79 @@ class Trainer(ABC):
     def run(self):
         pass
 
+    def setup_shared_memory(self):
+        """Put the training arrays (``data_train``, ``data_train_lr``, 
+        ``predictors_train`` and ``static_vars``) in node-local shared memory
+        (``shm_dir``), see ``dl4ds.to_shared_memory``. With Horovod, the data 
+        is read and copied only by the first local rank of each node, and all 
+        the local ranks map the same memory instead of holding their own copy. 
+        The files are removed once mapped by all the ranks, or if the copy 
+        fails. Nothing is done with a single local rank (e.g., without 
+        Horovod), the data loading workers forked by the process already share 
+        its memory.
+        """
+        if not has_horovod or hvd.local_size() == 1:
+            if self.verbose and self.running_on_first_worker:
+                print('A single local rank, `shared_memory` is ignored')
+            return
+
+        # a token shared by all the ranks for naming the files of this job
+        token = np.random.randint(0, 2**31 - 1) if hvd.rank() == 0 else 0
+        token = int(np.asarray(hvd.broadcast(tf.constant(token, tf.int64), 
+                                             root_rank=0, name='dl4ds_shm_token')))
+        is_writer = hvd.local_rank() == 0
+        barrier = _horovod_barrier
+        
+        paths = []
+        def share(data, name, time_series=True):
+            path = os.path.join(self.shm_dir, f'dl4ds_{token}_{name}.npy')
+            paths.append(path)
+            return to_shared_memory(data, path, is_writer=is_writer, 
+                                    barrier=barrier, time_series=time_series)
+
+        try:
+            self.data_train = share(self.data_train, 'data_train')
+            if self.data_train_lr is not None:
+                self.data_train_lr = share(self.data_train_lr, 'data_train_lr')
+            if getattr(self, 'predictors_train', None) is not None:
+                self.predictors_train = [share(pred, f'predictors_train{i}') 
+                                         for i, pred in enumerate(self.predictors_train)]
+            if getattr(self, 'static_vars', None) is not None:
+                self.static_vars = [share(var, f'static_vars{i}', time_series=False) 
+                                    for i, var in enumerate(self.static_vars)]
+            barrier()
+        finally:
+            if is_writer:
+                for path in paths:
+                    if os.path.exists(path):
+                        os.remove(path)
+
     @abstractmethod
     def setup_model(self):
         pass
 
+    def setup_throughput_monitor(self, batch_size):
+        """Monitor of the training throughput (see ``dl4ds.ThroughputMonitor``)
+        if ``report_throughput`` is True, or None. Only the first worker 
+        writes the log (``save_path``/throughput.csv).
+        """
+        if not self.report_throughput:
+            return None
+        n_workers = hvd.size() if has_horovod else 1
+        log_path = None
+        if self.save and self.running_on_first_worker:
+            os.makedirs(self.save_path, exist_ok=True)
+            log_path = self.save_path + 'throughput.csv'
+        return ThroughputMonitor(batch_size, n_workers=n_workers, log_path=log_path)
+
+    def stop_profiler(self):
+        """Stop the profiler (if any) and print its summary.
+        """
+        if self.profiler is not None:
+            self.profiler.stop()
+            if self.verbose and self.running_on_first_worker:
+                self.profiler.summary()
+
     def save_results(self, model_to_save=None, folder_prefix=None):
         """ 
         Save the TF model, learning curve, running time and test score. 
@@ -175,8 +274,11 @@ class Trainer(ABC):
             if self.running_on_first_worker:
                 os.makedirs(self.model_save_path, exist_ok=True)
                 model_to_save.save(self.model_save_path, save_format='tf')        
+                self.save_metadata(self.model_save_path)
                 np.savetxt(self.save_path + 'running_time.txt', [self.timing.running_time], fmt='%s')
                 np.savetxt(self.save_path + 'test_loss.txt', [self.test_loss], fmt='%0.6f')
+                if self.profiler is not None:
+                    self.profiler.save(self.save_path + 'profile')
 
             if hasattr(self, 'fithist'):
                 learning_curve_fname = self.save_path + 'learning_curve.png'
@@ -186,3 +288,30 @@ class Trainer(ABC):
                 else:
                     close()
 
+    def save_metadata(self, path):
+        """ 
+        Save the parameters needed for inference with the saved model (e.g., 
+        ``scale`` and ``time_window``) to ``path``/dl4ds_metadata.json. They 
+        are read by ``dl4ds.load_model`` and the ``dl4ds-predict`` app.
+        """
+        static_vars = getattr(self, 'static_vars', None)
+        metadata = {
+            'dl4ds_version': __version__,
+            'backbone': self.backbone,
+            'upsampling': self.upsampling,
+            'scale': self.scale,
+            'time_window': self.time_window if self.model_is_spatiotemporal else None,
+            'interpolation': getattr(self, 'interpolation', 'inter_area'),
+            'trained_with_lr': self.data_train_lr is not None,
+            'n_static_vars': 0 if static_vars is None else len(static_vars),
+            'predictors': getattr(self, 'predictors_train', None) is not None,
+            'precision': self.precision,
+            'batch_dtype': self.batch_dtype}
+        with open(os.path.join(path, _METADATA_FNAME), 'w') as f:
+            json.dump(metadata, f, indent=4)
+
+
+def _horovod_barrier():
+    """Block until all the Horovod ranks reach this point.
+    """
+    hvd.allreduce(tf.constant(0.), name='dl4ds_barrier')
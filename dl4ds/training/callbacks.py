@@ -0,0 +1,164 @@
+"""
+Keras callbacks for profiling and monitoring the training with ``model.fit``
+"""
+
+import time
+import threading
+import tensorflow as tf
+from collections import deque
+
+
+class ProfilerCallback(tf.keras.callbacks.Callback):
+    """
+    Keras callback recording the training steps ('train_step'), epochs,
+    validation and end-of-epoch callbacks ('checkpoint', e.g.,
+    ModelCheckpoint and EarlyStopping) of ``model.fit`` in a
+    ``dl4ds.Profiler``. It must be the first callback of the list. With Keras,
+    the time waiting for the batches is part of 'train_step', the batch
+    assembly is recorded separately by the data generators.
+    """
+    def __init__(self, profiler):
+        super().__init__()
+        self.profiler = profiler
+        self._step_start = None
+        self._epoch_start = None
+        self._epoch_end = None
+        self._test_start = None
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.profiler.begin_step()
+        self._step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.profiler.record('train_step', time.perf_counter() - self._step_start)
+        self.profiler.end_step()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._record_checkpoint()
+        self._epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self._epoch_end = time.perf_counter()
+        self.profiler.record('epoch', self._epoch_end - self._epoch_start)
+
+    def on_test_begin(self, logs=None):
+        self._test_start = time.perf_counter()
+
+    def on_test_end(self, logs=None):
+        self.profiler.record('validation', time.perf_counter() - self._test_start)
+
+    def on_train_end(self, logs=None):
+        self._record_checkpoint()
+
+    def _record_checkpoint(self):
+        # time spent by the callbacks following this one at the end of the epoch
+        if self._epoch_end is not None:
+            self.profiler.record('checkpoint', time.perf_counter() - self._epoch_end)
+            self._epoch_end = None
+
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    """
+    Keras callback feeding a ``ThroughputMonitor`` with the training steps of
+    ``model.fit`` and adding the statistics of the epoch so far to the batch
+    logs (shown by the progress bar if it lists 
+    ``ThroughputMonitor.progbar_metrics`` as stateful metrics). 
+
+    Keras waits for the batches within the train step, so the input wait is 
+    estimated from the time each batch is ready: the data generator calls 
+    ``batch_ready`` when a batch is assembled and the batches are assumed to
+    be consumed in the order they are completed. The wait is not estimated 
+    for the first step, which includes the tracing of the train function.
+    When the batches are assembled in other processes (Keras 
+    ``use_multiprocessing``), ``batch_ready`` cannot be called and the input
+    wait is reported as not measured (``measure_input_wait=False``).
+    """
+    def __init__(self, monitor, recreate_iterator=True, measure_input_wait=True):
+        """
+        Parameters
+        ----------
+        monitor : ThroughputMonitor
+            Monitor collecting the statistics.
+        recreate_iterator : bool, optional
+            Whether the input is iterated anew at every epoch (Keras Sequence),
+            discarding the batches prefetched at the end of the previous epoch,
+            or continuously (repeated tf.data.Dataset).
+        measure_input_wait : bool, optional
+            Whether ``batch_ready`` is called in this process when the batches
+            are ready. If False, the input wait is not estimated.
+        """
+        super().__init__()
+        self.monitor = monitor
+        self.recreate_iterator = recreate_iterator
+        self.measure_input_wait = measure_input_wait
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._step_start = None
+        self._epoch_end = None
+        self._first_step = True
+
+    def batch_ready(self):
+        """Record that a batch is ready (called by the data generator).
+        """
+        with self._lock:
+            self._ready.append(time.perf_counter())
+
+    def on_train_begin(self, logs=None):
+        # batches probed before training (e.g., for the input shapes)
+        with self._lock:
+            self._ready.clear()
+        self._first_step = True
+
+    def on_epoch_begin(self, epoch, logs=None):
+        if self.recreate_iterator and self._epoch_end is not None:
+            with self._lock:
+                while self._ready and self._ready[0] <= self._epoch_end:
+                    self._ready.popleft()
+        self.monitor.begin_epoch()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        step_end = time.perf_counter()
+        with self._lock:
+            ready = self._ready.popleft() if self._ready else None
+        if not self.measure_input_wait:
+            wait_time = None
+        elif ready is None or self._first_step:
+            wait_time = 0.
+        else:
+            wait_time = max(0., min(ready, step_end) - self._step_start)
+        self._first_step = False
+        self.monitor.add_step(step_end - self._step_start, wait_time)
+        if logs is not None:
+            logs.update(self.monitor.step_logs())
+
+    def on_epoch_end(self, epoch, logs=None):
+        self._epoch_end = time.perf_counter()
+        self.monitor.end_epoch(epoch)
+
+
+class PlainModelCheckpoint(tf.keras.callbacks.ModelCheckpoint):
+    """
+    Keras ModelCheckpoint saving a given ``model`` instead of the one trained 
+    by ``model.fit``. When the training runs on the ``dl4ds.StaticFields`` 
+    wrapper (taking the crop offsets of the static variables), the plain 
+    model is saved, with the same inputs as the models saved by the trainers.
+    """
+    def __init__(self, filepath, model, **kwargs):
+        """
+        Parameters
+        ----------
+        filepath : str
+            Path where the model is saved.
+        model : tf.keras.Model
+            Model to be saved, sharing its layers with the trained one.
+        **kwargs : dict
+            Arguments of ``tf.keras.callbacks.ModelCheckpoint``.
+        """
+        super().__init__(filepath, **kwargs)
+        self._plain_model = model
+
+    def set_model(self, model):
+        super().set_model(self._plain_model)
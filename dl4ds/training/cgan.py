@@ -3,6 +3,7 @@ Training procedure for Conditional GAN models. Follows Isola et al. 2016
 """
 
 import os
+import time
 import datetime
 import numpy as np
 import xarray as xr
@@ -17,8 +18,11 @@ try:
 except ImportError:
     has_horovod = False
 
-from ..utils import Timing
-from ..dataloader import create_batch_hr_lr
+from ..utils import Timing, precision_policy
+from ..dataloader import (create_batch_hr_lr, DataGenerator, BatchPrefetcher, 
+                          DistributedSampler, StaticFields, _to_device)
+from ..profiling import ThroughputMonitor, _step, _sync, _timer
+from ..datasources import as_data_source, concatenate_sources, precompute_lr
 from ..models import (net_pin, recnet_pin, net_postupsampling, 
                      recnet_postupsampling, residual_discriminator)
 from ..models import (net_postupsampling, recnet_postupsampling, net_pin, 
@@ -61,6 +65,22 @@ class CGANTrainer(Trainer):
         generator_params={},
         discriminator_params={},
         verbose=True,
+        lr_cache=None,
+        use_tf_data=False,
+        deterministic=False,
+        precision='float32',
+        batch_dtype='float32',
+        use_tf_function=True,
+        jit_compile=False,
+        prefetch_depth=2,
+        prefetch_workers=1,
+        shared_memory=False,
+        shm_dir='/dev/shm',
+        graph_interpolation=False,
+        static_on_device=False,
+        profile=False,
+        profile_trace_steps=None,
+        report_throughput=False,
         ):
         """Training conditional adversarial generative models.
     
@@ -72,11 +92,12 @@ class CGANTrainer(Trainer):
         upsampling : str
             String with the name of the upsampling method used for the CGAN 
             generator.
-        data_train : 4D ndarray or xr.DataArray
+        data_train : 4D ndarray, xr.DataArray or dl4ds.DataSource
             Training dataset with dims [nsamples, lat, lon, 1]. These grids must 
             correspond to the observational reference at HR, from which a 
-            coarsened version will be created to produce paired samples. 
-        data_test : 4D ndarray or xr.DataArray
+            coarsened version will be created to produce paired samples. Lazy
+            data sources (memmap, dask) are read batch by batch.
+        data_test : 4D ndarray, xr.DataArray or dl4ds.DataSource
             Testing dataset with dims [nsamples, lat, lon, 1]. Holdout not used
             during training, but only to compute metrics with the final model.
         predictors_train : list of ndarray, optional
@@ -90,7 +111,12 @@ class CGANTrainer(Trainer):
         epochs : int, optional
             Number of epochs or passes through the whole training dataset. 
         steps_per_epoch : int, optional
-            ``batch_size * steps_per_epoch`` samples are passed per epoch.
+            ``batch_size * steps_per_epoch`` samples are passed per epoch. If 
+            None, it is equal to the number of samples divided by the 
+            ``batch_size``. The training samples are reshuffled at every epoch
+            and, with Horovod, split across the workers (see 
+            ``dl4ds.DistributedSampler``), so ``steps_per_epoch`` is divided 
+            by the number of workers.
         scale : int, optional
             Scaling factor. 
         interpolation : str, optional
@@ -117,6 +143,77 @@ class CGANTrainer(Trainer):
         verbose : bool, optional
             Verbosity mode. False or 0 = silent. True or 1, max amount of 
             information is printed out. When equal 2, then less info is shown.
+        lr_cache : bool, str or None, optional
+            Only used for implicit pairs (when the LR data is not given). If 
+            True, the coarsened LR grids are computed once (see 
+            ``dl4ds.precompute_lr``) instead of for every batch. If a str is 
+            given, the LR grids are persisted to this directory and reused by 
+            later runs and by ``dl4ds.Predictor``.
+        use_tf_data : bool, optional
+            If True, the batches are fed through a ``tf.data.Dataset`` (see 
+            ``dl4ds.DataGenerator.as_dataset``) that assembles them in parallel
+            threads and prefetches them to the device.
+        deterministic : bool, optional
+            Used when ``use_tf_data`` is True. If True, the order of the 
+            batches and the random crops are reproducible.
+        precision : str, optional
+            Keras precision policy, one of dl4ds.PRECISION_POLICIES. With 
+            'mixed_float16' or 'mixed_bfloat16', the generator and the 
+            discriminator compute in half precision while their variables and
+            outputs are kept in float32. With 'mixed_float16', dynamic loss 
+            scaling is applied to both optimizers.
+        batch_dtype : str, optional
+            Data type of the training batches, e.g., 'float16' or 'bfloat16' to 
+            halve the memory and host-device transfers.
+        use_tf_function : bool, optional
+            If True, the training step is compiled into a TF graph (see 
+            ``dl4ds.make_train_step``), traced once with the signature of the 
+            first batch, instead of running eagerly. 
+        jit_compile : bool, optional
+            Used when ``use_tf_function`` is True. If True, the training step 
+            is compiled with XLA. With Horovod, XLA compilation of the 
+            allreduce ops requires ``HOROVOD_ENABLE_XLA_OPS=1``.
+        prefetch_depth : int, optional
+            Used when ``use_tf_data`` is False. Number of batches prepared in 
+            background threads while the current training step runs (see 
+            ``dl4ds.BatchPrefetcher``). If 0, the batches are created 
+            synchronously in the training loop.
+        prefetch_workers : int, optional
+            Number of threads preparing batches when ``prefetch_depth`` > 0.
+        shared_memory : bool, optional
+            If True, the training data (HR, LR, predictors and static variables)
+            is copied once per node to shared memory (see 
+            ``dl4ds.Trainer.setup_shared_memory``), and mapped zero-copy by all
+            the Horovod local ranks and data loading workers of the node. Pass 
+            lazy data (memory-mapped arrays or dl4ds.DataSource) so that only
+            the first local rank reads it. Ignored with a single local rank.
+        shm_dir : str, optional
+            Directory in node-local shared memory used when ``shared_memory`` 
+            is True.
+        graph_interpolation : bool, optional
+            Only used with 'pin' upsampling. If True, the samples are kept at 
+            the LR resolution and the model interpolates them on the device, 
+            with a first ``dl4ds.InterpolationUpsampling`` layer, instead of 
+            the data pipeline (smaller batches and host-to-device transfers).
+        static_on_device : bool, optional
+            If True, the static variables are uploaded once to the device and 
+            the crops of each batch are gathered in-graph (see 
+            ``dl4ds.StaticFields``), instead of being copied with every batch.
+        profile : bool or dl4ds.Profiler, optional
+            If True (or a dl4ds.Profiler is given), the training steps (data 
+            wait, host-to-device transfer, compute and metrics), batch 
+            assembly, checkpointing and evaluation are timed (see 
+            ``dl4ds.Profiler``). The profile is printed after training and 
+            saved (profile.json and profile.csv) to ``save_path``.
+        profile_trace_steps : tuple of int or None, optional
+            Range of training steps (start, stop) for which a TensorFlow 
+            profiler trace is captured into ``save_path``/profiler_trace, when
+            ``profile`` is True.
+        report_throughput : bool, optional
+            If True, the samples and steps per second, the fraction of the step
+            time spent waiting for the input pipeline and the peak GPU and host
+            memory of each epoch are shown in the progress bar and written to 
+            ``save_path``/throughput.csv (see ``dl4ds.ThroughputMonitor``).
         """
         super().__init__(
             backbone=backbone,
@@ -134,7 +231,16 @@ class CGANTrainer(Trainer):
             model_list=model_list, 
             save=save, 
             save_path=save_path, 
-            show_plot=False
+            show_plot=False,
+            use_tf_data=use_tf_data,
+            deterministic=deterministic,
+            precision=precision,
+            batch_dtype=batch_dtype,
+            shared_memory=shared_memory,
+            shm_dir=shm_dir,
+            profile=profile,
+            profile_trace_steps=profile_trace_steps,
+            report_throughput=report_throughput
             )
         self.data_test = data_test
         self.data_test_lr = data_test_lr
@@ -150,11 +256,18 @@ class CGANTrainer(Trainer):
         self.learning_rates = learning_rates
         self.steps_per_epoch = steps_per_epoch
         self.interpolation = interpolation 
+        self.lr_cache = lr_cache
+        self.graph_interpolation = graph_interpolation
+        self.prefetch_depth = prefetch_depth
+        self.prefetch_workers = prefetch_workers
+        self.use_tf_function = use_tf_function
+        self.jit_compile = jit_compile
         self.static_vars = static_vars 
         if self.static_vars is not None:
             for i in range(len(self.static_vars)):
                 if isinstance(self.static_vars[i], xr.DataArray):
                     self.static_vars[i] = self.static_vars[i].values
+        self.static_on_device = static_on_device and self.static_vars is not None
         self.checkpoints_frequency = checkpoints_frequency
         self.save_loss_history = save_loss_history
         self.save_logs = save_logs
@@ -164,6 +277,7 @@ class CGANTrainer(Trainer):
         self.gengan = []
         self.gen_pxloss = []
         self.disc = []
+        self.data_wait_time = []
 
         self.time_window = time_window
         if self.time_window is not None and not self.model_is_spatiotemporal:
@@ -201,62 +315,77 @@ class CGANTrainer(Trainer):
             lr_height = lr_width = int(self.patch_size / self.scale)
             hr_height = hr_width = int(self.patch_size)
 
-        # Generator
-        if self.upsampling in POSTUPSAMPLING_METHODS:
-            if self.model_is_spatiotemporal:
-                self.generator = recnet_postupsampling(
-                    backbone_block=self.backbone,
-                    upsampling=self.upsampling, 
-                    scale=self.scale, 
-                    n_channels=n_channels, 
-                    n_aux_channels=n_aux_channels,
-                    lr_size=(lr_height, lr_width),
-                    time_window=self.time_window, 
-                    **self.generator_params)
-            else:
-                self.generator = net_postupsampling(
-                    backbone_block=self.backbone,
-                    upsampling=self.upsampling,
-                    scale=self.scale, 
-                    n_channels=n_channels,
-                    n_aux_channels=n_aux_channels,
-                    lr_size=(lr_height, lr_width),
-                    **self.generator_params)
-            
-        elif self.upsampling == 'pin':
-            if self.model_is_spatiotemporal:
-                self.generator = recnet_pin(
-                    backbone_block=self.backbone,
-                    n_channels=n_channels, 
-                    n_aux_channels=n_aux_channels,
-                    hr_size=(hr_height, hr_width),
-                    time_window=self.time_window, 
-                    **self.generator_params)
-            else:
-                if self.backbone == 'unet':
-                    self.generator = unet_pin(
+        with precision_policy(self.precision):
+            # Generator
+            if self.upsampling in POSTUPSAMPLING_METHODS:
+                if self.model_is_spatiotemporal:
+                    self.generator = recnet_postupsampling(
                         backbone_block=self.backbone,
-                        n_channels=n_channels,
+                        upsampling=self.upsampling, 
+                        scale=self.scale, 
+                        n_channels=n_channels, 
                         n_aux_channels=n_aux_channels,
-                        hr_size=(hr_height, hr_width),
+                        lr_size=(lr_height, lr_width),
+                        time_window=self.time_window, 
                         **self.generator_params)
                 else:
-                    self.generator = net_pin(
+                    self.generator = net_postupsampling(
+                        backbone_block=self.backbone,
+                        upsampling=self.upsampling,
+                        scale=self.scale, 
+                        n_channels=n_channels,
+                        n_aux_channels=n_aux_channels,
+                        lr_size=(lr_height, lr_width),
+                        **self.generator_params)
+            
+            elif self.upsampling == 'pin':
+                # LR-sized inputs interpolated by the model 
+                pin_params = {}
+                if self.graph_interpolation:
+                    pin_params = dict(scale=self.scale, interpolation=self.interpolation)
+                if self.model_is_spatiotemporal:
+                    self.generator = recnet_pin(
                         backbone_block=self.backbone,
                         n_channels=n_channels, 
                         n_aux_channels=n_aux_channels,
                         hr_size=(hr_height, hr_width),
-                        **self.generator_params)            
-
-        # Discriminator
-        n_channels_disc = n_channels[0] if isinstance(n_channels, tuple) else n_channels
-        self.discriminator = residual_discriminator(n_channels=n_channels_disc, 
-                                                    scale=self.scale, 
-                                                    upsampling=self.upsampling,
-                                                    is_spatiotemporal=self.model_is_spatiotemporal,
-                                                    lr_size=(lr_height, lr_width),
-                                                    **self.discriminator_params)
-        
+                        time_window=self.time_window, 
+                        **pin_params, **self.generator_params)
+                else:
+                    if self.backbone == 'unet':
+                        self.generator = unet_pin(
+                            backbone_block=self.backbone,
+                            n_channels=n_channels,
+                            n_aux_channels=n_aux_channels,
+                            hr_size=(hr_height, hr_width),
+                            **pin_params, **self.generator_params)
+                    else:
+                        self.generator = net_pin(
+                            backbone_block=self.backbone,
+                            n_channels=n_channels, 
+                            n_aux_channels=n_aux_channels,
+                            hr_size=(hr_height, hr_width),
+                            **pin_params, **self.generator_params)            
+
+            # Discriminator
+            n_channels_disc = n_channels[0] if isinstance(n_channels, tuple) else n_channels
+            # with in-graph interpolation, the LR input is not interpolated
+            disc_upsampling = 'spc' if self.graph_interpolation else self.upsampling
+            self.discriminator = residual_discriminator(n_channels=n_channels_disc, 
+                                                        scale=self.scale, 
+                                                        upsampling=disc_upsampling,
+                                                        is_spatiotemporal=self.model_is_spatiotemporal,
+                                                        lr_size=(lr_height, lr_width),
+                                                        **self.discriminator_params)
+
+            # static variables uploaded once, gathered in-graph for each batch
+            if self.static_on_device:
+                lr_sized = self.upsampling in POSTUPSAMPLING_METHODS or self.graph_interpolation
+                self.static_fields = StaticFields(
+                    self.static_vars, self.scale, lr_sized=lr_sized, 
+                    is_spatiotemporal=self.model_is_spatiotemporal, 
+                    interpolation=self.interpolation)
+
         if self.verbose == 1 and self.running_on_first_worker:
             self.generator.summary(line_length=150)
             self.discriminator.summary(line_length=150)
@@ -265,6 +394,10 @@ class CGANTrainer(Trainer):
         """
         """
         self.timing = Timing(self.verbose)
+        if self.profiler is not None:
+            self.profiler.start()
+        if self.shared_memory:
+            self.setup_shared_memory()
         self.setup_model()
 
         # Optimizers
@@ -276,6 +409,10 @@ class CGANTrainer(Trainer):
             genlr = dislr = self.learning_rates
         generator_optimizer = tf.keras.optimizers.Adam(genlr, beta_1=0.5)
         discriminator_optimizer = tf.keras.optimizers.Adam(dislr, beta_1=0.5)
+        if self.precision == 'mixed_float16':
+            # dynamic loss scaling to avoid the underflow of float16 gradients
+            generator_optimizer = tf.keras.mixed_precision.LossScaleOptimizer(generator_optimizer)
+            discriminator_optimizer = tf.keras.mixed_precision.LossScaleOptimizer(discriminator_optimizer)
         
         if self.save_logs:
             log_dir = "cgan_logs/"
@@ -293,93 +430,221 @@ class CGANTrainer(Trainer):
 
         # creating a single ndarray concatenating list of ndarray predictors along the last dimension 
         if self.predictors_train is not None:
-            self.predictors_train = np.concatenate(self.predictors_train, axis=-1)
+            self.predictors_train = concatenate_sources(self.predictors_train)
         else:
             self.predictors_train = None
 
-        # shuffling the order of the available indices (n samples)
+        # shuffling the order of the available indices (n samples) at every 
+        # epoch. Horovod: each worker loads and processes only its shard 
         if self.time_window is not None:
             self.n = self.data_train.shape[0] - self.time_window
         else:
             self.n = self.data_train.shape[0]
-        self.indices_train = np.random.permutation(np.arange(self.n))
+        if has_horovod:
+            # the same seed on all the workers for disjoint shards
+            self.sampler = DistributedSampler(self.n, num_replicas=hvd.size(), 
+                                              rank=hvd.rank(), seed=0)
+        else:
+            self.sampler = DistributedSampler(self.n, seed=np.random.randint(0, 2**31 - 1))
 
         if self.steps_per_epoch is None:
-            self.steps_per_epoch = int(self.n / self.batch_size)
-
-        if isinstance(self.data_train, xr.DataArray):
-            # self.time_metadata = self.data_train.time.copy()  # get time metadata
-            self.data_train = self.data_train.values
-        if isinstance(self.data_train_lr, xr.DataArray):
-            self.data_train_lr = self.data_train_lr.values
-
+            self.steps_per_epoch = int(len(self.sampler) / self.batch_size)
+        elif has_horovod:
+            self.steps_per_epoch = self.steps_per_epoch // hvd.size()
+
+        # in-memory or lazy (memmap, dask) data sources, see dl4ds.DataSource
+        # self.time_metadata = self.data_train.time.copy()  # get time metadata
+        self.data_train = as_data_source(self.data_train)
+        self.data_train_lr = as_data_source(self.data_train_lr)
+        # with in-graph interpolation, only the coarsened grids are cached
+        lr_upsampling = 'spc' if self.graph_interpolation else self.upsampling
+        if self.data_train_lr is None and self.lr_cache:
+            self.data_train_lr = precompute_lr(
+                self.data_train, self.scale, lr_upsampling, self.interpolation,
+                self.lr_cache if isinstance(self.lr_cache, str) else None)
+
+        if self.use_tf_data:
+            datagen = DataGenerator(
+                self.data_train, self.data_train_lr, 
+                backbone=self.backbone, 
+                upsampling=self.upsampling, 
+                scale=self.scale, 
+                batch_size=self.batch_size, 
+                patch_size=self.patch_size, 
+                time_window=self.time_window, 
+                static_vars=self.static_vars, 
+                predictors=self.predictors_train, 
+                interpolation=self.interpolation,
+                dtype=self.batch_dtype,
+                sampler=self.sampler,
+                graph_interpolation=self.graph_interpolation,
+                static_on_device=self.static_on_device)
+            device = '/gpu:0' if self.device == 'GPU' and tf.config.list_logical_devices('GPU') else None
+            dataset = datagen.as_dataset(deterministic=self.deterministic, repeat=True, 
+                                         device=device)
+            batches = iter(dataset)
+        else:
+            def load_batch(index, epoch, random_state=None):
+                with _timer('batch_assembly'):
+                    return create_batch_hr_lr(
+                        self.sampler.indices(epoch),
+                        index,
+                        self.data_train, 
+                        self.data_train_lr,
+                        upsampling=self.upsampling,
+                        scale=self.scale, 
+                        batch_size=self.batch_size, 
+                        patch_size=self.patch_size,
+                        time_window=self.time_window,
+                        static_vars=self.static_vars, 
+                        predictors=self.predictors_train,
+                        interpolation=self.interpolation,
+                        time_metadata=None,
+                        random_state=random_state,
+                        dtype=self.batch_dtype,
+                        graph_interpolation=self.graph_interpolation,
+                        static_on_device=self.static_on_device)
+
+            if self.prefetch_depth > 0:
+                # one seed per step, drawn upfront, for reproducible crops 
+                # regardless of the order in which the threads run
+                seeds = np.random.randint(0, 2**31 - 1, size=self.epochs * self.steps_per_epoch)
+                batches = BatchPrefetcher(
+                    lambda step: load_batch(step % self.steps_per_epoch, 
+                                            step // self.steps_per_epoch,
+                                            np.random.RandomState(seeds[step])),
+                    n_batches=self.epochs * self.steps_per_epoch, 
+                    workers=self.prefetch_workers, 
+                    depth=self.prefetch_depth)
+
+        # throughput and input pipeline stalls of every epoch
+        self.throughput = self.setup_throughput_monitor(self.batch_size)
+        progbar_metrics = ['gen_total_loss', 'gen_crosentr_loss', 'gen_mae_loss', 'disc_loss']
+        if self.throughput is not None:
+            progbar_metrics += ThroughputMonitor.progbar_metrics
+
+        compiled_train_step = None
         for epoch in range(self.epochs):
             print(f'\nEpoch {epoch+1}/{self.epochs}')
-            pb_i = Progbar(self.steps_per_epoch, 
-                           stateful_metrics=['gen_total_loss', 'gen_crosentr_loss', 
-                                             'gen_mae_loss', 'disc_loss'])
+            pb_i = Progbar(self.steps_per_epoch, stateful_metrics=progbar_metrics)
 
+            epoch_start = time.perf_counter()
+            data_wait_time = 0
+            if self.throughput is not None:
+                self.throughput.begin_epoch()
             for i in range(self.steps_per_epoch):
-                res = create_batch_hr_lr(
-                    self.indices_train,
-                    i,
-                    self.data_train, 
-                    self.data_train_lr,
-                    upsampling=self.upsampling,
-                    scale=self.scale, 
-                    batch_size=self.batch_size, 
-                    patch_size=self.patch_size,
-                    time_window=self.time_window,
-                    static_vars=self.static_vars, 
-                    predictors=self.predictors_train,
-                    interpolation=self.interpolation,
-                    time_metadata=None)
-               
-                if self.static_vars is not None:
-                    [lr_array, aux_hr], [hr_array] = res
-                else:
-                    [lr_array], [hr_array] = res
-
-                losses = train_step(
-                    lr_array, 
-                    hr_array, 
-                    generator=self.generator, 
-                    discriminator=self.discriminator, 
-                    generator_optimizer=generator_optimizer, 
-                    discriminator_optimizer=discriminator_optimizer, 
-                    epoch=epoch, 
-                    gen_pxloss_function=self.lossf,
-                    summary_writer=summary_writer, 
-                    first_batch=True if epoch==0 and i==0 else False,
-                    static_array=aux_hr)
-                
-                gen_total_loss, gen_gan_loss, gen_px_loss, disc_loss = losses
-                lossvals = [('gen_total_loss', gen_total_loss), 
-                            ('gen_crosentr_loss', gen_gan_loss), 
-                            ('gen_px_loss', gen_px_loss), 
-                            ('disc_loss', disc_loss)]
-                
-                if self.running_on_first_worker:
-                    pb_i.add(1, values=lossvals)
+                step_start = time.perf_counter()
+                with _step('train_step'):
+                    # time spent waiting for (or creating) the batch
+                    with _timer('data_wait'):
+                        if self.use_tf_data or self.prefetch_depth > 0:
+                            res = next(batches)
+                        else:
+                            res = load_batch(i, epoch)
+                    wait_time = time.perf_counter() - step_start
+                    data_wait_time += wait_time
+
+                    with _timer('host_to_device'):
+                        res = _to_device(res)
+                        _sync(res)
+
+                    with _timer('compute'):
+                        if self.static_on_device:
+                            inputs, [hr_array] = res
+                            lr_array, aux_hr = self.static_fields(inputs)
+                        elif self.static_vars is not None:
+                            [lr_array, aux_hr], [hr_array] = res
+                        else:
+                            [lr_array], [hr_array] = res
+                            aux_hr = None
+
+                        if self.use_tf_function:
+                            if compiled_train_step is None:
+                                # input signature taken from the first batch (with
+                                # unknown batch size), the step is traced only once
+                                arrays = [lr_array, hr_array] if aux_hr is None else [lr_array, hr_array, aux_hr]
+                                compiled_train_step = make_train_step(
+                                    generator=self.generator, 
+                                    discriminator=self.discriminator, 
+                                    generator_optimizer=generator_optimizer, 
+                                    discriminator_optimizer=discriminator_optimizer, 
+                                    gen_pxloss_function=self.lossf,
+                                    input_signature=[_tensor_spec(array) for array in arrays],
+                                    jit_compile=self.jit_compile)
+                            if aux_hr is None:
+                                losses = compiled_train_step(lr_array, hr_array)
+                            else:
+                                losses = compiled_train_step(lr_array, hr_array, aux_hr)
+                            if has_horovod and epoch == 0 and i == 0:
+                                broadcast_variables(self.generator, self.discriminator, 
+                                                    generator_optimizer, discriminator_optimizer)
+                            if summary_writer is not None:
+                                write_summaries(summary_writer, losses, epoch)
+                        else:
+                            losses = train_step(
+                                lr_array, 
+                                hr_array, 
+                                generator=self.generator, 
+                                discriminator=self.discriminator, 
+                                generator_optimizer=generator_optimizer, 
+                                discriminator_optimizer=discriminator_optimizer, 
+                                epoch=epoch, 
+                                gen_pxloss_function=self.lossf,
+                                summary_writer=summary_writer, 
+                                first_batch=True if epoch==0 and i==0 else False,
+                                static_array=aux_hr)
+                        _sync(losses)
+
+                    with _timer('metrics'):
+                        gen_total_loss, gen_gan_loss, gen_px_loss, disc_loss = losses
+                        lossvals = [('gen_total_loss', gen_total_loss), 
+                                    ('gen_crosentr_loss', gen_gan_loss), 
+                                    ('gen_px_loss', gen_px_loss), 
+                                    ('disc_loss', disc_loss)]
+                        if self.throughput is not None:
+                            # statistics of the previous steps of the epoch
+                            lossvals += list(self.throughput.step_logs().items())
+
+                        if self.running_on_first_worker:
+                            pb_i.add(1, values=lossvals)
+
+                if self.throughput is not None:
+                    self.throughput.add_step(time.perf_counter() - step_start, wait_time)
             
             self.gentotal.append(gen_total_loss)
             self.gengan.append(gen_gan_loss)
             self.gen_pxloss.append(gen_px_loss)
             self.disc.append(disc_loss)
+            self.data_wait_time.append(data_wait_time)
+            if self.throughput is not None:
+                stats = self.throughput.end_epoch(epoch)
+                if self.verbose and self.running_on_first_worker:
+                    print(self.throughput.summary(stats))
+            elif self.verbose and self.running_on_first_worker:
+                epoch_time = time.perf_counter() - epoch_start
+                print(f'Time waiting for data: {data_wait_time:.2f}s '
+                      f'({100 * data_wait_time / epoch_time:.1f}% of the epoch)')
             
             if self.checkpoints_frequency > 0:
                 # Horovod: save checkpoints only on worker 0 to prevent other 
                 # workers from corrupting it
                 if self.running_on_first_worker:
                     if (epoch + 1) % self.checkpoints_frequency == 0:
-                        checkpoint.save(file_prefix=checkpoint_prefix)
-                        # saving the generator in tf format
-                        self.generator.save(self.savecheckpoint_path + f'/checkpoints/save_epoch{epoch + 1}')
+                        with _timer('checkpoint'):
+                            checkpoint.save(file_prefix=checkpoint_prefix)
+                            # saving the generator in tf format
+                            generator_path = self.savecheckpoint_path + f'/checkpoints/save_epoch{epoch + 1}'
+                            self.generator.save(generator_path)
+                            self.save_metadata(generator_path)
         
         # Horovod: save last checkpoint only on worker 0 to prevent other 
         # workers from corrupting it
         if self.checkpoints_frequency > 0 and self.running_on_first_worker:
-            checkpoint.save(file_prefix=checkpoint_prefix)
+            with _timer('checkpoint'):
+                checkpoint.save(file_prefix=checkpoint_prefix)
+
+        if not self.use_tf_data and self.prefetch_depth > 0:
+            batches.close()
 
         if self.save_loss_history and self.running_on_first_worker:
             losses_array = np.array((self.gentotal, self.gengan, self.gen_pxloss, self.disc))
@@ -389,17 +654,19 @@ class CGANTrainer(Trainer):
 
         ### Loss on the Test set
         if self.predictors_test is not None:
-            self.predictors_test = np.concatenate(self.predictors_test, axis=-1)
+            self.predictors_test = concatenate_sources(self.predictors_test)
         else:
             self.predictors_test = None
 
-        if isinstance(self.data_test, xr.DataArray):
-            # self.time_metadata_test = self.data_test.time.copy()  # time metadata
-            self.data_test = self.data_test.values
-        else:
-            self.time_metadata_test = None
-        if isinstance(self.data_test_lr, xr.DataArray):
-            self.data_test_lr = self.data_test_lr.values
+        # self.time_metadata_test = self.data_test.time.copy()  # time metadata
+        self.time_metadata_test = None
+        self.data_test = as_data_source(self.data_test)
+        self.data_test_lr = as_data_source(self.data_test_lr)
+        lr_upsampling = 'spc' if self.graph_interpolation else self.upsampling
+        if self.data_test_lr is None and self.lr_cache:
+            self.data_test_lr = precompute_lr(
+                self.data_test, self.scale, lr_upsampling, self.interpolation,
+                self.lr_cache if isinstance(self.lr_cache, str) else None)
 
         # shuffling the order of the available indices (n samples)
         if self.time_window is not None:
@@ -422,7 +689,8 @@ class CGANTrainer(Trainer):
                 static_vars=self.static_vars, 
                 predictors=self.predictors_test,
                 interpolation=self.interpolation,
-                time_metadata=None)
+                time_metadata=None,
+                graph_interpolation=self.graph_interpolation)
             
             if self.static_vars is not None:
                 [lr_array, aux_hr], [hr_array] = res
@@ -432,15 +700,18 @@ class CGANTrainer(Trainer):
                 input_test = [lr_arrtest, auxhr_arrtest]
             else:
                 [lr_array], [hr_array] = res
+                hr_arrtest = tf.cast(hr_array, tf.float32)
                 lr_arrtest = tf.cast(lr_array, tf.float32)
                 input_test = [lr_arrtest]
             
-            y_test_pred = self.generator.predict(input_test)
-            self.test_loss = self.lossf(hr_arrtest, y_test_pred)
+            with _timer('evaluate'):
+                y_test_pred = self.generator.predict(input_test)
+                self.test_loss = self.lossf(hr_arrtest, y_test_pred)
             print(f'\n{self.lossf.__name__} on the test set: {self.test_loss}')
         
         self.timing.runtime()
 
+        self.stop_profiler()
         self.save_results(self.generator, folder_prefix='cgan_')
 
 
@@ -457,7 +728,8 @@ def load_checkpoint(
     n_blocks=(20, 4), 
     n_filters=(8, 32), 
     attention=False,
-    localcon_layer=False):
+    localcon_layer=False,
+    precision='float32'):
     """
     """
     n_channels = 1
@@ -473,46 +745,50 @@ def load_checkpoint(
     else:
         model_is_spatiotemporal = False
 
-    # generator
-    if upsampling in POSTUPSAMPLING_METHODS:
-        if model_is_spatiotemporal:
-            generator = recnet_postupsampling(
-                backbone_block=backbone, upsampling=upsampling, scale=scale, 
-                n_channels=n_channels, n_aux_channels=n_aux_channels, 
-                n_filters=n_filters[0], n_blocks=n_blocks[0], lr_size=input_height_width,
-                n_channels_out=1, time_window=time_window, attention=attention, 
-                localcon_layer=localcon_layer)
-        else:
-            generator = net_postupsampling(
-                backbone_block=backbone, upsampling=upsampling, scale=scale, 
-                n_channels=n_channels, n_aux_channels=n_aux_channels, 
-                n_filters=n_filters[0], n_blocks=n_blocks[0], lr_size=input_height_width,
-                n_channels_out=1, attention=attention, localcon_layer=localcon_layer)
+    with precision_policy(precision):
+        # generator
+        if upsampling in POSTUPSAMPLING_METHODS:
+            if model_is_spatiotemporal:
+                generator = recnet_postupsampling(
+                    backbone_block=backbone, upsampling=upsampling, scale=scale, 
+                    n_channels=n_channels, n_aux_channels=n_aux_channels, 
+                    n_filters=n_filters[0], n_blocks=n_blocks[0], lr_size=input_height_width,
+                    n_channels_out=1, time_window=time_window, attention=attention, 
+                    localcon_layer=localcon_layer)
+            else:
+                generator = net_postupsampling(
+                    backbone_block=backbone, upsampling=upsampling, scale=scale, 
+                    n_channels=n_channels, n_aux_channels=n_aux_channels, 
+                    n_filters=n_filters[0], n_blocks=n_blocks[0], lr_size=input_height_width,
+                    n_channels_out=1, attention=attention, localcon_layer=localcon_layer)
         
-    elif upsampling == 'pin':
-        if model_is_spatiotemporal:
-            generator = recnet_pin(
-                backbone_block=backbone, n_channels=n_channels, 
-                n_aux_channels=n_aux_channels, hr_size=input_height_width,
-                n_filters=n_filters[0], n_blocks=n_blocks[0], 
-                n_channels_out=1, time_window=time_window, 
-                attention=attention, localcon_layer=localcon_layer)
-        else: 
-            generator = net_pin(
-                backbone_block=backbone, n_channels=n_channels, 
-                n_aux_channels=n_aux_channels, hr_size=input_height_width,
-                n_filters=n_filters[0], n_blocks=n_blocks[0], 
-                n_channels_out=1, attention=attention, localcon_layer=localcon_layer)
+        elif upsampling == 'pin':
+            if model_is_spatiotemporal:
+                generator = recnet_pin(
+                    backbone_block=backbone, n_channels=n_channels, 
+                    n_aux_channels=n_aux_channels, hr_size=input_height_width,
+                    n_filters=n_filters[0], n_blocks=n_blocks[0], 
+                    n_channels_out=1, time_window=time_window, 
+                    attention=attention, localcon_layer=localcon_layer)
+            else: 
+                generator = net_pin(
+                    backbone_block=backbone, n_channels=n_channels, 
+                    n_aux_channels=n_aux_channels, hr_size=input_height_width,
+                    n_filters=n_filters[0], n_blocks=n_blocks[0], 
+                    n_channels_out=1, attention=attention, localcon_layer=localcon_layer)
         
-    # discriminator
-    discriminator = residual_discriminator(
-        n_channels=n_channels, upsampling=upsampling, is_spatiotemporal=model_is_spatiotemporal, 
-        scale=scale, lr_size=input_height_width, n_filters=n_filters[1], n_res_blocks=n_blocks[1],
-        attention=attention)
-    
+        # discriminator
+        discriminator = residual_discriminator(
+            n_channels=n_channels, upsampling=upsampling, is_spatiotemporal=model_is_spatiotemporal, 
+            scale=scale, lr_size=input_height_width, n_filters=n_filters[1], n_res_blocks=n_blocks[1],
+            attention=attention)
+
     # optimizers
     generator_optimizer = tf.keras.optimizers.Adam(2e-4, beta_1=0.5)
     discriminator_optimizer = tf.keras.optimizers.Adam(2e-4, beta_1=0.5)
+    if precision == 'mixed_float16':
+        generator_optimizer = tf.keras.mixed_precision.LossScaleOptimizer(generator_optimizer)
+        discriminator_optimizer = tf.keras.mixed_precision.LossScaleOptimizer(discriminator_optimizer)
 
     checkpoint_path = os.path.join(checkpoint_dir, "checkpoint_epoch")
     checkpoint = tf.train.Checkpoint(generator_optimizer=generator_optimizer,
@@ -579,7 +855,8 @@ def train_step(lr_array, hr_array, generator, discriminator, generator_optimizer
     Training:
     * For each example input generate an output.
     * The discriminator receives the input_image and the generated image as the 
-    first input. The second input is the input_image and the target_image.
+    first input. The second input is the input_image and the target_image. Both
+    are evaluated in a single batch, sharing the features of the input_image.
     * Next, we calculate the generator and the discriminator loss.
     * Then, we calculate the gradients of loss with respect to both the 
     generator and the discriminator variables(inputs) and apply those to the optimizer.
@@ -595,33 +872,45 @@ def train_step(lr_array, hr_array, generator, discriminator, generator_optimizer
     with tf.GradientTape() as gen_tape, tf.GradientTape() as disc_tape:
         # running the generator
         gen_array = generator(input_generator, training=True)
-        # running the discriminator using both the reference and generated HR images
-        disc_real_output = discriminator([lr_array, hr_array], training=True)
-        disc_generated_output = discriminator([lr_array, gen_array], training=True)
+        # running the discriminator using both the reference and generated HR images, 
+        # concatenated in a single batch (the LR branch is computed only once)
+        disc_output = discriminator([lr_array, tf.concat([hr_array, gen_array], axis=0)], 
+                                    training=True)
+        disc_real_output, disc_generated_output = tf.split(disc_output, 2, axis=0)
         # computing the losses
         gen_total_loss, gen_gan_loss, gen_px_loss = generator_loss(disc_generated_output, 
                                                                    gen_array, 
                                                                    hr_array, 
                                                                    gen_pxloss_function)
         disc_loss = discriminator_loss(disc_real_output, disc_generated_output)
+        # mixed precision: scaling the losses to avoid float16 gradient underflow
+        if isinstance(generator_optimizer, tf.keras.mixed_precision.LossScaleOptimizer):
+            gen_total_loss_scaled = generator_optimizer.get_scaled_loss(gen_total_loss)
+        else:
+            gen_total_loss_scaled = gen_total_loss
+        if isinstance(discriminator_optimizer, tf.keras.mixed_precision.LossScaleOptimizer):
+            disc_loss_scaled = discriminator_optimizer.get_scaled_loss(disc_loss)
+        else:
+            disc_loss_scaled = disc_loss
 
     if has_horovod:
         # Horovod: add Horovod Distributed GradientTape.
         gen_tape = hvd.DistributedGradientTape(gen_tape)
         disc_tape = hvd.DistributedGradientTape(disc_tape)
 
-    generator_gradients = gen_tape.gradient(gen_total_loss, generator.trainable_variables)
-    discriminator_gradients = disc_tape.gradient(disc_loss, discriminator.trainable_variables)
+    generator_gradients = gen_tape.gradient(gen_total_loss_scaled, generator.trainable_variables)
+    discriminator_gradients = disc_tape.gradient(disc_loss_scaled, discriminator.trainable_variables)
+    if isinstance(generator_optimizer, tf.keras.mixed_precision.LossScaleOptimizer):
+        generator_gradients = generator_optimizer.get_unscaled_gradients(generator_gradients)
+    if isinstance(discriminator_optimizer, tf.keras.mixed_precision.LossScaleOptimizer):
+        discriminator_gradients = discriminator_optimizer.get_unscaled_gradients(discriminator_gradients)
 
     generator_optimizer.apply_gradients(zip(generator_gradients, generator.trainable_variables))
     discriminator_optimizer.apply_gradients(zip(discriminator_gradients, discriminator.trainable_variables))
 
+    losses = gen_total_loss, gen_gan_loss, gen_px_loss, disc_loss
     if summary_writer is not None:
-        with summary_writer.as_default():
-            tf.summary.scalar('gen_total_loss', gen_total_loss, step=epoch)
-            tf.summary.scalar('gen_gan_loss', gen_gan_loss, step=epoch)
-            tf.summary.scalar('gen_px_loss', gen_px_loss, step=epoch)
-            tf.summary.scalar('disc_loss', disc_loss, step=epoch)
+        write_summaries(summary_writer, losses, epoch)
     
     if has_horovod:
         # Horovod: broadcast initial variable states from rank 0 to all other processes.
@@ -631,9 +920,76 @@ def train_step(lr_array, hr_array, generator, discriminator, generator_optimizer
         # Note: broadcast should be done after the first gradient step to ensure optimizer
         # initialization.
         if first_batch:
-            hvd.broadcast_variables(generator.variables, root_rank=0)
-            hvd.broadcast_variables(generator_optimizer.variables(), root_rank=0)
-            hvd.broadcast_variables(discriminator.variables, root_rank=0)
-            hvd.broadcast_variables(discriminator_optimizer.variables(), root_rank=0)
+            broadcast_variables(generator, discriminator, generator_optimizer, 
+                                discriminator_optimizer)
+
+    return losses
+
+
+def make_train_step(generator, discriminator, generator_optimizer, 
+                    discriminator_optimizer, gen_pxloss_function, 
+                    input_signature, jit_compile=False):
+    """
+    Graph-compiled version of ``train_step``. The returned ``tf.function`` 
+    takes the LR, HR and (optionally) the static arrays of a batch and returns
+    the losses. The fixed ``input_signature`` (e.g., with an unknown batch 
+    size) avoids retracing the step. The Horovod distributed gradient tapes 
+    are part of the graph, while the broadcast of the initial variables 
+    (``broadcast_variables``) and the summaries (``write_summaries``) are left
+    to the caller. 
+
+    Parameters
+    ----------
+    input_signature : list of tf.TensorSpec
+        Specs of the LR and HR arrays, and of the static array if any.
+    jit_compile : bool, optional
+        If True, the step is compiled with XLA.
+    """
+    kwargs = dict(generator=generator, 
+                  discriminator=discriminator, 
+                  generator_optimizer=generator_optimizer, 
+                  discriminator_optimizer=discriminator_optimizer, 
+                  epoch=None, 
+                  gen_pxloss_function=gen_pxloss_function,
+                  summary_writer=None, 
+                  first_batch=False)
+
+    if len(input_signature) == 3:
+        @tf.function(input_signature=input_signature, jit_compile=jit_compile)
+        def compiled_train_step(lr_array, hr_array, static_array):
+            return train_step(lr_array, hr_array, static_array=static_array, **kwargs)
+    else:
+        @tf.function(input_signature=input_signature, jit_compile=jit_compile)
+        def compiled_train_step(lr_array, hr_array):
+            return train_step(lr_array, hr_array, **kwargs)
+    return compiled_train_step
+
+
+def broadcast_variables(generator, discriminator, generator_optimizer, 
+                        discriminator_optimizer):
+    """
+    Horovod: broadcast the variables of the models and of the optimizers from 
+    rank 0 to all other processes.
+    """
+    hvd.broadcast_variables(generator.variables, root_rank=0)
+    hvd.broadcast_variables(generator_optimizer.variables(), root_rank=0)
+    hvd.broadcast_variables(discriminator.variables, root_rank=0)
+    hvd.broadcast_variables(discriminator_optimizer.variables(), root_rank=0)
 
-    return gen_total_loss, gen_gan_loss, gen_px_loss, disc_loss 
\ No newline at end of file
+
+def write_summaries(summary_writer, losses, epoch):
+    """
+    Write the generator and discriminator losses to the TensorBoard logs.
+    """
+    gen_total_loss, gen_gan_loss, gen_px_loss, disc_loss = losses
+    with summary_writer.as_default():
+        tf.summary.scalar('gen_total_loss', gen_total_loss, step=epoch)
+        tf.summary.scalar('gen_gan_loss', gen_gan_loss, step=epoch)
+        tf.summary.scalar('gen_px_loss', gen_px_loss, step=epoch)
+        tf.summary.scalar('disc_loss', disc_loss, step=epoch)
+
+
+def _tensor_spec(array):
+    """TensorSpec of a batch with unknown batch size.
+    """
+    return tf.TensorSpec((None,) + tuple(array.shape[1:]), tf.as_dtype(array.dtype)) 
\ No newline at end of file
@@ -7,7 +7,7 @@ import xarray as xr
 import tensorflow as tf
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.optimizers.schedules import PiecewiseConstantDecay
-from tensorflow.keras.callbacks import EarlyStopping
+from tensorflow.keras.callbacks import EarlyStopping, ProgbarLogger
 import logging
 tf.get_logger().setLevel(logging.ERROR)
 
@@ -18,11 +18,13 @@ except ImportError:
     has_horovod = False
 
 from .. import POSTUPSAMPLING_METHODS
-from ..utils import Timing
-from ..dataloader import DataGenerator
+from ..utils import Timing, precision_policy
+from ..profiling import ThroughputMonitor, _timer
+from ..dataloader import DataGenerator, DistributedSampler, StaticFields
 from ..models import (net_pin, recnet_pin, unet_pin, net_postupsampling, 
                      recnet_postupsampling)
 from .base import Trainer
+from .callbacks import PlainModelCheckpoint, ProfilerCallback, ThroughputCallback
 
 
 class SupervisedTrainer(Trainer):
@@ -68,6 +70,18 @@ class SupervisedTrainer(Trainer):
         trained_model=None,
         trained_epochs=0,
         verbose=True,
+        lr_cache=None,
+        use_tf_data=False,
+        deterministic=False,
+        precision='float32',
+        batch_dtype='float32',
+        shared_memory=False,
+        shm_dir='/dev/shm',
+        graph_interpolation=False,
+        static_on_device=False,
+        profile=False,
+        profile_trace_steps=None,
+        report_throughput=False,
         **architecture_params
         ):
         """Training procedure for supervised models.
@@ -78,15 +92,16 @@ class SupervisedTrainer(Trainer):
             String with the name of the backbone block.
         upsampling : str
             String with the name of the upsampling method. 
-        data_train : 4D ndarray or xr.DataArray
+        data_train : 4D ndarray, xr.DataArray or dl4ds.DataSource
             Training dataset with dims [nsamples, lat, lon, 1]. These grids must 
             correspond to the observational reference at HR, from which a 
-            coarsened version will be created to produce paired samples. 
-        data_val : 4D ndarray or xr.DataArray
+            coarsened version will be created to produce paired samples. Lazy
+            data sources (memmap, dask) are read batch by batch.
+        data_val : 4D ndarray, xr.DataArray or dl4ds.DataSource
             Validation dataset with dims [nsamples, lat, lon, 1]. This holdout 
             dataset is used at the end of each epoch to check the losses and 
             diagnose overfitting.
-        data_test : 4D ndarray or xr.DataArray
+        data_test : 4D ndarray, xr.DataArray or dl4ds.DataSource
             Testing dataset with dims [nsamples, lat, lon, 1]. Holdout not used
             during training, but only to compute metrics with the final model.
         predictors_train : list of ndarray, optional
@@ -120,7 +135,10 @@ class SupervisedTrainer(Trainer):
             Total number of steps (batches of samples) before declaring one epoch
             finished.``batch_size * steps_per_epoch`` samples are passed per 
             epoch. If None, ``then steps_per_epoch`` is equal to the number of 
-            samples diviced by the ``batch_size``.
+            samples diviced by the ``batch_size``. With Horovod, the training 
+            samples are split across the workers (see 
+            ``dl4ds.DistributedSampler``) and ``steps_per_epoch`` is divided 
+            by the number of workers.
         validation_steps : int, optional
             Steps using at the end of each epoch for drawing validation samples. 
         test_steps : int, optional
@@ -160,6 +178,65 @@ class SupervisedTrainer(Trainer):
         verbose : bool, optional
             Verbosity mode. False or 0 = silent. True or 1, max amount of 
             information is printed out. When equal 2, then less info is shown.
+        lr_cache : bool, str or None, optional
+            Only used for implicit pairs (when the LR data is not given). If 
+            True, the coarsened LR grids are computed once (see 
+            ``dl4ds.precompute_lr``) instead of for every batch. If a str is 
+            given, the LR grids are persisted to this directory and reused by 
+            later runs and by ``dl4ds.Predictor``.
+        use_tf_data : bool, optional
+            If True, the batches are fed through a ``tf.data.Dataset`` (see 
+            ``dl4ds.DataGenerator.as_dataset``) that assembles them in parallel
+            threads and prefetches them.
+        deterministic : bool, optional
+            Used when ``use_tf_data`` is True. If True, the order of the 
+            batches and the random crops are reproducible.
+        precision : str, optional
+            Keras precision policy, one of dl4ds.PRECISION_POLICIES. With 
+            'mixed_float16' or 'mixed_bfloat16', the model computations are 
+            done in half precision while the variables and the output are 
+            kept in float32. With 'mixed_float16', dynamic loss scaling is 
+            applied by the optimizer.
+        batch_dtype : str, optional
+            Data type of the batches produced by the data generators. Feeding
+            'float16' or 'bfloat16' batches halves the memory and host-device 
+            transfers, the losses are still computed in float32.
+        shared_memory : bool, optional
+            If True, the training data (HR, LR, predictors and static variables)
+            is copied once per node to shared memory (see 
+            ``dl4ds.Trainer.setup_shared_memory``), and mapped zero-copy by all
+            the Horovod local ranks and data loading workers of the node. Pass 
+            lazy data (memory-mapped arrays or dl4ds.DataSource) so that only
+            the first local rank reads it. Ignored with a single local rank.
+        shm_dir : str, optional
+            Directory in node-local shared memory used when ``shared_memory`` 
+            is True.
+        graph_interpolation : bool, optional
+            Only used with 'pin' upsampling. If True, the samples are kept at 
+            the LR resolution and the model interpolates them on the device, 
+            with a first ``dl4ds.InterpolationUpsampling`` layer, instead of 
+            the data pipeline (smaller batches and host-to-device transfers).
+        static_on_device : bool, optional
+            If True, the static variables are uploaded once to the device and 
+            the crops of each batch are gathered in-graph (see 
+            ``dl4ds.StaticFields``), instead of being copied with every batch.
+            The saved models (and ``save_bestmodel`` checkpoints) take the 
+            static variables as inputs, as without this option.
+        profile : bool or dl4ds.Profiler, optional
+            If True (or a dl4ds.Profiler is given), the training steps, epochs,
+            batch assembly, checkpointing and evaluation are timed (see 
+            ``dl4ds.Profiler``). The profile is printed after training and 
+            saved (profile.json and profile.csv) to ``save_path``.
+        profile_trace_steps : tuple of int or None, optional
+            Range of training steps (start, stop) for which a TensorFlow 
+            profiler trace is captured into ``save_path``/profiler_trace, when
+            ``profile`` is True.
+        report_throughput : bool, optional
+            If True, the samples and steps per second, the fraction of the step
+            time spent waiting for the input pipeline and the peak GPU and host
+            memory of each epoch are shown in the progress bar and written to 
+            ``save_path``/throughput.csv (see ``dl4ds.ThroughputMonitor``).
+            The input wait is not measured with ``use_multiprocessing``.
         **architecture_params : dict
             Dictionary with additional parameters passed to the neural network 
             model.
@@ -181,7 +258,16 @@ class SupervisedTrainer(Trainer):
             model_list=model_list,
             save=save,
             save_path=save_path,
-            show_plot=show_plot
+            show_plot=show_plot,
+            use_tf_data=use_tf_data,
+            deterministic=deterministic,
+            precision=precision,
+            batch_dtype=batch_dtype,
+            shared_memory=shared_memory,
+            shm_dir=shm_dir,
+            profile=profile,
+            profile_trace_steps=profile_trace_steps,
+            report_throughput=report_throughput
             )
         self.data_val = data_val
         self.data_test = data_test
@@ -202,6 +288,9 @@ class SupervisedTrainer(Trainer):
                 if isinstance(self.static_vars[i], xr.DataArray):
                     self.static_vars[i] = self.static_vars[i].values
         self.interpolation = interpolation 
+        self.lr_cache = lr_cache
+        self.graph_interpolation = graph_interpolation
+        self.static_on_device = static_on_device and self.static_vars is not None
         self.epochs = epochs
         self.steps_per_epoch = steps_per_epoch
         self.validation_steps = validation_steps
@@ -228,10 +317,25 @@ class SupervisedTrainer(Trainer):
             static_vars=self.static_vars, 
             patch_size=self.patch_size, 
             interpolation=self.interpolation,
-            time_window=self.time_window)
+            lr_cache=self.lr_cache,
+            graph_interpolation=self.graph_interpolation,
+            static_on_device=self.static_on_device,
+            time_window=self.time_window,
+            dtype=self.batch_dtype)
+        # Horovod: each worker loads and processes only its shard of the 
+        # training samples, reshuffled at every epoch
+        sampler = None
+        if has_horovod:
+            n_train = self.data_train.shape[0]
+            if self.time_window is not None:
+                n_train -= self.time_window
+            sampler = DistributedSampler(n_train, num_replicas=hvd.size(), rank=hvd.rank())
+            if self.steps_per_epoch is not None:
+                self.steps_per_epoch = self.steps_per_epoch // hvd.size()
         self.ds_train = DataGenerator(
             self.data_train, self.data_train_lr, 
-            predictors=self.predictors_train, **datagen_params)
+            predictors=self.predictors_train, sampler=sampler, **datagen_params)
+        self.datagen_train = self.ds_train
         self.ds_val = DataGenerator(
             self.data_val, self.data_val_lr, 
             predictors=self.predictors_val, **datagen_params)
@@ -239,6 +343,14 @@ class SupervisedTrainer(Trainer):
             self.data_test, self.data_test_lr,
             predictors=self.predictors_test, **datagen_params)
 
+        if self.use_tf_data:
+            if self.steps_per_epoch is None:
+                self.steps_per_epoch = len(self.ds_train)
+            self.ds_train = self.ds_train.as_dataset(
+                deterministic=self.deterministic, repeat=True)
+            self.ds_val = self.ds_val.as_dataset(shuffle=False)
+            self.ds_test = self.ds_test.as_dataset(shuffle=False)
+
     def setup_model(self):
         """Setting up the model
         """
@@ -270,51 +382,56 @@ class SupervisedTrainer(Trainer):
 
         ### instantiating the model
         if self.trained_model is None:
-            if self.upsampling in POSTUPSAMPLING_METHODS:
-                if self.model_is_spatiotemporal:
-                    self.model = recnet_postupsampling(
-                        backbone_block=self.backbone,
-                        upsampling=self.upsampling, 
-                        scale=self.scale, 
-                        n_channels=n_channels, 
-                        n_aux_channels=n_aux_channels,
-                        lr_size=(lr_height, lr_width),
-                        time_window=self.time_window, 
-                        **self.architecture_params)
-                else:
-                    self.model = net_postupsampling(
-                        backbone_block=self.backbone,
-                        upsampling=self.upsampling, 
-                        scale=self.scale, 
-                        lr_size=(lr_height, lr_width),
-                        n_channels=n_channels, 
-                        n_aux_channels=n_aux_channels,
-                        **self.architecture_params)
-                    
-            elif self.upsampling == 'pin':
-                if self.model_is_spatiotemporal:
-                    self.model = recnet_pin(
-                        backbone_block=self.backbone,
-                        n_channels=n_channels,
-                        n_aux_channels=n_aux_channels,
-                        hr_size=(hr_height, hr_width),
-                        time_window=self.time_window, 
-                        **self.architecture_params)
-                else:
-                    if self.backbone == 'unet':
-                        self.model = unet_pin(
+            with precision_policy(self.precision):
+                if self.upsampling in POSTUPSAMPLING_METHODS:
+                    if self.model_is_spatiotemporal:
+                        self.model = recnet_postupsampling(
                             backbone_block=self.backbone,
-                            n_channels=n_channels,
+                            upsampling=self.upsampling, 
+                            scale=self.scale, 
+                            n_channels=n_channels, 
                             n_aux_channels=n_aux_channels,
-                            hr_size=(hr_height, hr_width),
+                            lr_size=(lr_height, lr_width),
+                            time_window=self.time_window, 
                             **self.architecture_params)
                     else:
-                        self.model = net_pin(
+                        self.model = net_postupsampling(
                             backbone_block=self.backbone,
+                            upsampling=self.upsampling, 
+                            scale=self.scale, 
+                            lr_size=(lr_height, lr_width),
                             n_channels=n_channels, 
                             n_aux_channels=n_aux_channels,
+                            **self.architecture_params)
+                    
+                elif self.upsampling == 'pin':
+                    # LR-sized inputs interpolated by the model 
+                    pin_params = {}
+                    if self.graph_interpolation:
+                        pin_params = dict(scale=self.scale, interpolation=self.interpolation)
+                    if self.model_is_spatiotemporal:
+                        self.model = recnet_pin(
+                            backbone_block=self.backbone,
+                            n_channels=n_channels,
+                            n_aux_channels=n_aux_channels,
                             hr_size=(hr_height, hr_width),
-                            **self.architecture_params)        
+                            time_window=self.time_window, 
+                            **pin_params, **self.architecture_params)
+                    else:
+                        if self.backbone == 'unet':
+                            self.model = unet_pin(
+                                backbone_block=self.backbone,
+                                n_channels=n_channels,
+                                n_aux_channels=n_aux_channels,
+                                hr_size=(hr_height, hr_width),
+                                **pin_params, **self.architecture_params)
+                        else:
+                            self.model = net_pin(
+                                backbone_block=self.backbone,
+                                n_channels=n_channels, 
+                                n_aux_channels=n_aux_channels,
+                                hr_size=(hr_height, hr_width),
+                                **pin_params, **self.architecture_params)
 
             if self.verbose == 1 and self.running_on_first_worker:
                 self.model.summary(line_length=150)
@@ -324,11 +441,28 @@ class SupervisedTrainer(Trainer):
             self.model = self.trained_model
             print('Loading pre-trained model')
 
+        # model trained on the batches with the crop offsets of the static 
+        # variables, sharing the weights of ``self.model``
+        if self.static_on_device:
+            lr_sized = self.upsampling in POSTUPSAMPLING_METHODS or self.graph_interpolation
+            with precision_policy(self.precision):
+                self.static_fields = StaticFields(
+                    self.static_vars, self.scale, lr_sized=lr_sized, 
+                    is_spatiotemporal=self.model_is_spatiotemporal, 
+                    interpolation=self.interpolation)
+                self.training_model = self.static_fields.wrap(self.model)
+        else:
+            self.training_model = self.model
+
 
     def run(self):
         """Compiling, training and saving the model
         """
         self.timing = Timing(self.verbose)
+        if self.profiler is not None:
+            self.profiler.start()
+        if self.shared_memory:
+            self.setup_shared_memory()
         self.setup_datagen()
         self.setup_model()
 
@@ -353,8 +487,27 @@ class SupervisedTrainer(Trainer):
         self.optimizer = Adam(learning_rate=self.learning_rate)
 
         ### Callbacks
-        # early stopping
         callbacks = []
+        if self.profiler is not None:
+            # first callback, for timing the end-of-epoch callbacks (checkpoints)
+            callbacks.append(ProfilerCallback(self.profiler))
+
+        # throughput and input pipeline stalls of every epoch
+        self.throughput = self.setup_throughput_monitor(self.global_batch_size)
+        if self.throughput is not None:
+            # with Keras multiprocessing, the batches are assembled in worker 
+            # processes, which cannot report when they are ready
+            measure_input_wait = not (self.use_multiprocessing and not self.use_tf_data)
+            throughput_callback = ThroughputCallback(self.throughput, 
+                                                     recreate_iterator=not self.use_tf_data,
+                                                     measure_input_wait=measure_input_wait)
+            if measure_input_wait:
+                self.datagen_train.on_batch_ready = throughput_callback.batch_ready
+            elif self.verbose and self.running_on_first_worker:
+                print('The input wait is not measured with `use_multiprocessing`')
+            callbacks.append(throughput_callback)
+
+        # early stopping
         if self.early_stopping:
             earlystop = EarlyStopping(monitor='val_loss', mode='min', patience=self.patience, 
                                       min_delta=self.min_delta, verbose=self.verbose)
@@ -379,8 +532,10 @@ class SupervisedTrainer(Trainer):
         # Model checkopoints are saved at the end of every epoch, if it's the best seen so far.
         if self.save_bestmodel:
             os.makedirs(self.savecheckpoint_path, exist_ok=True)
-            model_checkpoint_callback = tf.keras.callbacks.ModelCheckpoint(
+            # the plain model is saved, not the StaticFields wrapper
+            model_checkpoint_callback = PlainModelCheckpoint(
                 os.path.join(self.savecheckpoint_path, './best_model'), 
+                self.model,
                 save_weights_only=False,
                 monitor='val_loss',
                 mode='min',
@@ -389,12 +544,14 @@ class SupervisedTrainer(Trainer):
             if self.running_on_first_worker:
                 callbacks.append(model_checkpoint_callback)
 
-        ### Compiling and training the model
-        if self.steps_per_epoch is not None and has_horovod:
-            self.steps_per_epoch = self.steps_per_epoch // hvd.size()
+        # progress bar showing the throughput of the epoch so far, must be last
+        if self.throughput is not None and verbose in [1, 2]:
+            callbacks.append(ProgbarLogger(count_mode='steps', 
+                                           stateful_metrics=ThroughputMonitor.progbar_metrics))
 
-        self.model.compile(optimizer=self.optimizer, loss=self.lossf)
-        self.fithist = self.model.fit(
+        ### Compiling and training the model
+        self.training_model.compile(optimizer=self.optimizer, loss=self.lossf)
+        self.fithist = self.training_model.fit(
             self.ds_train, 
             epochs=self.epochs, 
             initial_epoch=self.trained_epochs,
@@ -406,11 +563,13 @@ class SupervisedTrainer(Trainer):
             use_multiprocessing=self.use_multiprocessing)
         
         if self.running_on_first_worker:
-            self.test_loss = self.model.evaluate(self.ds_test, steps=self.test_steps, verbose=verbose)
+            with _timer('evaluate'):
+                self.test_loss = self.training_model.evaluate(self.ds_test, steps=self.test_steps, verbose=verbose)
             
             if self.verbose:
                 print(f'\nScore on the test set: {self.test_loss}')
             
             self.timing.runtime()
 
+        self.stop_profiler()
         self.save_results(self.model)
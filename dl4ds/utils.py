@@ -1,32 +1,45 @@
+from __future__ import annotations
+
 import numpy as np
-import tensorflow as tf
+from numpy.lib.stride_tricks import sliding_window_view
 import xarray as xr
 import cv2
 from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
-import matplotlib.pyplot as plt
-from typing import List, Dict, Type, Union, Tuple, Callable
+from typing import List, Dict, Type, Union, Tuple, Callable, TYPE_CHECKING
 import os
 import math
 import pandas as pd
-from matplotlib.axes import Axes
-from matplotlib.figure import Figure
-from tensorflow.keras.callbacks import History
 
-from . import BACKBONE_BLOCKS, DROPOUT_VARIANTS, LOSS_FUNCTIONS, UPSAMPLING_METHODS, INTERPOLATION_METHODS
-from . import losses
+# tensorflow and matplotlib are imported by the functions using them, so that
+# importing the array utilities (e.g., ``resize_array``) stays fast
+if TYPE_CHECKING:
+    from matplotlib.axes import Axes
+    from matplotlib.figure import Figure
+    from tensorflow.keras.callbacks import History
+
+from . import (BACKBONE_BLOCKS, DROPOUT_VARIANTS, LOSS_FUNCTIONS, UPSAMPLING_METHODS, 
+               INTERPOLATION_METHODS, PRECISION_POLICIES)
+from .profiling import _timer
 
 
-def spatial_to_spatiotemporal_samples(array, time_window):
+def spatial_to_spatiotemporal_samples(array, time_window, copy=True):
     """Add one dimension to spatial array [n_samples or time, lat, lon, vars] 
-    in order to have [n_samples, time_window, lat, lon, vars].
+    in order to have [n_samples, time_window, lat, lon, vars]. 
+    
+    By default, a new (writable) float64 array is returned. If ``copy`` is 
+    False, the samples are a read-only sliding-window view on ``array``, 
+    keeping its dtype: the overlapping windows share memory, which does not 
+    grow with ``time_window``.
     """
-    n_samples, y, x, n_channels = array.shape
-    n_t_samples = n_samples - (time_window - 1)
-    array_out = np.zeros((n_t_samples, time_window, y, x, n_channels))
-    for i in range(n_t_samples):
-        array_out[i] = array[i: i+time_window]
-    return array_out
+    windows = sliding_window_view(np.asarray(array), time_window, axis=0)
+    # windows are indexed as [n_samples, lat, lon, vars, time_window]
+    windows = np.moveaxis(windows, -1, 1)
+    if copy:
+        return windows.astype('float64')
+    return windows
 
 
 def spatiotemporal_to_spatial_samples(array, time_window):
@@ -144,6 +157,7 @@ def checkarg_loss(loss):
     loss : str
         Loss/cost function.  
     """
+    from . import losses
     if isinstance(loss, str):
         if loss not in LOSS_FUNCTIONS:
             msg = f"`loss` must be one of {LOSS_FUNCTIONS}, got {loss}"
@@ -171,13 +185,55 @@ def checkarg_loss(loss):
         raise TypeError('`loss` must be a string, one of {LOSS_FUNCTIONS}')
 
 
+def checkarg_precision(precision):
+    """Check the argument ``precision``.
+
+    Parameters
+    ----------
+    precision : str
+        Keras (mixed) precision policy.  
+    """
+    if not isinstance(precision, str):
+        raise TypeError(f'`precision` must be a string, one of {PRECISION_POLICIES}')
+    if precision not in PRECISION_POLICIES:
+        msg = f"`precision` must be one of {PRECISION_POLICIES}, got {precision}"
+        raise ValueError(msg)
+    return precision
+
+
+@contextmanager
+def precision_policy(precision):
+    """Context manager setting the Keras (mixed) precision policy of the 
+    layers and models built inside it, e.g., by the model builders in 
+    ``dl4ds.models``. With a mixed policy, the computations are done in 
+    float16/bfloat16 while the variables, the output layer of the models and 
+    the losses are kept in float32. The previous global policy is restored on 
+    exit.
+
+    Parameters
+    ----------
+    precision : str
+        One of dl4ds.PRECISION_POLICIES.
+    """
+    import tensorflow as tf
+    precision = checkarg_precision(precision)
+    previous_policy = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy(precision)
+    try:
+        yield
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previous_policy)
+
+
 def set_gpu_memory_growth():
+    import tensorflow as tf
     physical_devices = list_devices(verbose=False) 
     for gpu in physical_devices:
         tf.config.experimental.set_memory_growth(gpu, True)
 
 
 def list_devices(which='physical', gpu=True, verbose=True):
+    import tensorflow as tf
     if gpu:
         dev = 'GPU'
     else:
@@ -193,6 +249,7 @@ def list_devices(which='physical', gpu=True, verbose=True):
 
 
 def set_visible_gpus(*gpu_indices):
+    import tensorflow as tf
     gpus = list_devices('physical', gpu=True, verbose=False)
     wanted_gpus = [gpus[i] for i in gpu_indices]
     tf.config.set_visible_devices(wanted_gpus, 'GPU') 
@@ -339,10 +396,21 @@ def crop_array(array, size, yx=None, position=False, exclude_borders=False,
 
 
 def resize_array(array, newsize, interpolation='inter_area', squeezed=True, 
-                 keep_dynamic_range=False):
+                 keep_dynamic_range=False, workers=None):
     """
     Return a resized version of a 2D or [y,x] 3D ndarray [y,x,channels] or
     4D ndarray [time,y,x,channels] via interpolation.
+
+    The dtype of ``array`` is kept (half-precision grids are interpolated in 
+    float32). Boolean grids and integer grids of types not supported by 
+    OpenCV (int8, int32, int64 and uint32, uint64) are resized with nearest
+    neighbors, uint8, uint16 and int16 grids are interpolated by OpenCV in 
+    their own type. 4D stacks are
+    resized as a whole, the frames being distributed over a pool of threads
+    (OpenCV releases the GIL), and grids with more channels than supported by
+    OpenCV are resized in groups of channels. Downsampling grids with many
+    channels by integer factors with 'inter_area' is computed as a mean over 
+    blocks of pixels, in a single vectorized operation.
     
     Parameters
     ----------
@@ -355,6 +423,11 @@ def resize_array(array, newsize, interpolation='inter_area', squeezed=True,
     squeezed : bool, optional
         If True, the output will be squeezed (any dimension with lenght 1 will
         be removed).
+    keep_dynamic_range : bool, optional
+        If True, the output is clipped to the range of values of ``array``.
+    workers : int or None, optional
+        Number of threads used for 4D stacks. By default, the number of CPUs 
+        (up to 8).
 
     Returns
     -------
@@ -363,37 +436,45 @@ def resize_array(array, newsize, interpolation='inter_area', squeezed=True,
     """
     if interpolation not in INTERPOLATION_METHODS:
         raise ValueError(f'`interpolation` must be one of {INTERPOLATION_METHODS}. Received {interpolation}')
-    if array.dtype in ['bool', 'int', 'int64']:
-        array = array.astype('int')
-        interpolation = 'nearest'  # only nearest is supported in opencv for int
-
-    if interpolation == 'nearest':
-        intmethod = cv2.INTER_NEAREST
-    elif interpolation == 'bicubic':
-        intmethod = cv2.INTER_CUBIC
-    elif interpolation == 'bilinear':
-        intmethod = cv2.INTER_LINEAR
-    elif interpolation == 'inter_area':
-        intmethod = cv2.INTER_AREA
-    elif interpolation == 'lanczos':
-        intmethod = cv2.INTER_LANCZOS4
-
-    size_x, size_y = newsize
-    
-    if array.ndim in [2, 3]:
-        resized_arr = cv2.resize(array, (size_x, size_y), interpolation=intmethod)
-        if resized_arr.ndim == 2 and array.ndim == 3:
-            resized_arr = np.expand_dims(resized_arr, -1)
-    elif array.ndim == 4:
-        n = array.shape[0]
-        n_ch = array.shape[-1]
-        resized_arr = np.zeros((n, size_y, size_x, n_ch))
-        for i in range(n):
-            ti = cv2.resize(array[i], (size_x, size_y), interpolation=intmethod)                
-            resized_arr[i] = np.expand_dims(ti, -1) if n_ch ==1 else ti
-    else:
+    array = np.asarray(array)
+    if array.ndim not in [2, 3, 4]:
         raise RuntimeError(f'Wrong dimensions, got {array.ndim}')
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
 
+    size_x, size_y = newsize
+    y, x = array.shape[-3:-1] if array.ndim == 4 else array.shape[:2]
+    # stack of frames [n, y, x, channels]
+    stack = array.reshape((-1, y, x, array.shape[-1] if array.ndim > 2 else 1))
+    n, n_ch = stack.shape[0], stack.shape[-1]
+    resized_arr = np.empty((n, size_y, size_x, n_ch), dtype=array.dtype)
+
+    with _timer('resize'):
+        if array.dtype.kind == 'b' or (array.dtype.kind in 'iu' and 
+                                       array.dtype not in _CV_INT_DTYPES):
+            # only nearest is supported in opencv for these types
+            _nearest_stack(stack, (size_x, size_y), resized_arr)
+        elif (interpolation == 'inter_area' and y % size_y == 0 and x % size_x == 0 
+              and n_ch > _CV_MAX_CHANNELS_AREA):
+            # opencv has optimized area paths only for up to 4 channels
+            _block_mean_stack(stack, (y // size_y, x // size_x), resized_arr)
+        else:
+            if interpolation == 'nearest':
+                intmethod = cv2.INTER_NEAREST
+            elif interpolation == 'bicubic':
+                intmethod = cv2.INTER_CUBIC
+            elif interpolation == 'bilinear':
+                intmethod = cv2.INTER_LINEAR
+            elif interpolation == 'inter_area':
+                intmethod = cv2.INTER_AREA
+            elif interpolation == 'lanczos':
+                intmethod = cv2.INTER_LANCZOS4
+            _cv2_resize_stack(stack, (size_x, size_y), intmethod, resized_arr, workers)
+
+    if array.ndim == 2:
+        resized_arr = resized_arr[0, :, :, 0]
+    elif array.ndim == 3:
+        resized_arr = resized_arr[0]
     if squeezed:
         resized_arr = np.squeeze(resized_arr)
     if keep_dynamic_range:
@@ -401,6 +482,95 @@ def resize_array(array, newsize, interpolation='inter_area', squeezed=True,
     return resized_arr
 
 
+def _resize_stack(array, newsize, interpolation):
+    """Resize a stack of grids [..., y, x, c] to ``newsize`` (X,Y), with the 
+    dtype of ``array`` (see ``resize_array``).
+    """
+    lead_shape = array.shape[:-3]
+    frames = array.reshape((-1,) + array.shape[-3:])
+    resized = resize_array(frames, newsize, interpolation, squeezed=False)
+    return resized.reshape(lead_shape + resized.shape[1:])
+
+
+def _cv2_resize_stack(stack, newsize, intmethod, out, workers=1):
+    """Resize the frames of ``stack`` [n, y, x, c] into ``out`` with OpenCV, 
+    in groups of channels and splitting the frames among ``workers`` threads.
+    Types not supported by OpenCV (e.g., float16) are interpolated in float32.
+    """
+    n, n_ch = stack.shape[0], stack.shape[-1]
+    if stack.dtype in (np.float32, np.float64) or stack.dtype in _CV_INT_DTYPES:
+        work_dtype = stack.dtype
+    else:
+        work_dtype = np.float32
+    max_ch = _CV_MAX_CHANNELS_AREA if intmethod == cv2.INTER_AREA else _CV_MAX_CHANNELS
+    channels = [slice(c, c + max_ch) for c in range(0, n_ch, max_ch)]
+
+    def resize_frames(frames):
+        for i in frames:
+            for ch in channels:
+                frame = np.asarray(stack[i, :, :, ch], dtype=work_dtype)
+                resized = cv2.resize(frame, newsize, interpolation=intmethod)
+                out[i, :, :, ch] = resized.reshape(out.shape[1:3] + (-1,))
+
+    n_chunks = min(workers, n)
+    if n_chunks > 1:
+        chunks = np.array_split(np.arange(n), n_chunks)
+        list(_resize_executor(workers).map(resize_frames, chunks))
+    else:
+        resize_frames(range(n))
+
+
+def _block_mean_stack(stack, factors, out):
+    """Downsample the frames of ``stack`` [n, y, x, c] into ``out`` by integer
+    ``factors`` (Y,X) as the mean over blocks of pixels (equivalent to 
+    'inter_area'). The sums are accumulated in float32 (or float64).
+    """
+    fy, fx = factors
+    n, y, x, c = stack.shape
+    acc_dtype = np.float64 if stack.dtype == np.float64 else np.float32
+    blocks = stack.reshape(n, y // fy, fy, x // fx, fx, c)
+    rows = blocks[:, :, 0].astype(acc_dtype)
+    for i in range(1, fy):
+        rows += blocks[:, :, i]
+    acc = rows[:, :, :, 0].copy()
+    for j in range(1, fx):
+        acc += rows[:, :, :, j]
+    acc *= acc_dtype(1 / (fy * fx))
+    if out.dtype.kind in 'iu':
+        # rounded to the nearest integer, as in opencv
+        np.rint(acc, out=acc)
+    out[...] = acc
+
+
+def _nearest_stack(stack, newsize, out):
+    """Nearest neighbors resizing of the frames of ``stack`` [n, y, x, c] into
+    ``out`` (as ``cv2.INTER_NEAREST``), for any dtype.
+    """
+    size_x, size_y = newsize
+    y, x = stack.shape[1:3]
+    idx_y = np.minimum(np.floor(np.arange(size_y) * (y / size_y)).astype(int), y - 1)
+    idx_x = np.minimum(np.floor(np.arange(size_x) * (x / size_x)).astype(int), x - 1)
+    out[...] = stack[:, idx_y][:, :, idx_x]
+
+
+def _resize_executor(workers):
+    """Thread pool (shared by the calls with the same number of ``workers``)
+    used for resizing stacks of frames.
+    """
+    if workers not in _RESIZE_EXECUTORS:
+        _RESIZE_EXECUTORS[workers] = ThreadPoolExecutor(max_workers=workers)
+    return _RESIZE_EXECUTORS[workers]
+
+
+# maximum number of channels interpolated in a single OpenCV call (the area
+# interpolation with non-integer factors supports up to 4 channels)
+_CV_MAX_CHANNELS = 128
+_CV_MAX_CHANNELS_AREA = 4
+# integer types interpolated by opencv with all the methods
+_CV_INT_DTYPES = (np.uint8, np.uint16, np.int16)
+_RESIZE_EXECUTORS = {}
+
+
 " -----------------------------------------------------------------------------"
 " -----------------------------------------------------------------------------"
 """Methods for plotting a keras model training history. Adapted from 
@@ -556,6 +726,7 @@ def _plot_history(
     number_of_metrics = len(metrics)
     w = min(number_of_metrics, graphs_per_row)
     h = math.ceil(number_of_metrics/graphs_per_row)
+    import matplotlib.pyplot as plt
     fig, axes = plt.subplots(h, w, figsize=(side*w, side*h), dpi=200, constrained_layout=True)
     flat_axes = np.array(axes).flatten()
 
@@ -647,13 +818,14 @@ def _to_dataframe(history: Union[History, pd.DataFrame, Dict, str]) -> pd.DataFr
         return history
     if isinstance(history, Dict):
         return pd.DataFrame(history)
-    if isinstance(history, History):
-        return _to_dataframe(history.history)
     if isinstance(history, str):
         if "csv" in history.split("."):
             return pd.read_csv(history)
         if "json" in history.split("."):
             return pd.read_json(history)
+    from tensorflow.keras.callbacks import History
+    if isinstance(history, History):
+        return _to_dataframe(history.history)
     raise TypeError("Given history object of type {history_type} is not currently supported!".format(
         history_type=type(history)))
 
@@ -23,7 +23,8 @@ setup(
     name='dl4ds',
     packages=['dl4ds',
               'dl4ds.models',
-              'dl4ds.training'],
+              'dl4ds.training',
+              'dl4ds.benchmarks'],
     version=VERSION,
     description='Deep Learning for empirical DownScaling',
     long_description=README,
@@ -56,6 +57,10 @@ setup(
     extras_require={
         'horovod':['horovod'] 
     },
+    entry_points={
+        'console_scripts': ['dl4ds-benchmarks=dl4ds.benchmarks.__main__:main',
+                            'dl4ds-predict=dl4ds.predict_app:main']
+    },
     classifiers=[
         'Intended Audience :: Science/Research',
         'Operating System :: POSIX :: Linux',